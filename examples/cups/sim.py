@@ -36,6 +36,7 @@ from asyncio import subprocess
 sys.path.append('../../pysys')
 import tcutils as tu
 import testutils as tstu
+import loops
 import simutils as su
 
 import logging
@@ -184,7 +185,8 @@ def sigHandler(signum, frame):
     quit()
 
 tstu.setup_logging()
+loops.install()
 signal.signal(signal.SIGINT, sigHandler)
 
 task = asyncio.ensure_future(test_start())
-asyncio.get_event_loop().run_forever()
+loops.get_event_loop().run_forever()
@@ -36,6 +36,7 @@ from asyncio import subprocess
 sys.path.append('../../pysys')
 import tcutils as tu
 import simutils as su
+import loops
 
 import logging
 handler = logging.StreamHandler(sys.stdout)
@@ -174,5 +175,6 @@ def sigHandler(signum, frame):
 
 signal.signal(signal.SIGINT, sigHandler)
 
+loops.install()
 task = asyncio.ensure_future(func())
-asyncio.get_event_loop().run_forever()
+loops.get_event_loop().run_forever()
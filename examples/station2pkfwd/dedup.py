@@ -0,0 +1,149 @@
+# --- Revised 3-Clause BSD License ---
+# Copyright Semtech Corporation 2022. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright notice,
+#       this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright notice,
+#       this list of conditions and the following disclaimer in the documentation
+#       and/or other materials provided with the distribution.
+#     * Neither the name of the Semtech corporation nor the names of its
+#       contributors may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SEMTECH CORPORATION. BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from typing import Any,Callable,Dict,List,Optional
+import time
+import asyncio
+import collections
+import logging
+
+import metrics
+
+logger = logging.getLogger('ts2pktfwd')
+
+"""Cross gateway uplink deduplication keyed by PHYPayload"""
+
+DFLT_HOLD   = 0.2    # secs - copies collected before the best one is forwarded
+DFLT_BUCKET = 0.05   # secs - expiry granularity
+
+
+class Uplink():
+    __slots__ = ('pdu', 'first', 'gw', 'rxpk', 'copies', 'sent')
+
+    def __init__(self, pdu:bytes, first:float, gw:Any, rxpk:Dict[str,Any]) -> None:
+        self.pdu = pdu
+        self.first = first
+        self.gw = gw
+        self.rxpk = rxpk
+        self.copies = 1
+        self.sent = False
+
+
+class UplinkDedup():
+    ''' Forwards one copy per PHYPayload seen within window secs.
+
+    The first copy opens a hold period - copies arriving until then compete on
+    RSSI and the best one is passed to forward(gw, rxpk). Copies arriving after
+    the hold but within the window are dropped as late. Entries are kept in
+    time buckets of bucket secs: expiry drops whole buckets from the front, O(1)
+    per entry. Holds are constant, so due uplinks are always at the front of the
+    pending FIFO and one timer serves all of them. '''
+
+    def __init__(self, forward:Callable[[Any,Dict[str,Any]],None], window:float, hold:float=DFLT_HOLD, bucket:float=DFLT_BUCKET) -> None:
+        assert window >= hold, 'Dedup window %g shorter than hold time %g' % (window, hold)
+        self.forward = forward
+        self.window = window
+        self.hold = hold
+        self.bucket = bucket
+        self.index = {}                       # type: Dict[bytes,Uplink]
+        self.buckets = collections.deque()    # type: collections.deque  [start, [Uplink]]
+        self.pending = collections.deque()    # type: collections.deque  Uplink by arrival
+        self.timer = None                     # type: Optional[asyncio.TimerHandle]
+        self.n_copies = 0
+        self.n_forwarded = 0
+        self.m_forwarded = metrics.DEDUP.labels('forwarded')
+        self.m_duplicate = metrics.DEDUP.labels('duplicate')
+        self.m_late = metrics.DEDUP.labels('late')
+        metrics.DEDUP_RATIO.labels().set_function(self.ratio)
+
+    def __str__(self) -> str:
+        return 'UplinkDedup'
+
+    def ratio(self) -> float:
+        ''' Copies received per uplink forwarded. '''
+        return self.n_copies / self.n_forwarded if self.n_forwarded else 0.0
+
+    def add(self, gw:Any, rxpk:Dict[str,Any], pdu:bytes) -> None:
+        now = time.monotonic()
+        self.expire(now)
+        self.n_copies += 1
+        up = self.index.get(pdu)
+        if up is not None:
+            up.copies += 1
+            if up.sent:
+                self.m_late.inc()
+                logger.debug('%s: late copy from %s dropped' % (self, gw))
+            else:
+                self.m_duplicate.inc()
+                if rxpk['rssi'] > up.rxpk['rssi']:
+                    up.gw, up.rxpk = gw, rxpk
+            return
+        up = Uplink(pdu, now, gw, rxpk)
+        self.index[pdu] = up
+        if not self.buckets or now >= self.buckets[-1][0] + self.bucket:
+            self.buckets.append([now, []])
+        self.buckets[-1][1].append(up)
+        self.pending.append(up)
+        if self.timer is None:
+            self.timer = asyncio.get_event_loop().call_later(self.hold, self.on_timer)
+
+    def expire(self, now:float) -> None:
+        buckets = self.buckets
+        while buckets and buckets[0][0] + self.bucket + self.window <= now:
+            ups = buckets[0][1]
+            if not ups[-1].sent:
+                break    # forwarded in arrival order - timer is late, keep the bucket
+            buckets.popleft()
+            for up in ups:
+                del self.index[up.pdu]
+
+    def forward_due(self, until:float) -> None:
+        pending = self.pending
+        while pending and pending[0].first + self.hold <= until:
+            up = pending.popleft()
+            up.sent = True
+            self.n_forwarded += 1
+            self.m_forwarded.inc()
+            if up.copies > 1:
+                logger.debug('%s: %d copies, forwarding via %s' % (self, up.copies, up.gw))
+            try:
+                self.forward(up.gw, up.rxpk)
+            except Exception as exc:
+                logger.error('%s: forward failed: %s', self, exc, exc_info=True)
+
+    def on_timer(self) -> None:
+        self.timer = None
+        now = time.monotonic()
+        self.forward_due(now)
+        if self.pending:
+            self.timer = asyncio.get_event_loop().call_later(max(0.0, self.pending[0].first + self.hold - now), self.on_timer)
+
+    def flush(self) -> None:
+        ''' Forward all held uplinks now. '''
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+        self.forward_due(float('inf'))
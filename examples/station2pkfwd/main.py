@@ -24,7 +24,7 @@
 # OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
 # ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-from typing import Any,Awaitable,Callable,Dict,List,Mapping,Optional
+from typing import Any,Awaitable,Callable,Dict,List,Mapping,Optional,Tuple
 import sys
 import os
 import traceback
@@ -38,7 +38,10 @@ from websockets.server import WebSocketServerProtocol as WSSP
 
 import router_config
 from router import Router
+from pkfwdc import PkFwdMux
+from ratelimit import DFLT_QUANTUM, DFLT_RATELIMITS, FairScheduler
 from id6 import Id6
+from metrics import MetricsServer
 
 logger = logging.getLogger('ts2pktfwd')
 
@@ -47,9 +50,14 @@ logger = logging.getLogger('ts2pktfwd')
 # at startup time.
 routerid2router = {}    # type:Mapping[Id6,Router]
 
-async def add_router(routerid:'Id6', rconfig:Mapping[str,Any], pkfwduri:str) -> Router:
+# Message quantum of each router on the shared loop and default per router
+# rate limits (overridden by the ratelimit section of a router config).
+fair_sched = FairScheduler()
+ratelimits = dict(DFLT_RATELIMITS)   # type:Dict[str,float]
+
+async def add_router(routerid:'Id6', rconfig:Mapping[str,Any], pkfwdmux:PkFwdMux) -> Router:
     assert routerid not in routerid2router
-    r = Router(routerid, rconfig, pkfwduri)
+    r = Router(routerid, rconfig, pkfwdmux, fair_sched, ratelimits)
     await r.start()
     routerid2router[routerid] = r
     return r
@@ -59,14 +67,33 @@ async def websocket_send_error(websocket: WSSP, router:Optional[str], message:st
 
 
 class Infos():
-    ''' Simple info server to handle router info requests. '''
+    ''' Simple info server to handle router info requests.
+
+    Router ids are looked up in a routing table which maps them to the muxs and
+    uri to connect to. Responses are JSON encoded once per requested router and
+    then served from a cache. At most max_conns connections are served at the
+    same time (0 = unlimited), excess connections are closed with 1013 (try again later). '''
 
-    def __init__(self, host:str, port:int, muxs_uri:str) -> None:
+    MAX_CACHED_RESPONSES = 100000
+
+    def __init__(self, host:str, port:int, muxs_uri:str, max_conns:int=0) -> None:
         self.host = host
         self.port = port
         self.muxs_uri = muxs_uri
+        self.max_conns = max_conns
+        self.nconns = 0
+        self.routes = {}      # type: Dict[Id6,Tuple[str,str]]
+        self.responses = {}   # type: Dict[Any,str]
         self.ws_server = None    # type: Optional[websockets.server.WebSocketServer]
 
+    def add_route(self, routerid:Id6, muxs_uri:Optional[str]=None, muxs:str='muxs-::0') -> None:
+        self.routes[routerid] = (muxs, muxs_uri or self.muxs_uri+'/'+str(routerid))
+        self.responses.clear()
+
+    def del_route(self, routerid:Id6) -> None:
+        self.routes.pop(routerid, None)
+        self.responses.clear()
+
     async def start(self):
         #self.ws_server = await websockets.serve(self.accept, host=self.host, port=self.port)
         self.ws_server = await websockets.serve(self.accept, port=self.port)
@@ -74,35 +101,51 @@ class Infos():
     def __str__(self):
         return 'Infos'
 
+    def get_response(self, router:Any) -> Optional[str]:
+        key = (router.__class__, router)
+        resp = self.responses.get(key)
+        if resp is None:
+            route = self.routes.get(Id6(router, 'router'))
+            if route is None:
+                return None
+            resp = json.dumps({ 'router': router, 'muxs': route[0], 'uri': route[1] })
+            if len(self.responses) >= Infos.MAX_CACHED_RESPONSES:
+                self.responses.clear()
+            self.responses[key] = resp
+        return resp
+
     async def accept(self, websocket:WSSP, path:str) -> None:
-        logger.info('%s: accept: path %s' % (self, path))
+        if self.max_conns and self.nconns >= self.max_conns:
+            logger.warning('%s: too many connections (%d) - rejecting %s', self, self.nconns, path)
+            await websocket.close(1013)
+            return
+        self.nconns += 1
+        logger.debug('%s: accept: path %s', self, path)
         router = None  # type:Optional[str]
         errmsg = None  # type:Optional[str]
         try:
             s = json.loads(await websocket.recv())
-            logger.info('%s: read: %s' % (self, s))
+            logger.debug('%s: read: %s', self, s)
             if 'router' not in s:
                 errmsg = 'Invalid request data'
             else:
                 router = s['router']
-                routerid = Id6(router, 'router')
-                if routerid not in routerid2router:
+                resp = self.get_response(router)
+                if resp is None:
                     errmsg = 'Router not provisioned'
                 else:
-                    logger.info('%s: respond: %s' % (self, self.muxs_uri+'/'+str(routerid)))
-                    resp = { 'router': router, 'muxs': 'muxs-::0', 'uri': self.muxs_uri+'/'+str(routerid) }
-                    await websocket.send(json.dumps(resp))
+                    logger.info('%s: respond: %s', self, resp)
+                    await websocket.send(resp)
                     return
         except asyncio.CancelledError:
             raise
         except Exception as exc:
             errmsg = 'Could not handle request'
             logger.error('%s: server socket failed: %s', self, exc, exc_info=True)
+        finally:
+            self.nconns -= 1
         await websocket_send_error(websocket, router, errmsg)
 
-        resp = { 'error': errmsg }
-        await websocket.send(json.dumps(resp))
-
     async def shutdown(self) -> None:
         ws_server = self.ws_server
         if ws_server:
@@ -150,6 +193,8 @@ class Muxs():
 
 infos  = None  # type:Optional[Infos]
 muxs   = None  # type:Optional[Muxs]
+metrics_server = None  # type:Optional[MetricsServer]
+pkfwdmux = None  # type:Optional[PkFwdMux]
 
 
 LOG_LEVELS = [ 'ERROR', 'WARNING', 'INFO', 'DEBUG' ]
@@ -165,6 +210,21 @@ def ap_routerid(s:str) -> Id6:
     return Id6(s,'router')
 
 
+LOOP_KINDS = [ 'auto', 'uvloop', 'asyncio' ]
+
+def install_loop(kind:str) -> str:
+    ''' Event loop policy for kind - auto picks uvloop if installed (as pysys/loops.py). Returns the loop installed. '''
+    if kind != 'asyncio':
+        try:
+            import uvloop
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+            return 'uvloop'
+        except ImportError:
+            if kind == 'uvloop':
+                logger.warning('uvloop not installed - using the asyncio event loop')
+    return 'asyncio'
+
+
 def handle_exc(exc, exit_code=2):
     osenv = os.environ
     if 'stacktrace' in osenv and osenv['stacktrace']:
@@ -176,7 +236,7 @@ def handle_exc(exc, exit_code=2):
 
 
 async def main(args):
-    global infos, muxs
+    global infos, muxs, metrics_server, pkfwdmux, fair_sched
 
     root = logging.getLogger()
     ll = logging.INFO
@@ -206,9 +266,10 @@ async def main(args):
     muxshost = muxsuri.hostname
     pkfwduri = urlparse(args.pkfwduri)
 
+    logger.info('Event loop: %s' % (args.loop))
     logger.info('Connection details: infosuri %s, muxsuri %s, pkfwduri %s' % (infosuri.geturl(), muxsuri.geturl(), pkfwduri.geturl()))
 
-    infos = Infos(infoshost, infosport, muxsuri.geturl())
+    infos = Infos(infoshost, infosport, muxsuri.geturl(), args.infos_max_conns)
     muxs = Muxs(muxshost, muxsport)
 
     await infos.start()
@@ -217,20 +278,44 @@ async def main(args):
     await muxs.start()
     logger.info('Muxs started.')
 
+    if args.metricsuri:
+        metricsuri = urlparse(args.metricsuri)
+        metrics_server = MetricsServer(metricsuri.hostname, metricsuri.port)
+        await metrics_server.start()
+        logger.info('Metrics served at %s/metrics' % (metricsuri.geturl()))
+
+    fair_sched = FairScheduler(args.fair_quantum)
+    ratelimits.update(up_rate=args.up_rate, up_burst=args.up_burst, dn_rate=args.dn_rate, dn_burst=args.dn_burst)
+
+    pkfwdmux = PkFwdMux(pkfwduri, args.pkfwd_sockets, args.dedup_window, args.dedup_hold)
+    await pkfwdmux.start()
+
     router_config.ini([ args.confdir ])
     routers = args.routerids if args.routerids else router_config.routerid2config.keys()
     for s in routers:
         routerid = Id6(s, 'router')
         logger.info("Instantiating %s" % (routerid))
         rc = router_config.get_router_config(routerid)
-        await add_router(routerid, rc, pkfwduri)
+        await add_router(routerid, rc, pkfwdmux)
+        infos.add_route(routerid, rc.get_muxs_uri())
 
 
 if __name__ == '__main__':  # pragma:nocover
     parser = argparse.ArgumentParser(description='''ts2pkdfwd.''')
     parser.add_argument("--infosuri", type=str, default="ws://localhost:6090", help="Info server base URI.")
     parser.add_argument("--muxsuri", type=str, default=None, help="Mux server base URI, by default Info server port plus 2.")
+    parser.add_argument("--infos-max-conns", type=int, default=0, help="Maximum number of concurrent Info server connections, 0 for no limit.")
     parser.add_argument("--pkfwduri", type=str, help="Packet forwarder destination URI.", default="udp://localhost:1680")
+    parser.add_argument("--pkfwd-sockets", type=int, default=1, help="UDP sockets to the packet forwarder server shared by all routers, 0 for one per router.")
+    parser.add_argument("--dedup-window", type=float, default=0.0, help="Forward only one copy of uplinks with the same PHYPayload heard by several routers within this many secs, 0 to disable.")
+    parser.add_argument("--dedup-hold", type=float, default=0.2, help="Secs to collect copies of an uplink before forwarding the one with the best RSSI.")
+    parser.add_argument("--up-rate", type=float, default=DFLT_RATELIMITS['up_rate'], help="Uplinks per second accepted from each router, 0 for no limit.")
+    parser.add_argument("--up-burst", type=float, default=DFLT_RATELIMITS['up_burst'], help="Uplink burst accepted from each router.")
+    parser.add_argument("--dn-rate", type=float, default=DFLT_RATELIMITS['dn_rate'], help="Downlinks per second forwarded to each router, 0 for no limit.")
+    parser.add_argument("--dn-burst", type=float, default=DFLT_RATELIMITS['dn_burst'], help="Downlink burst forwarded to each router.")
+    parser.add_argument("--fair-quantum", type=int, default=DFLT_QUANTUM, help="Messages a router processes before yielding the event loop to other routers.")
+    parser.add_argument("--metricsuri", type=str, default=None, help="HTTP URI serving /metrics (e.g. http://localhost:6095), disabled by default.")
+    parser.add_argument("--loop", type=str, choices=LOOP_KINDS, help="Event loop: %s - auto uses uvloop if installed." % LOOP_KINDS, default='auto')
     parser.add_argument("--confdir", type=str, help="Directory where to load region and router configuration.", default=".")
     parser.add_argument("--logfile", type=str, help="Log file, by default logged to stdout.", default=None)
     parser.add_argument("--loglevel", type=str, choices=LOG_LEVELS, help="Log level: %s" % LOG_LEVELS, default='INFO')
@@ -240,6 +325,7 @@ if __name__ == '__main__':  # pragma:nocover
     except Exception as exc:
         handle_exc(exc, 1)
 
+    args.loop = install_loop(args.loop)
     loop = asyncio.get_event_loop()
     try:
         loop.run_until_complete(main(args))
@@ -0,0 +1,281 @@
+# --- Revised 3-Clause BSD License ---
+# Copyright Semtech Corporation 2022. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright notice,
+#       this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright notice,
+#       this list of conditions and the following disclaimer in the documentation
+#       and/or other materials provided with the distribution.
+#     * Neither the name of the Semtech corporation nor the names of its
+#       contributors may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SEMTECH CORPORATION. BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from typing import Callable,Dict,List,Optional,Sequence,Tuple
+import time
+import bisect
+import asyncio
+import logging
+
+logger = logging.getLogger('ts2pktfwd')
+
+"""Counters, gauges and histograms served in Prometheus text format over HTTP (GET /metrics)"""
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+LOOP_LAG_INTVL = 0.1
+
+
+def _labelstr(labelnames:Sequence[str], values:Sequence[str], extra:str='') -> str:
+    pairs = [ '%s="%s"' % (n, str(v).replace('\\', '\\\\').replace('"', '\\"')) for n,v in zip(labelnames, values) ]
+    if extra:
+        pairs.append(extra)
+    return '{%s}' % ','.join(pairs) if pairs else ''
+
+
+def _fmt(v:float) -> str:
+    return '%d' % v if isinstance(v, int) else repr(float(v))
+
+
+class CounterChild():
+    __slots__ = ('value',)
+
+    def __init__(self) -> None:
+        self.value = 0
+
+    def inc(self, n:int=1) -> None:
+        self.value += n
+
+
+class GaugeChild():
+    __slots__ = ('value', 'fn')
+
+    def __init__(self) -> None:
+        self.value = 0      # type: float
+        self.fn = None      # type: Optional[Callable[[],float]]
+
+    def set(self, v:float) -> None:
+        self.value = v
+
+    def inc(self, n:float=1) -> None:
+        self.value += n
+
+    def dec(self, n:float=1) -> None:
+        self.value -= n
+
+    def set_function(self, fn:Callable[[],float]) -> None:
+        ''' Value is sampled from fn at scrape time. '''
+        self.fn = fn
+
+    def get(self) -> float:
+        return self.fn() if self.fn else self.value
+
+
+class HistogramChild():
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets:Sequence[float]) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets)+1)   # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, v:float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, v)] += 1
+        self.sum += v
+        self.count += 1
+
+
+class Metric():
+    ''' A metric family - children per label value tuple, created on first use. '''
+
+    kind = ''
+
+    def __init__(self, name:str, help:str, labelnames:Sequence[str]=()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.children = {}   # type: Dict[Tuple[str,...],object]
+
+    def new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values:str):
+        assert len(values) == len(self.labelnames), '%s: labels %r' % (self.name, self.labelnames)
+        child = self.children.get(values)
+        if child is None:
+            child = self.children[values] = self.new_child()
+        return child
+
+    def remove(self, *values:str) -> None:
+        self.children.pop(values, None)
+
+    def render(self, out:List[str]) -> None:
+        out.append('# HELP %s %s' % (self.name, self.help))
+        out.append('# TYPE %s %s' % (self.name, self.kind))
+        for values, child in self.children.items():
+            self.render_child(out, _labelstr(self.labelnames, values), values, child)
+
+    def render_child(self, out:List[str], labels:str, values:Tuple[str,...], child) -> None:
+        out.append('%s%s %s' % (self.name, labels, _fmt(child.value)))
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def new_child(self) -> CounterChild:
+        return CounterChild()
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def new_child(self) -> GaugeChild:
+        return GaugeChild()
+
+    def render_child(self, out:List[str], labels:str, values:Tuple[str,...], child) -> None:
+        try:
+            v = child.get()
+        except Exception as exc:
+            logger.error('Metric %s%s: sampling failed: %s', self.name, labels, exc)
+            return
+        out.append('%s%s %s' % (self.name, labels, _fmt(v)))
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name:str, help:str, labelnames:Sequence[str]=(), buckets:Sequence[float]=LATENCY_BUCKETS) -> None:
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def new_child(self) -> HistogramChild:
+        return HistogramChild(self.buckets)
+
+    def render_child(self, out:List[str], labels:str, values:Tuple[str,...], child) -> None:
+        acc = 0
+        for le, n in zip(self.buckets + (float('inf'),), child.counts):
+            acc += n
+            out.append('%s_bucket%s %d' % (self.name, _labelstr(self.labelnames, values, 'le="%s"' % ('+Inf' if le == float('inf') else _fmt(le))), acc))
+        out.append('%s_sum%s %s' % (self.name, labels, repr(child.sum)))
+        out.append('%s_count%s %d' % (self.name, labels, child.count))
+
+
+class Registry():
+    def __init__(self) -> None:
+        self.metrics = {}    # type: Dict[str,Metric]
+
+    def add(self, metric:Metric) -> Metric:
+        assert metric.name not in self.metrics, 'Duplicate metric: %s' % (metric.name)
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name:str, help:str, labelnames:Sequence[str]=()) -> Counter:
+        return self.add(Counter(name, help, labelnames))
+
+    def gauge(self, name:str, help:str, labelnames:Sequence[str]=()) -> Gauge:
+        return self.add(Gauge(name, help, labelnames))
+
+    def histogram(self, name:str, help:str, labelnames:Sequence[str]=(), buckets:Sequence[float]=LATENCY_BUCKETS) -> Histogram:
+        return self.add(Histogram(name, help, labelnames, buckets))
+
+    def render(self) -> str:
+        out = []  # type: List[str]
+        for m in self.metrics.values():
+            m.render(out)
+        out.append('')
+        return '\n'.join(out)
+
+
+REGISTRY = Registry()
+
+UPLINKS      = REGISTRY.counter('ts2pktfwd_uplinks_total', 'Uplink frames received from stations', ('router', 'msgtype'))
+DOWNLINKS    = REGISTRY.counter('ts2pktfwd_downlinks_total', 'Downlinks received from the packet forwarder server', ('router',))
+DNTXED       = REGISTRY.counter('ts2pktfwd_dntxed_total', 'Downlinks reported as sent by stations', ('router',))
+WS_QUEUE     = REGISTRY.gauge('ts2pktfwd_ws_queue_depth', 'Messages queued for the station web socket', ('router',))
+WS_SEND      = REGISTRY.histogram('ts2pktfwd_ws_send_seconds', 'Duration of a web socket send to a station', ('router',))
+BGTASK_BATCH = REGISTRY.histogram('ts2pktfwd_bgtask_batch_size', 'Queue entries processed per background task run', ('task',), BATCH_BUCKETS)
+BGTASK_TIME  = REGISTRY.histogram('ts2pktfwd_bgtask_seconds', 'Duration of a background task run', ('task',))
+PKFWD_RTT    = REGISTRY.histogram('ts2pktfwd_pkfwd_rtt_seconds', 'PUSH_DATA/PUSH_ACK and PULL_DATA/PULL_ACK round trip time', ('router', 'kind'))
+PUSH_RXPK    = REGISTRY.histogram('ts2pktfwd_pkfwd_push_rxpk', 'rxpk batched into one PUSH_DATA', (), BATCH_BUCKETS)
+UNMATCHED    = REGISTRY.counter('ts2pktfwd_pkfwd_unmatched_total', 'Datagrams from the pkfwd server not matching any gateway', ('msgtype',))
+DEDUP        = REGISTRY.counter('ts2pktfwd_dedup_uplinks_total', 'Uplink copies by dedup result: forwarded, duplicate (within hold), late (after hold)', ('result',))
+DEDUP_RATIO  = REGISTRY.gauge('ts2pktfwd_dedup_ratio', 'Uplink copies received per uplink forwarded')
+RATE_LIMITED = REGISTRY.counter('ts2pktfwd_rate_limited_total', 'Uplinks and downlinks dropped by the router rate limits', ('router', 'direction'))
+FAIR_YIELDS  = REGISTRY.counter('ts2pktfwd_fair_yields_total', 'Times a router gave up the event loop after its message quantum', ('router',))
+LOOP_LAG     = REGISTRY.histogram('ts2pktfwd_loop_lag_seconds', 'Event loop lag - late wakeup of a periodic timer')
+
+
+def bgtask_stats(name:str, start:float, end:float, qlen:int) -> None:
+    ''' BgTask.stats_fn feeding the batch size and duration histograms. '''
+    BGTASK_BATCH.labels(name).observe(qlen)
+    BGTASK_TIME.labels(name).observe(end - start)
+
+
+async def loop_lag_task(intvl:float=LOOP_LAG_INTVL) -> None:
+    loop = asyncio.get_event_loop()
+    lag = LOOP_LAG.labels()
+    while True:
+        t = loop.time()
+        await asyncio.sleep(intvl)
+        lag.observe(max(0.0, loop.time() - t - intvl))
+
+
+class MetricsServer():
+    ''' Minimal HTTP server answering GET /metrics from a registry. '''
+
+    def __init__(self, host:str, port:int, registry:Registry=REGISTRY) -> None:
+        self.host = host
+        self.port = port
+        self.registry = registry
+        self.server = None     # type: Optional[asyncio.AbstractServer]
+        self.lag_task = None   # type: Optional[asyncio.Future]
+
+    def __str__(self):
+        return 'Metrics'
+
+    async def start(self) -> None:
+        self.server = await asyncio.start_server(self.accept, host=self.host, port=self.port)
+        self.lag_task = asyncio.ensure_future(loop_lag_task())
+
+    async def accept(self, reader:asyncio.StreamReader, writer:asyncio.StreamWriter) -> None:
+        try:
+            reqline = (await reader.readline()).decode('latin-1').split()
+            while (await reader.readline()).strip():
+                pass    # skip headers
+            if len(reqline) >= 2 and reqline[0] in ('GET', 'HEAD') and reqline[1].split('?')[0] == '/metrics':
+                status, ctype, body = '200 OK', 'text/plain; version=0.0.4; charset=utf-8', self.registry.render().encode()
+            else:
+                status, ctype, body = '404 Not Found', 'text/plain', b'Not found\n'
+            writer.write(('HTTP/1.0 %s\r\nContent-Type: %s\r\nContent-Length: %d\r\nConnection: close\r\n\r\n' %
+                          (status, ctype, len(body))).encode())
+            if reqline[:1] != ['HEAD']:
+                writer.write(body)
+            await writer.drain()
+        except Exception as exc:
+            logger.error('%s: request failed: %s', self, exc)
+        finally:
+            writer.close()
+
+    async def shutdown(self) -> None:
+        if self.lag_task:
+            self.lag_task.cancel()
+            self.lag_task = None
+        server = self.server
+        if server:
+            self.server = None
+            server.close()
+            await server.wait_closed()
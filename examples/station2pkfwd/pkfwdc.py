@@ -24,22 +24,29 @@
 # OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
 # ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-from typing import Any,Awaitable,Callable,Dict,List,Mapping,Optional
+from typing import Any,Awaitable,Callable,Dict,Hashable,List,Mapping,Optional,Tuple
 import struct
 import asyncio
 import datetime
 import logging
 import json
+import time
 import base64
 
 import router_config
+from dedup import UplinkDedup
 from id6 import Id6
+import metrics
 
 logger = logging.getLogger('ts2pktfwd')
 
 PKFWD_VER = 2
 DFLT_KEEPALIVE_INTVL = 10.0
 DFLT_STAT_INTVL      = 6
+STAT_DELAY           = 0.3    # secs between a PULL_DATA and the stat PUSH_DATA
+WHEEL_TICK           = 0.1    # secs
+WHEEL_SLOTS          = 128
+MAX_RXPK_PER_PUSH    = 8      # rxpk batched into one PUSH_DATA
 PUSH_DATA = 0
 PUSH_ACK  = 1
 PULL_DATA = 2
@@ -57,11 +64,241 @@ MSGTYPE2NAME = {
 }
 
 
-class PkFwdC():
-    def __init__(self, pkfwduri:str, routerid:Id6, config:router_config.RouterConfig, on_pull_resp:Any, get_stat:Any) -> None:
+class TimerWheel():
+    ''' Hashed timer wheel: O(1) add/remove of keyed timers, one task ticking for all of them.
+
+    Timers fire with a resolution of tick secs. Delays longer than a revolution
+    (tick*nslots) wait the remaining rounds in their slot. '''
+
+    def __init__(self, tick:float=WHEEL_TICK, nslots:int=WHEEL_SLOTS) -> None:
+        self.tick = tick
+        self.slots = [ {} for _ in range(nslots) ]   # type: List[Dict[Hashable,List[Any]]]  key -> [rounds, fn]
+        self.where = {}  # type: Dict[Hashable,int]  key -> slot index
+        self.cur = 0
+        self.task = None # type: Optional[asyncio.Future]
+
+    def __len__(self) -> int:
+        return len(self.where)
+
+    def start(self) -> None:
+        if not self.task:
+            self.task = asyncio.ensure_future(self.run())
+
+    def stop(self) -> None:
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    def add(self, key:Hashable, delay:float, fn:Callable[[],None]) -> None:
+        ''' Call fn after delay secs - replaces a pending timer with the same key. '''
+        self.remove(key)
+        n = len(self.slots)
+        ticks = max(1, int(round(delay/self.tick)))
+        idx = (self.cur + ticks) % n
+        self.slots[idx][key] = [(ticks-1)//n, fn]
+        self.where[key] = idx
+
+    def remove(self, key:Hashable) -> None:
+        idx = self.where.pop(key, None)
+        if idx is not None:
+            del self.slots[idx][key]
+
+    def advance(self) -> None:
+        self.cur = (self.cur + 1) % len(self.slots)
+        slot = self.slots[self.cur]
+        due = []
+        for key, e in list(slot.items()):
+            if e[0]:
+                e[0] -= 1
+                continue
+            del slot[key]
+            del self.where[key]
+            due.append(e[1])
+        for fn in due:
+            try:
+                fn()
+            except Exception as exc:
+                logger.error('TimerWheel: timer failed: %s', exc, exc_info=True)
+
+    async def run(self) -> None:
+        loop = asyncio.get_event_loop()
+        deadline = loop.time()
+        while True:
+            deadline += self.tick
+            await asyncio.sleep(max(0.0, deadline - loop.time()))
+            self.advance()
+
+
+class PkFwdSocket():
+    ''' One UDP socket to the pkfwd server - upstream sockets may be shared by several gateways.
+
+    Tokens of PUSH_DATA/PULL_DATA are allocated per socket so PUSH_ACK/PULL_ACK
+    map back to the gateway which sent them. PULL_RESP carries no gateway_ID -
+    the server sends it to the source address of the gateway's last PULL_DATA.
+    Hence PULL_DATA goes out on a socket with a single gateway (see
+    PkFwdMux.register) and PULL_RESP belongs to that gateway. '''
+
+    def __init__(self, name:str) -> None:
+        self.name = name
+        self.transport = None   # type: Optional[asyncio.DatagramTransport]
+        self.gws = []           # type: List[PkFwdC]
+        self.token_counter = 0
+        self.token2gw = {}      # type: Dict[int,PkFwdC]
+
+    def __str__(self) -> str:
+        return 'PkFwdSocket#%s' % (self.name)
+
+    def new_token(self, gw:'PkFwdC') -> int:
+        self.token_counter = (self.token_counter + 1) % 65536
+        self.token2gw[self.token_counter] = gw
+        return self.token_counter
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        #logger.info("%s: received packet: %s" % (self, data.hex()))
+        pver, token, t = struct.unpack('>BHB', data[0:4])
+        if pver != PKFWD_VER:
+            logger.info("%s: received invalid packet: %s" % (self, data.hex()))
+        if t == PULL_ACK or t == PUSH_ACK:
+            gw = self.token2gw.get(token)
+            if gw is None:
+                metrics.UNMATCHED.labels(MSGTYPE2NAME[t]).inc()
+                logger.info("%s: %s with unknown token %d" % (self, MSGTYPE2NAME[t], token))
+            elif t == PULL_ACK:
+                gw.on_pull_ack(token)
+            else:
+                gw.on_push_ack(token)
+            return
+        if t == PULL_RESP:
+            o = json.loads(data[4:].decode())
+            gw = self.gws[0] if len(self.gws) == 1 else None
+            if gw is None:
+                metrics.UNMATCHED.labels('PULL_RESP').inc()
+                logger.error("%s: PULL_RESP for no known gateway: token %d, object %s" % (self, token, o))
+                return
+            logger.info("%s: PULL_RESP: token %d, object %s" % (gw, token, o))
+            gw.on_pull_resp(token, o)
+            return
+        logger.info("%s: received unknown packet: %s" % (self, data.hex()))
+
+    def error_received(self, exc):
+        logger.info("%s: received error: %s" % (self, exc))
+
+    def connection_lost(self, exc):
+        if self.transport is not None:
+            logger.error("%s: socket unexpextedly closed" % (self))
+
+    def sendto(self, message:bytes) -> None:
+        self.transport.sendto(message)
+
+    def close(self) -> None:
+        transport = self.transport
+        self.transport = None
+        if transport:
+            transport.close()
+
+
+class PkFwdMux():
+    ''' All gateways of the bridge over a small pool of UDP sockets.
+
+    Gateways are assigned round robin to nsockets upstream sockets (0: one
+    socket per gateway). A gateway on a shared socket gets a downstream socket
+    of its own for PULL_DATA/PULL_RESP/TX_ACK - as the upstream/downstream
+    sockets of a packet forwarder - so PULL_RESP needs no guessing. Uplinks queued by the gateways within one loop iteration are
+    flushed together, several rxpk per PUSH_DATA. Keepalives (PULL_DATA and
+    the periodic stat) of all gateways run off one TimerWheel. With a
+    dedup_window (secs) copies of an uplink heard by several gateways are
+    reduced to the best one by an UplinkDedup. '''
+
+    def __init__(self, pkfwduri:Any, nsockets:int=1, dedup_window:float=0.0, dedup_hold:float=0.2) -> None:
         self.host = pkfwduri.hostname
         self.port = pkfwduri.port
-        logger.info('PkFwdC: %s %d' % (self.host, self.port))
+        self.nsockets = nsockets
+        self.sockets = []     # type: List[PkFwdSocket]  upstream
+        self.dnsockets = []   # type: List[PkFwdSocket]  downstream of gateways on shared sockets
+        self.ngws = 0
+        self.wheel = TimerWheel()
+        self.dirty = []       # type: List[PkFwdC]
+        self.flush_pending = False
+        self.m_push_rxpk = metrics.PUSH_RXPK.labels()
+        self.dedup = UplinkDedup(self.queue_rxpk, dedup_window, dedup_hold) if dedup_window > 0 else None  # type: Optional[UplinkDedup]
+
+    def __str__(self) -> str:
+        return 'PkFwdMux'
+
+    async def start(self) -> None:
+        logger.info('%s: %s %d, %s' % (self, self.host, self.port,
+                                       '%d sockets' % self.nsockets if self.nsockets else 'one socket per router'))
+        if self.dedup:
+            logger.info('%s: dedup window %gs, hold %gs' % (self, self.dedup.window, self.dedup.hold))
+        self.wheel.start()
+
+    async def shutdown(self) -> None:
+        if self.dedup:
+            self.dedup.flush()
+            self.flush()
+        self.wheel.stop()
+        for sock in self.sockets + self.dnsockets:
+            sock.close()
+
+    async def open_socket(self, name:str) -> PkFwdSocket:
+        loop = asyncio.get_event_loop()
+        sock = PkFwdSocket(name)
+        await loop.create_datagram_endpoint(lambda: sock, remote_addr=(self.host, self.port))
+        return sock
+
+    async def register(self, gw:'PkFwdC') -> Tuple[PkFwdSocket,PkFwdSocket]:
+        ''' Upstream and downstream socket of gw - the same one unless sockets are shared. '''
+        idx = self.ngws % self.nsockets if self.nsockets else self.ngws
+        self.ngws += 1
+        if idx == len(self.sockets):
+            self.sockets.append(await self.open_socket(str(idx)))
+        sock = self.sockets[idx]
+        sock.gws.append(gw)
+        if not self.nsockets:
+            return sock, sock
+        dnsock = await self.open_socket('dn:%s' % (gw.routerid,))
+        dnsock.gws.append(gw)
+        self.dnsockets.append(dnsock)
+        return sock, dnsock
+
+    def push_rxpk(self, gw:'PkFwdC', rxpk:Dict[str,Any], pdu:bytes) -> None:
+        if self.dedup:
+            self.dedup.add(gw, rxpk, pdu)
+        else:
+            self.queue_rxpk(gw, rxpk)
+
+    def queue_rxpk(self, gw:'PkFwdC', rxpk:Dict[str,Any]) -> None:
+        if not gw.pend_rxpk:
+            self.mark_dirty(gw)
+        gw.pend_rxpk.append(rxpk)
+
+    def mark_dirty(self, gw:'PkFwdC') -> None:
+        self.dirty.append(gw)
+        if not self.flush_pending:
+            self.flush_pending = True
+            asyncio.get_event_loop().call_soon(self.flush)
+
+    def flush(self) -> None:
+        self.flush_pending = False
+        dirty = self.dirty
+        self.dirty = []
+        for gw in dirty:
+            try:
+                gw.flush_rxpk()
+            except Exception as exc:
+                logger.error('%s: flush failed: %s', gw, exc, exc_info=True)
+
+
+class PkFwdC():
+    ''' Packet forwarder state of one gateway - sends over a socket of the PkFwdMux. '''
+
+    def __init__(self, mux:PkFwdMux, routerid:Id6, config:router_config.RouterConfig, on_pull_resp:Any, get_stat:Any) -> None:
+        self.mux = mux
+        self.sock = None    # type: Optional[PkFwdSocket]  PUSH_DATA
+        self.dnsock = None  # type: Optional[PkFwdSocket]  PULL_DATA, TX_ACK
         self.routerid = routerid
         self.rid = routerid.id
         # the id as reported to the remote packet forarder process
@@ -69,77 +306,47 @@ class PkFwdC():
         self.on_pull_resp = on_pull_resp
         self.get_stat = get_stat
         self.keepalive_intvl = DFLT_KEEPALIVE_INTVL
+        self.active = False
+        self.pend_rxpk = []     # type: List[Dict[str,Any]]
         self.push_data_token = 0
         self.push_data_counter = 0
         self.push_ack_counter = 0
-        self.pull_data_task = None
         self.pull_data_token = 0
         self.pull_data_counter = 0
         self.pull_ack_token = 0
+        self.push_sent = {}     # type: Dict[int,float]  PUSH_DATA token -> send time (RTT)
+        self.pull_sent = None   # type: Optional[float]
+        self.m_push_rtt = metrics.PKFWD_RTT.labels(str(routerid), 'push')
+        self.m_pull_rtt = metrics.PKFWD_RTT.labels(str(routerid), 'pull')
 
 
-    def __str__(self) -> None:
-        return 'PkFwdC'
+    def __str__(self) -> str:
+        return 'PkFwdC:%s' % (self.routerid)
 
 
     async def shutdown(self):
-        if self.transport:
-            try:
-                self.transport.close()
-            except:
-                pass  # pragma:nocover
+        await self.pause()
 
 
     async def start(self) -> None:
-        loop = asyncio.get_event_loop()
-        self.transport, self.protocol = await loop.create_datagram_endpoint(lambda: self, remote_addr=(self.host, self.port))
+        self.sock, self.dnsock = await self.mux.register(self)
+        logger.info('%s: on %s/%s' % (self, self.sock, self.dnsock))
 
 
     async def pause(self) -> None:
-        if self.pull_data_task:
-            t = self.pull_data_task
-            self.pull_data_task = None
-            t.cancel()
+        self.active = False
+        self.mux.wheel.remove((self, PULL_DATA))
+        self.mux.wheel.remove((self, PUSH_DATA))
 
 
     async def resume(self) -> None:
-        assert self.pull_data_task is None
-        self.pull_data_task = asyncio.ensure_future(self.pull_data_task_func())
-
-
-    def connection_made(self, transport):
-        self.transport = transport
-
-
-    def datagram_received(self, data, addr):
-        #logger.info("%s: received packet: %s" % (self, data.hex()))
-        pver, token, t = struct.unpack('>BHB', data[0:4])
-        if pver != PKFWD_VER:
-            logger.info("%s: received invalid packet: %s" % (self, data.hex()))
-        if t == PULL_ACK:
-            self.on_pull_ack(token)
-            return
-        if t == PUSH_ACK:
-            self.on_push_ack(token)
-            return
-        if t == PULL_RESP:
-            o = json.loads(data[4:].decode())
-            logger.info("%s: PULL_RESP: token %d, object %s" % (self, token, o))
-            self.on_pull_resp(token, o)
-            return
-        logger.info("%s: received unknown packet: %s" % (self, data.hex()))
-
-
-    def error_received(self, exc):
-        logger.info("%s: received error: %s" % (self, exc))
-
-
-    def connection_lost(self, exc):
-        logger.error("%s: socket unexpextedly closed" % (self))
+        assert not self.active
+        self.active = True
+        self.keepalive()
 
 
     def sendto(self, message:bytes) -> None:
-        self.transport.sendto(message)
+        self.sock.sendto(message)
 
 
     def push_rxpk(self, rxtime:float, tmst:int, chan:int, rfch:int, Freq:int, datr:str, rssi:float, snr:float, pdu_ba:bytes) -> None:
@@ -147,83 +354,96 @@ class PkFwdC():
         pdu_b64 = base64.b64encode(pdu_ba).decode('ascii')
         assert Freq > 100000000
         freq = Freq/1000000.0
-        pkt = {
-            'rxpk': [{
-                "time": time,
-                "tmst": tmst,
-                "chan": chan,
-                "rfch": rfch,
-                "freq": freq,
-                "stat": 1,
-                "modu": "LORA",
-                "datr": datr,
-                'codr': "4/5",
-                "rssi": rssi,
-                "lsnr": snr,
-                "size": len(pdu_ba),
-                "data": pdu_b64
-            }]
+        rxpk = {
+            "time": time,
+            "tmst": tmst,
+            "chan": chan,
+            "rfch": rfch,
+            "freq": freq,
+            "stat": 1,
+            "modu": "LORA",
+            "datr": datr,
+            'codr': "4/5",
+            "rssi": rssi,
+            "lsnr": snr,
+            "size": len(pdu_ba),
+            "data": pdu_b64
         }
-        logger.info('%s: rxpk: %s' % (self, pkt))
-        self.push_data(pkt)
+        logger.info('%s: rxpk: %s' % (self, rxpk))
+        self.mux.push_rxpk(self, rxpk, pdu_ba)
+
+
+    def flush_rxpk(self) -> None:
+        pend = self.pend_rxpk
+        self.pend_rxpk = []
+        for i in range(0, len(pend), MAX_RXPK_PER_PUSH):
+            batch = pend[i:i+MAX_RXPK_PER_PUSH]
+            self.mux.m_push_rxpk.observe(len(batch))
+            self.push_data({ 'rxpk': batch })
 
 
     def push_txack(self, token:int) -> None:
         hdr = struct.pack('>BHBq', PKFWD_VER, token, TX_ACK, self.pkfwdgwid)
         logger.info('%s: TX_ACK: %d %s' % (self, token, hdr))
-        self.sendto(hdr)
+        self.dnsock.sendto(hdr)
 
 
     def push_data(self, pkt:Any) -> None:
         self.push_data_counter += 1
-        self.push_data_token = self.push_data_counter % 65536
+        self.push_data_token = self.sock.new_token(self)
         hdr = struct.pack('>BHBq', PKFWD_VER, self.push_data_token, PUSH_DATA, self.pkfwdgwid)
         data = hdr + bytes(json.dumps(pkt), 'utf-8')
         logger.debug('%s: push_data: %s %s' % (self, hdr.hex(), data.hex()))
+        self.push_sent[self.push_data_token] = time.monotonic()
         self.sendto(data)
 
 
     def on_push_ack(self, token:int) -> None:
         self.push_ack_counter += 1
+        sent = self.push_sent.pop(token, None)
+        if sent is not None:
+            self.m_push_rtt.observe(time.monotonic() - sent)
         logger.debug('%s: on_push_ack: %d' % (self, token))
 
 
     def pull_data(self) -> None:
         self.pull_data_counter += 1
-        self.pull_data_token = self.pull_data_counter % 65536
+        self.pull_data_token = self.dnsock.new_token(self)
         ba = struct.pack('>BHBq', PKFWD_VER, self.pull_data_token, PULL_DATA, self.pkfwdgwid)
-        self.sendto(ba)
+        self.pull_sent = time.monotonic()
+        self.dnsock.sendto(ba)
 
 
     def on_pull_ack(self, token:int) -> None:
         self.pull_ack_token = token
+        if self.pull_sent is not None and token == self.pull_data_token:
+            self.m_pull_rtt.observe(time.monotonic() - self.pull_sent)
+            self.pull_sent = None
         logger.debug('%s: on_pull_ack: %d' % (self, token))
 
 
-    async def pull_data_task_func(self) -> None:
-        while True:
-            try:
-                self.pull_data()
-            except asyncio.CancelledError:
-                logger.error('%s: pull_data_task_func cancelled.' % (self))
-                raise
-            except Exception as exc:
-                logger.error('%s: pull_data_task_func failed: %s', self, exc, exc_info=True)
-
-            if ((self.pull_data_counter - 1) % DFLT_STAT_INTVL) == 0:
-                await asyncio.sleep(0.3)
-                stat = self.get_stat()
-                pkt = { 'stat': stat }
-                pkt['stat']['time'] = datetime.datetime.utcnow().isoformat() + 'Z'
-                if self.push_data_counter == 0:
-                    pkt['stat']['ackr'] = 0.0
-                else:
-                    pkt['stat']['ackr'] = round((100*self.push_ack_counter)/self.push_data_counter, 1)
-                logger.info('%s: send_stats: %s' % (self, pkt))
-                self.push_data(pkt)
-
-            await asyncio.sleep(self.keepalive_intvl)
-
-            if self.pull_ack_token != self.pull_ack_token:
-                logger.warn('PULL_DATA/_ACK mismatch, disconnected?')
-
+    def keepalive(self) -> None:
+        ''' PULL_DATA every keepalive_intvl, stat every DFLT_STAT_INTVL'th time - timers of mux.wheel. '''
+        if not self.active:
+            return
+        if self.pull_sent is not None:
+            logger.warning('%s: PULL_DATA/_ACK mismatch, disconnected?' % (self))
+        try:
+            self.pull_data()
+        except Exception as exc:
+            logger.error('%s: keepalive failed: %s', self, exc, exc_info=True)
+        if ((self.pull_data_counter - 1) % DFLT_STAT_INTVL) == 0:
+            self.mux.wheel.add((self, PUSH_DATA), STAT_DELAY, self.send_stat)
+        self.mux.wheel.add((self, PULL_DATA), self.keepalive_intvl, self.keepalive)
+
+
+    def send_stat(self) -> None:
+        stat = self.get_stat()
+        pkt = { 'stat': stat }
+        pkt['stat']['time'] = datetime.datetime.utcnow().isoformat() + 'Z'
+        if self.push_data_counter == 0:
+            pkt['stat']['ackr'] = 0.0
+        else:
+            pkt['stat']['ackr'] = round((100*self.push_ack_counter)/self.push_data_counter, 1)
+        logger.info('%s: send_stat: %s' % (self, pkt))
+        self.push_data(pkt)
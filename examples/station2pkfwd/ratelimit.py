@@ -0,0 +1,99 @@
+# --- Revised 3-Clause BSD License ---
+# Copyright Semtech Corporation 2022. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright notice,
+#       this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright notice,
+#       this list of conditions and the following disclaimer in the documentation
+#       and/or other materials provided with the distribution.
+#     * Neither the name of the Semtech corporation nor the names of its
+#       contributors may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SEMTECH CORPORATION. BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from typing import Any,Mapping,Optional
+import time
+import asyncio
+import logging
+
+logger = logging.getLogger('ts2pktfwd')
+
+"""Per router rate limits and fair sharing of the event loop between routers"""
+
+RATELIMIT_KEYS = ('up_rate', 'up_burst', 'dn_rate', 'dn_burst')
+DFLT_RATELIMITS = { 'up_rate': 0.0, 'up_burst': 10.0, 'dn_rate': 0.0, 'dn_burst': 5.0 }   # rate 0: unlimited
+DFLT_QUANTUM = 16
+
+
+class TokenBucket():
+    ''' Admits on average rate events per second with bursts up to burst. '''
+
+    def __init__(self, rate:float, burst:float=1.0) -> None:
+        assert rate > 0
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.tokens = self.burst
+        self.tstamp = time.monotonic()
+
+    def take(self, n:float=1.0) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.tstamp) * self.rate)
+        self.tstamp = now
+        if self.tokens >= n:
+            self.tokens -= n
+            return True
+        return False
+
+
+def make_bucket(limits:Mapping[str,float], kind:str) -> Optional[TokenBucket]:
+    ''' Bucket for kind 'up' or 'dn' - None if unlimited. '''
+    rate = float(limits.get(kind+'_rate') or 0.0)
+    return TokenBucket(rate, float(limits.get(kind+'_burst') or 1.0)) if rate > 0 else None
+
+
+class FairScheduler():
+    ''' Round robin between routers on the shared event loop.
+
+    A web socket with buffered messages returns them without suspending, so a
+    busy router could process its backlog in one go. Each router spends one
+    unit of its Budget per message and yields after quantum messages - it
+    then queues up behind all other ready routers, pkfwd datagrams and
+    downlink writers. '''
+
+    def __init__(self, quantum:int=DFLT_QUANTUM) -> None:
+        assert quantum > 0
+        self.quantum = quantum
+
+    def budget(self, m_yields:Any=None) -> 'Budget':
+        ''' Budget of one router - m_yields (a counter) counts its yields. '''
+        return Budget(self, m_yields)
+
+
+class Budget():
+    __slots__ = ('sched', 'left', 'm_yields')
+
+    def __init__(self, sched:FairScheduler, m_yields:Any=None) -> None:
+        self.sched = sched
+        self.left = sched.quantum
+        self.m_yields = m_yields
+
+    async def spend(self) -> None:
+        self.left -= 1
+        if self.left <= 0:
+            self.left = self.sched.quantum
+            if self.m_yields:
+                self.m_yields.inc()
+            await asyncio.sleep(0)
@@ -33,12 +33,15 @@ import struct
 import base64
 import datetime
 import copy
+import time
 from websockets.server import WebSocketServerProtocol as WSSP
 
 import router_config
 import pkfwdc
 from id6 import Id6, Eui
 from bgtask import BgTask
+from ratelimit import FairScheduler, make_bucket
+import metrics
 
 
 logger = logging.getLogger('ts2pktfwd')
@@ -51,14 +54,31 @@ def xtime2bits32(xtime:int) -> int:
 class Router:
     ''' Map Station messages to pkfwd and vice versa. '''
 
-    def __init__(self, routerid:Id6, config:router_config.RouterConfig, pkfwduri:Any) -> None:
+    def __init__(self, routerid:Id6, config:router_config.RouterConfig, pkfwdmux:pkfwdc.PkFwdMux,
+                 sched:FairScheduler, ratelimits:Mapping[str,float]) -> None:
         self.routerid = routerid
         self.config = config
-        self.pkfwdc = pkfwdc.PkFwdC(pkfwduri, routerid, config, self.on_pull_resp, self.get_pkfwd_stat)
+        limits = dict(ratelimits)
+        limits.update(config.get_ratelimit())
+        self.up_bucket = make_bucket(limits, 'up')
+        self.dn_bucket = make_bucket(limits, 'dn')
+        self.pkfwdc = pkfwdc.PkFwdC(pkfwdmux, routerid, config, self.on_pull_resp, self.get_pkfwd_stat)
         self.websocket = None  # type:Optional[WSSP]
         empty_list_fn = list            # type: Callable[[],List[Mapping{str,Any]]]
         self.ws_write_bgtask = BgTask(self.ws_write_bgtask_func, empty_list_fn, 'ws_write_bgtask', 10.0)
+        self.ws_write_bgtask.stats_fn = metrics.bgtask_stats
         self.ws_write_bgtask.start()
+
+        rlabel = str(routerid)
+        self.m_jreq = metrics.UPLINKS.labels(rlabel, 'jreq')
+        self.m_updf = metrics.UPLINKS.labels(rlabel, 'updf')
+        self.m_dnlinks = metrics.DOWNLINKS.labels(rlabel)
+        self.m_dntxed = metrics.DNTXED.labels(rlabel)
+        self.m_ws_send = metrics.WS_SEND.labels(rlabel)
+        self.m_up_limited = metrics.RATE_LIMITED.labels(rlabel, 'up')
+        self.m_dn_limited = metrics.RATE_LIMITED.labels(rlabel, 'dn')
+        self.budget = sched.budget(metrics.FAIR_YIELDS.labels(rlabel))
+        metrics.WS_QUEUE.labels(rlabel).set_function(lambda: len(self.ws_write_bgtask.queue))
         
         self.chan = 0
         self.rfch = 0
@@ -108,6 +128,7 @@ class Router:
 
             while True:
                 s = json.loads(await websocket.recv())
+                await self.budget.spend()
                 msgtype = s.get('msgtype')
                 logger.info('%s: on_ws: msgtype: %s' % (self, msgtype))
                 logger.debug('%s: on_ws: %s' % (self, s))
@@ -120,6 +141,9 @@ class Router:
                     await websocket.send(json.dumps(msg))
 
                 elif msgtype == 'jreq':
+                    self.m_jreq.inc()
+                    if not self.admit_uplink():
+                        continue
                     self.pkfwdstat['rxnb'] += 1
                     self.pkfwdstat['rxok'] += 1
                     self.pkfwdstat['rxfw'] += 1
@@ -139,6 +163,9 @@ class Router:
                     self.pkfwdc.push_rxpk(rxtime, xtime2bits32(xtime), self.chan, self.rfch, s['Freq'], datr, rssi, snr, pdu_ba)
 
                 elif msgtype == 'updf':
+                    self.m_updf.inc()
+                    if not self.admit_uplink():
+                        continue
                     self.pkfwdstat['rxnb'] += 1
                     self.pkfwdstat['rxok'] += 1
                     self.pkfwdstat['rxfw'] += 1
@@ -162,6 +189,7 @@ class Router:
                     self.pkfwdc.push_rxpk(rxtime, xtime2bits32(xtime), self.chan, self.rfch, s['Freq'], datr, rssi, snr, pdu_ba)
 
                 elif msgtype == 'dntxed':
+                    self.m_dntxed.inc()
                     self.pkfwdstat['txnb'] += 1
                     token = s['diid']
                     self.pkfwdc.push_txack(token)
@@ -175,6 +203,17 @@ class Router:
             await self.pkfwdc.pause()
 
 
+    def admit_uplink(self) -> bool:
+        ''' Uplink within the router's rate limit? Otherwise it is dropped. '''
+        if self.up_bucket is None or self.up_bucket.take():
+            return True
+        self.m_up_limited.inc()
+        self.pkfwdstat['rxnb'] += 1
+        self.pkfwdstat['rxok'] += 1
+        logger.debug('%s: uplink rate limit exceeded - dropped' % (self))
+        return False
+
+
     def get_pkfwd_stat(self) -> MutableMapping[str,Any]:
         return self.pkfwdstat
 
@@ -185,7 +224,12 @@ class Router:
             logger.info('%s: on_pull_resp: unhandled message: %s' % (self, obj))
             return
 
+        self.m_dnlinks.inc()
         self.pkfwdstat['dwnb'] += 1
+        if self.dn_bucket is not None and not self.dn_bucket.take():
+            self.m_dn_limited.inc()
+            logger.warning('%s: downlink rate limit exceeded - dropped token %d' % (self, token))
+            return
 
         txpk = obj['txpk']
         RxDelay  = self.config.RxDelay
@@ -233,7 +277,9 @@ class Router:
             for e in queue:
                 logger.debug('%s: ws_write_bgtask_func: %s' % (self, e))
                 if self.websocket is not None:
+                    t = time.monotonic()
                     await self.websocket.send(json.dumps(e))
+                    self.m_ws_send.observe(time.monotonic() - t)
         except asyncio.CancelledError:
             logger.error('%s: ws_write_bgtask_func cancelled.' % (self))
             raise
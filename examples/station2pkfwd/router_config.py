@@ -32,6 +32,7 @@ import logging
 import pprint
 import struct
 from id6 import Id6, Eui
+from ratelimit import RATELIMIT_KEYS
 
 logger = logging.getLogger('ts2pktfwd')
 
@@ -81,6 +82,14 @@ class RouterConfig:
         else:
             raise Exception('Unsupported region: %s' % (region))
 
+        # Optional muxs uri overriding the default of muxs base uri + router id
+        self.muxs_uri = config.get('muxs_uri')
+
+        # Optional rate limits overriding the command line defaults
+        self.ratelimit = config.get('ratelimit') or {}
+        for kw in self.ratelimit:
+            assert kw in RATELIMIT_KEYS, 'Invalid ratelimit key in router config of %s: %s' % (routerid, kw)
+
         pktfwd = config['pktfwd']
         self.pktfwd = pktfwd
         if 'gateway_ID' not in pktfwd:
@@ -95,6 +104,12 @@ class RouterConfig:
     def get_pktfwd_gateway_ID(self) -> int:
         return self.pktfwd['gateway_ID']
 
+    def get_muxs_uri(self) -> Optional[str]:
+        return self.muxs_uri
+
+    def get_ratelimit(self) -> Mapping[str,float]:
+        return self.ratelimit
+
     def get_hwspec(self) -> str:
         return self.station['hwspec']
 
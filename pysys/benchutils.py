@@ -0,0 +1,76 @@
+# --- Revised 3-Clause BSD License ---
+# Copyright Semtech Corporation 2022. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright notice,
+#       this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright notice,
+#       this list of conditions and the following disclaimer in the documentation
+#       and/or other materials provided with the distribution.
+#     * Neither the name of the Semtech corporation nor the names of its
+#       contributors may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SEMTECH CORPORATION. BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+from typing import Any,Callable,Dict,List,Optional,Sequence
+import os
+import sys
+import json
+import time
+import logging
+
+logger = logging.getLogger('benchutils')
+
+
+def percentiles(samples:Sequence[float], ps:Sequence[float]=(50,90,99,99.9)) -> Dict[str,float]:
+    """Nearest-rank percentiles of samples keyed as 'p50', 'p99.9' etc."""
+    if not samples:
+        return { 'p%g' % p: float('nan') for p in ps }
+    s = sorted(samples)
+    n = len(s)
+    return { 'p%g' % p: s[min(n-1, max(0, int(round(p/100.0*n+0.5))-1))] for p in ps }
+
+
+def timeit(fn:Callable[...,Any], *args, repeat:int=3) -> float:
+    """Best wall clock time in seconds of repeat calls of fn(*args)."""
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter()-t0)
+    return best
+
+
+class BenchReport:
+    """Collect named result rows of a benchmark run, print them as a table and
+    optionally append them as JSON lines to the file named by env var BENCH_JSON."""
+
+    def __init__(self, name:str) -> None:
+        self.name = name
+        self.rows = []    # type: List[Dict[str,Any]]
+
+    def add(self, case:str, **values) -> None:
+        row = { 'bench': self.name, 'case': case, **values }
+        self.rows.append(row)
+        logger.info('%s %-28s %s', self.name, case,
+                    ' '.join('%s=%s' % (k, ('%.4g' % v if isinstance(v,float) else v)) for k,v in values.items()))
+
+    def done(self) -> None:
+        fn = os.environ.get('BENCH_JSON')
+        if fn:
+            with open(fn, 'a') as f:
+                for row in self.rows:
+                    f.write(json.dumps(row)+'\n')
@@ -0,0 +1,187 @@
+# --- Revised 3-Clause BSD License ---
+# Copyright Semtech Corporation 2022. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright notice,
+#       this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright notice,
+#       this list of conditions and the following disclaimer in the documentation
+#       and/or other materials provided with the distribution.
+#     * Neither the name of the Semtech corporation nor the names of its
+#       contributors may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SEMTECH CORPORATION. BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Capture of station<->MUXS and station<->lgwsim traffic.
+
+Frames are appended to a binary file - a magic header followed by records:
+
+    <d q B B H I>  mono, xticks, chan, flags, unit, len   followed by len bytes
+
+mono is time.monotonic() when the frame was sent/received, xticks the
+simulated SX130x time (lgwsim frames only, see FLAG_XTICKS). A partially
+written last record (crash) is ignored by read_frames.
+
+Every Recorder starts a session with a CHAN_SESSION record (JSON: pid, argv,
+cwd, time). test.sh scripts run test.py several times, so one file may hold
+several sessions - read_frames(path, session) selects one of them.
+
+Setting CAPTURE_FILE makes every Muxs/LgwSimServer record into that file.
+See replay.py for re-injecting a capture into a station.
+"""
+
+from typing import Any,BinaryIO,Dict,Iterator,List,NamedTuple,Optional,Union
+import os
+import sys
+import time
+import struct
+import atexit
+import argparse
+import json
+
+MAGIC = b'S2CAP\x00\x01\n'
+REC = struct.Struct('<dqBBHI')
+
+CHAN_SESSION = 0   # session header - see Recorder
+CHAN_MUXS    = 1
+CHAN_LGWSIM  = 2
+CHAN_NAMES = { CHAN_SESSION: 'session', CHAN_MUXS: 'muxs', CHAN_LGWSIM: 'lgwsim' }
+
+FLAG_DN     = 0x01   # sent to the station (otherwise sent by the station)
+FLAG_TEXT   = 0x02   # websocket text frame
+FLAG_XTICKS = 0x04   # xticks field is valid
+
+FLUSH_INTVL = 0.5    # secs - data is also flushed at exit
+
+Frame = NamedTuple('Frame', [('mono',float), ('xticks',int), ('chan',int), ('flags',int), ('unit',int), ('data',bytes)])
+
+
+class Recorder:
+    def __init__(self, path:str) -> None:
+        self.path = path
+        self.file = open(path, 'ab')  # type: Optional[BinaryIO]
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+        info = json.dumps({ 'pid': os.getpid(), 'argv': sys.argv, 'cwd': os.getcwd(), 'time': time.time() }).encode('utf-8')
+        self.file.write(REC.pack(time.monotonic(), 0, CHAN_SESSION, FLAG_TEXT, 0, len(info)))
+        self.file.write(info)
+        self.nframes = 0
+        self.last_flush = time.monotonic()
+        atexit.register(self.close)
+
+    def record(self, chan:int, flags:int, data:Union[bytes,str], unit:int=0, xticks:Optional[int]=None) -> None:
+        if self.file is None:
+            return
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+            flags |= FLAG_TEXT
+        if xticks is not None:
+            flags |= FLAG_XTICKS
+        now = time.monotonic()
+        self.file.write(REC.pack(now, xticks or 0, chan, flags, unit, len(data)))
+        self.file.write(data)
+        self.nframes += 1
+        if now - self.last_flush >= FLUSH_INTVL:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.file is not None:
+            self.file.flush()
+            self.last_flush = time.monotonic()
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+_default = None  # type: Optional[Recorder]
+
+def default_recorder() -> Optional[Recorder]:
+    """Recorder for CAPTURE_FILE shared by all servers of this process (None if not set)."""
+    global _default
+    path = os.environ.get('CAPTURE_FILE')
+    if not path:
+        return None
+    if _default is None or _default.path != path:
+        _default = Recorder(path)
+    return _default
+
+
+def read_records(path:str) -> Iterator[Frame]:
+    """All records including session headers"""
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('%s: not a capture file' % (path,))
+        while True:
+            hdr = f.read(REC.size)
+            if len(hdr) < REC.size:
+                return
+            mono, xticks, chan, flags, unit, n = REC.unpack(hdr)
+            data = f.read(n)
+            if len(data) < n:
+                return
+            yield Frame(mono, xticks, chan, flags, unit, data)
+
+
+def read_frames(path:str, session:Optional[int]=None) -> Iterator[Frame]:
+    """Frames of one session (index in file order) - of all sessions if None.
+    Frames before the first session header (older captures) belong to session 0."""
+    idx = 0
+    started = False
+    for fr in read_records(path):
+        if fr.chan == CHAN_SESSION:
+            idx += started
+            started = True
+        elif session is None or session == idx:
+            yield fr
+
+
+def sessions(path:str) -> List[Dict[str,Any]]:
+    """Session headers in file order - [{}] for a capture without headers"""
+    infos = [ json.loads(fr.data) for fr in read_records(path) if fr.chan == CHAN_SESSION ]
+    return infos or [{}]
+
+
+def describe(frame:Frame) -> str:
+    """One line summary - msgtype for MUXS text frames, frame size otherwise."""
+    if frame.chan == CHAN_SESSION:
+        info = json.loads(frame.data)
+        return 'session pid=%s %s' % (info.get('pid'), ' '.join(info.get('argv', [])))
+    what = '%d bytes' % len(frame.data)
+    if frame.flags & FLAG_TEXT:
+        try:
+            what = json.loads(frame.data).get('msgtype') or 'router_info/config'
+        except Exception:
+            pass
+    return '%-6s#%d %s %s' % (CHAN_NAMES.get(frame.chan, frame.chan), frame.unit,
+                              '->station' if frame.flags & FLAG_DN else '<-station', what)
+
+
+def main(args) -> None:
+    ap = argparse.ArgumentParser(description='Dump a station traffic capture')
+    ap.add_argument('file')
+    ap.add_argument('--session', type=int, help='Only frames of this session (0..)')
+    args = ap.parse_args(args)
+    t0 = None
+    frames = read_records(args.file) if args.session is None else read_frames(args.file, args.session)
+    for fr in frames:
+        t0 = fr.mono if t0 is None or fr.chan == CHAN_SESSION else t0
+        xt = '%16d' % fr.xticks if fr.flags & FLAG_XTICKS else '%16s' % '-'
+        print('%10.6f %s %s' % (fr.mono - t0, xt, describe(fr)))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
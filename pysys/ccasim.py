@@ -0,0 +1,212 @@
+# --- Revised 3-Clause BSD License ---
+# Copyright Semtech Corporation 2022. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright notice,
+#       this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright notice,
+#       this list of conditions and the following disclaimer in the documentation
+#       and/or other materials provided with the distribution.
+#     * Neither the name of the Semtech corporation nor the names of its
+#       contributors may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SEMTECH CORPORATION. BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Channel occupancy scenarios streamed into LgwSim as CCA updates.
+
+Each Interferer is a process of alternating idle/busy periods on one
+frequency. CcaScenario keeps generating their busy intervals and sends the
+ones overlapping the next `horizon` seconds to LgwSim whenever that window
+changes. lgwsim refuses a TX whose start falls into a busy interval on the
+TX frequency (LBT failure) - the station then has to defer, reroute or drop
+the downlink.
+
+    scn = ccasim.CcaScenario([ ccasim.PoissonInterferer(922.1, occupancy=0.3, mean_busy=0.05) ])
+    scn.start(lgwsim)
+    ...
+    await scn.stop()
+
+A CCA frame holds at most MAX_CCA_INFOS-1 intervals. If more would be
+needed to cover the window, the latest are left out and counted in
+`truncated` - use a shorter horizon/tick or fewer interferers.
+"""
+
+from typing import Dict,List,Optional,Sequence,Tuple
+import bisect
+import random
+import asyncio
+import logging
+
+import simutils as su
+
+logger = logging.getLogger('ccasim')
+
+Interval = Tuple[int,int]   # busy from/to in xticks (inclusive)
+MAX_INTERVALS = su.MAX_CCA_INFOS - 1
+XTICKS_MAX = (1<<63) - 1
+MAX_HISTORY = 100000        # past intervals kept per interferer for busy()/occupancy()
+
+
+class Interferer:
+    """Busy intervals on one frequency (MHz) - subclasses define the periods."""
+    def __init__(self, freq:float, seed:Optional[int]=None) -> None:
+        self.freq = freq
+        self.freq_hz = int(round(freq*1e6))
+        self.rnd = random.Random(seed)
+        self.past = []  # type: List[Interval]
+        self.t = None   # type: Optional[int]  generated up to here
+
+    def next_period(self) -> Tuple[float,float]:
+        """(idle, busy) seconds of the next period"""
+        raise NotImplementedError()
+
+    def first_idle(self) -> float:
+        """Idle time before the first busy period - random phase by default"""
+        idle, busy = self.next_period()
+        return self.rnd.uniform(0, idle+busy)
+
+    def intervals(self, t0:int, t1:int) -> List[Interval]:
+        """Busy intervals overlapping [t0,t1] - generated on demand, t0 must not go backwards."""
+        if self.t is None:
+            self.t = t0 + int(self.first_idle()*1e6)
+        while self.t <= t1:
+            idle, busy = self.next_period()
+            beg = self.t
+            end = beg + max(1, int(busy*1e6))
+            self.past.append((beg, end))
+            self.t = end + max(1, int(idle*1e6))
+        if len(self.past) > MAX_HISTORY:
+            del self.past[:len(self.past)-MAX_HISTORY]
+        # Intervals are ordered and disjoint - scan back from the latest
+        ivs = []
+        for iv in reversed(self.past):
+            if iv[1] < t0:
+                break
+            if iv[0] <= t1:
+                ivs.append(iv)
+        return ivs[::-1]
+
+    def busy(self, xtime:int) -> bool:
+        i = bisect.bisect_right(self.past, (xtime, XTICKS_MAX)) - 1
+        return i >= 0 and self.past[i][1] >= xtime
+
+    def occupancy(self, t0:int, t1:int) -> float:
+        """Busy fraction of [t0,t1] as generated so far"""
+        if t1 <= t0:
+            return 0.0
+        busy = sum(max(0, min(end,t1) - max(beg,t0)) for beg,end in self.past)
+        return busy / (t1-t0)
+
+
+class PoissonInterferer(Interferer):
+    """Random traffic: exponential busy and idle times for a mean occupancy."""
+    def __init__(self, freq:float, occupancy:float, mean_busy:float=0.05, seed:Optional[int]=None) -> None:
+        super().__init__(freq, seed)
+        assert 0 < occupancy < 1
+        self.mean_busy = mean_busy
+        self.mean_idle = mean_busy * (1-occupancy) / occupancy
+
+    def next_period(self) -> Tuple[float,float]:
+        return self.rnd.expovariate(1/self.mean_idle), self.rnd.expovariate(1/self.mean_busy)
+
+
+class PeriodicInterferer(Interferer):
+    """Beacon like traffic: busy for `busy` secs every `period` secs (phase `offset`, random if None)."""
+    def __init__(self, freq:float, period:float, busy:float, offset:Optional[float]=None, seed:Optional[int]=None) -> None:
+        super().__init__(freq, seed)
+        assert 0 < busy < period
+        self.period = period
+        self.busy_s = busy
+        self.offset = offset
+
+    def next_period(self) -> Tuple[float,float]:
+        return self.period - self.busy_s, self.busy_s
+
+    def first_idle(self) -> float:
+        return self.rnd.uniform(0, self.period) if self.offset is None else self.offset
+
+
+def interferers(freqs:Sequence[float], occupancy:float, model:str='poisson', mean_busy:float=0.05,
+                seed:Optional[int]=None) -> List[Interferer]:
+    """One interferer per frequency with the given mean occupancy (empty list for occupancy 0).
+    Periodic interferers are busy mean_busy secs per period."""
+    if occupancy <= 0:
+        return []
+    rnd = random.Random(seed)
+    if model == 'periodic':
+        return [ PeriodicInterferer(f, mean_busy/occupancy, mean_busy, seed=rnd.getrandbits(32)) for f in freqs ]
+    if model == 'poisson':
+        return [ PoissonInterferer(f, occupancy, mean_busy, seed=rnd.getrandbits(32)) for f in freqs ]
+    raise ValueError('Unknown interferer model: %s' % (model,))
+
+
+class CcaScenario:
+    def __init__(self, interferers:Sequence[Interferer], horizon:float=0.3, tick:float=0.02) -> None:
+        self.interferers = list(interferers)
+        self.horizon = horizon
+        self.tick = tick
+        self.nupdates = 0
+        self.truncated = 0
+        self.t0 = None    # type: Optional[int]
+        self.last = None  # type: Optional[List[Tuple[float,int,int]]]
+        self.task = None  # type: Optional[asyncio.Future]
+
+    def window(self, now:int) -> List[Tuple[float,int,int]]:
+        """CCA infos (freq MHz, beg, end) for the next horizon - earliest first"""
+        if self.t0 is None:
+            self.t0 = now
+        t1 = now + int(self.horizon*1e6)
+        ivs = sorted((beg, end, itf.freq) for itf in self.interferers for beg,end in itf.intervals(now, t1))
+        if len(ivs) > MAX_INTERVALS:
+            self.truncated += len(ivs) - MAX_INTERVALS
+            ivs = ivs[:MAX_INTERVALS]
+        return [ (freq, beg, end) for beg,end,freq in ivs ]
+
+    async def update(self, lgwsim:su.LgwSim) -> None:
+        infos = self.window(lgwsim.xticks())
+        if infos != self.last:
+            await lgwsim.send_cca(infos)
+            self.last = infos
+            self.nupdates += 1
+
+    async def run(self, lgwsim:su.LgwSim) -> None:
+        while True:
+            await self.update(lgwsim)
+            await asyncio.sleep(self.tick)
+
+    def start(self, lgwsim:su.LgwSim) -> None:
+        self.task = asyncio.ensure_future(self.run(lgwsim))
+
+    async def stop(self, lgwsim:Optional[su.LgwSim]=None) -> None:
+        """Stop streaming - with lgwsim all channels are cleared."""
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        if lgwsim is not None:
+            await lgwsim.send_cca([])
+            self.last = None
+
+    def busy(self, freq_hz:int, xtime:int) -> bool:
+        """Whether freq was busy at xtime according to the generated intervals"""
+        return any(itf.busy(xtime) for itf in self.interferers if itf.freq_hz == freq_hz)
+
+    def occupancy(self, now:int) -> Dict[float,float]:
+        """Generated busy fraction per frequency since the first update"""
+        t0 = self.t0 if self.t0 is not None else now
+        return { itf.freq: itf.occupancy(t0, now) for itf in self.interferers }
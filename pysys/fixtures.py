@@ -0,0 +1,283 @@
+# --- Revised 3-Clause BSD License ---
+# Copyright Semtech Corporation 2022. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright notice,
+#       this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright notice,
+#       this list of conditions and the following disclaimer in the documentation
+#       and/or other materials provided with the distribution.
+#     * Neither the name of the Semtech corporation nor the names of its
+#       contributors may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SEMTECH CORPORATION. BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Async fixtures for regression tests.
+
+Servers (tcutils.Infos/Muxs/Cups, simutils.LgwSimServer) are async context
+managers themselves. This module adds the station process, a way to start a
+group of servers, the outcome of a test and event driven waits:
+
+    async def main() -> int:
+        outcome = fx.Outcome()
+        async with fx.serving(tu.Infos(), TestMuxs(outcome), TestLgwSimServer()):
+            async with fx.StationProcess('-p', '--temp', '.'):
+                return await outcome.wait()
+
+    fx.run(main, timeout=60)
+
+Teardown runs in reverse order of setup and also on timeouts and errors.
+Muxs and LgwSimServer queue what they receive in a Mailbox, so tests wait for
+events instead of sleeping:
+
+    dntxed = await muxs.expect('dntxed', where={'seqno': 3}, within=5.0)
+    pkt = await sim.expect_tx(freq=869.525, within=5.0)
+"""
+
+from typing import Any,Awaitable,Callable,Dict,List,Optional
+import os
+import sys
+import time
+import asyncio
+import contextlib
+from collections import deque
+from asyncio import subprocess
+import logging
+import procprof
+import loops
+
+logger = logging.getLogger('fixtures')
+
+# Exit status of a test which ran into its timeout
+TIMEOUT_STATUS = 98
+
+
+class Outcome:
+    """Final status of a test (0=success) - set once by whichever handler decides it."""
+
+    def __init__(self) -> None:
+        self.fut = asyncio.get_event_loop().create_future()
+
+    def done(self, status:int=0, reason:str='') -> None:
+        if self.fut.done():
+            return
+        if status:
+            logger.error('Test failed (status=%d) %s', status, reason)
+        else:
+            logger.info('Test succeeded %s', reason)
+        self.fut.set_result(status)
+
+    def fail(self, reason:str, status:int=1) -> None:
+        self.done(status, reason)
+
+    def is_done(self) -> bool:
+        return self.fut.done()
+
+    async def wait(self, within:Optional[float]=None) -> int:
+        return await asyncio.wait_for(asyncio.shield(self.fut), within)
+
+
+class Signal:
+    """Event driven waits on changing state - call notify() after every change.
+
+    await sig.wait_for(lambda: len(rxed) >= 3, within=5.0)
+    """
+
+    def __init__(self) -> None:
+        self.event = asyncio.Event()
+
+    def notify(self) -> None:
+        # Wake up current waiters - later waiters wait on a fresh event
+        self.event.set()
+        self.event = asyncio.Event()
+
+    async def wait_for(self, predicate:Callable[[],Any], within:Optional[float]=None) -> Any:
+        """Return the first truthy value of predicate - raises asyncio.TimeoutError after within seconds."""
+        async def waiter() -> Any:
+            while True:
+                value = predicate()
+                if value:
+                    return value
+                await self.event.wait()
+        return await asyncio.wait_for(waiter(), within)
+
+
+class ExpectationFailed(AssertionError):
+    pass
+
+
+def matches(where:Any, item:Any) -> bool:
+    """where is None (anything), a predicate or a dict of field values/predicates."""
+    if where is None:
+        return True
+    if callable(where):
+        return bool(where(item))
+    for k,v in where.items():
+        if k not in item:
+            return False
+        if callable(v) and not v(item[k]) or not callable(v) and item[k] != v:
+            return False
+    return True
+
+
+class Mailbox:
+    """Received items queued per key (e.g. msgtype) in arrival order. expect() consumes
+    the first matching item - also one which arrived before expect() was called.
+    Items beyond MAX_ITEMS per key are dropped (oldest first) and the key is marked as
+    truncated - any later expect() on that key fails instead of passing on partial input."""
+
+    MAX_ITEMS = 1000   # per key
+
+    def __init__(self) -> None:
+        self.items = {}  # type: Dict[Any,deque]
+        self.dropped = {}  # type: Dict[Any,int]
+        self.signal = Signal()
+
+    def put(self, key:Any, item:Any) -> None:
+        q = self.items.get(key)
+        if q is None:
+            q = self.items[key] = deque(maxlen=Mailbox.MAX_ITEMS)
+        if len(q) == Mailbox.MAX_ITEMS:
+            n = self.dropped[key] = self.dropped.get(key, 0) + 1
+            if n == 1:
+                logger.error('Mailbox: more than %d pending %s items - dropping oldest', Mailbox.MAX_ITEMS, key)
+        q.append(item)
+        self.signal.notify()
+
+    def pending(self, key:Any) -> List[Any]:
+        return list(self.items.get(key, ()))
+
+    def clear(self, key:Any=None) -> None:
+        if key is None:
+            self.items.clear()
+            self.dropped.clear()
+        else:
+            self.items.pop(key, None)
+            self.dropped.pop(key, None)
+
+    def _check_dropped(self, key:Any) -> None:
+        n = self.dropped.get(key)
+        if n:
+            raise ExpectationFailed('%s: %d items dropped (more than %d pending) - input truncated' % (
+                key, n, Mailbox.MAX_ITEMS))
+
+    def _take(self, key:Any, where:Any) -> Optional[List[Any]]:
+        self._check_dropped(key)
+        q = self.items.get(key)
+        if q:
+            for i,item in enumerate(q):
+                if matches(where, item):
+                    del q[i]
+                    return [ item ]  # truthy even if item is not
+        return None
+
+    async def expect(self, key:Any, where:Any=None, within:float=5.0) -> Any:
+        """Return the first item under key matching where - ExpectationFailed after within seconds."""
+        try:
+            return (await self.signal.wait_for(lambda: self._take(key, where), within))[0]
+        except asyncio.TimeoutError:
+            raise ExpectationFailed('%s%s not seen within %.1fs - pending: %r' % (
+                key, ' where %r' % (where,) if where is not None else '', within, self.pending(key)[-5:])) from None
+
+    async def expect_none(self, key:Any, where:Any=None, within:float=1.0) -> None:
+        """Make sure no item under key matching where arrives within the next seconds."""
+        try:
+            item = (await self.signal.wait_for(lambda: self._take(key, where), within))[0]
+        except asyncio.TimeoutError:
+            return
+        raise ExpectationFailed('Unexpected %s: %r' % (key, item))
+
+
+class StationProcess:
+    """Station subprocess - terminated (and if needed killed) on exit of the context.
+    Its resources are profiled while it runs (see procprof.py)."""
+
+    def __init__(self, *args:str, binary:str='station', cwd:Optional[str]=None, env:Optional[dict]=None, term_timeout:float=5.0,
+                 profile:bool=True) -> None:
+        self.args = [ binary ] + list(args)
+        self.cwd = cwd
+        self.env = env
+        self.term_timeout = term_timeout
+        self.profile = profile and os.path.isdir('/proc/self')
+        self.proc = None  # type: Optional[asyncio.subprocess.Process]
+        self.profiler = None  # type: Optional[procprof.Profiler]
+
+    @property
+    def returncode(self) -> Optional[int]:
+        return self.proc.returncode if self.proc else None
+
+    async def start(self) -> None:
+        logger.debug('Starting: %s', ' '.join(self.args))
+        env = None if self.env is None else { **os.environ, **self.env }
+        self.proc = await subprocess.create_subprocess_exec(*self.args, cwd=self.cwd, env=env)
+        if self.profile:
+            self.profiler = procprof.Profiler(self.proc.pid)
+
+    async def wait(self, within:Optional[float]=None) -> int:
+        return await asyncio.wait_for(self.proc.wait(), within)
+
+    async def stop(self) -> Optional[int]:
+        if self.profiler is not None:
+            await self.profiler.stop()
+        if self.proc is None or self.proc.returncode is not None:
+            return self.returncode
+        self.proc.terminate()
+        try:
+            await asyncio.wait_for(self.proc.wait(), self.term_timeout)
+        except asyncio.TimeoutError:
+            logger.error('Station did not terminate within %.1fs - killing it', self.term_timeout)
+            self.proc.kill()
+            await self.proc.wait()
+        return self.returncode
+
+    async def __aenter__(self) -> 'StationProcess':
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.stop()
+        if self.profiler is not None and exc_info[0] is None:
+            procprof.finish(self.profiler)   # raises procprof.Regression
+
+
+@contextlib.asynccontextmanager
+async def serving(*servers:Any):
+    """Start servers in order and stop them in reverse order - also if starting one fails."""
+    async with contextlib.AsyncExitStack() as stack:
+        for server in servers:
+            await stack.enter_async_context(server)
+        yield servers
+
+
+def run(main:Callable[[],Awaitable[Optional[int]]], timeout:float=60.0) -> None:
+    """Run the test coroutine with an overall timeout and exit with its status."""
+    async def guarded() -> int:
+        t0 = time.monotonic()
+        try:
+            status = await asyncio.wait_for(main(), timeout)
+        except asyncio.TimeoutError:
+            logger.error('Test timed out after %.1fs', timeout)
+            return TIMEOUT_STATUS
+        except procprof.Regression as exc:
+            logger.error('%s', exc)
+            return 1
+        logger.debug('Test finished after %.1fs with status %r', time.monotonic()-t0, status)
+        return status or 0
+    try:
+        status = loops.run(guarded())
+    except Exception as exc:
+        logger.error('Test crashed: %s', exc, exc_info=True)
+        status = 1
+    sys.exit(status)
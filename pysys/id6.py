@@ -24,11 +24,22 @@
 # OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
 # ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-from typing import Optional,Union
+from typing import Callable,Optional,Tuple,Union
 import functools
 import re
 import struct
-from base64 import b16decode as _b16decode
+try:
+    import numpy as np
+except ImportError:   # only needed for bulk conversions
+    np = None
+
+
+INTERN_CACHE_SIZE = 4096
+"""Maximum number of text representations kept in the Eui/Id6 intern caches"""
+
+_MASK64 = (1<<64)-1
+_pack_q = struct.Struct('>q').pack
+_unpack_q = struct.Struct('>q').unpack
 
 
 @functools.total_ordering
@@ -36,7 +47,12 @@ class Eui(object):
     """Class to represent EUIs. The normal representation is an string with 23 characters
     and a format of HH-...-HH. This matches the JSON and SQL representation.
     There are methods to convert to binary string or 64bit integer.
+
+    Instances are immutable and backed by a signed 64bit integer. The text representation
+    is rendered on demand. Instances created from strings are interned in a bounded
+    LRU cache - parsing the same EUI again returns the same object.
     """
+    __slots__ = ('_id', '_euistr')
 
     NUM_REGEX = re.compile("^(\-?\d+|0[xX][0-9A-Fa-f]+)$")
     """Standard decimal or hexadecimal number"""
@@ -44,23 +60,23 @@ class Eui(object):
     """Regular expression matching a well formed EUI"""
     REGEX2 = re.compile("^([0-9a-fA-F]){2}(:([0-9a-fA-F]){2}){7}$")
     """Regular expression matching a well formed EUI using colon instead of dashes"""
+    PARSE_REGEX = re.compile("^(?:(?P<num>-?\d+|0[xX][0-9A-Fa-f]+)|"
+                             "[0-9A-Fa-f]{2}(?P<sep>[-:])[0-9A-Fa-f]{2}(?:(?P=sep)[0-9A-Fa-f]{2}){6})$")
+    """Single pass expression matching any of the above representations"""
 
 
     @staticmethod
     def int2str (num:int) -> str:
-        return "-".join(["{0:02X}".format((num>>(i*8)&0xFF)) for i in range(7,-1,-1)])
+        return (num & _MASK64).to_bytes(8,'big').hex('-').upper()
 
     @staticmethod
     def str2int (s:str) -> int:
-        if Eui.NUM_REGEX.match(s):
-            return int(s,0)
-        if Eui.REGEX.match(s):
-            b = _b16decode(s.replace("-","").encode('ascii'))
-        elif Eui.REGEX2.match(s):
-            b = _b16decode(s.replace(":","").encode('ascii'))
-        else:
+        m = Eui.PARSE_REGEX.match(s)
+        if m is None:
             raise ValueError("Illegal Eui: {}".format(s))
-        return struct.unpack_from('>q',b)[0]
+        if m.group('num'):
+            return int(s,0)
+        return _unpack_q(bytes.fromhex(s.replace(m.group('sep'),'')))[0]
 
     @staticmethod
     def from_str(euistr:str) -> 'Eui':
@@ -74,18 +90,52 @@ class Eui(object):
     def from_bytes(euibytes:bytes) -> 'Eui':
         return Eui(euibytes)
 
+    @staticmethod
+    def bulk_from_strings(strs) -> 'np.ndarray':
+        """Parse many EUIs at once. Input is a sequence of str/bytes, a NumPy string array
+        or a bytes like buffer of whitespace separated EUIs. Returns an int64 array."""
+        return _bulk_parse(strs, ('eui',), False, lambda s: Eui._parse(s)._id)
+
+    @staticmethod
+    def bulk_to_strings(ids, sep:str='-') -> 'np.ndarray':
+        """Format an int64 array as an array of EUI strings (HH-..-HH or HH:..:HH)."""
+        return _bulk_bytes_str(ids, 8, ord(sep), True)
+
+    @classmethod
+    def _make(cls, id:int) -> 'Eui':
+        self = object.__new__(cls)
+        self._id = id
+        self._euistr = None
+        return self
+
+    @classmethod
+    def _parse(cls, euispec:str) -> 'Eui':
+        m = Eui.PARSE_REGEX.match(euispec)
+        if m is None:
+            raise ValueError("Illegal EUI: {}".format(euispec))
+        if m.group('num'):
+            return cls(int(euispec,0))
+        return cls._make(_unpack_q(bytes.fromhex(euispec.replace(m.group('sep'),'')))[0])
+
     def __bool__(self) -> bool:
         # Bool value is not dependent on EUI's int value
         return True
 
     def __index__(self) -> int:
-        return struct.unpack_from('>q',self.as_bytes(),0)[0]
+        return self._id
 
     def as_int(self) -> int:
-        return self.__index__()
+        return self._id
 
     def as_bytes(self) -> bytes:
-        return _b16decode(self.euistr.replace("-","").encode('ascii'))
+        return _pack_q(self._id)
+
+    @property
+    def euistr(self) -> str:
+        s = self._euistr
+        if s is None:
+            s = self._euistr = Eui.int2str(self._id)
+        return s
 
     def __str__(self):
         return self.euistr
@@ -93,36 +143,34 @@ class Eui(object):
     def __repr__(self) -> str:
         return "<{}: {}>".format(self.__class__.__name__, str(self))
 
+    def __reduce__(self):
+        return (self.__class__, (self._id,))
+
     def __hash__(self):
-        return hash(self.euistr)
+        return hash(self._id)
 
     def __lt__(self, other):
-        return self.euistr < other.euistr
+        # Order like the text representation, i.e. unsigned
+        return (self._id & _MASK64) < (other._id & _MASK64)
 
     def __eq__(self, other):
-        return True if isinstance(other,Eui) and self.euistr==other.euistr else False
+        return isinstance(other,Eui) and self._id==other._id
 
-    def __init__(self, euispec) -> None:
+    def __new__(cls, euispec) -> 'Eui':
         if isinstance(euispec,Eui):
-            self.euistr = euispec.euistr   # type: str
-        elif isinstance(euispec,str):
-            if Eui.NUM_REGEX.match(euispec):
-                self.euistr = Eui.int2str(int(euispec,0))
-            else:
-                if Eui.REGEX.match(euispec):
-                    self.euistr = euispec.upper()
-                elif Eui.REGEX2.match(euispec):
-                    self.euistr = euispec.replace(':','-').upper()
-                else:
-                    raise ValueError("Illegal EUI: {}".format(euispec))
-        elif isinstance(euispec,bytes):
+            return cls._make(euispec._id)
+        if isinstance(euispec,str):
+            if cls is Eui:
+                return _eui_intern(euispec)
+            return cls._parse(euispec)
+        if isinstance(euispec,bytes):
             if len(euispec)!=8:
                 raise ValueError("Illegal EUI length: {}".format(len(euispec)))
-            self.euistr = "-".join([ "{:02X}".format(euispec[i]) for i in range(8) ])
-        elif isinstance(euispec,int):
-            self.euistr = Eui.int2str(euispec)
-        else:
-            raise ValueError("Illegal EUI type: "+str(type(euispec)))
+            return cls._make(_unpack_q(euispec)[0])
+        if isinstance(euispec,int):
+            euispec &= _MASK64
+            return cls._make(euispec - (1<<64) if euispec >= 1<<63 else euispec)
+        raise ValueError("Illegal EUI type: "+str(type(euispec)))
 
 
 @functools.total_ordering
@@ -130,7 +178,10 @@ class Id6(object):
     """Class to represent 64bit unique ids. This is class very similar to Eui class but allows
     shorter text representations of the 64bit unique identifiers.
     The text encoding is analoguous to IPv6 text representation but covering 64 bits instead of 128 bits.
+
+    Like Eui, instances are immutable, integer backed and interned when created from strings.
     """
+    __slots__ = ('id', 'cat', '_idstr')
 
     NUM_REGEX = re.compile("^(\-?\d+|0[xX][0-9A-Fa-f]+)$")
     """Standard decimal or hexadecimal number"""
@@ -142,6 +193,14 @@ class Id6(object):
     """Id6 regular expression matching representation after :: expansion"""
     MAC_REGEX = re.compile("^([0-9a-fA-F]){2}(:([0-9a-fA-F]){2}){5}$")
     """Regular expression mathing a well-formed MAC addresss"""
+    PARSE_REGEX = re.compile(
+        ("^(?:(?P<num>-?\d+|0[xX][0-9A-Fa-f]+)"
+         "|(?P<mac>HH(?::HH){5})"
+         "|(?P<eui>HH(?P<sep>[-:])HH(?:(?P=sep)HH){6})"
+         "|(?P<w0>W):(?P<w1>W):(?P<w2>W):(?P<w3>W)"
+         "|(?:(?P<l0>W)(?::(?P<l1>W))?)?::(?:(?P<r0>W)(?::(?P<r1>W))?)?"
+         ")$").replace('HH','[0-9a-fA-F]{2}').replace('W','[0-9a-fA-F]{1,4}'))
+    """Single pass expression matching all of the above and the :: compressed forms"""
 
     # Not used right now
     #ID6_REGEX_ALL = re.compile('(W:W:W:W|W::|W:W::|::W|::W:W|W::W)$'.replace('W','[0-9a-fA-F]{1,4}'))
@@ -183,48 +242,40 @@ class Id6(object):
 
 
     @staticmethod
-    def str2int(idstr:str) -> int:
-        if Id6.NUM_REGEX.match(idstr):
+    def str2int(idstr:str, macx:bool=False) -> int:
+        m = Id6.PARSE_REGEX.match(idstr)
+        if m is None:
+            raise ValueError("Malformed Id6 representation: <"+idstr+">")
+        g = m.group
+        if g('num'):
             i = int(idstr,0)
-        elif Id6.MAC_REGEX.match(idstr):
+        elif g('mac'):
             i = int(idstr.replace(":",""), 16)
-            i += 0x2<<56
-        else:
-            if idstr[0:2] == '::':
-                if len(idstr)==2:
-                    return 0
-                try:
-                    idstr.index(':',2)
-                    s = '0:0:'
-                except ValueError:
-                    s = '0:0:0:'
-                idstr = s+idstr[2:]
-
-            elif idstr[-2:] == '::':
-                if idstr.index(':') < len(idstr)-2:
-                    s = ':0:0'
-                else:
-                    s = ':0:0:0'
-                idstr = idstr[:-2]+s
-            else:
-                try:
-                    p = idstr.index('::')
-                    idstr = idstr[0:p]+':0:0:'+idstr[p+2:]
-                except ValueError:
-                    pass
-            if not Id6.ID6_REGEX.match(idstr):
-                if Id6.EUI_REGEX.match(idstr):
-                    i = int(idstr.replace("-",""), 16)
-                elif Id6.EUI_REGEX2.match(idstr):
-                    i = int(idstr.replace(":",""), 16)
-                else:
-                    raise ValueError("Malformed Id6 representation: <"+idstr+">")
+            if macx:
+                i = (i & 0xFFFFFF) | ((i & 0xFFFFFF000000) << 16) | 0xFFFE000000
             else:
-                a = idstr.split(':')
-                i = ((int(a[0],16)<<48)|
-                     (int(a[1],16)<<32)|
-                     (int(a[2],16)<<16)|
-                     (int(a[3],16)    ))
+                i += 0x2<<56
+        elif g('eui'):
+            i = int(idstr.replace(g('sep'),""), 16)
+        elif g('w0'):
+            i = ((int(g('w0'),16)<<48)|
+                 (int(g('w1'),16)<<32)|
+                 (int(g('w2'),16)<<16)|
+                 (int(g('w3'),16)    ))
+        else:
+            # :: compressed form - at most two groups in total (W::W, W:W::, ::W:W, ...)
+            l0, l1, r0, r1 = g('l0','l1','r0','r1')
+            if (l1 and r0) or (r1 and l0):
+                raise ValueError("Malformed Id6 representation: <"+idstr+">")
+            i = 0
+            if l0:
+                i |= int(l0,16)<<48
+                if l1:
+                    i |= int(l1,16)<<32
+            if r1:
+                i |= (int(r0,16)<<16) | int(r1,16)
+            elif r0:
+                i |= int(r0,16)
         if i >= 1<<63:
             i = (-1<<64) + i
         return i;
@@ -234,13 +285,46 @@ class Id6(object):
         """This function is the same as str2int execept that it translates MAC addresses
         into 64 bit by inserting 0xFFFE in the middle. This is the new scheme better suited
         for station2 deployments."""
-        if Id6.MAC_REGEX.match(idstr):
-            idstr = idstr.replace(":","")
-            i = (int(idstr[0:6], 16) << 40) | int(idstr[6:12], 16) | 0xFFFE000000
-            if i >= 1<<63:
-                i = (-1<<64) + i
-            return i;
-        return Id6.str2int(idstr)
+        return Id6.str2int(idstr, macx=True)
+
+    @staticmethod
+    def bulk_from_strings(strs, macx:bool=False) -> 'np.ndarray':
+        """Parse many ids at once - see Eui.bulk_from_strings for accepted input.
+        MAC addresses are expanded like strx2int if macx is set, otherwise like str2int.
+        Categories are accepted and dropped. Returns an int64 array."""
+        return _bulk_parse(strs, ('eui','mac','id6'), macx, lambda s: Id6._parse(s,'',macx).id)
+
+    @staticmethod
+    def bulk_to_strings(ids) -> 'np.ndarray':
+        """Format an int64 array as an array of Id6 strings using the rules of int2str."""
+        return _bulk_id6_str(ids)
+
+    @staticmethod
+    def bulk_to_mac_strings(ids) -> 'np.ndarray':
+        """Format an int64 array as an array of MAC strings like as_mac_str."""
+        _need_numpy()
+        u = np.asarray(ids, dtype=np.int64).view(np.uint64)
+        x = (u & np.uint64(0xFFFF000000)) == np.uint64(0xFFFE000000)
+        u = np.where(x, (u & np.uint64(0xFFFFFF)) | ((u >> np.uint64(16)) & np.uint64(0xFFFFFF000000)), u)
+        return _bulk_bytes_str(u.view(np.int64), 6, ord(':'), True)
+
+    @classmethod
+    def _make(cls, id:int, cat:str) -> 'Id6':
+        self = object.__new__(cls)
+        self.id = id
+        self.cat = cat
+        self._idstr = None
+        return self
+
+    @classmethod
+    def _parse(cls, idspec:str, cat:str, macx:bool=False) -> 'Id6':
+        pos = idspec.find('-')
+        if pos > 0 and not Id6.EUI_REGEX.match(idspec):
+            if cat and idspec[0:pos] != cat:
+                raise ValueError("Conflicting category '%s' - expecting '%s'" % (idspec[0:pos], cat))
+            cat = idspec[0:pos]
+            idspec = idspec[pos+1:]
+        return cls._make(Id6.str2int(idspec, macx), cat)
 
     def __bool__(self) -> bool:
         # Bool value is not dependent on internal int value
@@ -256,7 +340,7 @@ class Id6(object):
         id = self.id
         if id & 0xFFFF000000 == 0xFFFE000000:
             id = (id & 0xFFFFFF) | ((id >> 16) & 0xFFFFFF000000)
-        return ":".join(["{0:02X}".format((id>>(i*8)&0xFF)) for i in range(5,-1,-1)])
+        return (id & 0xFFFFFFFFFFFF).to_bytes(6,'big').hex(':').upper()
 
     def as_eui_str(self) -> str:
         return Eui.int2str(self.id)
@@ -268,13 +352,19 @@ class Id6(object):
         return struct.pack("<q", self.id)
 
     def __str__(self):
+        s = self._idstr
+        if s is None:
+            s = self._idstr = Id6.int2str(self.id)   # nomalized repr
         if self.cat:
-            return self.cat+'-'+self._idstr
-        return self._idstr
+            return self.cat+'-'+s
+        return s
 
     def __repr__(self) -> str:
         return "<{}: {}>".format(self.__class__.__name__, str(self))
 
+    def __reduce__(self):
+        return (self.__class__, (self.id, self.cat))
+
     def __hash__(self):
         return hash((self.cat,self.id))
 
@@ -288,29 +378,273 @@ class Id6(object):
             return False
         return self.cat==other.cat and self.id==other.id
 
-    def __init__(self, idspec:Union[int,str,'Id6',Eui], cat:str='') -> None:
-        self.cat = cat
+    def __new__(cls, idspec:Union[int,str,'Id6',Eui], cat:str='') -> 'Id6':
+        if isinstance(idspec,str):
+            if cls is Id6:
+                return _id6_intern(idspec, cat)
+            return cls._parse(idspec, cat)
         if isinstance(idspec,Id6):
-            self.id = idspec.id           # type: int
-            self._idstr = idspec._idstr   # type: str
-            self.cat = cat or idspec.cat  # type: str
-        elif isinstance(idspec,str):
-            if '-' in idspec:
-                pos = idspec.index('-')
-                if pos > 0 and not Id6.EUI_REGEX.match(idspec):
-                    self.cat = idspec[0:pos]
-                    if cat and self.cat != cat:
-                        raise ValueError("Conflicting category '%s' - expecting '%s'" % (self.cat, cat))
-                    idspec = idspec[pos+1:]
-            self.id = Id6.str2int(idspec)
-            self._idstr = Id6.int2str(self.id)   # nomalized repr
-        elif isinstance(idspec,int):
+            return cls._make(idspec.id, cat or idspec.cat)
+        if isinstance(idspec,int):
             if idspec >= 1<<63:
                 idspec = (-1<<64) + idspec
-            self.id = idspec
-            self._idstr = Id6.int2str(self.id)
-        elif isinstance(idspec,Eui):
-            self.id = idspec.as_int()
-            self._idstr = Id6.int2str(self.id)
+            return cls._make(idspec, cat)
+        if isinstance(idspec,Eui):
+            return cls._make(idspec.as_int(), cat)
+        raise ValueError("Illegal Id6 type: "+str(type(idspec)))
+
+
+_eui_intern = functools.lru_cache(maxsize=INTERN_CACHE_SIZE)(Eui._parse)
+_id6_intern = functools.lru_cache(maxsize=INTERN_CACHE_SIZE)(Id6._parse)
+
+
+# ---------------------------------------------------------------------------
+# Bulk conversions over NumPy arrays
+#
+# Text is handled as a 2D uint8 character matrix (one zero padded row per id).
+# Parsing walks the columns once - vectorized over all rows - and splits every
+# row into hex groups separated by ':' or '-'. Rows which do not have one of the
+# well-known group layouts (numbers, categories, malformed text) fall back to
+# the scalar parser, which also raises the usual ValueError for bad input.
+# ---------------------------------------------------------------------------
+
+def _need_numpy() -> None:
+    if np is None:
+        raise ImportError("Bulk Id6/Eui conversions require numpy")
+
+_HEXVAL = None
+_HEXCHR_LO = b'0123456789abcdef'
+_HEXCHR_UP = b'0123456789ABCDEF'
+
+def _hexval() -> 'np.ndarray':
+    global _HEXVAL
+    if _HEXVAL is None:
+        t = np.full(256, -1, dtype=np.int16)
+        for i,c in enumerate(_HEXCHR_LO):
+            t[c] = i
+        for i,c in enumerate(_HEXCHR_UP):
+            t[c] = i
+        _HEXVAL = t
+    return _HEXVAL
+
+def _char_matrix(strs) -> Tuple['np.ndarray','np.ndarray']:
+    """Turn a sequence of str/bytes, a NumPy string array or a bytes like buffer of
+    whitespace separated records into a (N,W) uint8 matrix and the bytes array backing it."""
+    if isinstance(strs, (bytes,bytearray,memoryview)):
+        strs = bytes(strs).split()
+    arr = np.asarray(strs)
+    if arr.dtype.kind == 'U':
+        arr = arr.astype('S%d' % max(arr.dtype.itemsize//4, 1))
+    elif arr.dtype.kind != 'S':
+        arr = np.array([ s.encode('ascii') if isinstance(s,str) else bytes(s) for s in arr.ravel() ], dtype='S')
+    arr = np.ascontiguousarray(arr.ravel())
+    return arr.view(np.uint8).reshape(len(arr), arr.dtype.itemsize), arr
+
+def _fixed_pairs(A:'np.ndarray', nbytes:int) -> Tuple['np.ndarray','np.ndarray','np.ndarray']:
+    """Fast path for fixed width HH?HH?..HH rows. Returns mask, separator and values."""
+    n, w = A.shape
+    L = 3*nbytes-1
+    if w < L:
+        return np.zeros(n, dtype=bool), np.zeros(n, dtype=np.uint8), np.zeros(n, dtype=np.uint64)
+    hv = _hexval()
+    S = A[:,2:L:3]
+    sep = S[:,0]
+    ok = ((sep == 0x3A) | (sep == 0x2D)) & (S == sep[:,None]).all(axis=1)
+    if w > L:
+        ok &= A[:,L] == 0
+    hi = hv[A[:,0:L:3]]
+    lo = hv[A[:,1:L:3]]
+    ok &= (hi >= 0).all(axis=1) & (lo >= 0).all(axis=1)
+    b = ((hi << 4) | lo).clip(0).astype(np.uint64)
+    k = np.arange(nbytes, dtype=np.uint64)
+    v = (b << (np.uint64(8)*(np.uint64(nbytes-1)-k))).sum(axis=1, dtype=np.uint64)
+    return ok, sep, v
+
+def _bulk_parse(strs, layouts:Tuple[str,...], macx:bool, fallback:Callable[[str],int]) -> 'np.ndarray':
+    _need_numpy()
+    A, arr = _char_matrix(strs)
+    res = np.zeros(len(A), dtype=np.int64)
+    todo = np.ones(len(A), dtype=bool)
+    if 'eui' in layouts:
+        m, sep, v = _fixed_pairs(A, 8)
+        res[m] = v[m].view(np.int64)
+        todo &= ~m
+    if 'mac' in layouts:
+        m, sep, v = _fixed_pairs(A, 6)
+        m &= sep == 0x3A
+        if macx:
+            v = (v & np.uint64(0xFFFFFF)) | ((v & np.uint64(0xFFFFFF000000)) << np.uint64(16)) | np.uint64(0xFFFE000000)
+        else:
+            v = v + np.uint64(0x2<<56)
+        res[m] = v[m].view(np.int64)
+        todo &= ~m
+    if todo.all():
+        return _bulk_parse_groups(A, arr, layouts, macx, fallback)
+    if todo.any():
+        idx = np.nonzero(todo)[0]
+        res[idx] = _bulk_parse_groups(A[idx], arr[idx], layouts, macx, fallback)
+    return res
+
+def _bulk_parse_groups(A:'np.ndarray', arr:'np.ndarray', layouts:Tuple[str,...], macx:bool, fallback:Callable[[str],int]) -> 'np.ndarray':
+    n, w = A.shape
+    hv = _hexval()
+    MAXW = 23
+    rows = np.arange(n)
+    acc    = np.zeros(n, dtype=np.uint64)
+    glen   = np.zeros(n, dtype=np.int8)
+    ng     = np.zeros(n, dtype=np.int8)       # number of completed groups
+    run    = np.zeros(n, dtype=np.int8)       # length of current separator run
+    ndd    = np.zeros(n, dtype=np.int8)       # number of '::'
+    left   = np.zeros(n, dtype=np.int8)       # groups left of '::'
+    ncolon = np.zeros(n, dtype=np.int8)
+    ndash  = np.zeros(n, dtype=np.int8)
+    groups = np.zeros((n,8), dtype=np.uint64)
+    minlen = np.full(n, 9, dtype=np.int8)
+    maxlen = np.zeros(n, dtype=np.int8)
+    prevhex = np.zeros(n, dtype=bool)
+    bad = (A[:,MAXW:] != 0).any(axis=1) if w > MAXW else np.zeros(n, dtype=bool)
+    for j in range(min(w,MAXW)+1):
+        c = A[:,j] if j < w else np.zeros(n, dtype=np.uint8)
+        h = hv[c]
+        ishex = h >= 0
+        iscolon = c == 0x3A
+        isdash = c == 0x2D
+        issep = iscolon | isdash
+        bad |= ~(ishex | issep | (c == 0))
+        # A group starts - check the separator run in front of it
+        start = ishex & ~prevhex
+        bad |= start & ((run > 2) | ((run == 1) & (ng == 0)))
+        dd = start & (run == 2)
+        left = np.where(dd, ng, left)
+        ndd += dd
+        # A group ends - store it
+        end = prevhex & ~ishex
+        if end.any():
+            e = rows[end]
+            bad[e] |= ng[e] >= 8
+            groups[e, np.minimum(ng[e],7)] = acc[e]
+            minlen[e] = np.minimum(minlen[e], glen[e])
+            maxlen[e] = np.maximum(maxlen[e], glen[e])
+            ng[e] += 1
+            acc[e] = 0
+            glen[e] = 0
+        acc = np.where(ishex, (acc << np.uint64(4)) | h.clip(0).astype(np.uint64), acc)
+        glen += ishex
+        bad |= glen > 4
+        run = np.where(issep, run+1, np.where(ishex, 0, run))
+        ncolon += iscolon
+        ndash += isdash
+        prevhex = ishex
+    # Trailing separator run
+    dd = (run == 2) & ~prevhex
+    left = np.where(dd, ng, left)
+    ndd += dd
+    bad |= (run == 1) | (run > 2)
+    bad |= ndd > 1
+    noempty = ng > 0
+
+    out = np.zeros(n, dtype=np.uint64)
+    done = np.zeros(n, dtype=bool)
+    k = np.arange(8, dtype=np.uint64)
+    pairs = ~bad & (minlen == 2) & (maxlen == 2) & (ndd == 0)
+    if 'eui' in layouts:
+        m = pairs & (ng == 8) & (((ncolon == 7) & (ndash == 0)) | ((ndash == 7) & (ncolon == 0)))
+        out[m] = (groups[m] << (np.uint64(8)*(np.uint64(7)-k))).sum(axis=1, dtype=np.uint64)
+        done |= m
+    if 'mac' in layouts:
+        m = pairs & (ng == 6) & (ncolon == 5) & (ndash == 0)
+        v = (groups[m,:6] << (np.uint64(8)*(np.uint64(5)-k[:6]))).sum(axis=1, dtype=np.uint64)
+        if macx:
+            v = (v & np.uint64(0xFFFFFF)) | ((v & np.uint64(0xFFFFFF000000)) << np.uint64(16)) | np.uint64(0xFFFE000000)
+        else:
+            v = v + np.uint64(0x2<<56)
+        out[m] = v
+        done |= m
+    if 'id6' in layouts:
+        ok = ~bad & ~done & (ndash == 0) & (maxlen <= 4) & ((minlen >= 1) | ~noempty)
+        m = ok & (ndd == 0) & (ng == 4) & (ncolon == 3)
+        out[m] = (groups[m,:4] << (np.uint64(16)*(np.uint64(3)-k[:4]))).sum(axis=1, dtype=np.uint64)
+        done |= m
+        m = ok & (ndd == 1) & (ng <= 2)
+        if m.any():
+            g = ng[m].astype(np.int64)[:,None]
+            l = left[m].astype(np.int64)[:,None]
+            kk = np.arange(2, dtype=np.int64)[None,:]
+            shift = np.where(kk < l, 48-16*kk, 16*(g-1-kk))
+            shift = np.where(kk < g, shift, 0).astype(np.uint64)
+            vals = np.where(kk < g, groups[m,:2], np.uint64(0))
+            out[m] = (vals << shift).sum(axis=1, dtype=np.uint64)
+            done |= m
+    res = out.view(np.int64)
+    for i in np.nonzero(~done)[0]:
+        res[i] = fallback(arr[i].decode('ascii'))
+    return res
+
+def _group_hex(v:'np.ndarray', upper:bool) -> Tuple['np.ndarray','np.ndarray']:
+    """Hex digits (N,4) of 16bit values right aligned and number of significant digits."""
+    chars = np.frombuffer(_HEXCHR_UP if upper else _HEXCHR_LO, dtype=np.uint8)
+    nib = np.stack([ (v >> np.uint64(s)) & np.uint64(0xF) for s in (12,8,4,0) ], axis=1).astype(np.intp)
+    nd = np.where(v >= 0x1000, 4, np.where(v >= 0x100, 3, np.where(v >= 0x10, 2, 1)))
+    return chars[nib], nd
+
+def _to_str_array(M:'np.ndarray') -> 'np.ndarray':
+    M = np.ascontiguousarray(M)
+    return M.view('S%d' % M.shape[1]).ravel().astype('U%d' % M.shape[1])
+
+def _bulk_bytes_str(ids, nbytes:int, sep:int, upper:bool) -> 'np.ndarray':
+    _need_numpy()
+    u = np.asarray(ids, dtype=np.int64).view(np.uint64)
+    b = u.astype('>u8').view(np.uint8).reshape(len(u), 8)[:,8-nbytes:]
+    chars = np.frombuffer(_HEXCHR_UP if upper else _HEXCHR_LO, dtype=np.uint8)
+    M = np.full((len(u), 3*nbytes-1), sep, dtype=np.uint8)
+    M[:,0::3] = chars[b >> 4]
+    M[:,1::3] = chars[b & 0xF]
+    return _to_str_array(M)
+
+def _bulk_id6_str(ids) -> 'np.ndarray':
+    _need_numpy()
+    u = np.asarray(ids, dtype=np.int64).view(np.uint64)
+    n = len(u)
+    g = [ (u >> np.uint64(s)) & np.uint64(0xFFFF) for s in (48,32,16,0) ]
+    hi32 = (u >> np.uint64(32)) == 0
+    lo32 = (u & np.uint64(0xFFFFFFFF)) == 0
+    # Same case analysis as Id6.int2str - emit: which groups, '::' in front, '::' after group k
+    c_lo = hi32 & (g[2] == 0)                  # ::W (incl. ::0)
+    c_lo2 = hi32 & ~c_lo                       # ::W:W
+    c_hi = ~hi32 & lo32 & (g[1] == 0)          # W::
+    c_hi2 = ~hi32 & lo32 & ~c_hi               # W:W::
+    c_mid = ~hi32 & ~lo32 & (g[1] == 0) & (g[2] == 0)   # W::W
+    c_all = ~(c_lo | c_lo2 | c_hi | c_hi2 | c_mid)
+    emit = [ c_hi | c_hi2 | c_mid | c_all,
+             c_hi2 | c_all,
+             c_lo2 | c_all,
+             c_lo | c_lo2 | c_mid | c_all ]
+    ddafter = [ c_hi | c_mid, c_hi2 ]
+    M = np.zeros((n, 19), dtype=np.uint8)
+    rows = np.arange(n)
+    pos = np.zeros(n, dtype=np.intp)
+    pre = c_lo | c_lo2
+    M[pre,0] = M[pre,1] = 0x3A
+    pos[pre] = 2
+    for k in range(4):
+        digits, nd = _group_hex(g[k], False)
+        e = emit[k]
+        for d in range(4):
+            m = e & (d >= 4-nd)
+            M[rows[m], pos[m]+d-(4-nd[m])] = digits[m,d]
+        pos = np.where(e, pos+nd, pos)
+        if k < 2:
+            dd = ddafter[k]
+            M[rows[dd], pos[dd]] = 0x3A
+            M[rows[dd], pos[dd]+1] = 0x3A
+            pos = np.where(dd, pos+2, pos)
         else:
-            raise ValueError("Illegal Id6 type: "+str(type(idspec)))
+            dd = np.zeros(n, dtype=bool)
+        if k < 3:
+            more = emit[k+1]
+            for kk in range(k+2,4):
+                more = more | emit[kk]
+            sep = e & more & ~dd
+            M[rows[sep], pos[sep]] = 0x3A
+            pos = np.where(sep, pos+1, pos)
+    return _to_str_array(M)
@@ -0,0 +1,163 @@
+# --- Revised 3-Clause BSD License ---
+# Copyright Semtech Corporation 2022. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright notice,
+#       this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright notice,
+#       this list of conditions and the following disclaimer in the documentation
+#       and/or other materials provided with the distribution.
+#     * Neither the name of the Semtech corporation nor the names of its
+#       contributors may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SEMTECH CORPORATION. BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Event loop factory for pysys servers, tests, simulations and benchmarks.
+
+    loops.run(main())                      # asyncio.run on the selected loop
+    loops.install(); ...
+    loops.get_event_loop().run_forever()   # old style tests
+
+PYSYS_LOOP selects the loop: auto (default - uvloop if installed), uvloop
+or asyncio. Every loop handed out here runs a LagMonitor - a periodic timer
+whose late wakeups are the time callbacks had to wait for the loop. Its
+percentiles are logged when the loop is done (LOOP_LAG_INTVL sets the
+sampling interval in secs, 0 disables it).
+"""
+
+from typing import Any,Awaitable,Dict,List,Optional
+import os
+import atexit
+import importlib.util
+import asyncio
+import collections
+import logging
+
+import benchutils as bu
+
+logger = logging.getLogger('loops')
+
+LOOP_KINDS = ('auto', 'uvloop', 'asyncio')
+MAX_LAG_SAMPLES = 100000
+
+_installed = None  # type: Optional[str]
+_monitor = None    # type: Optional[LagMonitor]
+
+
+def available() -> List[str]:
+    """Loop kinds usable in this environment"""
+    return ['asyncio', 'uvloop'] if importlib.util.find_spec('uvloop') else ['asyncio']
+
+
+def install(kind:Optional[str]=None) -> str:
+    """Set the event loop policy for kind (default: PYSYS_LOOP) - returns the
+    loop installed. Must be called before the first loop is created."""
+    global _installed
+    kind = kind or os.environ.get('PYSYS_LOOP', 'auto')
+    if kind not in LOOP_KINDS:
+        raise ValueError('Unknown loop kind: %s (expecting one of %s)' % (kind, ', '.join(LOOP_KINDS)))
+    if kind != 'asyncio':
+        try:
+            import uvloop
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+            kind = 'uvloop'
+        except ImportError:
+            if kind == 'uvloop':
+                logger.warning('uvloop not installed - using the asyncio event loop')
+            kind = 'asyncio'
+    if kind == 'asyncio':
+        asyncio.set_event_loop_policy(asyncio.DefaultEventLoopPolicy())
+    if kind != _installed:
+        logger.debug('Event loop: %s', kind)
+    _installed = kind
+    return kind
+
+
+def installed() -> str:
+    return _installed or install()
+
+
+class LagMonitor:
+    """Samples the lag of the running loop: how late a timer of interval secs fires."""
+
+    def __init__(self, interval:Optional[float]=None) -> None:
+        self.interval = float(os.environ.get('LOOP_LAG_INTVL', '0.05')) if interval is None else interval
+        self.lags = collections.deque(maxlen=MAX_LAG_SAMPLES)  # type: collections.deque
+        self.task = None  # type: Optional[asyncio.Future]
+
+    def start(self, loop:Optional[asyncio.AbstractEventLoop]=None) -> None:
+        if self.interval > 0 and self.task is None:
+            loop = loop or asyncio.get_event_loop()
+            self.task = loop.create_task(self.run())
+
+    def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    def reset(self) -> None:
+        self.lags.clear()
+
+    async def run(self) -> None:
+        loop = asyncio.get_event_loop()
+        while True:
+            t = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, loop.time() - t - self.interval))
+
+    def summary(self, ps=(50,99,99.9)) -> Dict[str,Any]:
+        """Lag percentiles and max in ms"""
+        lags = list(self.lags)
+        res = { 'lag_ms_'+k: v*1e3 for k,v in bu.percentiles(lags, ps).items() }
+        res['lag_ms_max'] = max(lags)*1e3 if lags else float('nan')
+        res['samples'] = len(lags)
+        return res
+
+    def report(self) -> None:
+        if self.lags:
+            logger.info('Event loop %s lag: %s', installed(),
+                        ' '.join('%s=%.3g' % (k,v) for k,v in self.summary().items()))
+
+
+def monitor() -> Optional[LagMonitor]:
+    """LagMonitor of the loop handed out by get_event_loop/run (None if not yet started)"""
+    return _monitor
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """The current loop of the installed policy with a LagMonitor - reported at exit."""
+    global _monitor
+    installed()
+    loop = asyncio.get_event_loop_policy().get_event_loop()
+    if _monitor is None:
+        _monitor = LagMonitor()
+        _monitor.start(loop)
+        atexit.register(_monitor.report)
+    return loop
+
+
+def run(main:Awaitable[Any]) -> Any:
+    """asyncio.run of main on the installed loop with a LagMonitor"""
+    installed()
+    async def monitored() -> Any:
+        global _monitor
+        _monitor = LagMonitor()
+        _monitor.start()
+        try:
+            return await main
+        finally:
+            _monitor.stop()
+            _monitor.report()
+    return asyncio.run(monitored())
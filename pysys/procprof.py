@@ -0,0 +1,236 @@
+# --- Revised 3-Clause BSD License ---
+# Copyright Semtech Corporation 2022. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright notice,
+#       this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright notice,
+#       this list of conditions and the following disclaimer in the documentation
+#       and/or other materials provided with the distribution.
+#     * Neither the name of the Semtech corporation nor the names of its
+#       contributors may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SEMTECH CORPORATION. BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Resource profile of the station process tree sampled from /proc.
+
+fixtures.StationProcess samples RSS, CPU time, open fds and context switches
+of the station and its slaves while a test runs. With PROFILE_DIR set the
+time series and summary are written to PROFILE_DIR/<test>-<variant>.json -
+the test name includes the arguments of test.py (see test_key).
+With PROFILE_BASELINE set the summary is compared against that file and the
+test fails if a metric grew by more than PROFILE_TOLERANCE (default 0.25).
+
+    python -m procprof report $PROFILE_DIR
+    python -m procprof baseline $PROFILE_DIR > baseline.json
+"""
+
+from typing import Any,Dict,List,Optional,Tuple
+import os
+import re
+import sys
+import glob
+import json
+import time
+import asyncio
+import argparse
+import logging
+
+logger = logging.getLogger('procprof')
+
+CLK_TCK = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+PAGE_KB = (os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096) // 1024
+
+METRICS = ('max_rss_kb', 'cpu_s', 'max_fds', 'ctxsw')
+# Absolute slack on top of the relative tolerance - avoids flaky failures for tiny values
+SLACK = { 'max_rss_kb': 512, 'cpu_s': 0.2, 'max_fds': 2, 'ctxsw': 200 }
+
+Sample = Tuple[float,int,float,int,int]  # t, rss_kb, cpu_s, nfds, ctxsw
+
+
+class Regression(AssertionError):
+    pass
+
+
+def _read_stat(pid:int) -> Tuple[int,float,int]:
+    """ppid, cpu secs (incl. waited for children), rss kB"""
+    with open('/proc/%d/stat' % pid) as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    # fields[0] is field 3 (state) of proc(5)
+    ppid = int(fields[1])
+    cpu = sum(int(x) for x in fields[11:15]) / CLK_TCK   # utime stime cutime cstime
+    return ppid, cpu, int(fields[21]) * PAGE_KB
+
+
+def _read_ctxsw(pid:int) -> int:
+    n = 0
+    with open('/proc/%d/status' % pid) as f:
+        for line in f:
+            if line.startswith(('voluntary_ctxt_switches:', 'nonvoluntary_ctxt_switches:')):
+                n += int(line.split()[1])
+    return n
+
+
+def process_tree(pid:int) -> List[int]:
+    """pid and all its descendants"""
+    children = {}  # type: Dict[int,List[int]]
+    for d in os.listdir('/proc'):
+        if d.isdigit():
+            try:
+                children.setdefault(_read_stat(int(d))[0], []).append(int(d))
+            except (OSError, IndexError, ValueError):
+                pass
+    pids, todo = [], [pid]
+    while todo:
+        p = todo.pop()
+        pids.append(p)
+        todo.extend(children.get(p, ()))
+    return pids
+
+
+def sample(pid:int, t0:float) -> Optional[Sample]:
+    """One sample over the process tree of pid - None if pid is gone."""
+    rss = nfds = ctxsw = 0
+    cpu = 0.0
+    pids = process_tree(pid)
+    for p in pids:
+        try:
+            _, c, r = _read_stat(p)
+            cpu += c
+            rss += r
+            ctxsw += _read_ctxsw(p)
+            nfds += len(os.listdir('/proc/%d/fd' % p))
+        except (OSError, IndexError, ValueError):
+            if p == pid:
+                return None
+    return (time.monotonic() - t0, rss, cpu, nfds, ctxsw)
+
+
+class Profiler:
+    def __init__(self, pid:int, interval:float=0.5) -> None:
+        self.pid = pid
+        self.interval = interval
+        self.t0 = time.monotonic()
+        self.samples = []  # type: List[Sample]
+        self.task = asyncio.ensure_future(self.run())
+
+    def take(self) -> None:
+        s = sample(self.pid, self.t0)
+        if s is not None:
+            self.samples.append(s)
+
+    async def run(self) -> None:
+        while True:
+            self.take()
+            await asyncio.sleep(self.interval)
+
+    async def stop(self) -> None:
+        """Take a final sample - call before the process is terminated."""
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.take()
+
+    def summary(self) -> Dict[str,float]:
+        if not self.samples:
+            return {}
+        return {
+            'max_rss_kb': max(s[1] for s in self.samples),
+            'cpu_s'     : round(self.samples[-1][2], 3),
+            'max_fds'   : max(s[3] for s in self.samples),
+            'ctxsw'     : self.samples[-1][4],
+            'duration_s': round(self.samples[-1][0], 3),
+        }
+
+
+_runs = {}  # type: Dict[str,int]  finished profiles per key in this process
+
+def test_key() -> str:
+    """<test>[+<arg>...]/<variant> - test.sh scripts run test.py with different arguments
+    (e.g. test3-updn-tls: plain, tls no_ca, tls), each run is a workload of its own."""
+    name = '+'.join([ os.path.basename(os.getcwd()) ] + [ re.sub(r'[^\w.-]', '_', a) for a in sys.argv[1:] ])
+    return '%s/%s' % (name, os.environ.get('TEST_VARIANT', 'testsim'))
+
+
+def run_key() -> str:
+    """test_key plus #<n> for the n-th station (n>1) profiled by this process"""
+    key = test_key()
+    _runs[key] = n = _runs.get(key, 0) + 1
+    return key if n == 1 else '%s#%d' % (key, n)
+
+
+def check(summary:Dict[str,float], baseline:Dict[str,float], tolerance:float) -> List[str]:
+    """Metrics exceeding baseline*(1+tolerance)+slack"""
+    errs = []
+    for m in METRICS:
+        if m in summary and m in baseline:
+            limit = baseline[m] * (1 + tolerance) + SLACK[m]
+            if summary[m] > limit:
+                errs.append('%s=%g exceeds baseline %g (limit %g)' % (m, summary[m], baseline[m], limit))
+    return errs
+
+
+def finish(prof:Profiler) -> None:
+    """Store the profile (PROFILE_DIR) and compare against PROFILE_BASELINE - raises Regression."""
+    key = run_key()
+    summary = prof.summary()
+    logger.info('Station profile %s: %r', key, summary)
+    outdir = os.environ.get('PROFILE_DIR')
+    if outdir:
+        os.makedirs(outdir, exist_ok=True)
+        with open(os.path.join(outdir, key.replace('/', '-') + '.json'), 'w') as f:
+            json.dump({ 'test': key, 'summary': summary,
+                        'samples': [ dict(zip(('t','rss_kb','cpu_s','fds','ctxsw'), s)) for s in prof.samples ] }, f)
+    path = os.environ.get('PROFILE_BASELINE')
+    if path and summary:
+        with open(path) as f:
+            baseline = json.load(f)
+        base = baseline.get(key)
+        if base is None:
+            logger.warning('No profile baseline for %s in %s', key, path)
+            return
+        errs = check(summary, base, float(os.environ.get('PROFILE_TOLERANCE', '0.25')))
+        if errs:
+            raise Regression('Station resource regression %s: %s' % (key, '; '.join(errs)))
+
+
+def load_profiles(outdir:str) -> Dict[str,Dict[str,float]]:
+    profiles = {}
+    for fn in sorted(glob.glob(os.path.join(outdir, '*.json'))):
+        with open(fn) as f:
+            p = json.load(f)
+        profiles[p['test']] = p['summary']
+    return profiles
+
+
+def main(args) -> None:
+    ap = argparse.ArgumentParser(description='Station resource profiles')
+    ap.add_argument('cmd', choices=('report', 'baseline'))
+    ap.add_argument('dir', help='PROFILE_DIR of a test run')
+    args = ap.parse_args(args)
+    profiles = load_profiles(args.dir)
+    if args.cmd == 'baseline':
+        json.dump(profiles, sys.stdout, indent=2, sort_keys=True)
+        print()
+        return
+    print('%-40s %10s %8s %7s %8s' % ('test/variant', 'rss[kB]', 'cpu[s]', 'fds', 'ctxsw'))
+    for key, s in profiles.items():
+        print('%-40s %10d %8.2f %7d %8d' % (key, s.get('max_rss_kb',0), s.get('cpu_s',0), s.get('max_fds',0), s.get('ctxsw',0)))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,233 @@
+# --- Revised 3-Clause BSD License ---
+# Copyright Semtech Corporation 2022. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright notice,
+#       this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright notice,
+#       this list of conditions and the following disclaimer in the documentation
+#       and/or other materials provided with the distribution.
+#     * Neither the name of the Semtech corporation nor the names of its
+#       contributors may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SEMTECH CORPORATION. BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Replay a captured session (see capture.py) into a station.
+
+Run from a test directory (station.conf, slave-*.conf, tc.uri):
+
+    python -m replay session.cap --speed 4 --session 1
+
+Frames sent to the station - router_config, dnmsg, RX and CCA frames - are
+re-injected at their recorded offsets from the MUXS connect, divided by
+--speed. Timestamps are rebased: count_us of RX frames and CCA intervals to
+the current lgwsim xticks, the drift anchor of TIME frames to the current
+monotonic time, dnmsg xtime via the matching replayed uplink.
+A capture holding several sessions (test.sh running test.py more than once)
+needs --session - each session starts with its own MUXS connect.
+Timesync is answered live. Afterwards the frames the station sent are counted
+per kind and compared with the capture (exit status 1 on a mismatch).
+"""
+
+from typing import Any,Dict,List,Optional,Tuple
+import sys
+import json
+import time
+import struct
+import asyncio
+import argparse
+import logging
+from collections import Counter
+
+import tcutils as tu
+import simutils as su
+import testutils as tstu
+import fixtures as fx
+import capture
+
+logger = logging.getLogger('replay')
+
+CHECK_KINDS = ('updf', 'jreq', 'propdf', 'dntxed', 'tx')
+UPLINK_KINDS = ('updf', 'jreq', 'propdf')
+CCA_ENTRY = struct.Struct('@IQQ')
+
+
+def frame_kind(fr:capture.Frame) -> Optional[str]:
+    if fr.chan == capture.CHAN_LGWSIM:
+        return 'tx'
+    if not fr.flags & capture.FLAG_TEXT:
+        return 'binary'
+    try:
+        return json.loads(fr.data).get('msgtype')
+    except Exception:
+        return None
+
+
+def rebase_lgw_frame(data:bytes, delta:int, hal=su.LgwHAL) -> bytes:
+    """Shift the timestamps of a packed RX or CCA frame by delta xticks."""
+    b = bytearray(data)
+    if struct.unpack_from('@I', b, 0)[0] == su.MAGIC_CCA_FREQ:
+        for i in range(su.MAX_CCA_INFOS):
+            off = 8 + i*CCA_ENTRY.size
+            freq, beg, end = CCA_ENTRY.unpack_from(b, off)
+            if freq:
+                CCA_ENTRY.pack_into(b, off, freq, max(0, beg+delta), max(0, end+delta))
+    elif struct.unpack_from('@I', b, 0)[0] != su.MAGIC_TIME_FREQ:
+        off = hal.OFF_PKT_RX_COUNT_US
+        count_us = struct.unpack_from('@I', b, off)[0]
+        struct.pack_into('@I', b, off, (count_us+delta) & 0xFFFFFFFF)
+    return bytes(b)
+
+
+def rebase_time_frame(data:bytes, delta_us:int) -> bytes:
+    """Shift the drift anchor (monotonic us) of a packed TIME frame."""
+    b = bytearray(data)
+    anchor = struct.unpack_from('@q', b, 8)[0]
+    if anchor:
+        struct.pack_into('@q', b, 8, anchor+delta_us)
+    return bytes(b)
+
+
+class CountingMailbox(fx.Mailbox):
+    def __init__(self) -> None:
+        super().__init__()
+        self.counts = Counter()  # type: Counter
+        self.upxtimes = []       # type: List[int]
+
+    def put(self, key:Any, item:Any) -> None:
+        self.counts[key] += 1
+        if key in UPLINK_KINDS:
+            self.upxtimes.append(item['upinfo']['xtime'])
+        super().put(key, item)
+
+
+class ReplayMuxs(tu.Muxs):
+    def __init__(self, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.mailbox = CountingMailbox()
+        self.connected = fx.Signal()
+        self.conntime = None  # type: Optional[float]
+
+    async def handle_ws(self, ws):
+        if self.capture:
+            ws = tu.CapturingWs(ws, self.capture)
+        self.ws = ws
+        self.conntime = time.monotonic()
+        self.connected.notify()
+        await self.handle_connection(ws)
+
+
+class Replay:
+    def __init__(self, frames:List[capture.Frame], speed:float=1.0) -> None:
+        self.frames = frames
+        self.speed = speed
+        self.muxs = ReplayMuxs()
+        self.sim = su.LgwSimServer()
+        self.sim.mailbox = CountingMailbox()
+        self.recorded = Counter(k for k in (frame_kind(fr) for fr in frames if not fr.flags & capture.FLAG_DN) if k)
+        # Recorded uplink xtimes in order - paired with replayed ones to rebase dnmsg xtime
+        self.upxtimes = [ json.loads(fr.data)['upinfo']['xtime'] for fr in frames
+                          if not fr.flags & capture.FLAG_DN and frame_kind(fr) in UPLINK_KINDS ]
+        self.nsent = 0
+
+    def rebase_xtime(self, xtime:int) -> int:
+        replayed = self.muxs.mailbox.upxtimes
+        for i in range(min(len(replayed), len(self.upxtimes))-1, -1, -1):
+            if self.upxtimes[i]>>48 == xtime>>48:
+                return replayed[i] + (xtime - self.upxtimes[i])
+        return xtime
+
+    async def send(self, fr:capture.Frame) -> None:
+        if fr.chan == capture.CHAN_LGWSIM:
+            lgwsim = await self.sim.mailbox.signal.wait_for(lambda: self.sim.units.get(fr.unit), within=10.0)
+            data = fr.data
+            if fr.flags & capture.FLAG_XTICKS:
+                data = rebase_lgw_frame(data, lgwsim.xticks() - fr.xticks, lgwsim.hal)
+            if struct.unpack_from('@I', data, 0)[0] == su.MAGIC_TIME_FREQ:
+                data = rebase_time_frame(data, int((time.monotonic() - fr.mono)*1e6))
+                # Keep lgwsim.xticks() in step with the simulated SX130x
+                _, _, lgwsim.drift_anchor, lgwsim.drift_acc, lgwsim.drift_ppb, _ = struct.unpack_from('@IIqqii', data, 0)
+            await lgwsim.send_raw(data)
+        elif fr.flags & capture.FLAG_TEXT:
+            msg = json.loads(fr.data)
+            if msg.get('msgtype') == 'timesync':
+                return   # answered live by Muxs.handle_timesync
+            if 'xtime' in msg:
+                msg['xtime'] = self.rebase_xtime(msg['xtime'])
+            await self.muxs.ws.send(json.dumps(msg))
+        else:
+            await self.muxs.ws.send(fr.data)
+        self.nsent += 1
+
+    async def run(self, tail:float=2.0) -> None:
+        dnframes = [ fr for fr in self.frames if fr.flags & capture.FLAG_DN ]
+        if not dnframes:
+            return
+        await self.muxs.connected.wait_for(lambda: self.muxs.conntime, within=30.0)
+        anchor = self.muxs.conntime
+        t0 = next((fr.mono for fr in dnframes if fr.chan == capture.CHAN_MUXS), dnframes[0].mono)
+        for fr in dnframes:
+            delay = anchor + (fr.mono - t0)/self.speed - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await self.send(fr)
+        await asyncio.sleep(tail)
+
+    def compare(self, kinds=CHECK_KINDS) -> List[Tuple[str,int,int]]:
+        """Per kind (recorded, replayed) counts of frames sent by the station."""
+        replayed = self.muxs.mailbox.counts + self.sim.mailbox.counts
+        return [ (k, self.recorded[k], replayed[k]) for k in sorted(set(self.recorded) | set(replayed))
+                 if k in kinds or k in self.recorded ]
+
+
+async def replay_main(args) -> int:
+    frames = list(capture.read_frames(args.file, args.session))
+    rp = Replay(frames, args.speed)
+    station_args = args.station_args.split() if args.station_args else []
+    async with fx.serving(tu.Infos(), rp.muxs, rp.sim):
+        if args.no_station:
+            await rp.run(args.tail)
+        else:
+            async with fx.StationProcess(*station_args):
+                await rp.run(args.tail)
+    status = 0
+    logger.info('Replayed %d frames (speed x%g)', rp.nsent, args.speed)
+    for kind, nrec, nrep in rp.compare():
+        bad = kind in CHECK_KINDS and nrec != nrep
+        status |= bad
+        logger.info('  %-10s recorded=%-6d replayed=%-6d%s', kind, nrec, nrep, '  MISMATCH' if bad else '')
+    return status
+
+
+def main(args) -> None:
+    ap = argparse.ArgumentParser(description='Replay a captured session into a station')
+    ap.add_argument('file')
+    ap.add_argument('--speed', type=float, default=1.0, help='Replay speed factor (default: original speed)')
+    ap.add_argument('--tail', type=float, default=2.0, help='Secs to wait for station frames after the last injected frame')
+    ap.add_argument('--station-args', default='-p --temp .', help='Arguments for the station process')
+    ap.add_argument('--no-station', action='store_true', help='Only run the servers - station is started externally')
+    ap.add_argument('--session', type=int, help='Session to replay (0.. in file order) - required if the capture holds several')
+    args = ap.parse_args(args)
+    nsess = len(capture.sessions(args.file))
+    if args.session is None and nsess > 1:
+        ap.error('%s holds %d sessions - select one with --session 0..%d' % (args.file, nsess, nsess-1))
+    if args.session is not None and not 0 <= args.session < nsess:
+        ap.error('--session %d: %s holds %d session(s)' % (args.session, args.file, nsess))
+    tstu.setup_logging()
+    fx.run(lambda: replay_main(args), timeout=None)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
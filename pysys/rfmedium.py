@@ -0,0 +1,255 @@
+# --- Revised 3-Clause BSD License ---
+# Copyright Semtech Corporation 2022. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright notice,
+#       this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright notice,
+#       this list of conditions and the following disclaimer in the documentation
+#       and/or other materials provided with the distribution.
+#     * Neither the name of the Semtech corporation nor the names of its
+#       contributors may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SEMTECH CORPORATION. BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Shared virtual RF medium between simulated devices and gateways.
+
+Gateways are LgwSim units of LgwSimServers, each feeding a real station.
+Devices sit at positions (meters) and transmit once - every gateway hears
+the frame with RSSI/SNR from a path loss model. Station TX frames propagate
+back to all devices the same way.
+
+    medium = rfmedium.Medium(rfmedium.LogDistance(seed=1))
+    medium.add_gateway('gw0', sim, (0,0))
+    dev = medium.add_device(0x1000, (1200,300))
+    medium.transmit(dev, 868.1, (7,125), frame)
+
+A frame is lost at a receiver if its SNR is below the demodulation floor of
+its SF, if the receiving gateway transmits meanwhile (half duplex) or if it
+collides with another frame on the same frequency and SF. Of colliding frames
+one survives if it is at least CAPTURE_DB stronger than each of the others
+(capture effect). Different SFs are treated as orthogonal, uplinks and
+downlinks (inverted IQ) don't interfere. Frames are delivered when their
+transmission ends.
+"""
+
+from typing import Any,Callable,Dict,List,Optional,Set,Tuple
+import math
+import time
+import random
+import asyncio
+import logging
+from collections import Counter
+
+import simutils as su
+
+logger = logging.getLogger('rfmedium')
+
+Position = Tuple[float,float]
+
+SNR_FLOOR = { 5: -2.5, 6: -5.0, 7: -7.5, 8: -10.0, 9: -12.5, 10: -15.0, 11: -17.5, 12: -20.0 }  # dB
+NOISE_FIGURE = 6.0   # dB
+CAPTURE_DB = 6.0     # dB a frame must exceed interferers by to survive a collision
+KEEP_US = 10000000   # receptions kept for collision checks after they ended
+
+
+def noise_dbm(bw:int) -> float:
+    """Thermal noise over bw kHz plus receiver noise figure"""
+    return -174.0 + 10*math.log10(bw*1e3) + NOISE_FIGURE
+
+
+def distance(a:Position, b:Position) -> float:
+    return math.hypot(a[0]-b[0], a[1]-b[1])
+
+
+class LogDistance:
+    """Log-distance path loss with optional log-normal shadowing (sigma dB). The
+    defaults are a measured 868MHz fit with an elevated gateway antenna
+    (128.95dB at 1km, exponent 2.32)."""
+    def __init__(self, pl0:float=128.95, d0:float=1000.0, exponent:float=2.32, shadowing:float=0.0,
+                 seed:Optional[int]=None) -> None:
+        self.pl0 = pl0
+        self.d0 = d0
+        self.exponent = exponent
+        self.shadowing = shadowing
+        self.rnd = random.Random(seed)
+
+    def loss(self, a:Position, b:Position) -> float:
+        d = max(distance(a, b), 1.0)
+        pl = self.pl0 + 10*self.exponent*math.log10(d/self.d0)
+        return pl + (self.rnd.gauss(0, self.shadowing) if self.shadowing else 0.0)
+
+
+class Reception:
+    __slots__ = ('freq_hz', 'sf', 'bw', 'beg', 'end', 'rssi', 'snr', 'frame', 'lost')
+
+    def __init__(self, freq_hz:int, rps:Tuple[int,int], beg:int, end:int, rssi:float, frame:bytes) -> None:
+        self.freq_hz = freq_hz
+        self.sf, self.bw = rps
+        self.beg = beg      # monotonic us
+        self.end = end
+        self.rssi = rssi
+        self.snr = rssi - noise_dbm(self.bw)
+        self.frame = frame
+        self.lost = None    # type: Optional[str]
+
+    def overlaps(self, other:'Reception') -> bool:
+        return (other is not self and other.freq_hz == self.freq_hz and other.sf == self.sf and
+                other.beg < self.end and self.beg < other.end)
+
+
+class Receiver:
+    def __init__(self, name:Any, pos:Position) -> None:
+        self.name = name
+        self.pos = pos
+        self.receptions = []  # type: List[Reception]
+
+    def add(self, rx:Reception) -> None:
+        self.receptions = [ r for r in self.receptions if r.end >= rx.beg - KEEP_US ]
+        self.receptions.append(rx)
+
+    def collided(self, rx:Reception) -> bool:
+        return any(other.rssi > rx.rssi - CAPTURE_DB for other in self.receptions if rx.overlaps(other))
+
+
+class Gateway(Receiver):
+    def __init__(self, name:Any, server:su.LgwSimServer, pos:Position, unit:int=0) -> None:
+        super().__init__(name, pos)
+        self.server = server
+        self.unit = unit
+        self.txing = []  # type: List[Tuple[int,int]]  own TX beg/end (monotonic us)
+
+    def transmitting(self, beg:int, end:int) -> bool:
+        return any(b < end and beg < e for b,e in self.txing)
+
+    async def deliver(self, rx:Reception) -> bool:
+        lgwsim = self.server.units.get(self.unit)
+        if lgwsim is None:
+            return False
+        await lgwsim.send_rx((rx.sf, rx.bw), freq=rx.freq_hz/1e6, rxtime=lgwsim.mono2xticks(rx.end),
+                             frame=rx.frame, rssi=round(rx.rssi, 1), snr=round(rx.snr, 1))
+        return True
+
+
+class Device(Receiver):
+    def __init__(self, name:Any, pos:Position, txpow:float=14.0) -> None:
+        super().__init__(name, pos)
+        self.txpow = txpow
+        self.received = []  # type: List[Tuple[Any,Reception]]  (gateway name, downlink)
+        self.on_rx = None   # type: Optional[Callable[[Any,Reception],None]]
+
+    def deliver(self, gwname:Any, rx:Reception) -> None:
+        self.received.append((gwname, rx))
+        if self.on_rx is not None:
+            self.on_rx(gwname, rx)
+
+
+class Medium:
+    def __init__(self, pathloss:Optional[LogDistance]=None) -> None:
+        self.pathloss = pathloss or LogDistance()
+        self.gateways = []  # type: List[Gateway]
+        self.devices = {}   # type: Dict[Any,Device]
+        self.stats = Counter()  # type: Counter
+        self.tasks = set()  # type: Set[asyncio.Future]
+
+    def add_gateway(self, name:Any, server:su.LgwSimServer, pos:Position, unit:int=0) -> Gateway:
+        """Station TX frames of server unit propagate to all devices (server.on_tx is still called)."""
+        gw = Gateway(name, server, pos, unit)
+        self.gateways.append(gw)
+        on_tx = server.on_tx
+        async def medium_on_tx(lgwsim:su.LgwSim, pkt:Dict[str,Any]) -> None:
+            if lgwsim.unitIdx == gw.unit:
+                self.downlink(gw, lgwsim, pkt)
+            await on_tx(lgwsim, pkt)
+        server.on_tx = medium_on_tx
+        return gw
+
+    def add_device(self, name:Any, pos:Position, txpow:float=14.0) -> Device:
+        dev = self.devices[name] = Device(name, pos, txpow)
+        return dev
+
+    def rssi(self, txpow:float, a:Position, b:Position) -> float:
+        return txpow - self.pathloss.loss(a, b)
+
+    def later(self, at:int, fn:Callable[[],Any]) -> None:
+        """Run coroutine function fn at monotonic time at (us)"""
+        async def run() -> None:
+            await asyncio.sleep(max(0, at - int(time.monotonic()*1e6)) / 1e6)
+            await fn()
+        task = asyncio.ensure_future(run())
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def transmit(self, dev:Device, freq:float, rps:Tuple[int,int], frame:bytes) -> Dict[Any,Reception]:
+        """Uplink starting now - returns the receptions per gateway, their `lost`
+        attribute is set once the transmission ended (None if delivered)."""
+        beg = int(time.monotonic()*1e6)
+        end = beg + int(su.airtime(rps[0], rps[1], len(frame))*1e6)
+        self.stats['uplinks'] += 1
+        rxs = {}
+        for gw in self.gateways:
+            rx = Reception(int(round(freq*1e6)), rps, beg, end, self.rssi(dev.txpow, dev.pos, gw.pos), frame)
+            rxs[gw.name] = rx
+            if rx.snr < SNR_FLOOR[rx.sf]:
+                rx.lost = 'weak'
+                self.stats['up_weak'] += 1
+                continue
+            gw.add(rx)
+            self.later(end, lambda gw=gw, rx=rx: self.finish_uplink(gw, rx))
+        return rxs
+
+    async def finish_uplink(self, gw:Gateway, rx:Reception) -> None:
+        if gw.transmitting(rx.beg, rx.end):
+            rx.lost = 'gw_tx'
+        elif gw.collided(rx):
+            rx.lost = 'collision'
+        elif not await gw.deliver(rx):
+            rx.lost = 'gw_down'
+        self.stats['up_' + (rx.lost or 'delivered')] += 1
+
+    def downlink(self, gw:Gateway, lgwsim:su.LgwSim, pkt:Dict[str,Any]) -> None:
+        rps = lgwsim.hal.get_rps(pkt)
+        beg = lgwsim.xticks2mono(lgwsim.tx_xticks(pkt))
+        end = beg + int(su.airtime(rps[0], rps[1], pkt['size'])*1e6)
+        gw.txing = [ (b,e) for b,e in gw.txing if e >= beg - KEEP_US ] + [(beg, end)]
+        self.stats['downlinks'] += 1
+        for dev in self.devices.values():
+            rx = Reception(pkt['freq_hz'], rps, beg, end, self.rssi(pkt['rf_power'], gw.pos, dev.pos), pkt['payload'])
+            if rx.snr < SNR_FLOOR[rx.sf]:
+                continue
+            dev.add(rx)
+            self.later(end, lambda dev=dev, rx=rx: self.finish_downlink(gw, dev, rx))
+
+    async def finish_downlink(self, gw:Gateway, dev:Device, rx:Reception) -> None:
+        if dev.collided(rx):
+            rx.lost = 'collision'
+            self.stats['dn_collision'] += 1
+            return
+        self.stats['dn_delivered'] += 1
+        dev.deliver(gw.name, rx)
+
+    def best_sf(self, pos:Position, txpow:float=14.0, margin:float=10.0, sfs:Tuple[int,...]=(7,8,9,10,11,12), bw:int=125) -> int:
+        """Lowest SF reaching the nearest gateway with margin dB above the SNR floor (ADR like)."""
+        if not self.gateways:
+            return sfs[-1]
+        loss = min(self.pathloss.pl0 + 10*self.pathloss.exponent*math.log10(max(distance(pos, gw.pos), 1.0)/self.pathloss.d0)
+                   for gw in self.gateways)
+        snr = txpow - loss - noise_dbm(bw)
+        return next((sf for sf in sfs if snr >= SNR_FLOOR[sf] + margin), sfs[-1])
+
+    async def close(self) -> None:
+        for task in list(self.tasks):
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
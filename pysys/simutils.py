@@ -24,17 +24,25 @@
 # OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
 # ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-from typing import Any,Dict,List,Tuple,Union
+from typing import Any,Dict,List,Optional,Set,Tuple,Union
 import os
+import json
+import math
+import random
 import sys
 import asyncio
 import socket
 import struct
 import time
 import logging
+from fixtures import Mailbox, matches
+import capture
 
 logger = logging.getLogger('simutils')
 
+SF_FSK = 0             # sf of FSK as in router_config DRs
+RPS_FSK = (SF_FSK, 0)  # (sf, bw) of FSK
+
 class LgwHAL():
     BW_500KHZ = 0x01
     BW_250KHZ = 0x02
@@ -67,19 +75,42 @@ class LgwHAL():
     CR_LORA_4_7 = 0x03
     CR_LORA_4_8 = 0x04
 
+    MOD_LORA = 0x10
+    MOD_FSK  = 0x20
+    FSK_DATARATE = 50000   # baud - the only FSK rate station uses
+
+    OFF_PKT_RX_COUNT_US = 8   # same in Lgw1/Lgw2 layouts
+    FTIME = False             # RX frames carry a fine timestamp (see LgwSim.enable_ftime)
+
     @classmethod
     def add_rps(cls, pkt, rps):
+        """Modulation fields for rps (sf, bw in kHz) - RPS_FSK for FSK.
+        Raises ValueError for SFs without a datarate code in the layout (SF5/SF6)."""
+        if rps[0] == SF_FSK:
+            pkt['modulation'] = cls.MOD_FSK
+            pkt['datarate'] = cls.FSK_DATARATE
+            return
+        if rps[0] not in cls.DR_MAP:
+            raise ValueError('SF%d not supported by the %s layout' % (rps[0], cls.__name__))
+        pkt['modulation'] = cls.MOD_LORA
         pkt['bandwidth'] = cls.BW_MAP[rps[1]]
         pkt['datarate'] = cls.DR_MAP[rps[0]]
 
+    @classmethod
+    def get_rps(cls, pkt) -> Tuple[int,int]:
+        """(sf, bw in kHz) of a packet - inverse of add_rps"""
+        if pkt.get('modulation') == cls.MOD_FSK:
+            return RPS_FSK
+        sf = next(s for s,v in cls.DR_MAP.items() if v == pkt['datarate'])
+        bw = next(b for b,v in cls.BW_MAP.items() if v == pkt['bandwidth'])
+        return sf, bw
+
 class Lgw1(LgwHAL):
     SIZE_PKT_TX = 288
     SIZE_PKT_RX = 300
     OFF_PKT_RX_PAYLOAD = 44
     OFF_PKT_TX_PAYLOAD = 30
     STAT_CRC_OK = 0x10
-    MOD_LORA = 0x10
-    MOD_FSK  = 0x20
     IMMEDIATE = 0
     TIMESTAMPED = 1
     ON_GPS = 2
@@ -134,6 +165,7 @@ class Lgw1(LgwHAL):
         return pkt
 
 class Lgw2(LgwHAL):
+    FTIME = True
     SIZE_PKT_TX = 296
     SIZE_PKT_RX = 284
     OFF_PKT_RX_PAYLOAD = 30
@@ -166,12 +198,12 @@ class Lgw2(LgwHAL):
 
         f = (
         1,                                  #  is_valid;          /*!> Is there a signal on this antenna? */
-        0,                                  #  fine_received;     /*!> Have we received a valid fine timestamp? */
+        'ftime' in pkt,                     #  fine_received;     /*!> Have we received a valid fine timestamp? */
         1,                                  #  sig_info_received; /*!> Have we received signal information from DSP (RSSI, SNR...)? */
         pkt.get('if_chain'  ,           0), #  chan;              /*!> Channel on which packet was received */
         0,                                  #  freq_offset;       /*!> Frequency offset, in Hz */
         b'\xAB'*16,                         #  fine_tmst_enc[SX1301AR_BOARD_AES_DATA_SIZE]; /*!> Main fine timestamp of packet arrival (encrypted) */
-        0,                                  #  fine_tmst;         /*!> Main fine timestamp of packet arrival (clear) */
+        pkt.get('ftime'     ,           0), #  fine_tmst;         /*!> Main fine timestamp of packet arrival (clear) */
         0,                                  #  fine_tmst_status;  /*!> Main fine timestamp status */
         0,                                  #  fine_tmst_version; /*!> Version of the main fine timestamp */
         pkt.get('rssi'      ,       -50.0), #  rssi_chan;         /*!> Channel RSSI in dB */
@@ -220,6 +252,27 @@ class Lgw2(LgwHAL):
 
 MAX_CCA_INFOS  = 10  # keep in sync with lgwsim.c
 MAGIC_CCA_FREQ = 0xCCAFCCAF  # ditto
+MAGIC_TIME_FREQ = 0x71AE71AE # ditto
+TIME_FLAG_NOPPS = 0x01       # ditto
+
+def airtime(sf:int, bw:int=125, plen:int=20, cr:int=1, preamble:int=8, crc:bool=True, header:bool=True) -> float:
+    """LoRa time on air in seconds (bw in kHz, cr=1..4 for 4/5..4/8) - FSK (sf=SF_FSK) at 50kbps."""
+    if sf == SF_FSK:
+        # preamble, syncword, length byte, CRC - same as station's s2e_calcDnAirTime
+        return (plen + 5 + 3 + 1 + 2*crc) * 8 / 50000
+    tsym = (1 << sf) / (bw * 1e3)
+    de = 1 if tsym >= 16e-3 else 0
+    if sf <= 6:
+        # SF5/SF6 have a longer preamble and no low datarate optimization
+        tpre = (preamble + 6.25) * tsym
+        n = 8*plen + 16*crc - 4*sf + 20*header
+        nsym = 8 + max(math.ceil(n / (4*sf)) * (cr+4), 0)
+    else:
+        tpre = (preamble + 4.25) * tsym
+        n = 8*plen - 4*sf + 28 + 16*crc - 20*(not header)
+        nsym = 8 + max(math.ceil(n / (4*(sf - 2*de))) * (cr+4), 0)
+    return tpre + nsym * tsym
+
 
 class FrmType(object):
     JREQ = 0x00
@@ -240,10 +293,30 @@ def makeDF(mhdr=FrmType.DAUP, fctrl=0, fcnt=0, devaddr=1, fopts=b'', port=-1, pa
     return b
 
 
+class RxCopy:
+    """One antenna's copy of an uplink (see LgwSimServer.send_rx_diversity):
+    unit (slave), rf_chain, arrival offset (us) and signal quality."""
+    __slots__ = ('unit', 'rf_chain', 'offset_us', 'rssi', 'snr')
+
+    def __init__(self, unit:int=0, rf_chain:int=0, offset_us:int=0, rssi:float=-50.0, snr:float=9.0) -> None:
+        self.unit = unit
+        self.rf_chain = rf_chain
+        self.offset_us = offset_us
+        self.rssi = rssi
+        self.snr = snr
+
+    def __repr__(self) -> str:
+        return 'RxCopy(unit=%d rf_chain=%d offset_us=%d rssi=%g snr=%g)' % (
+            self.unit, self.rf_chain, self.offset_us, self.rssi, self.snr)
+
+
 class LgwSimServer:
     def __init__(self, path:str='spidev') -> None:
         self.path = path
         self.units = {}
+        self.sock = None
+        self.mailbox = Mailbox()  # 'tx': (unitIdx,pkt) as sent by station, 'connected': LgwSim
+        self.capture = capture.default_recorder()
 
     async def start_server(self):
         logger.debug('  LgwSimServer starting...')
@@ -256,6 +329,22 @@ class LgwSimServer:
             lgwsim.close()
         self.units = {}
 
+    async def stop_server(self) -> None:
+        self.close()
+        if self.sock is not None:
+            self.sock.close()
+            await self.sock.wait_closed()
+            self.sock = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    async def __aenter__(self):
+        await self.start_server()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.stop_server()
+
     async def connected(self, reader, writer) -> None:
         p = await reader.read(Lgw1.SIZE_PKT_TX)
         assert len(p) == Lgw1.SIZE_PKT_TX
@@ -273,6 +362,7 @@ class LgwSimServer:
         lgwsim = self.make_lgwsim(unitIdx, hal, timeOffset, reader, writer)
         logger.debug('  LgwSimServer: SPI device #%d connected (timeOffset=0x%X xticksNow=0x%X)' % (unitIdx, timeOffset, lgwsim.xticks()))
         self.units[unitIdx] = lgwsim
+        self.mailbox.put('connected', lgwsim)
         await self.on_connected(lgwsim)
 
     def make_lgwsim(self, unitIdx, hal, timeOffset, reader, writer) -> 'LgwSim':
@@ -284,6 +374,43 @@ class LgwSimServer:
     async def on_tx(self, lgwsim, pkt):
         pass
 
+    async def on_close(self):
+        pass
+
+    def _tx_filter(self, freq:Optional[float], unit:Optional[int], where:Any):
+        freq_hz = None if freq is None else int(round(freq*1e6))
+        return lambda item: ((unit is None or item[0] == unit) and
+                             (freq_hz is None or item[1]['freq_hz'] == freq_hz) and
+                             matches(where, item[1]))
+
+    async def expect_tx(self, freq:Optional[float]=None, unit:Optional[int]=None, where:Any=None, within:float=5.0) -> Dict[str,Any]:
+        """Wait for a TX frame (freq in MHz) from the station - returns the unpacked packet."""
+        return (await self.mailbox.expect('tx', self._tx_filter(freq, unit, where), within))[1]
+
+    async def expect_no_tx(self, freq:Optional[float]=None, unit:Optional[int]=None, where:Any=None, within:float=1.0) -> None:
+        await self.mailbox.expect_none('tx', self._tx_filter(freq, unit, where), within)
+
+    async def expect_connected(self, unit:int=0, within:float=10.0) -> 'LgwSim':
+        return await self.mailbox.expect('connected', lambda lgwsim: lgwsim.unitIdx == unit, within)
+
+    async def send_rx_diversity(self, rps:Tuple[int,int], freq:float, frame:bytes, copies:List[RxCopy],
+                                mono:Optional[int]=None) -> List[Tuple[RxCopy,int]]:
+        """Same frame received by several units/rf_chains: each copy ends offset_us
+        after mono (monotonic us, default now) on the clock of its unit. Copies
+        are sent in arrival order, those for units not connected are skipped.
+        Returns (copy, rxtime xticks) of the copies sent."""
+        mono = int(time.monotonic()*1e6) if mono is None else mono
+        sent = []
+        for c in sorted(copies, key=lambda c: c.offset_us):
+            lgwsim = self.units.get(c.unit)
+            if lgwsim is None:
+                logger.debug('  LgwSimServer: unit #%d not connected - skipping RX copy', c.unit)
+                continue
+            rxtime = lgwsim.mono2xticks(mono + c.offset_us)
+            await lgwsim.send_rx(rps, freq=freq, rxtime=rxtime, frame=frame, rssi=c.rssi, snr=c.snr, rf_chain=c.rf_chain)
+            sent.append((c, rxtime))
+        return sent
+
 
 class LgwSim:
     def __init__(self, server, unitIdx:int, hal:Union[Lgw1,Lgw2], timeOffset:int, reader:asyncio.StreamReader, writer:asyncio.StreamWriter) -> None:
@@ -293,16 +420,53 @@ class LgwSim:
         self.reader = reader
         self.writer = writer
         self.timeOffset = timeOffset # This assumes target to run on the same system clock as simulation
+        self.drift_ppb = 0           # SX130x clock drift - see send_time
+        self.drift_anchor = 0
+        self.drift_acc = 0
+        self.pps_offset = 0
+        self.pps = True
+        self.ftime_jitter = None     # type: Optional[float]  see enable_ftime
+        self.ftime_rnd = random.Random()
+        self.capture = server.capture
         self.read_task = asyncio.ensure_future(self.read_loop())
 
     def xticks(self) -> int:
-        return int(time.monotonic()*1e6) - self.timeOffset
+        return self.mono2xticks(int(time.monotonic()*1e6))
+
+    def drift(self, mono:int) -> int:
+        """Drift accumulated by the simulated SX130x clock at mono (us) - same arithmetic as lgwsim.c"""
+        if not self.drift_ppb:
+            return 0
+        d = (mono - self.drift_anchor) * self.drift_ppb
+        return self.drift_acc + (abs(d) // 1000000000) * (1 if d >= 0 else -1)
 
     def xticks2mono(self, xticks:int) -> int:
-        return self.timeOffset + xticks
+        mono = self.timeOffset + xticks
+        return mono - self.drift(mono - self.drift(mono))
 
     def mono2xticks(self, mono:int) -> int:
-        return mono - self.timeOffset
+        return mono - self.timeOffset + self.drift(mono)
+
+    def enable_ftime(self, jitter_ns:float=0.0, seed:Optional[int]=None) -> None:
+        """Fine timestamps in RX frames (layouts with FTIME - Lgw2): ns since the
+        PPS edge before the RX time plus gaussian jitter (sigma jitter_ns). As
+        with real hardware there are none while PPS is out (see send_time)."""
+        self.ftime_jitter = jitter_ns
+        self.ftime_rnd = random.Random(seed)
+
+    def disable_ftime(self) -> None:
+        self.ftime_jitter = None
+
+    def fine_time(self, xticks:int) -> Optional[int]:
+        """Fine timestamp (ns) of an RX frame at xticks - None if disabled or no PPS"""
+        if self.ftime_jitter is None or not self.pps:
+            return None
+        now = time.monotonic()
+        utc = int((time.time() - now)*1e6) + self.xticks2mono(xticks)
+        ns = ((utc - self.pps_offset) % 1000000)*1000
+        if self.ftime_jitter:
+            ns += int(round(self.ftime_rnd.gauss(0, self.ftime_jitter)))
+        return ns % 1000000000
 
     def close(self):
         self.writer.close()
@@ -317,7 +481,10 @@ class LgwSim:
                     logger.debug('  LGWSIM(%d) - read EOF' % self.unitIdx)
                     break
                 else:
+                    if self.capture:
+                        self.capture.record(capture.CHAN_LGWSIM, 0, p, self.unitIdx, self.xticks())
                     pkt = self.hal.unpack_pkt_tx(p)
+                    self.server.mailbox.put('tx', (self.unitIdx, pkt))
                     await self.on_tx(pkt)
         except BrokenPipeError:
             pass
@@ -329,15 +496,31 @@ class LgwSim:
         await self.server.on_close()
         self.server.units.pop(self.unitIdx,None)
 
-    async def send_rx(self, rps:Tuple[int,int], freq=869.515, rxtime=None, frame=b''):
+    def tx_xticks(self, pkt:Dict[str,Any]) -> int:
+        """Full xticks of the 32 bit count_us of a TX frame (TX time near now)"""
+        now = self.xticks()
+        d = (pkt['count_us'] - now) & 0xFFFFFFFF
+        return now + (d - (1<<32) if d >= 1<<31 else d)
+
+    async def send_rx(self, rps:Tuple[int,int], freq=869.515, rxtime=None, frame=b'', rssi:Optional[float]=None, snr:Optional[float]=None,
+                      rf_chain:Optional[int]=None):
         pkt = {
             'freq_hz': int(freq*1e6),
             'payload': frame
         }
+        if rf_chain is not None:
+            pkt['rf_chain'] = rf_chain
+        if rssi is not None:
+            pkt['rssi'] = rssi
+        if snr is not None:
+            pkt.update(snr=snr, snr_min=snr-0.3, snr_max=snr+0.3)
         self.hal.add_rps(pkt, rps)
-        p = self.hal.pack_pkt_rx(pkt, rxtime or self.xticks())
-        self.writer.write(p)
-        await self.writer.drain()
+        rxtime = rxtime or self.xticks()
+        ftime = self.fine_time(rxtime)
+        if ftime is not None:
+            pkt['ftime'] = ftime
+        p = self.hal.pack_pkt_rx(pkt, rxtime)
+        await self.send_raw(p)
 
     async def send_cca(self, cca_infos:List[Tuple[int,int,int]]):
         assert len(cca_infos) < MAX_CCA_INFOS
@@ -346,6 +529,28 @@ class LgwSim:
              b''.join(struct.pack("@IQQ", int(i[0]*1e6), i[1], i[2])
                       for i in cca_infos))
         p += b'\x00' * (self.hal.SIZE_PKT_RX - len(p))
+        await self.send_raw(p)
+
+    async def send_time(self, drift_ppb:Optional[int]=None, pps_offset:int=0, pps:bool=True) -> None:
+        """Clock faults of the simulated SX130x: drift against the MCU clock (ppb,
+        None keeps the current one), PPS edge pps_offset us after the UTC second,
+        no PPS edges at all if pps is false."""
+        if drift_ppb is not None and drift_ppb != self.drift_ppb:
+            now = int(time.monotonic()*1e6)
+            self.drift_acc = self.drift(now)
+            self.drift_anchor = now
+            self.drift_ppb = drift_ppb
+        self.pps_offset = pps_offset
+        self.pps = pps
+        p = struct.pack("@IIqqii", MAGIC_TIME_FREQ, 0 if pps else TIME_FLAG_NOPPS,
+                        self.drift_anchor, self.drift_acc, self.drift_ppb, pps_offset)
+        p += b'\x00' * (self.hal.SIZE_PKT_RX - len(p))
+        await self.send_raw(p)
+
+    async def send_raw(self, p:bytes) -> None:
+        """Send a packed RX or CCA frame to the station."""
+        if self.capture:
+            self.capture.record(capture.CHAN_LGWSIM, capture.FLAG_DN, p, self.unitIdx, self.xticks())
         self.writer.write(p)
         await self.writer.drain()
 
@@ -360,33 +565,233 @@ class LgwSim:
 
 
 class LgwSimLoopbackSetup:
+    """Two stations facing each other: a frame sent by one side is received
+    by the same unit of the other side when its transmission ends."""
     def __init__(self) -> None:
         self.router_side = LgwSimServer('spidev.router')
         self.device_side = LgwSimServer('spidev.device')
+        self.router_side.on_tx = lambda lgwsim, pkt: self.forward(self.device_side, lgwsim, pkt)
+        self.device_side.on_tx = lambda lgwsim, pkt: self.forward(self.router_side, lgwsim, pkt)
+        self.tasks = set()  # type: Set[asyncio.Future]
 
     async def close(self) -> None:
-        self.router_side.close()
-        self.router_side = None
-        self.device_side.close()
-        self.device_side = None
-
-    async def forward(self, src_side, dst_side, src_lgwsim, pkt):
-        unitIdx = src_lgwsim.unitIdx
-        if unitIdx not in dst_side.units:
+        for task in list(self.tasks):
+            task.cancel()
+        await self.router_side.stop_server()
+        await self.device_side.stop_server()
+
+    async def forward(self, dst_side:LgwSimServer, src_lgwsim:'LgwSim', pkt:Dict[str,Any]) -> None:
+        sf, bw = src_lgwsim.hal.get_rps(pkt)
+        txend = src_lgwsim.xticks2mono(src_lgwsim.tx_xticks(pkt)) + int(airtime(sf, bw, pkt['size'])*1e6)
+        task = asyncio.ensure_future(self.deliver(dst_side, src_lgwsim.unitIdx, txend, pkt, (sf, bw)))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def deliver(self, dst_side:LgwSimServer, unitIdx:int, txend:int, pkt:Dict[str,Any], rps:Tuple[int,int]) -> None:
+        await asyncio.sleep(max(0, txend - int(time.monotonic()*1e6)) / 1e6)
+        dst_lgwsim = dst_side.units.get(unitIdx)
+        if dst_lgwsim is None:
             logger.error('Unit %d of %s not yet connected - dropping TX frame', unitIdx, dst_side.path)
             return
-        dst_lgwsim = dst_side.units[unitIdx]
-        xticks = dst_side.mono2xticks(src_side.xticks2mono(pkt['count_us']))
-        dst_lgwsim.writer.write(pack_pkt_rx(pkt, xticks))
-        await dst_lgwsim.writer.drain()
-
-
-    async def on_connected_router(self, lgwsim:'LgwSim') -> None:
-        await lgwsim.on_connected()
-        lgwsim.on_close = self.close
-        lgwsim.on_tx = lambda lgwsim, pkt: self.forward(self.router_side, self.device_side, lgwsim, pkt)
-
+        await dst_lgwsim.send_rx(rps, freq=pkt['freq_hz']/1e6, rxtime=dst_lgwsim.mono2xticks(txend), frame=pkt['payload'])
 
     async def start(self) -> None:
         await self.router_side.start_server()
         await self.device_side.start_server()
+
+
+# Station master<->slave pipe protocol (src-linux/ralsub.h) - native layouts
+RAL_CMD_CONFIG   = 1
+RAL_CMD_TXSTATUS = 2
+RAL_CMD_TXABORT  = 3
+RAL_CMD_TX       = 4
+RAL_CMD_TX_NOCCA = 5
+RAL_CMD_RX       = 6
+RAL_CMD_TIMESYNC = 7
+RAL_CMD_STOP     = 8
+
+RAL_TX_OK   =  0
+RAL_TX_FAIL = -1
+RAL_TX_NOCA = -2
+
+TXSTATUS_IDLE      = 0
+TXSTATUS_SCHEDULED = 1
+TXSTATUS_EMITTING  = 2
+
+RPS_BCN = 0x40
+RPS_SF_FSK = 6           # s2e SF enum: SF12=0 .. SF7=5, FSK=6
+RPS_BWS = (125, 250, 500)
+
+RAL_TXUNIT_SHIFT = 56
+RAL_XTSESS_SHIFT = 48
+RAL_TXUNIT_MASK  = 0x7F
+RAL_XTSESS_MASK  = 0xFF
+
+PIPE_BUF = 4096
+MAX_UPCHNLS = 80
+
+RAL_HEADER        = struct.Struct('@qB0q')          # rctx cmd - also timesync/stop/txabort/txstatus requests
+RAL_CONFIG_REQ    = struct.Struct('@qBHI%dI%dB32s%ds0q' % (MAX_UPCHNLS, MAX_UPCHNLS, PIPE_BUF-16-32-5*MAX_UPCHNLS))
+RAL_TX_REQ        = struct.Struct('@qBBhBBIq255s0q')
+RAL_RESPONSE      = struct.Struct('@qBb0q')          # rctx cmd status
+RAL_TIMESYNC_RESP = struct.Struct('@qBiqqq0q')       # rctx cmd quality ustime xtime pps_xtime
+RAL_RX_RESP       = struct.Struct('@qBBBIqiBb255s0q')
+
+assert RAL_CONFIG_REQ.size == PIPE_BUF and RAL_TX_REQ.size == 288 and RAL_RX_RESP.size == 288
+
+
+def rps2tuple(rps:int) -> Tuple[int,int]:
+    """(sf, bw in kHz) of a station rps_t - RPS_FSK for FSK"""
+    sf = rps & 0x7
+    if sf == RPS_SF_FSK:
+        return RPS_FSK
+    return 12-sf, RPS_BWS[(rps >> 3) & 0x3]
+
+
+def tuple2rps(rps:Tuple[int,int]) -> int:
+    """Station rps_t of (sf, bw in kHz) - inverse of rps2tuple"""
+    if rps[0] == SF_FSK:
+        return RPS_SF_FSK
+    if not 7 <= rps[0] <= 12:
+        raise ValueError('SF%d not in station rps_t' % (rps[0],))
+    return (12-rps[0]) | (RPS_BWS.index(rps[1]) << 3)
+
+
+class Slave:
+    """Python replacement of the station's radio slave process (src-linux/ral_slave.c).
+
+    The master (station of a testms variant) execs it via --exec/-X and passes
+    SLAVE_IDX, SLAVE_RDFD and SLAVE_WRFD in the environment. There is no radio:
+    the SX130x counter is simulated from the monotonic clock (same clock as
+    the station's ustime), TX requests are passed to ral_tx and uplinks are
+    injected with send_rx. Subclasses override the ral_* hooks.
+    """
+    def __init__(self) -> None:
+        self.slaveIdx = int(os.environ.get('SLAVE_IDX', '0'))
+        self.rdfd = int(os.environ['SLAVE_RDFD'])
+        self.wrfd = int(os.environ['SLAVE_WRFD'])
+        self.reader = None      # type: Optional[asyncio.StreamReader]
+        self.transport = None   # type: Optional[asyncio.WriteTransport]
+        self.read_task = None   # type: Optional[asyncio.Future]
+        self.region = 0
+        self.xtime_sess = 0     # upper xtime bits: txunit and session - 0 while stopped
+        self.t0 = int(time.monotonic()*1e6)
+        self.txwindow = None    # type: Optional[Tuple[int,int]]  xtime begin/end of the last TX
+
+    async def start_slave(self) -> None:
+        loop = asyncio.get_event_loop()
+        self.reader = asyncio.StreamReader()
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(self.reader), os.fdopen(self.rdfd, 'rb', 0))
+        self.transport, _ = await loop.connect_write_pipe(asyncio.Protocol, os.fdopen(self.wrfd, 'wb', 0))
+        self.read_task = asyncio.ensure_future(self.read_loop())
+        logger.info('Slave (%d) started - pid=%d', self.slaveIdx, os.getpid())
+
+    def xticks(self) -> int:
+        return int(time.monotonic()*1e6) - self.t0
+
+    def xtime(self, xticks:Optional[int]=None) -> int:
+        return self.xtime_sess + (self.xticks() if xticks is None else xticks)
+
+    def new_session(self) -> None:
+        """As ts_newXtimeSession - session is never 0"""
+        sess = random.randint(1, RAL_XTSESS_MASK)
+        self.xtime_sess = (sess << RAL_XTSESS_SHIFT) | ((self.slaveIdx & RAL_TXUNIT_MASK) << RAL_TXUNIT_SHIFT)
+
+    def write(self, data:bytes) -> None:
+        if self.transport is None or self.transport.is_closing():
+            logger.error('Slave (%d) pipe to master closed - dropping %d bytes', self.slaveIdx, len(data))
+            return
+        self.transport.write(data)
+
+    async def read_loop(self) -> None:
+        try:
+            while True:
+                hdr = await self.reader.readexactly(RAL_HEADER.size)
+                rctx, cmd = RAL_HEADER.unpack(hdr)
+                if cmd == RAL_CMD_CONFIG:
+                    req = RAL_CONFIG_REQ.unpack(hdr + await self.reader.readexactly(RAL_CONFIG_REQ.size - RAL_HEADER.size))
+                    await self.handle_config(req)
+                elif cmd in (RAL_CMD_TX, RAL_CMD_TX_NOCCA):
+                    req = RAL_TX_REQ.unpack(hdr + await self.reader.readexactly(RAL_TX_REQ.size - RAL_HEADER.size))
+                    await self.handle_tx(req)
+                elif cmd == RAL_CMD_TXSTATUS:
+                    self.write(RAL_RESPONSE.pack(rctx, cmd, await self.ral_txstatus(rctx)))
+                elif cmd == RAL_CMD_TXABORT:
+                    await self.ral_txabort(rctx)
+                elif cmd == RAL_CMD_TIMESYNC:
+                    self.send_timesync()
+                elif cmd == RAL_CMD_STOP:
+                    await self.ral_stop()
+                else:
+                    raise ValueError('Slave (%d) unknown command from master: cmd=%d' % (self.slaveIdx, cmd))
+        except asyncio.IncompleteReadError as exc:
+            if exc.partial:
+                logger.error('Slave (%d) truncated request from master: %d bytes', self.slaveIdx, len(exc.partial))
+            logger.info('Slave (%d) EOF from master', self.slaveIdx)
+            await self.slave_eof()
+
+    async def handle_config(self, req:Tuple) -> None:
+        jsonlen, region = req[2], req[3]
+        hwspec = req[4+2*MAX_UPCHNLS].rstrip(b'\x00').decode()
+        config = json.loads(req[5+2*MAX_UPCHNLS][:jsonlen].decode()) if jsonlen else {}
+        self.region = region
+        self.new_session()
+        await self.ral_config(hwspec, config)
+        self.send_timesync()
+
+    async def handle_tx(self, req:Tuple) -> None:
+        rctx, cmd, txlen, txpow, rps, addcrc, freq, xtime, txdata = req
+        sf, bw = rps2tuple(rps)
+        self.txwindow = (xtime, xtime + int(airtime(sf, bw, txlen, crc=bool(addcrc), header=not rps & RPS_BCN)*1e6))
+        status = await self.ral_tx(rctx, txpow/10, (sf, bw), freq/1e6, xtime, txdata[:txlen])
+        if self.region:
+            # Master waits for the LBT verdict only if there is a CCA region
+            self.write(RAL_RESPONSE.pack(rctx, cmd, RAL_TX_OK if status is None else status))
+
+    def send_timesync(self) -> None:
+        ustime = int(time.monotonic()*1e6)
+        xtime = self.xtime()
+        quality = int(time.monotonic()*1e6) - ustime
+        self.write(RAL_TIMESYNC_RESP.pack(self.slaveIdx, RAL_CMD_TIMESYNC, quality, ustime, xtime, 0))
+
+    def send_rx(self, rctx:Optional[int]=None, freq:float=869.525, rxdata:bytes=b'', rps:Tuple[int,int]=(7,125),
+                rssi:float=-50.0, snr:float=9.0, xtime:Optional[int]=None, fts:int=-1) -> None:
+        """Report an uplink (freq in MHz) - received now unless xtime is given.
+        rctx defaults to the slave index as with ral_slave.c."""
+        if not self.xtime_sess:
+            logger.error('Slave (%d) not configured - dropping RX frame', self.slaveIdx)
+            return
+        self.write(RAL_RX_RESP.pack(self.slaveIdx if rctx is None else rctx, RAL_CMD_RX, len(rxdata), tuple2rps(rps),
+                                    int(freq*1e6), self.xtime() if xtime is None else xtime, fts,
+                                    int(-rssi) & 0xFF, max(-128, min(127, int(snr*4))), rxdata))
+
+    async def slave_eof(self) -> None:
+        """Master is gone - ral_slave.c exits with status 2."""
+        logging.shutdown()
+        sys.stdout.flush()
+        os._exit(2)   # SystemExit would only end the read task
+
+    async def ral_config(self, hwspec:str, config:Dict[str,Any]) -> None:
+        logger.info('Slave (%d) config: hwspec=%s region=%d', self.slaveIdx, hwspec, self.region)
+
+    async def ral_tx(self, rctx:int, txpow_eirp:float, rps:Tuple[int,int], freq:float, txtime:int, txdata:bytes) -> Optional[int]:
+        """TX request (freq in MHz, txtime an xtime) - returns RAL_TX_* (None: RAL_TX_OK)"""
+        logger.debug('Slave (%d) TX: rctx=%d %.3fMHz %s xtime=0x%X len=%d', self.slaveIdx, rctx, freq, rps, txtime, len(txdata))
+        return None
+
+    async def ral_txstatus(self, rctx:int) -> int:
+        if self.txwindow is None:
+            return TXSTATUS_IDLE
+        now = self.xtime()
+        if now < self.txwindow[0]:
+            return TXSTATUS_SCHEDULED
+        if now < self.txwindow[1]:
+            return TXSTATUS_EMITTING
+        return TXSTATUS_IDLE
+
+    async def ral_txabort(self, rctx:int) -> None:
+        self.txwindow = None
+
+    async def ral_stop(self) -> None:
+        self.xtime_sess = 0
+        self.txwindow = None
@@ -0,0 +1,186 @@
+# --- Revised 3-Clause BSD License ---
+# Copyright Semtech Corporation 2022. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright notice,
+#       this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright notice,
+#       this list of conditions and the following disclaimer in the documentation
+#       and/or other materials provided with the distribution.
+#     * Neither the name of the Semtech corporation nor the names of its
+#       contributors may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SEMTECH CORPORATION. BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Building blocks for benchmarks driving a real station through Muxs and LgwSim.
+
+    async with sb.station_setup(muxs, sim) as lgwsim:
+        await lgwsim.send_rx(rps=(7,125), freq=868.1, frame=sb.uplink_frame(devaddr, size=20))
+
+Benchmarks keep their own bookkeeping in Muxs/LgwSimServer subclasses and
+correlate frames by DevAddr (unique per injected uplink). Uplink rate steps
+share CountingMuxs and run_step.
+"""
+
+from typing import Any,Dict,List,Optional,Sequence,Tuple
+import os
+import time
+import struct
+import asyncio
+import contextlib
+import logging
+
+import tcutils as tu
+import simutils as su
+import benchutils as bu
+import fixtures as fx
+
+logger = logging.getLogger('stationbench')
+
+XTICKS_MASK = 0xFFFFFFFF
+UPFRAME_OVERHEAD = 13    # MHDR DevAddr FCtrl FCnt FPort MIC
+
+# LoRa SFs the station maps from router_config DRs (s2e.h: SF12..SF7, FSK) -
+# J_DRs turns any other SF into FSK/SFNIL
+STATION_LORA_SFS = (7, 8, 9, 10, 11, 12)
+
+
+def uplink_frame(devaddr:int, size:int=20, fcnt:int=0, port:int=1) -> bytes:
+    """Unconfirmed data up frame of size bytes - DevAddr identifies it at Muxs."""
+    assert size >= UPFRAME_OVERHEAD
+    return su.makeDF(fcnt=fcnt & 0xFFFF, devaddr=devaddr, port=port, payload=bytes(size-UPFRAME_OVERHEAD))
+
+
+def dnframe_pdu(key:int, size:int=12) -> str:
+    """Downlink PDU carrying key in its first 4 bytes (see pdu_key)."""
+    return (struct.pack('<I', key) + bytes(max(0, size-4))).hex()
+
+
+def pdu_key(payload:bytes) -> int:
+    return struct.unpack_from('<I', payload, 0)[0]
+
+
+def xticks_diff(a:int, b:int) -> int:
+    """a-b for 32 bit count_us values"""
+    d = (a - b) & XTICKS_MASK
+    return d - (1<<32) if d >= 1<<31 else d
+
+
+# LoRa time on air (secs) - lives in simutils for the RF medium simulation
+airtime = su.airtime
+
+
+def upchannels(router_config:Dict[str,Any]) -> List[float]:
+    """Uplink frequencies in MHz"""
+    return [ f/1e6 for f,_,_ in router_config['upchannels'] ]
+
+
+def dr_of_rps(router_config:Dict[str,Any], sf:int, bw:int=125) -> int:
+    """Uplink DR of (sf, bw) - (0,0) is FSK as in router_config DRs"""
+    for dr,(s,b,dnonly) in enumerate(router_config['DRs']):
+        if s == sf and b == bw and not dnonly:
+            return dr
+    raise ValueError('No uplink DR for SF%d/BW%d in %s' % (sf, bw, router_config.get('region')))
+
+
+def rps_of_tx(pkt:Dict[str,Any], hal=su.Lgw1) -> Tuple[int,int]:
+    """(sf, bw in kHz) of a TX frame decoded by hal (LgwSim.hal) - su.RPS_FSK for FSK"""
+    return hal.get_rps(pkt)
+
+
+class CountingMuxs(tu.Muxs):
+    """Matches updfs to injected uplinks by DevAddr (see run_step)."""
+    def __init__(self, router_config:Dict[str,Any]) -> None:
+        super().__init__()
+        self.router_config = router_config
+        self.sent = {}      # type: Dict[int,float]  DevAddr -> injection time
+        self.delays = []    # type: List[float]
+
+    async def handle_updf(self, ws, msg):
+        t = self.sent.pop(msg['DevAddr'], None)
+        if t is not None:
+            self.delays.append(time.monotonic() - t)
+
+
+async def run_step(lgwsim:su.LgwSim, muxs:CountingMuxs, rps:Tuple[int,int], chans:List[float], devaddr:int,
+                   rate:float, step:float=5.0, drain:float=2.0, size:int=20) -> Tuple[int,Dict[str,Any]]:
+    """Inject uplinks with unique DevAddrs from devaddr on at rate frames/s for step
+    secs and count the updfs arriving at muxs until drain secs later.
+    Returns the next free DevAddr and the step's values."""
+    muxs.sent.clear()
+    muxs.delays = []
+    n = int(rate*step)
+    i = 0
+    t0 = time.monotonic()
+    while i < n:
+        # Send all frames due by now - keeps up the rate if a wakeup comes late
+        due = min(n, int((time.monotonic()-t0)*rate)+1)
+        while i < due:
+            muxs.sent[devaddr+i] = time.monotonic()
+            await lgwsim.send_rx(rps=rps, freq=chans[i % len(chans)],
+                                 frame=uplink_frame(devaddr+i, size, fcnt=i))
+            i += 1
+        await asyncio.sleep(max(0.0, t0 + i/rate - time.monotonic()))
+    tsend = time.monotonic() - t0
+    await asyncio.sleep(drain)
+    pct = bu.percentiles([ d*1e3 for d in muxs.delays ], (50,99))
+    nupdf = len(muxs.delays)
+    return devaddr + n, {
+        'offered': rate,
+        'injected': n / tsend,   # below offered if the simulator is the bottleneck
+        'received': nupdf / tsend,
+        'loss': 1 - nupdf / max(n,1),
+        'delay_ms_p50': pct['p50'],
+        'delay_ms_p99': pct['p99'],
+    }
+
+
+class LogTail:
+    """New lines of the station log since the last call."""
+    def __init__(self, path:str, pattern=None) -> None:
+        self.path = path
+        self.pattern = pattern
+        self.pos = 0
+
+    def lines(self) -> List[str]:
+        try:
+            with open(self.path, errors='replace') as f:
+                f.seek(0, os.SEEK_END)
+                if f.tell() < self.pos:
+                    self.pos = 0   # rotated
+                f.seek(self.pos)
+                lines = f.readlines()
+                self.pos = f.tell()
+                return lines
+        except FileNotFoundError:
+            return []
+
+    def count(self) -> int:
+        """Number of new lines matching pattern"""
+        return sum(1 for line in self.lines() if self.pattern.search(line))
+
+
+@contextlib.asynccontextmanager
+async def station_setup(muxs:tu.Muxs, sim:su.LgwSimServer, *station_args:str, warmup:float=3.0, within:float=30.0):
+    """Serve INFOS/MUXS/lgwsim, start the station and yield lgwsim unit 0 once the
+    radio is up. warmup gives the station time to sync with the SX130x
+    (otherwise downlinks get rejected)."""
+    with open('tc.uri', 'w') as f:
+        f.write('ws://localhost:%d' % tu.INFOS_PORT)
+    async with fx.serving(tu.Infos(), muxs, sim):
+        async with fx.StationProcess(*(station_args or ('-p', '--temp', '.'))):
+            lgwsim = await sim.expect_connected(0, within=within)
+            await asyncio.sleep(warmup)
+            yield lgwsim
@@ -24,9 +24,11 @@
 # OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
 # ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-from typing import Any,Dict,List,Optional,Tuple
+from typing import Any,Dict,List,Optional,Tuple,Union
 import time
 import re
+import math
+import random
 import base64
 import os
 import sys
@@ -41,10 +43,18 @@ import ssl
 from zlib import crc32
 import logging
 from id6 import Id6
+from fixtures import Mailbox
+import capture
 import glob
 
 logger = logging.getLogger('_tcutils')
 
+# Server ports - the parallel test runner assigns free ports per test via the environment
+INFOS_PORT = int(os.environ.get('INFOS_PORT', 6038))
+MUXS_PORT  = int(os.environ.get('MUXS_PORT',  6039))
+CUPS_PORT  = int(os.environ.get('CUPS_PORT',  6040))
+CUPS2_PORT = int(os.environ.get('CUPS2_PORT', 6041))
+
 base_regions = {
     "EU863" : {
         'msgtype': 'router_config',
@@ -248,60 +258,260 @@ def get_ws_path(ws):
         return ws.path
     return '/'
 
+class TokenBucket:
+    """Token bucket admitting on average rate requests per second with bursts up to burst.
+    Denied requests are remembered as debt which drains at rate - backoff_hint() tells
+    a rejected client how long to stay away so that returning clients spread out evenly."""
+
+    def __init__(self, rate:float, burst:float=1.0):
+        assert rate > 0
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.tokens = self.burst
+        self.debt = 0.0
+        self.tstamp = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        delta = (now - self.tstamp) * self.rate
+        self.tstamp = now
+        self.tokens = min(self.burst, self.tokens + delta)
+        self.debt = max(0.0, self.debt - delta)
+
+    def take(self, n:float=1.0) -> bool:
+        """Consume n tokens if available. Otherwise record the request as debt."""
+        self._refill()
+        if self.tokens >= n:
+            self.tokens -= n
+            return True
+        self.debt += n
+        return False
+
+    def reserve(self, n:float=1.0) -> float:
+        """Unconditionally consume n tokens and return the seconds until they are actually available."""
+        self._refill()
+        self.tokens -= n
+        return max(0.0, -self.tokens / self.rate)
+
+    def backoff_hint(self) -> int:
+        """Seconds a rejected client should wait - at least 1."""
+        self._refill()
+        return max(1, math.ceil(self.debt / self.rate))
+
+
+# Options of TLS server contexts created by make_server_tlsctx - set before servers are created.
+TLS_OPTIONS = {
+    'version': 'TLSv1_2',   # highest TLS version offered (ssl.TLSVersion name)
+    'ciphers': None,        # OpenSSL cipher string for TLS <= 1.2 - None = Python defaults
+    'curve'  : None,        # ECDH curve name, e.g. 'prime256v1' - None = OpenSSL defaults
+    'tickets': True,        # issue session tickets (resumption)
+}  # type: Dict[str,Any]
+
+_tls_contexts = {}  # type: Dict[Any,ssl.SSLContext]
+_tls_hello = {}     # type: Dict[int,float]
+MAX_PENDING_HELLOS = 10000
+
+
+def _tls_on_hello(sslobj, server_name, ctx) -> None:
+    # SNI callback - runs when the ClientHello arrives, i.e. at start of the handshake
+    if len(_tls_hello) >= MAX_PENDING_HELLOS:
+        _tls_hello.clear()  # handshakes which never completed
+    _tls_hello[id(sslobj)] = time.perf_counter()
+
+
+def make_server_tlsctx(tlsidentity:str, tls_no_ca:bool=False, **options) -> ssl.SSLContext:
+    """Return a TLS server context for the files tlsidentity.{crt,key,trust}.
+    Contexts are shared by all servers with the same identity and options, so they
+    also share session ticket keys: a session from INFOS can be resumed at MUXS if both
+    run with the same identity. Changed files (mtime) yield a fresh context."""
+    opts = { **TLS_OPTIONS, **options }
+    files = [ tlsidentity+ext for ext in ('.crt', '.key', '.trust') ]
+    key = (tlsidentity, tls_no_ca, tuple(sorted(opts.items())), tuple(os.stat(f).st_mtime_ns for f in files))
+    tlsctx = _tls_contexts.get(key)
+    if tlsctx is not None:
+        return tlsctx
+    tlsctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    tlsctx.minimum_version = ssl.TLSVersion.TLSv1_2
+    tlsctx.maximum_version = ssl.TLSVersion[opts['version']]
+    tlsctx.load_verify_locations(files[2])
+    tlsctx.load_cert_chain(files[0], files[1])
+    if not tls_no_ca:
+        tlsctx.verify_mode = ssl.CERT_REQUIRED
+    if opts['ciphers']:
+        tlsctx.set_ciphers(opts['ciphers'])
+    if opts['curve']:
+        tlsctx.set_ecdh_curve(opts['curve'])
+    if not opts['tickets']:
+        tlsctx.options |= ssl.OP_NO_TICKET
+    tlsctx.sni_callback = _tls_on_hello
+    _tls_contexts[key] = tlsctx
+    return tlsctx
+
+
+class TlsStats:
+    """TLS handshake timings of a server in seconds - from ClientHello until the
+    connection is handed to the websocket handler (includes the WS upgrade)."""
+
+    MAX_SAMPLES = 100000
+
+    def __init__(self) -> None:
+        self.full = []     # type: List[float]
+        self.resumed = []  # type: List[float]
+
+    def record(self, ws) -> Optional[float]:
+        transport = getattr(ws, 'transport', None)
+        sslobj = transport.get_extra_info('ssl_object') if transport else None
+        t0 = _tls_hello.pop(id(sslobj), None) if sslobj else None
+        if t0 is None:
+            return None
+        secs = time.perf_counter() - t0
+        samples = self.resumed if sslobj.session_reused else self.full
+        if len(samples) < TlsStats.MAX_SAMPLES:
+            samples.append(secs)
+        return secs
+
+    def summary(self) -> Dict[str,Any]:
+        return {
+            'full'        : len(self.full),
+            'resumed'     : len(self.resumed),
+            'full_mean'   : sum(self.full)/len(self.full) if self.full else None,
+            'resumed_mean': sum(self.resumed)/len(self.resumed) if self.resumed else None,
+        }
+
+
 class ServerABC:
     def __init__(self, port:int=6000, tlsidentity:Optional[str]=None, tls_no_ca=False):
         self.server = None
         self.ws = None
         self.port = port
         self.tls_no_ca = tls_no_ca
+        self.backlog = 100    # listen backlog - raise for reconnect storms
+        self.admission = None # type: Optional[TokenBucket]
+        self.nrejected = 0
+        self.tlsstats = TlsStats()
         self.tlsctx = self.make_tlsctx(tlsidentity)
 
     def make_tlsctx(self, tlsidentity:Optional[str]):
         if tlsidentity is None:
             return {}
-        tlsctx = ssl.SSLContext(ssl.PROTOCOL_TLSv1_2)
-        tlsctx.load_verify_locations(tlsidentity+'.trust')
-        crtfile = tlsidentity+'.crt'
-        keyfile = tlsidentity+'.key'
-        tlsctx.load_cert_chain(crtfile, keyfile)
-        if not self.tls_no_ca:
-            tlsctx.verify_mode = ssl.CERT_REQUIRED
-        return { 'ssl':tlsctx }
+        return { 'ssl': make_server_tlsctx(tlsidentity, self.tls_no_ca) }
 
     async def start_server(self):
-        self.server = await websockets.serve(self.handle_ws, host='0.0.0.0', port=self.port, **self.tlsctx)
+        self.server = await websockets.serve(self.admit_ws, host='0.0.0.0', port=self.port, backlog=self.backlog, **self.tlsctx)
+
+    async def stop_server(self) -> None:
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def __aenter__(self):
+        await self.start_server()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.stop_server()
+
+    async def admit_ws(self, ws):
+        if self.tlsctx:
+            secs = self.tlsstats.record(ws)
+            if secs is not None:
+                logger.debug('  TLS handshake on port %d: %.1fms', self.port, secs*1e3)
+        if self.admission is not None and not self.admission.take():
+            self.nrejected += 1
+            await self.reject_ws(ws)
+            return
+        await self.handle_ws(ws)
+
+    async def reject_ws(self, ws):
+        """Called for connections denied by admission control."""
+        await ws.close(1013)  # try again later
 
     async def handle_ws(self, ws):
         pass
 
 
 class Infos(ServerABC):
-    def __init__(self, muxsuri='ws://localhost:6039/router', tlsidentity:Optional[str]=None, tls_no_ca=False, homedir='.'):
-        super().__init__(port=6038, tlsidentity=homedir+'/'+tlsidentity if tlsidentity else None, tls_no_ca=tls_no_ca)
+    """Router info server. Answers router info requests from a routing table mapping
+    router ids to (muxs, uri). Routers without an entry get the default muxsuri.
+    Encoded responses are cached per requested router until the routing table changes.
+    If max_conns is set, connections beyond this limit are closed with code 1013 (try again later).
+    Requests denied by the admission bucket are answered with an error and a backoff hint (secs).
+    If muxs_admission is set, responses carry a backoff to spread out the following MUXS connects."""
+
+    MAX_CACHED_RESPONSES = 100000
+
+    def __init__(self, muxsuri='ws://localhost:%d/router' % MUXS_PORT, tlsidentity:Optional[str]=None, tls_no_ca=False, homedir='.', max_conns:int=0):
+        super().__init__(port=INFOS_PORT, tlsidentity=homedir+'/'+tlsidentity if tlsidentity else None, tls_no_ca=tls_no_ca)
         self.muxsuri = muxsuri
         self.homedir = homedir
         self.tlsidentity = tlsidentity
+        self.routes = {}      # type: Dict[int,Tuple[str,str]]
+        self.resp_cache = {}  # type: Dict[Any,str]
+        self.max_conns = max_conns
+        self.muxs_admission = None # type: Optional[TokenBucket]
+        self.nconns = 0
+
+    def add_route(self, router:Any, uri:str, muxs:str='muxs-::0') -> None:
+        self.routes[Id6(router).id] = (muxs, uri)
+        self.resp_cache.clear()
+
+    def del_route(self, router:Any) -> None:
+        self.routes.pop(Id6(router).id, None)
+        self.resp_cache.clear()
+
+    def get_route(self, router:Any) -> Tuple[str,str]:
+        try:
+            return self.routes.get(Id6(router).id) or ('muxs-::0', self.muxsuri)
+        except ValueError:
+            return ('muxs-::0', self.muxsuri)
 
     async def start_server(self):
         logger.debug("  Starting INFOS (%s/%s) on Port %d (muxsuri=%s)" %(self.homedir, self.tlsidentity or "", self.port, self.muxsuri))
         await super().start_server()
 
+    def encode_response(self, r:Any, backoff:int=0) -> str:
+        if backoff:
+            muxs, uri = self.get_route(r)
+            return json.dumps(self.router_info_response({
+                'router' : r,
+                'muxs'   : muxs,
+                'uri'    : uri,
+                'backoff': backoff,
+            }))
+        key = (r.__class__, r)
+        resp = self.resp_cache.get(key)
+        if resp is None:
+            muxs, uri = self.get_route(r)
+            resp = json.dumps(self.router_info_response({
+                'router': r,
+                'muxs'  : muxs,
+                'uri'   : uri,
+            }))
+            if len(self.resp_cache) >= Infos.MAX_CACHED_RESPONSES:
+                self.resp_cache.clear()
+            self.resp_cache[key] = resp
+        return resp
+
     async def handle_ws(self, ws):
         path = get_ws_path(ws)
-        logger.debug('. INFOS connect: %s from %r' % (path, ws.remote_address))
+        if self.max_conns and self.nconns >= self.max_conns:
+            self.nrejected += 1
+            logger.debug('x INFOS reject: %s from %r (%d connections)', path, ws.remote_address, self.nconns)
+            await ws.close(1013)
+            return
+        self.nconns += 1
+        logger.debug('. INFOS connect: %s from %r', path, ws.remote_address)
         try:
             while True:
                 msg = json.loads(await ws.recv())
-                logger.debug('> INFOS: %r' % msg)
-                r = msg['router']
-                resp = {
-                    'router': r,
-                    'muxs'  : 'muxs-::0',
-                    'uri'   : self.muxsuri,
-                }
-                resp = self.router_info_response(resp)
-                await ws.send(json.dumps(resp))
-                logger.debug('< INFOS: %r' % resp)
+                logger.debug('> INFOS: %r', msg)
+                backoff = 0
+                if self.muxs_admission is not None:
+                    backoff = math.ceil(self.muxs_admission.reserve())
+                resp = self.encode_response(msg['router'], backoff)
+                await ws.send(resp)
+                logger.debug('< INFOS: %s', resp)
         except websockets.exceptions.ConnectionClosed as exc:
             if exc.code != 1000:
                 logger.error('x INFOS close: code=%d reason=%r', exc.code, exc.reason)
@@ -310,26 +520,64 @@ class Infos(ServerABC):
             try:
                 await ws.close()
             except: pass
+        finally:
+            self.nconns -= 1
 
+    async def reject_ws(self, ws):
+        # Jitter so that clients rejected within the same second do not return together
+        hint = self.admission.backoff_hint()
+        backoff = hint + random.randrange(hint+1)
+        try:
+            msg = json.loads(await asyncio.wait_for(ws.recv(), 5.0))
+            await ws.send(json.dumps({ 'router': msg.get('router'), 'error': 'Overloaded - try again later', 'backoff': backoff }))
+            logger.debug('x INFOS overload: %r backoff=%ds', msg.get('router'), backoff)
+            await ws.close(1000)
+        except Exception as exc:
+            logger.debug('x INFOS reject failed: %s', exc)
 
     def router_info_response(self, resp):
+        """Hook to adjust the response - results are cached per router."""
         return resp
 
 
+class CapturingWs:
+    """Websocket proxy recording every frame of a MUXS connection."""
+
+    def __init__(self, ws, recorder:capture.Recorder) -> None:
+        self.ws = ws
+        self.recorder = recorder
+
+    def __getattr__(self, name:str) -> Any:
+        return getattr(self.ws, name)
+
+    async def recv(self) -> Union[str,bytes]:
+        data = await self.ws.recv()
+        self.recorder.record(capture.CHAN_MUXS, 0, data)
+        return data
+
+    async def send(self, data:Union[str,bytes]) -> None:
+        self.recorder.record(capture.CHAN_MUXS, capture.FLAG_DN, data)
+        await self.ws.send(data)
+
+
 class Muxs(ServerABC):
     def __init__(self, tlsidentity:Optional[str]=None, tls_no_ca=False, homedir='.'):
-        super().__init__(port=6039, tlsidentity=homedir+'/'+tlsidentity if tlsidentity else None, tls_no_ca=tls_no_ca)
+        super().__init__(port=MUXS_PORT, tlsidentity=homedir+'/'+tlsidentity if tlsidentity else None, tls_no_ca=tls_no_ca)
         self.homedir = homedir
         self.tlsidentity = tlsidentity
         self.router_config = router_config_EU863_6ch
         self.gps_enable = None  # None = don't include, True/False = include in router_config
         self.station_features = []  # features reported by station in version message
+        self.mailbox = Mailbox()    # received messages by msgtype ('binary' for binary frames)
+        self.capture = capture.default_recorder()
 
     async def start_server(self):
         logger.debug("  Starting MUXS (%s/%s) on Port %d" %(self.homedir, self.tlsidentity or "", self.port))
         await super().start_server()
 
     async def handle_ws(self, ws):
+        if self.capture:
+            ws = CapturingWs(ws, self.capture)
         path = get_ws_path(ws)
         logger.debug('. MUXS connect: %s' % (path,))
         if path != '/router':
@@ -357,6 +605,13 @@ class Muxs(ServerABC):
             await self.ws.send(json.dumps(config))
             logger.debug('< MUXS: router_config (gps_enable=%s)', self.gps_enable)
 
+    async def expect(self, msgtype:str, where:Any=None, within:float=5.0) -> Dict[str,Any]:
+        """Wait for a message of msgtype from the station matching where (dict of field values or predicate)."""
+        return await self.mailbox.expect(msgtype, where, within)
+
+    async def expect_none(self, msgtype:str, where:Any=None, within:float=1.0) -> None:
+        await self.mailbox.expect_none(msgtype, where, within)
+
     async def handle_binaryData(self, ws, data:bytes) -> None:
         pass
 
@@ -366,11 +621,13 @@ class Muxs(ServerABC):
                 msgtxt = await ws.recv()
                 #print('MUXS raw recv: %r' % (msgtxt,))
                 if isinstance(msgtxt, bytes):
+                    self.mailbox.put('binary', msgtxt)
                     await self.handle_binaryData(ws, msgtxt)
                     continue
                 msg = json.loads(msgtxt)
                 msgtype = msg.get('msgtype')
                 if msgtype:
+                    self.mailbox.put(msgtype, msg)
                     fn = getattr(self, 'handle_'+msgtype, None)
                     if fn:
                         await fn(ws, msg)
@@ -411,7 +668,7 @@ class Muxs(ServerABC):
 
 class Cups(ServerABC):
     def __init__(self, tlsidentity:Optional[str]=None, tls_no_ca=False, homedir='.', tcdir='.'):
-        super().__init__(port=6040, tlsidentity=homedir+"/"+tlsidentity if tlsidentity else None, tls_no_ca=tls_no_ca)
+        super().__init__(port=CUPS_PORT, tlsidentity=homedir+"/"+tlsidentity if tlsidentity else None, tls_no_ca=tls_no_ca)
         self.homedir = homedir
         self.tcdir = tcdir
         self.tlsidentity = tlsidentity
@@ -0,0 +1,351 @@
+# --- Revised 3-Clause BSD License ---
+# Copyright Semtech Corporation 2022. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright notice,
+#       this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright notice,
+#       this list of conditions and the following disclaimer in the documentation
+#       and/or other materials provided with the distribution.
+#     * Neither the name of the Semtech corporation nor the names of its
+#       contributors may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SEMTECH CORPORATION. BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""GPS/PPS and LNS timesync fault simulation.
+
+A Scenario combines models evaluated over scenario time t (secs since start):
+
+    DriftModel   SX130x clock drift against the MCU clock (ppm)
+    PpsModel     PPS edge offset/jitter from the UTC second and PPS outages
+    NmeaModel    NMEA GGA sentences written to the station's GPS device, with outages
+    RttModel     up/down delays of LNS timesync answers (asymmetric, jittered)
+
+Scenario.speed compresses scenario time against wall clock time so that slow
+processes (temperature cycles, rare outages) can be played in a short run.
+Drift itself still applies to real elapsed time (ppm keep their meaning).
+
+TimeSim streams the clock faults into lgwsim (LgwSim.send_time), writes NMEA
+and answers timesync for TimesyncMuxs. TimeErrorProbe injects uplinks and
+compares the gpstime the station reports in updf with the true GPS time of
+the frame - the station's time sync error.
+"""
+
+from typing import Any,Callable,Dict,List,Optional,Sequence,Tuple
+import os
+import json
+import time
+import math
+import errno
+import random
+import asyncio
+import logging
+
+import tcutils as tu
+import simutils as su
+import stationbench as sb
+
+logger = logging.getLogger('timesim')
+
+GPS_EPOCH_UNIX = 315964800   # tu.GPS_EPOCH as Unix time
+
+
+def gpstime_of_utc(utc:float) -> int:
+    """GPS time (us) of a Unix timestamp"""
+    return int((utc - GPS_EPOCH_UNIX + tu.UTC_GPS_LEAPS)*1e6)
+
+
+class Outages:
+    """Time spans during which something is out - fixed spans and/or random ones
+    (rate per hour, exponential durations with mean `mean_len` secs)."""
+    def __init__(self, spans:Sequence[Tuple[float,float]]=(), rate:float=0.0, mean_len:float=30.0,
+                 seed:Optional[int]=None) -> None:
+        self.spans = sorted(spans)
+        self.rate = rate
+        self.mean_len = mean_len
+        self.rnd = random.Random(seed)
+        self.random = []  # type: List[Tuple[float,float]]
+        self.t = 0.0
+
+    def active(self, t:float) -> bool:
+        if self.rate > 0:
+            while self.t <= t:
+                self.t += self.rnd.expovariate(self.rate/3600)
+                self.random.append((self.t, self.rnd.expovariate(1/self.mean_len)))
+        return any(beg <= t < beg+n for beg,n in self.spans) or any(beg <= t < beg+n for beg,n in self.random)
+
+
+class DriftModel:
+    def ppm(self, t:float) -> float:
+        return 0.0
+
+
+class ConstantDrift(DriftModel):
+    def __init__(self, ppm:float) -> None:
+        self.ppm0 = ppm
+
+    def ppm(self, t:float) -> float:
+        return self.ppm0
+
+
+class RandomWalkDrift(DriftModel):
+    """Drift wandering by `step` ppm per sqrt(sec), kept within +/-limit."""
+    def __init__(self, ppm:float=0.0, step:float=0.1, limit:float=20.0, seed:Optional[int]=None) -> None:
+        self.cur = ppm
+        self.step = step
+        self.limit = limit
+        self.rnd = random.Random(seed)
+        self.t = 0.0
+
+    def ppm(self, t:float) -> float:
+        dt = t - self.t
+        if dt > 0:
+            self.cur = max(-self.limit, min(self.limit, self.cur + self.rnd.gauss(0, self.step*dt**0.5)))
+            self.t = t
+        return self.cur
+
+
+class TemperatureDrift(DriftModel):
+    """Crystal following a daily temperature cycle: ppm + amplitude*sin(2pi t/period)."""
+    def __init__(self, ppm:float=0.0, amplitude:float=5.0, period:float=86400.0) -> None:
+        self.ppm0 = ppm
+        self.amplitude = amplitude
+        self.period = period
+
+    def ppm(self, t:float) -> float:
+        return self.ppm0 + self.amplitude * math.sin(2*math.pi*t/self.period)
+
+
+class PpsModel:
+    """PPS edges offset_us after the UTC second with gaussian jitter, none during outages."""
+    def __init__(self, offset_us:int=0, jitter_us:float=0.0, outages:Optional[Outages]=None, seed:Optional[int]=None) -> None:
+        self.offset_us = offset_us
+        self.jitter_us = jitter_us
+        self.outages = outages or Outages()
+        self.rnd = random.Random(seed)
+
+    def present(self, t:float) -> bool:
+        return not self.outages.active(t)
+
+    def offset(self, t:float) -> int:
+        return self.offset_us + (int(round(self.rnd.gauss(0, self.jitter_us))) if self.jitter_us else 0)
+
+
+class NmeaModel:
+    """A GGA sentence every `interval` secs - nothing during outages, no fix during nofix spans."""
+    def __init__(self, interval:float=1.0, outages:Optional[Outages]=None, nofix:Optional[Outages]=None,
+                 position:Tuple[float,float,float]=(47.246118, 8.830645, 480.0)) -> None:
+        self.interval = interval
+        self.outages = outages or Outages()
+        self.nofix = nofix or Outages()
+        self.position = position
+
+    def sentence(self, t:float, utc:float) -> Optional[bytes]:
+        if self.outages.active(t):
+            return None
+        hms = time.strftime('%H%M%S', time.gmtime(utc)) + '.%03d' % (int(utc*1000) % 1000)
+        lat, lon, alt = self.position
+        fix = 0 if self.nofix.active(t) else 1
+        body = b'GPGGA,%s,%s,%s,%d,%02d,1.01,%.1f,M,48.0,M,,' % (
+            hms.encode(), _nmea_angle(lat, 'NS', 2), _nmea_angle(lon, 'EW', 3), fix, 9 if fix else 0, alt)
+        return nmea_cksum(body)
+
+
+def _nmea_angle(deg:float, hemi:str, width:int) -> bytes:
+    h = hemi[0] if deg >= 0 else hemi[1]
+    deg = abs(deg)
+    d = int(deg)
+    return b'%0*d%07.4f,%s' % (width, d, (deg-d)*60, h.encode())
+
+
+def nmea_cksum(b:bytes) -> bytes:
+    v = 0
+    for bi in b:
+        v ^= bi
+    return b'$' + b + b'*%02X\r\n' % (v&0xFF)
+
+
+class RttModel:
+    """Timesync answer delays: `up` before the LNS takes its timestamp, `down`
+    after it, each plus an exponential jitter with the given mean."""
+    def __init__(self, up:float=0.05, down:float=0.05, jitter:float=0.0, seed:Optional[int]=None) -> None:
+        self.up = up
+        self.down = down
+        self.jitter = jitter
+        self.rnd = random.Random(seed)
+
+    def sample(self) -> Tuple[float,float]:
+        j = (lambda: self.rnd.expovariate(1/self.jitter)) if self.jitter else (lambda: 0.0)
+        return self.up + j(), self.down + j()
+
+
+class Scenario:
+    def __init__(self, drift:Optional[DriftModel]=None, pps:Optional[PpsModel]=None, nmea:Optional[NmeaModel]=None,
+                 rtt:Optional[RttModel]=None, speed:float=1.0) -> None:
+        self.drift = drift or DriftModel()
+        self.pps = pps or PpsModel()
+        self.nmea = nmea or NmeaModel()
+        self.rtt = rtt or RttModel()
+        self.speed = speed
+
+
+class TimeSim:
+    def __init__(self, scenario:Scenario, tick:float=1.0) -> None:
+        self.scenario = scenario
+        self.tick = tick
+        self.t0 = time.monotonic()
+        self.tasks = []  # type: List[asyncio.Future]
+        self.nmea_written = 0
+        self.rtts = []   # type: List[Tuple[float,float]]
+
+    def t(self) -> float:
+        """Scenario time"""
+        return (time.monotonic() - self.t0) * self.scenario.speed
+
+    async def update(self, sim:su.LgwSimServer) -> None:
+        t = self.t()
+        scn = self.scenario
+        ppb = int(round(scn.drift.ppm(t)*1000))
+        present = scn.pps.present(t)
+        offset = scn.pps.offset(t)
+        for lgwsim in list(sim.units.values()):
+            await lgwsim.send_time(drift_ppb=ppb, pps_offset=offset, pps=present)
+
+    async def clock_loop(self, sim:su.LgwSimServer) -> None:
+        while True:
+            await self.update(sim)
+            await asyncio.sleep(self.tick)
+
+    async def nmea_loop(self, path:str) -> None:
+        fd = None
+        try:
+            while True:
+                if fd is None:
+                    try:
+                        fd = os.open(path, os.O_WRONLY|os.O_NONBLOCK)
+                    except OSError as exc:
+                        if exc.errno not in (errno.ENXIO, errno.ENOENT):
+                            raise
+                        # No reader yet (station not up)
+                if fd is not None:
+                    line = self.scenario.nmea.sentence(self.t(), time.time())
+                    if line:
+                        try:
+                            os.write(fd, line)
+                            self.nmea_written += 1
+                        except (BlockingIOError, BrokenPipeError):
+                            os.close(fd)
+                            fd = None
+                await asyncio.sleep(self.scenario.nmea.interval)
+        finally:
+            if fd is not None:
+                os.close(fd)
+
+    def start(self, sim:su.LgwSimServer, nmea_path:Optional[str]=None) -> None:
+        self.t0 = time.monotonic()
+        self.tasks.append(asyncio.ensure_future(self.clock_loop(sim)))
+        if nmea_path:
+            self.tasks.append(asyncio.ensure_future(self.nmea_loop(nmea_path)))
+
+    async def stop(self) -> None:
+        for task in self.tasks:
+            task.cancel()
+        for task in self.tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self.tasks = []
+
+    async def answer_timesync(self, ws, msg:Dict[str,Any]) -> None:
+        up, down = self.scenario.rtt.sample()
+        self.rtts.append((up, down))
+        await asyncio.sleep(up)
+        reply = {
+            'msgtype': 'timesync',
+            'gpstime': gpstime_of_utc(time.time()),
+            'txtime' : msg['txtime'],
+            'MuxTime': time.time(),
+        }
+        await asyncio.sleep(down)
+        await ws.send(json.dumps(reply))
+
+
+class TimesyncMuxs(tu.Muxs):
+    """Muxs answering timesync through a TimeSim and feeding updf to a TimeErrorProbe."""
+    def __init__(self, timesim:TimeSim, probe:Optional['TimeErrorProbe']=None, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.timesim = timesim
+        self.probe = probe
+
+    async def handle_timesync(self, ws, msg):
+        await self.timesim.answer_timesync(ws, msg)
+
+    async def handle_updf(self, ws, msg):
+        if self.probe is not None:
+            self.probe.on_updf(msg)
+
+
+class TimeErrorProbe:
+    """Uplinks every `interval` secs - error of the gpstime reported by the station."""
+    def __init__(self, timesim:TimeSim, interval:float=2.0, freq:float=868.1, devaddr:int=0x7000000) -> None:
+        self.timesim = timesim
+        self.interval = interval
+        self.freq = freq
+        self.devaddr = devaddr
+        self.pending = {}  # type: Dict[int,Tuple[float,int]]  DevAddr -> (scenario t, true gpstime)
+        self.samples = []  # type: List[Tuple[float,Optional[int]]]  (scenario t, error us or None if unsynced)
+        self.task = None   # type: Optional[asyncio.Future]
+
+    async def probe(self, lgwsim:su.LgwSim) -> None:
+        self.devaddr += 1
+        mono = time.monotonic()
+        utc = time.time()
+        xt = lgwsim.mono2xticks(int(mono*1e6))
+        self.pending[self.devaddr] = (self.timesim.t(), gpstime_of_utc(utc))
+        await lgwsim.send_rx(rps=(7,125), freq=self.freq, rxtime=xt, frame=sb.uplink_frame(self.devaddr))
+
+    def on_updf(self, msg:Dict[str,Any]) -> None:
+        p = self.pending.pop(msg['DevAddr'], None)
+        if p is None:
+            return
+        gpstime = msg['upinfo'].get('gpstime', 0)
+        self.samples.append((p[0], gpstime - p[1] if gpstime else None))
+
+    async def run(self, sim:su.LgwSimServer) -> None:
+        while True:
+            lgwsim = sim.units.get(0)
+            if lgwsim is not None:
+                await self.probe(lgwsim)
+            await asyncio.sleep(self.interval)
+
+    def start(self, sim:su.LgwSimServer) -> None:
+        self.task = asyncio.ensure_future(self.run(sim))
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def errors(self, since:float=0.0) -> List[int]:
+        return [ e for t,e in self.samples if e is not None and t >= since ]
+
+    def synced_ratio(self, since:float=0.0) -> float:
+        s = [ e for t,e in self.samples if t >= since ]
+        return sum(1 for e in s if e is not None) / len(s) if s else 0.0
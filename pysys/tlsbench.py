@@ -0,0 +1,129 @@
+# --- Revised 3-Clause BSD License ---
+# Copyright Semtech Corporation 2022. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright notice,
+#       this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright notice,
+#       this list of conditions and the following disclaimer in the documentation
+#       and/or other materials provided with the distribution.
+#     * Neither the name of the Semtech corporation nor the names of its
+#       contributors may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SEMTECH CORPORATION. BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""TLS handshake rate benchmark against the INFOS/MUXS servers of tcutils.
+
+Run from a test directory holding the server identities (e.g. test3-updn-tls):
+
+    python -m tlsbench --client ../pki-data/tc-router-1 -n 1000
+
+Clients run in a thread pool and only do the TLS handshake. Cases:
+full handshakes, resumed handshakes at MUXS and resumption across the
+INFOS->MUXS hop (with separate and with a shared server identity).
+"""
+
+from typing import Any,Dict,List,Optional,Tuple
+import ssl
+import time
+import socket
+import asyncio
+import argparse
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import tcutils as tu
+import benchutils as bu
+import testutils as tstu
+import loops
+
+logger = logging.getLogger('tlsbench')
+
+
+def make_client_tlsctx(trust:Optional[str], identity:Optional[str]) -> ssl.SSLContext:
+    tlsctx = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    tlsctx.check_hostname = False
+    if trust:
+        tlsctx.load_verify_locations(trust)
+    else:
+        tlsctx.verify_mode = ssl.CERT_NONE
+    if identity:
+        tlsctx.load_cert_chain(identity+'.crt', identity+'.key')
+    return tlsctx
+
+
+def handshake(tlsctx:ssl.SSLContext, port:int, session:Optional[ssl.SSLSession]) -> Tuple[float,ssl.SSLSession,bool]:
+    t0 = time.perf_counter()
+    with socket.create_connection(('localhost', port)) as sock:
+        with tlsctx.wrap_socket(sock, server_hostname='localhost', session=session) as tls:
+            return (time.perf_counter() - t0, tls.session, tls.session_reused)
+
+
+async def run_case(name:str, report:bu.BenchReport, tlsctx:ssl.SSLContext, pool:ThreadPoolExecutor,
+                   n:int, port:int, resume_port:Optional[int]=None) -> None:
+    """n handshakes at port - if resume_port is set each one resumes a session obtained from resume_port."""
+    loop = asyncio.get_event_loop()
+    sessions = [ None ] * n  # type: List[Optional[ssl.SSLSession]]
+    if resume_port is not None:
+        res = await asyncio.gather(*[ loop.run_in_executor(pool, handshake, tlsctx, resume_port, None) for _ in range(n) ])
+        sessions = [ r[1] for r in res ]
+    t0 = time.perf_counter()
+    res = await asyncio.gather(*[ loop.run_in_executor(pool, handshake, tlsctx, port, s) for s in sessions ])
+    elapsed = time.perf_counter() - t0
+    report.add(name, n=n, rate=n/elapsed, resumed=sum(1 for r in res if r[2]),
+               **{ k: v*1e3 for k,v in bu.percentiles([ r[0] for r in res ]).items() })
+
+
+async def main(args) -> None:
+    tu.TLS_OPTIONS.update(version=args.version, ciphers=args.ciphers, curve=args.curve, tickets=not args.no_tickets)
+    tlsctx = make_client_tlsctx(args.trust, args.client)
+    report = bu.BenchReport('tls-handshake')
+    pool = ThreadPoolExecutor(args.concurrency)
+    for shared in (False, True):
+        infos = tu.Infos(tlsidentity=(args.muxs if shared else args.infos), tls_no_ca=args.no_ca)
+        muxs = tu.Muxs(tlsidentity=args.muxs, tls_no_ca=args.no_ca)
+        await infos.start_server()
+        await muxs.start_server()
+        try:
+            if not shared:
+                await run_case('full', report, tlsctx, pool, args.n, muxs.port)
+                await run_case('resumed', report, tlsctx, pool, args.n, muxs.port, muxs.port)
+            await run_case('hop-shared' if shared else 'hop-separate', report, tlsctx, pool, args.n, muxs.port, infos.port)
+        finally:
+            for srv in (infos.server, muxs.server):
+                srv.close()
+                await srv.wait_closed()
+    pool.shutdown()
+    report.done()
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description='TLS handshake rate benchmark for INFOS/MUXS.')
+    ap.add_argument('-n', type=int, default=1000, help='Handshakes per case.')
+    ap.add_argument('--concurrency', type=int, default=16, help='Number of concurrent clients.')
+    ap.add_argument('--infos', default='infos-0', help='INFOS server identity (files .crt/.key/.trust).')
+    ap.add_argument('--muxs', default='muxs-0', help='MUXS server identity (files .crt/.key/.trust).')
+    ap.add_argument('--client', default=None, help='Client identity - required unless --no-ca.')
+    ap.add_argument('--trust', default=None, help='CA to verify servers - default: no verification.')
+    ap.add_argument('--no-ca', action='store_true', help='Servers do not require client certificates.')
+    ap.add_argument('--version', default='TLSv1_2', help='Highest TLS version offered by the servers.')
+    ap.add_argument('--ciphers', default=None, help='Server cipher string.')
+    ap.add_argument('--curve', default=None, help='Server ECDH curve.')
+    ap.add_argument('--no-tickets', action='store_true', help='Disable session tickets.')
+    args = ap.parse_args()
+    tstu.setup_logging()
+    logging.getLogger('websockets').setLevel(logging.CRITICAL)
+    logging.getLogger('asyncio').setLevel(logging.CRITICAL)
+    loops.run(main(args))
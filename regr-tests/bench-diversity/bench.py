@@ -0,0 +1,171 @@
+# --- Revised 3-Clause BSD License ---
+# Copyright Semtech Corporation 2022. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright notice,
+#       this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright notice,
+#       this list of conditions and the following disclaimer in the documentation
+#       and/or other materials provided with the distribution.
+#     * Neither the name of the Semtech corporation nor the names of its
+#       contributors may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SEMTECH CORPORATION. BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+# Antenna diversity: every uplink is received by several antennas - the
+# units (slaves) of the testms variants, else the rf_chains of unit 0 -
+# with the copies offset by --offsets us and the SNR/RSSI of the k-th best
+# copy lowered by k*--snr-delta/--rssi-delta. Which antenna gets the best
+# copy is random. Station should forward one updf per uplink, the one
+# with the best signal (its mirror frame dedup keeps the larger
+# 8*snr-rssi). Per offset and uplink rate reported: updfs per uplink,
+# share of uplinks forwarded more than once, share forwarded with the
+# best copy, updf delay and station CPU per uplink - against one copy per
+# uplink as the baseline cost.
+
+from typing import Any,Dict,List,Optional,Tuple
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import logging
+logger = logging.getLogger('bench-diversity')
+
+import tcutils as tu
+import simutils as su
+import benchutils as bu
+import testutils as tstu
+import fixtures as fx
+import procprof
+import stationbench as sb
+
+ap = argparse.ArgumentParser(description='Antenna diversity benchmark.')
+ap.add_argument('--copies', type=int, default=2, help='Antennas receiving each uplink.')
+ap.add_argument('--offsets', default='0,20,1000', help='Comma separated arrival offsets (us) between copies - one case each.')
+ap.add_argument('--snr-delta', type=float, default=2.0, help='SNR (dB) below the best copy per rank.')
+ap.add_argument('--rssi-delta', type=float, default=3.0, help='RSSI (dB) below the best copy per rank.')
+ap.add_argument('--rates', default='20,100,400', help='Comma separated uplink rates (frames/s).')
+ap.add_argument('--step', type=float, default=5.0, help='Seconds per rate step.')
+ap.add_argument('--drain', type=float, default=2.0, help='Seconds to wait for late updfs after a step.')
+ap.add_argument('--sf', type=int, default=7, help='Uplink spreading factor.')
+ap.add_argument('--size', type=int, default=20, help='Uplink PHYPayload size (bytes).')
+ap.add_argument('--seed', type=int, default=1)
+args = ap.parse_args()
+
+tstu.setup_logging()
+logging.getLogger('_tcutils').setLevel(logging.INFO)
+logging.getLogger('simutils').setLevel(logging.INFO)
+
+VARIANT = os.environ.get('TEST_VARIANT', 'testsim')
+ROUTER_CONFIG = tu.router_config_EU863_6ch
+BASE_RSSI = -80.0
+BASE_SNR = 5.0
+
+
+def score(c:su.RxCopy) -> int:
+    """Station's mirror frame preference on its quantized values (rxjob snr*4, -rssi)"""
+    return 8*int(c.snr*4) - int(-c.rssi)
+
+
+class DiversityMuxs(tu.Muxs):
+    def __init__(self) -> None:
+        super().__init__()
+        self.router_config = ROUTER_CONFIG
+        self.sent = {}   # type: Dict[int,Tuple[float,su.RxCopy]]  DevAddr -> (injection time, best copy)
+        self.updfs = {}  # type: Dict[int,List[Tuple[float,Dict[str,Any]]]]
+
+    async def handle_updf(self, ws, msg):
+        if msg['DevAddr'] in self.sent:
+            self.updfs.setdefault(msg['DevAddr'], []).append((time.monotonic(), msg['upinfo']))
+
+
+def make_copies(rnd:random.Random, ncopies:int, offset:int, by_unit:bool) -> List[su.RxCopy]:
+    ranks = list(range(ncopies))
+    rnd.shuffle(ranks)   # rank 0 is the best copy
+    return [ su.RxCopy(unit=i if by_unit else 0, rf_chain=0 if by_unit else i, offset_us=i*offset,
+                       rssi=BASE_RSSI - r*args.rssi_delta, snr=BASE_SNR - r*args.snr_delta)
+             for i, r in enumerate(ranks) ]
+
+
+async def run_step(sim:su.LgwSimServer, muxs:DiversityMuxs, proc:fx.StationProcess, rnd:random.Random,
+                   ncopies:int, offset:int, rate:float, devaddr:int) -> Tuple[int,Dict[str,Any]]:
+    by_unit = len(sim.units) > 1
+    chans = sb.upchannels(ROUTER_CONFIG)
+    muxs.sent.clear()
+    muxs.updfs.clear()
+    n = int(rate*args.step)
+    cpu0 = procprof.sample(proc.proc.pid, 0.0)
+    t0 = time.monotonic()
+    for i in range(n):
+        copies = make_copies(rnd, ncopies, offset, by_unit)
+        muxs.sent[devaddr+i] = (time.monotonic(), max(copies, key=score))
+        await sim.send_rx_diversity((args.sf,125), chans[i % len(chans)],
+                                    sb.uplink_frame(devaddr+i, args.size, fcnt=i), copies)
+        await asyncio.sleep(max(0.0, t0 + (i+1)/rate - time.monotonic()))
+    await asyncio.sleep(args.drain)
+    cpu1 = procprof.sample(proc.proc.pid, 0.0)
+    delays, nupdf, ndup, nbest = [], 0, 0, 0
+    for da, (t, best) in muxs.sent.items():
+        ups = muxs.updfs.get(da, [])
+        nupdf += len(ups)
+        if not ups:
+            continue
+        delays.append((ups[0][0] - t)*1e3)
+        ndup += len(ups) > 1
+        nbest += len(ups) == 1 and abs(ups[0][1]['snr'] - best.snr) < 0.25
+    heard = max(len(delays), 1)
+    pct = bu.percentiles(delays, (50,99))
+    return devaddr + n, {
+        'uplinks': n,
+        'loss': 1 - len(delays)/max(n,1),
+        'updf_per_uplink': nupdf / heard,
+        'dup_ratio': ndup / heard,
+        'best_ratio': nbest / heard,
+        'delay_ms_p50': pct['p50'],
+        'delay_ms_p99': pct['p99'],
+        'cpu_us_per_uplink': (cpu1[2] - cpu0[2])*1e6 / max(n,1) if cpu0 and cpu1 else None,
+    }
+
+
+async def main() -> int:
+    report = bu.BenchReport('diversity')
+    muxs = DiversityMuxs()
+    sim = su.LgwSimServer()
+    rnd = random.Random(args.seed)
+    rates = [ float(r) for r in args.rates.split(',') ]
+    with open('tc.uri', 'w') as f:
+        f.write('ws://localhost:%d' % tu.INFOS_PORT)
+    async with fx.serving(tu.Infos(), muxs, sim):
+        async with fx.StationProcess('-p', '--temp', '.') as proc:
+            await sim.expect_connected(0, within=30.0)
+            if VARIANT.startswith('testms'):
+                await sim.expect_connected(1, within=30.0)   # slave-1.conf
+            await asyncio.sleep(3.0)
+            ncopies = min(args.copies, len(sim.units)) if len(sim.units) > 1 else args.copies
+            via = '%d units' % ncopies if len(sim.units) > 1 else '%d rf_chains' % ncopies
+            devaddr = 0x100
+            cases = [ (1, 0) ] + [ (ncopies, int(o)) for o in args.offsets.split(',') ]
+            for copies, offset in cases:
+                for rate in rates:
+                    devaddr, vals = await run_step(sim, muxs, proc, rnd, copies, offset, rate, devaddr)
+                    case = 'single' if copies == 1 else '%s +%dus' % (via, offset)
+                    report.add('%s %s %g/s' % (VARIANT, case, rate), **vals)
+    report.done()
+    return 0
+
+fx.run(main, timeout=None)
@@ -0,0 +1,266 @@
+# --- Revised 3-Clause BSD License ---
+# Copyright Semtech Corporation 2022. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright notice,
+#       this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright notice,
+#       this list of conditions and the following disclaimer in the documentation
+#       and/or other materials provided with the distribution.
+#     * Neither the name of the Semtech corporation nor the names of its
+#       contributors may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SEMTECH CORPORATION. BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+# Downlink scheduling stress: Muxs floods the station with a mix of
+#
+#   A1  class A answering an injected uplink in RX1 (RX2 as alternative)
+#   A2  class A with RX2 only
+#   C   class C (send as soon as possible)
+#   B   class B ping slots right after a beacon (BEACON_INTVL=2s)
+#
+# spread over all antennas (2 with the testms variants and slave-1.conf).
+# LgwSim.on_tx checks that each frame confirmed by dntxed was handed to the
+# radio before its air time and, for class A, at exactly RX1/RX2. Reported
+# are scheduler throughput, airtime use, acceptance and timing per kind and
+# the scheduler's reasons for moving or rejecting frames (from station.log).
+
+from typing import Any,Dict,List,Optional
+import os
+import re
+import sys
+import time
+import json
+import random
+import asyncio
+import argparse
+import logging
+from datetime import datetime
+from collections import Counter
+logger = logging.getLogger('bench-dn-stress')
+
+import tcutils as tu
+import simutils as su
+import benchutils as bu
+import testutils as tstu
+import fixtures as fx
+import stationbench as sb
+
+ap = argparse.ArgumentParser(description='Downlink scheduling stress benchmark.')
+ap.add_argument('--rates', default='5,20,50', help='Comma separated downlink rates (dnmsgs/s).')
+ap.add_argument('--mix', default='A1=0.4,A2=0.2,C=0.3,B=0.1', help='Share of each downlink kind.')
+ap.add_argument('--duration', type=float, default=20.0, help='Seconds of downlinks per rate.')
+ap.add_argument('--size', type=int, default=12, help='Downlink PDU size (bytes).')
+ap.add_argument('--drain', type=float, default=4.0, help='Seconds to wait for outstanding TX after a rate.')
+ap.add_argument('--seed', type=int, default=1)
+args = ap.parse_args()
+
+tstu.setup_logging()
+logging.getLogger('_tcutils').setLevel(logging.INFO)
+logging.getLogger('simutils').setLevel(logging.INFO)
+
+VARIANT = os.environ.get('TEST_VARIANT', 'testsim')
+STATION_LOG = 'station.log'
+BEACON_INTVL = 2.0      # secs - keep in sync with station.conf
+RXDELAY = 1             # secs
+RX2DR, RX2FREQ = 0, 921900000
+PING_DR, PING_FREQ = 3, 923100000
+ROUTER_CONFIG = {
+    **tu.router_config_KR920,
+    'bcning': { 'DR': 3, 'layout': [2,8,17], 'freqs': [923100000] },
+}
+KINDS = ('A1', 'A2', 'C', 'B')
+
+# Scheduler log messages (src/s2e.c) - some are final, others lead to an alternative
+REASONS = [
+    ('classA_no_alternative', r'class A has no more alternate'),
+    ('classA_too_late_rx2',   r'too late for RX2'),
+    ('classA_trying_rx2',     r'trying RX2'),
+    ('classB_no_alternative', r'class B ping has no alternate'),
+    ('classC_out_of_tries',   r'class C out of TX tries'),
+    ('no_time_sync',          r'no time sync|time sync problems|time conversion problems'),
+    ('too_far_ahead',         r'too far ahead'),
+    ('unable_to_place',       r'unable to place frame'),
+    ('missed_txtime',         r'missed TX time'),
+    ('hindered',              r'Hindered by'),
+    ('displaced',             r'displaces'),
+    ('channel_busy',          r'channel busy'),
+    ('radio_failed',          r'radio layer failed|radio is not emitting'),
+    ('out_of_jobs',           r'Out of TX (jobs|data space)'),
+]
+REASONS_RE = [ (name, re.compile(rx)) for name,rx in REASONS ]
+
+
+def gpstime_now() -> int:
+    return int(((datetime.utcnow() - tu.GPS_EPOCH).total_seconds() + tu.UTC_GPS_LEAPS)*1e6)
+
+
+class StressMuxs(tu.Muxs):
+    def __init__(self) -> None:
+        super().__init__()
+        self.router_config = ROUTER_CONFIG
+        self.jobs = {}  # type: Dict[int,Dict[str,Any]]  diid -> job
+
+    def make_dnmsg(self, diid:int, job:Dict[str,Any]) -> Dict[str,Any]:
+        dnmsg = {
+            'msgtype' : 'dnmsg',
+            'dC'      : { 'A1':0, 'A2':0, 'C':2, 'B':1 }[job['kind']],
+            'priority': 0,
+            'RxDelay' : RXDELAY,
+            'RX2DR'   : RX2DR,
+            'RX2Freq' : RX2FREQ,
+            'DevEui'  : '00-00-00-00-11-00-00-01',
+            'diid'    : diid,
+            'MuxTime' : time.time(),
+            'rctx'    : job['unit'],
+            'pdu'     : sb.dnframe_pdu(diid, args.size),
+        }
+        if job['kind'] == 'B':
+            dnmsg.update(RX1DR=PING_DR, RX1Freq=PING_FREQ, gpstime=job['gpstime'])
+            del dnmsg['RX2DR'], dnmsg['RX2Freq']
+        return dnmsg
+
+    async def send_job(self, diid:int, job:Dict[str,Any], updf:Optional[Dict[str,Any]]=None) -> None:
+        dnmsg = self.make_dnmsg(diid, job)
+        if updf is not None:
+            dnmsg['xtime'] = updf['upinfo']['xtime']
+            dnmsg['rctx'] = updf['upinfo']['rctx']
+            if job['kind'] == 'A1':
+                dnmsg.update(RX1DR=updf['DR'], RX1Freq=updf['Freq'])
+        job['sent'] = time.monotonic()
+        await self.ws.send(json.dumps(dnmsg))
+
+    async def handle_updf(self, ws, msg):
+        job = self.jobs.get(msg['DevAddr'])
+        if job is not None and 'sent' not in job:
+            await self.send_job(msg['DevAddr'], job, msg)
+
+    async def handle_dntxed(self, ws, msg):
+        job = self.jobs.get(msg['diid'])
+        if job is not None:
+            job['dntxed'] = time.monotonic()
+            job['dnunit'] = msg['rctx']
+
+
+class StressSim(su.LgwSimServer):
+    def __init__(self) -> None:
+        super().__init__()
+        self.jobs = {}  # type: Dict[int,Dict[str,Any]]
+        self.other_tx = 0   # beacons
+
+    async def on_tx(self, lgwsim, pkt):
+        job = self.jobs.get(sb.pdu_key(pkt['payload'])) if len(pkt['payload']) == args.size else None
+        if job is None:
+            self.other_tx += 1
+            return
+        job['tx'] = time.monotonic()
+        job['txunit'] = lgwsim.unitIdx
+        job['lead'] = sb.xticks_diff(pkt['count_us'], lgwsim.xticks())
+        job['airtime'] = sb.airtime(*sb.rps_of_tx(pkt, lgwsim.hal), plen=args.size)
+        if 'rxxt' in job:
+            # Class A: exactly RX1 or RX2 after the uplink
+            d = sb.xticks_diff(pkt['count_us'], job['rxxt'])
+            win = min((RXDELAY, RXDELAY+1), key=lambda w: abs(d - w*1000000))
+            job['rxwin'] = win
+            job['err'] = d - win*1000000
+
+
+def pick_kinds(n:int, rnd:random.Random) -> List[str]:
+    mix = dict((k, float(v)) for k,v in (kv.split('=') for kv in args.mix.split(',')))
+    kinds = [ k for k in KINDS if mix.get(k) ]
+    return rnd.choices(kinds, weights=[ mix[k] for k in kinds ], k=n)
+
+
+async def run_rate(lgwsim0:su.LgwSim, muxs:StressMuxs, sim:StressSim, diid:int, rate:float,
+                   rnd:random.Random, log:sb.LogTail, report:bu.BenchReport) -> int:
+    jobs = {}  # type: Dict[int,Dict[str,Any]]
+    muxs.jobs = sim.jobs = jobs
+    sim.other_tx = 0
+    units = sorted(sim.units)
+    chans = sb.upchannels(ROUTER_CONFIG)
+    n = int(rate*args.duration)
+    log.lines()
+    t0 = time.monotonic()
+    for i,kind in enumerate(pick_kinds(n, rnd)):
+        delay = t0 + i/rate - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        unit = units[i % len(units)]
+        lgwsim = sim.units.get(unit, lgwsim0)
+        job = jobs[diid+i] = { 'kind': kind, 'unit': unit }
+        if kind in ('A1', 'A2'):
+            # Answered when the updf arrives
+            xt = lgwsim.xticks()
+            job['rxxt'] = xt & sb.XTICKS_MASK
+            await lgwsim.send_rx(rps=(7,125), freq=chans[i % len(chans)], rxtime=xt,
+                                 frame=sb.uplink_frame(diid+i, 20, fcnt=i))
+        else:
+            if kind == 'B':
+                # Ping slot shortly after the next beacon but one
+                intvl = int(BEACON_INTVL*1e6)
+                job['gpstime'] = (gpstime_now() // intvl + 2) * intvl + rnd.randrange(0, 300000)
+            await muxs.send_job(diid+i, job)
+    tsend = time.monotonic() - t0
+    await asyncio.sleep(2*RXDELAY + args.drain)
+
+    reasons = Counter()  # type: Counter
+    for line in log.lines():
+        for name, rx in REASONS_RE:
+            if rx.search(line):
+                reasons[name] += 1
+    frs = list(jobs.values())
+    ndntxed = sum(1 for j in frs if 'dntxed' in j)
+    airtime = sum(j.get('airtime', 0) for j in frs)
+    report.add('%s %d ant %g/s' % (VARIANT, len(units), rate),
+               sent=n, dntxed_per_s=ndntxed/tsend, airtime_use=airtime/tsend,
+               # Confirmed by dntxed but never seen by the radio and vice versa
+               missing_tx=sum(1 for j in frs if 'dntxed' in j and 'tx' not in j),
+               unconfirmed_tx=sum(1 for j in frs if 'tx' in j and 'dntxed' not in j),
+               beacons=sim.other_tx, **{ 'why_'+k: v for k,v in sorted(reasons.items()) })
+    for kind in KINDS:
+        kj = [ j for j in frs if j['kind'] == kind ]
+        if not kj:
+            continue
+        txed = [ j for j in kj if 'tx' in j ]
+        late = sum(1 for j in txed if j['lead'] <= 0 or j.get('err', 0) != 0)
+        vals = { 'sent': len(kj),
+                 'accepted': sum(1 for j in kj if 'dntxed' in j) / len(kj),
+                 'on_time': (len(txed)-late) / max(len(txed),1),
+                 'alt_ant': sum(1 for j in txed if j['txunit'] != j['unit']) }
+        if kind == 'A1':
+            vals['rx2'] = sum(1 for j in txed if j.get('rxwin') == RXDELAY+1)
+        errs = [ abs(j['err']) for j in txed if 'err' in j ]
+        if errs:
+            vals.update(('err_us_'+p, v) for p,v in bu.percentiles(errs, (50,99)).items())
+        vals.update(('lead_ms_'+p, v) for p,v in bu.percentiles([ j['lead']/1e3 for j in txed ], (1,50)).items())
+        report.add('%s %d ant %g/s %s' % (VARIANT, len(units), rate, kind), **vals)
+    return diid + n
+
+
+async def main() -> int:
+    report = bu.BenchReport('dn-stress')
+    rnd = random.Random(args.seed)
+    muxs = StressMuxs()
+    sim = StressSim()
+    log = sb.LogTail(STATION_LOG)
+    diid = 0x100
+    async with sb.station_setup(muxs, sim, warmup=5.0) as lgwsim:
+        for rate in [ float(x) for x in args.rates.split(',') ]:
+            diid = await run_rate(lgwsim, muxs, sim, diid, rate, rnd, log, report)
+    report.done()
+    return 0
+
+fx.run(main, timeout=None)
@@ -0,0 +1,164 @@
+# --- Revised 3-Clause BSD License ---
+# Copyright Semtech Corporation 2022. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright notice,
+#       this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright notice,
+#       this list of conditions and the following disclaimer in the documentation
+#       and/or other materials provided with the distribution.
+#     * Neither the name of the Semtech corporation nor the names of its
+#       contributors may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SEMTECH CORPORATION. BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+# Fine timestamps: the same uplink load is injected into one station with
+# fine timestamps off and on (LgwSim.enable_ftime, per --jitter value). Per
+# case the time from injection to updf, the station CPU time per uplink and
+# the size of the updf messages are measured. fts_ratio is the share of
+# updfs carrying a fine timestamp. Only lgwsim builds against the lgw2 HAL
+# (Lgw2 layout, platform linuxV2) produce fine timestamps - with any other
+# layout, or if a case with fine timestamps on yields none, the bench fails
+# instead of reporting zeros. The fine timestamp jitter is reported back as
+# the spread of fts - xtime (mod 1s) over the uplinks of a case.
+
+from typing import Any,Dict,List,Optional
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import logging
+logger = logging.getLogger('bench-ftime')
+
+import tcutils as tu
+import simutils as su
+import benchutils as bu
+import testutils as tstu
+import fixtures as fx
+import procprof
+import stationbench as sb
+
+ap = argparse.ArgumentParser(description='Fine timestamp cost benchmark.')
+ap.add_argument('--jitter', default='0,50,500', help='Comma separated fine timestamp jitters (ns) - one case each.')
+ap.add_argument('--rate', type=float, default=200.0, help='Uplinks per second.')
+ap.add_argument('--count', type=int, default=2000, help='Uplinks per case.')
+ap.add_argument('--sf', type=int, default=7, help='Uplink spreading factor.')
+ap.add_argument('--size', type=int, default=20, help='Uplink PHYPayload size (bytes).')
+ap.add_argument('--drain', type=float, default=2.0, help='Seconds to wait for late updfs after a case.')
+ap.add_argument('--seed', type=int, default=1)
+args = ap.parse_args()
+
+tstu.setup_logging()
+logging.getLogger('_tcutils').setLevel(logging.INFO)
+logging.getLogger('simutils').setLevel(logging.INFO)
+
+VARIANT = os.environ.get('TEST_VARIANT', 'testsim')
+ROUTER_CONFIG = tu.router_config_EU863_6ch
+
+
+class FtimeMuxs(tu.Muxs):
+    def __init__(self) -> None:
+        super().__init__()
+        self.router_config = ROUTER_CONFIG
+        self.sent = {}      # type: Dict[int,float]  DevAddr -> injection time
+        self.delays = []    # type: List[float]
+        self.sizes = []     # type: List[int]
+        self.offsets = []   # type: List[int]   fts - xtime us part (ns)
+
+    async def handle_updf(self, ws, msg):
+        t = self.sent.pop(msg['DevAddr'], None)
+        if t is None:
+            return
+        self.delays.append(time.monotonic() - t)
+        # Station encodes compact JSON - re-encoding gives its size up to float formatting
+        self.sizes.append(len(json.dumps(msg, separators=(',',':'))))
+        fts = msg['upinfo'].get('fts', -1)
+        if fts >= 0:
+            self.offsets.append(fts - (msg['upinfo']['xtime'] & 0xFFFFFFFFFFFF) % 1000000 * 1000)
+
+
+def spread(values:List[int]) -> float:
+    """Standard deviation of values taken modulo 1s (ns) around their median"""
+    if len(values) < 2:
+        return 0.0
+    vals = sorted(values)
+    med = vals[len(vals)//2]
+    devs = [ (v - med + 500000000) % 1000000000 - 500000000 for v in vals ]
+    mean = sum(devs) / len(devs)
+    return (sum((d - mean)**2 for d in devs) / (len(devs)-1)) ** 0.5
+
+
+async def run_case(lgwsim:su.LgwSim, muxs:FtimeMuxs, proc:fx.StationProcess, devaddr:int, jitter:Optional[float]) -> Dict[str,Any]:
+    if jitter is None:
+        lgwsim.disable_ftime()
+    else:
+        lgwsim.enable_ftime(jitter, seed=args.seed)
+    muxs.sent.clear()
+    muxs.delays, muxs.sizes, muxs.offsets = [], [], []
+    chans = sb.upchannels(ROUTER_CONFIG)
+    cpu0 = procprof.sample(proc.proc.pid, 0.0)
+    t0 = time.monotonic()
+    for i in range(args.count):
+        muxs.sent[devaddr+i] = time.monotonic()
+        await lgwsim.send_rx(rps=(args.sf,125), freq=chans[i % len(chans)],
+                             frame=sb.uplink_frame(devaddr+i, args.size, fcnt=i))
+        await asyncio.sleep(max(0.0, t0 + (i+1)/args.rate - time.monotonic()))
+    await asyncio.sleep(args.drain)
+    cpu1 = procprof.sample(proc.proc.pid, 0.0)
+    n = len(muxs.delays)
+    pct = bu.percentiles([ d*1e3 for d in muxs.delays ], (50,99))
+    return {
+        'uplinks': args.count,
+        'loss': 1 - n / args.count,
+        'delay_ms_p50': pct['p50'],
+        'delay_ms_p99': pct['p99'],
+        'cpu_us_per_uplink': (cpu1[2] - cpu0[2]) * 1e6 / max(n,1) if cpu0 and cpu1 else None,
+        'updf_bytes': sum(muxs.sizes) / max(n,1),
+        'fts_ratio': len(muxs.offsets) / max(n,1),
+        'fts_spread_ns': spread(muxs.offsets),
+    }
+
+
+async def main() -> int:
+    report = bu.BenchReport('ftime')
+    muxs = FtimeMuxs()
+    sim = su.LgwSimServer()
+    with open('tc.uri', 'w') as f:
+        f.write('ws://localhost:%d' % tu.INFOS_PORT)
+    async with fx.serving(tu.Infos(), muxs, sim):
+        async with fx.StationProcess('-p', '--temp', '.') as proc:
+            lgwsim = await sim.expect_connected(0, within=30.0)
+            await asyncio.sleep(3.0)
+            logger.info('SX130x HAL layout: %s', lgwsim.hal.__name__)
+            if not lgwsim.hal.FTIME:
+                logger.error('SX130x HAL layout %s has no fine timestamps - build the station for platform linuxV2', lgwsim.hal.__name__)
+                return 1
+            devaddr = 0x100
+            cases = [ None ] + [ float(j) for j in args.jitter.split(',') ]
+            for jitter in cases:
+                vals = await run_case(lgwsim, muxs, proc, devaddr, jitter)
+                devaddr += args.count
+                name = 'ftime off' if jitter is None else 'ftime jitter=%gns' % jitter
+                report.add('%s %s %s' % (VARIANT, lgwsim.hal.__name__, name), **vals)
+                if jitter is not None and not vals['fts_ratio']:
+                    logger.error('%s: no updf carried a fine timestamp', name)
+                    return 1
+    report.done()
+    return 0
+
+fx.run(main, timeout=None)
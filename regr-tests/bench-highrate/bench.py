@@ -0,0 +1,154 @@
+# --- Revised 3-Clause BSD License ---
+# Copyright Semtech Corporation 2022. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright notice,
+#       this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright notice,
+#       this list of conditions and the following disclaimer in the documentation
+#       and/or other materials provided with the distribution.
+#     * Neither the name of the Semtech corporation nor the names of its
+#       contributors may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SEMTECH CORPORATION. BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+# High data rate uplinks: at SF5/SF6 (RP2 1.0.5), SF7/250kHz and FSK a frame
+# is on air for a few ms only, so the station's per frame cost rather than
+# the air time limits the uplink rate. For each modulation the uplink rate
+# is stepped up until the station loses frames or delays updfs beyond the
+# limits (as in bench-uplink-saturation). Reported per modulation: air
+# time per frame, the rate the channels could carry at 100% occupancy, the
+# measured saturation rate, their ratio (below 1: the station is the limit)
+# and the station CPU time per uplink. Modulations without an uplink DR or
+# without codes in the SX130x layout of the variant are skipped. SF5/SF6
+# (--sf5sf6) are refused while the station maps only SF7-SF12.
+
+from typing import Any,Dict,List,Optional,Tuple
+import os
+import sys
+import copy
+import asyncio
+import argparse
+import logging
+logger = logging.getLogger('bench-highrate')
+
+import tcutils as tu
+import simutils as su
+import benchutils as bu
+import testutils as tstu
+import fixtures as fx
+import procprof
+import stationbench as sb
+
+ap = argparse.ArgumentParser(description='High data rate uplink benchmark.')
+ap.add_argument('--rps', default='SF7/250,FSK', help='Comma separated modulations: SF<n>/<bw kHz> or FSK.')
+ap.add_argument('--sf5sf6', action='store_true',
+                help='Announce the RP2 1.0.5 SF5/SF6 DRs (only for stations mapping SF5/SF6).')
+ap.add_argument('--start', type=float, default=50.0, help='Uplink rate of the first step (frames/s).')
+ap.add_argument('--factor', type=float, default=1.5, help='Rate increase per step.')
+ap.add_argument('--max-rate', type=float, default=10000.0, help='Stop after this rate.')
+ap.add_argument('--step', type=float, default=5.0, help='Seconds per rate step.')
+ap.add_argument('--drain', type=float, default=2.0, help='Seconds to wait for late updfs after a step.')
+ap.add_argument('--max-loss', type=float, default=0.01, help='Loss ratio above which the station is saturated.')
+ap.add_argument('--max-delay', type=float, default=0.5, help='p99 queueing delay (s) above which the station is saturated.')
+ap.add_argument('--size', type=int, default=20, help='Uplink PHYPayload size (bytes).')
+args = ap.parse_args()
+if args.sf5sf6 and not {5,6} <= set(sb.STATION_LORA_SFS):
+    # The station would map SF6/SF5 DRs to FSK/SFNIL - every other DR would run under a broken table
+    ap.error('--sf5sf6: station has no SF5/SF6 (supports SF%s)' % '/'.join(map(str, sb.STATION_LORA_SFS)))
+
+tstu.setup_logging()
+logging.getLogger('_tcutils').setLevel(logging.INFO)
+logging.getLogger('simutils').setLevel(logging.INFO)
+
+VARIANT = os.environ.get('TEST_VARIANT', 'testsim')
+
+
+def router_config() -> Dict[str,Any]:
+    """EU868 6ch - with SF6/SF5 as DR12/DR13 (RP2 1.0.5) if requested"""
+    config = copy.deepcopy(tu.router_config_EU863_6ch)
+    if args.sf5sf6:
+        config['DRs'][12] = (6, 125, 0)
+        config['DRs'][13] = (5, 125, 0)
+    return config
+
+ROUTER_CONFIG = router_config()
+
+
+def parse_rps(s:str) -> Tuple[int,int]:
+    if s.upper() == 'FSK':
+        return su.RPS_FSK
+    sf, bw = s.upper().lstrip('SF').split('/')
+    return int(sf), int(bw)
+
+
+def rps_name(rps:Tuple[int,int]) -> str:
+    return 'FSK' if rps == su.RPS_FSK else 'SF%d/%d' % rps
+
+
+async def run_rps(lgwsim:su.LgwSim, muxs:sb.CountingMuxs, proc:fx.StationProcess, rps:Tuple[int,int],
+                  devaddr:int, report:bu.BenchReport) -> int:
+    name = '%s %s %s' % (VARIANT, lgwsim.hal.__name__, rps_name(rps))
+    try:
+        lgwsim.hal.add_rps({}, rps)
+        sb.dr_of_rps(ROUTER_CONFIG, *rps)
+    except ValueError as exc:
+        logger.warning('Skipping %s: %s', name, exc)
+        return devaddr
+    airtime = su.airtime(rps[0], rps[1], args.size)
+    capacity = len(sb.upchannels(ROUTER_CONFIG)) / airtime
+    saturation = 0.0
+    cpu = []   # type: List[float]  station CPU secs per uplink of the steps within limits
+    rate = args.start
+    while rate <= args.max_rate:
+        s0 = procprof.sample(proc.proc.pid, 0.0)
+        devaddr, vals = await sb.run_step(lgwsim, muxs, rps, sb.upchannels(ROUTER_CONFIG), devaddr, rate,
+                                          step=args.step, drain=args.drain, size=args.size)
+        s1 = procprof.sample(proc.proc.pid, 0.0)
+        report.add('%s %g/s' % (name, rate), **vals)
+        if vals['loss'] > args.max_loss or vals['delay_ms_p99'] > args.max_delay*1e3:
+            break
+        saturation = vals['received']
+        if s0 and s1:
+            cpu.append((s1[2] - s0[2]) / max(vals['received']*args.step, 1))
+        rate *= args.factor
+    report.add('%s saturation' % name,
+               airtime_ms=airtime*1e3,
+               airtime_limit_per_s=capacity,
+               uplinks_per_s=saturation,
+               station_bound=saturation < capacity,
+               utilization=saturation / capacity,
+               cpu_us_per_uplink=min(cpu)*1e6 if cpu else None)
+    return devaddr
+
+
+async def main() -> int:
+    report = bu.BenchReport('highrate')
+    muxs = sb.CountingMuxs(ROUTER_CONFIG)
+    sim = su.LgwSimServer()
+    with open('tc.uri', 'w') as f:
+        f.write('ws://localhost:%d' % tu.INFOS_PORT)
+    async with fx.serving(tu.Infos(), muxs, sim):
+        async with fx.StationProcess('-p', '--temp', '.') as proc:
+            lgwsim = await sim.expect_connected(0, within=30.0)
+            await asyncio.sleep(3.0)
+            devaddr = 0x100
+            for rps in [ parse_rps(s) for s in args.rps.split(',') ]:
+                devaddr = await run_rps(lgwsim, muxs, proc, rps, devaddr, report)
+    report.done()
+    return 0
+
+fx.run(main, timeout=None)
@@ -0,0 +1,111 @@
+# --- Revised 3-Clause BSD License ---
+# Copyright Semtech Corporation 2022. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright notice,
+#       this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright notice,
+#       this list of conditions and the following disclaimer in the documentation
+#       and/or other materials provided with the distribution.
+#     * Neither the name of the Semtech corporation nor the names of its
+#       contributors may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SEMTECH CORPORATION. BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Parse/format throughput of Id6 and Eui over a large population of ids.
+# Ids are drawn from a smaller set of unique values to mimic a fleet where
+# the same gateways/devices show up over and over again.
+
+import sys
+import random
+import argparse
+import logging
+logger = logging.getLogger('bench-id6')
+
+import id6
+from id6 import Id6, Eui
+import benchutils as bu
+import testutils as tstu
+
+ap = argparse.ArgumentParser(description='Id6/Eui parse and format benchmark.')
+ap.add_argument('-n', type=int, default=2000000, help='Number of ids parsed per case.')
+ap.add_argument('--unique', type=int, default=1000, help='Number of distinct ids in the population.')
+ap.add_argument('--seed', type=int, default=1)
+args = ap.parse_args()
+
+tstu.setup_logging()
+rnd = random.Random(args.seed)
+ids = [rnd.getrandbits(64) for _ in range(args.unique)]
+ids += [rnd.getrandbits(16), rnd.getrandbits(16)<<48, (rnd.getrandbits(16)<<48)|rnd.getrandbits(16)]
+population = [rnd.choice(ids) for _ in range(args.n)]
+
+forms = {
+    'id6':     lambda i: Id6.int2str(Id6(i).id),
+    'eui':     Eui.int2str,
+    'eui-colon': lambda i: Eui.int2str(i).replace('-',':'),
+    'mac':     lambda i: Id6(i & 0xFFFFFFFFFFFF).as_mac_str(),
+    'cat-id6': lambda i: 'router-'+Id6.int2str(Id6(i).id),
+}
+
+def parse_all(cls, strs):
+    for s in strs:
+        cls(s)
+
+def parse_nocache(fn, strs):
+    for s in strs:
+        fn(s)
+
+report = bu.BenchReport('id6')
+for form, fmt in forms.items():
+    text = { i: fmt(i) for i in ids }
+    strs = [ text[i] for i in population ]
+    cls = Eui if form.startswith('eui') else Id6
+    intern = id6._eui_intern if cls is Eui else id6._id6_intern
+    intern.cache_clear()
+    t = bu.timeit(parse_all, cls, strs)
+    report.add('parse-%s' % form, n=len(strs), secs=t, rate=len(strs)/t, hits=intern.cache_info().hits)
+    uncached = (lambda s: cls._parse(s)) if cls is Eui else (lambda s: Id6._parse(s, ''))
+    t = bu.timeit(parse_nocache, uncached, strs, repeat=1)
+    report.add('parse-%s-uncached' % form, n=len(strs), secs=t, rate=len(strs)/t)
+
+objs = [ Id6(i) for i in population ]
+t = bu.timeit(lambda: [ Id6.int2str(o.id) for o in objs ])
+report.add('format-id6', n=len(objs), secs=t, rate=len(objs)/t)
+t = bu.timeit(lambda: [ Eui.int2str(o.id) for o in objs ])
+report.add('format-eui', n=len(objs), secs=t, rate=len(objs)/t)
+euis = [ Eui(i) for i in population ]
+t = bu.timeit(lambda: [ e.as_bytes() for e in euis ])
+report.add('eui-as-bytes', n=len(euis), secs=t, rate=len(euis)/t)
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+if np is None:
+    logger.info('numpy not available - skipping bulk conversions')
+else:
+    arr = np.array([ Id6(i).id for i in population ], dtype=np.int64)
+    for name, tostr, fromstr in (('id6', Id6.bulk_to_strings, Id6.bulk_from_strings),
+                                 ('eui', Eui.bulk_to_strings, Eui.bulk_from_strings),
+                                 ('mac', Id6.bulk_to_mac_strings, Id6.bulk_from_strings)):
+        t = bu.timeit(tostr, arr, repeat=1)
+        report.add('bulk-format-%s' % name, n=len(arr), secs=t, rate=len(arr)/t)
+        strs = tostr(arr)
+        t = bu.timeit(fromstr, strs, repeat=1)
+        report.add('bulk-parse-%s' % name, n=len(arr), secs=t, rate=len(arr)/t)
+    buf = b'\n'.join(Eui.bulk_to_strings(arr).astype('S'))
+    t = bu.timeit(Eui.bulk_from_strings, buf, repeat=1)
+    report.add('bulk-parse-eui-buffer', n=len(arr), secs=t, rate=len(arr)/t)
+report.done()
@@ -0,0 +1,123 @@
+# --- Revised 3-Clause BSD License ---
+# Copyright Semtech Corporation 2022. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright notice,
+#       this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright notice,
+#       this list of conditions and the following disclaimer in the documentation
+#       and/or other materials provided with the distribution.
+#     * Neither the name of the Semtech corporation nor the names of its
+#       contributors may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SEMTECH CORPORATION. BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Reconnect storm against INFOS: a population of simulated stations connects
+# at (almost) the same time - as after an LNS restart - and each one asks for
+# its muxs uri. Rejected or failed connects are retried with backoff.
+
+import sys
+import time
+import json
+import random
+import resource
+import asyncio
+import argparse
+import logging
+logger = logging.getLogger('bench-infos')
+
+import websockets
+import tcutils as tu
+import benchutils as bu
+import testutils as tstu
+import loops
+
+ap = argparse.ArgumentParser(description='INFOS reconnect storm benchmark.')
+ap.add_argument('--stations', type=int, default=5000, help='Number of simulated stations.')
+ap.add_argument('--spread', type=float, default=0.0, help='Spread connects uniformly over this many seconds.')
+ap.add_argument('--max-conns', type=int, nargs='*', default=[0, 256], help='INFOS connection limits to compare (0 = unlimited).')
+ap.add_argument('--backlog', type=int, default=1024, help='INFOS listen backlog.')
+ap.add_argument('--shards', type=int, default=4, help='Number of muxs shards in the routing table.')
+ap.add_argument('--port', type=int, default=6038)
+ap.add_argument('--seed', type=int, default=1)
+args = ap.parse_args()
+
+tstu.setup_logging()
+logging.getLogger('_tcutils').setLevel(logging.WARNING)
+logging.getLogger('websockets').setLevel(logging.WARNING)
+
+soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+if soft < hard:
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+class Station:
+    def __init__(self, routerid:int) -> None:
+        self.routerid = routerid
+        self.tries = 0
+        self.rejected = 0
+        self.latency = None
+        self.resp = None
+
+    async def run(self, uri:str, delay:float) -> None:
+        await asyncio.sleep(delay)
+        t0 = time.monotonic()
+        backoff = 0.05
+        while True:
+            self.tries += 1
+            try:
+                async with websockets.connect(uri, open_timeout=30) as ws:
+                    await ws.send(json.dumps({ 'router': self.routerid }))
+                    self.resp = json.loads(await ws.recv())
+                    self.latency = time.monotonic() - t0
+                    return
+            except websockets.exceptions.ConnectionClosed as exc:
+                self.rejected += 1
+            except (OSError, asyncio.TimeoutError):
+                pass
+            await asyncio.sleep(backoff * (1 + random.random()))
+            backoff = min(backoff*2, 2.0)
+
+
+async def storm(max_conns:int, report:bu.BenchReport) -> None:
+    infos = tu.Infos(max_conns=max_conns)
+    infos.port = args.port
+    infos.backlog = args.backlog
+    for i in range(args.stations):
+        shard = i % args.shards
+        infos.add_route(i+1, 'ws://localhost:%d/router-%d' % (6039+shard, i+1), 'muxs-::%x' % shard)
+    await infos.start_server()
+    rnd = random.Random(args.seed)
+    stations = [ Station(i+1) for i in range(args.stations) ]
+    uri = 'ws://localhost:%d' % args.port
+    t0 = time.monotonic()
+    await asyncio.gather(*[ s.run(uri, rnd.random()*args.spread) for s in stations ])
+    elapsed = time.monotonic() - t0
+    infos.server.close()
+    await infos.server.wait_closed()
+    bad = sum(1 for s in stations if s.resp['uri'] != infos.routes[s.routerid][1])
+    lat = [ s.latency for s in stations ]
+    report.add('storm-max%d' % max_conns, stations=args.stations, secs=elapsed, rate=args.stations/elapsed,
+               tries=sum(s.tries for s in stations), rejected=infos.nrejected, wrong=bad,
+               **{ k: v*1e3 for k,v in bu.percentiles(lat).items() })
+
+
+async def main() -> None:
+    report = bu.BenchReport('infos')
+    for max_conns in args.max_conns:
+        await storm(max_conns, report)
+    report.done()
+
+loops.run(main())
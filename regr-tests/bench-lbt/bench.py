@@ -0,0 +1,220 @@
+# --- Revised 3-Clause BSD License ---
+# Copyright Semtech Corporation 2022. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright notice,
+#       this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright notice,
+#       this list of conditions and the following disclaimer in the documentation
+#       and/or other materials provided with the distribution.
+#     * Neither the name of the Semtech corporation nor the names of its
+#       contributors may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SEMTECH CORPORATION. BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+# LBT downlink capacity: interferers occupy every downlink channel (RX1 =
+# uplink channels, RX2) at a given mean occupancy, streamed into LgwSim as
+# CCA updates (ccasim.CcaScenario). Muxs sends class A (answering injected
+# uplinks) and class C downlinks. Each downlink ends up as
+#
+#   clean     TX on its first choice channel without hitting a busy channel
+#   deferred  TX on its first choice channel after "channel busy" (class C retries)
+#   rerouted  TX on another channel (class A RX2 after a busy RX1)
+#   dropped   no TX at all
+#
+# "channel busy" log lines are attributed to downlinks via diid. lbt_violations
+# counts TX frames starting inside a busy interval (must be 0).
+# Duty cycle limits are disabled (nodc) so only LBT limits capacity.
+
+from typing import Any,Dict,List,Optional
+import os
+import re
+import sys
+import time
+import json
+import random
+import asyncio
+import argparse
+import logging
+from collections import Counter
+logger = logging.getLogger('bench-lbt')
+
+import tcutils as tu
+import simutils as su
+import benchutils as bu
+import testutils as tstu
+import fixtures as fx
+import stationbench as sb
+import ccasim
+
+CONFIGS = {
+    'KR920': (tu.router_config_KR920, 921.9),   # router_config, RX2 freq (MHz)
+    'AS923': (tu.router_config_AS923, 923.2),
+}
+
+ap = argparse.ArgumentParser(description='LBT downlink capacity benchmark.')
+ap.add_argument('--configs', nargs='*', default=list(CONFIGS), choices=list(CONFIGS), help='Router configs to measure.')
+ap.add_argument('--occupancy', default='0,0.1,0.25,0.5,0.75', help='Comma separated mean channel occupancies.')
+ap.add_argument('--model', default='poisson', choices=('poisson', 'periodic'), help='Interferer model.')
+ap.add_argument('--mean-busy', type=float, default=0.05, help='Mean busy period of an interferer (s).')
+ap.add_argument('--rate', type=float, default=2.0, help='Downlinks per second.')
+ap.add_argument('--classc', type=float, default=0.3, help='Share of class C downlinks.')
+ap.add_argument('--duration', type=float, default=30.0, help='Seconds of downlinks per occupancy level.')
+ap.add_argument('--drain', type=float, default=3.0, help='Seconds to wait for outstanding TX after a level.')
+ap.add_argument('--rx2dr', type=int, default=5, help='RX2/class C datarate (keeps class C airtime short).')
+ap.add_argument('--size', type=int, default=12, help='Downlink PDU size (bytes).')
+ap.add_argument('--horizon', type=float, default=0.2, help='CCA window streamed ahead (s).')
+ap.add_argument('--seed', type=int, default=1)
+args = ap.parse_args()
+
+tstu.setup_logging()
+logging.getLogger('_tcutils').setLevel(logging.INFO)
+logging.getLogger('simutils').setLevel(logging.INFO)
+
+VARIANT = os.environ.get('TEST_VARIANT', 'testsim')
+STATION_LOG = 'station.log'
+RXDELAY = 1
+BUSY_RE = re.compile(r'diid=(\d+) .*channel busy')
+OUTCOMES = ('clean', 'deferred', 'rerouted', 'dropped')
+
+
+class LbtMuxs(tu.Muxs):
+    def __init__(self, router_config:Dict[str,Any], rx2freq:float) -> None:
+        super().__init__()
+        self.router_config = router_config
+        self.rx2freq = int(rx2freq*1e6)
+        self.jobs = {}  # type: Dict[int,Dict[str,Any]]  diid -> job
+
+    async def send_job(self, diid:int, job:Dict[str,Any], updf:Optional[Dict[str,Any]]=None) -> None:
+        dnmsg = {
+            'msgtype' : 'dnmsg',
+            'dC'      : 0 if updf else 2,
+            'priority': 0,
+            'RxDelay' : RXDELAY,
+            'RX2DR'   : args.rx2dr,
+            'RX2Freq' : self.rx2freq,
+            'DevEui'  : '00-00-00-00-11-00-00-01',
+            'diid'    : diid,
+            'MuxTime' : time.time(),
+            'rctx'    : 0,
+            'pdu'     : sb.dnframe_pdu(diid, args.size),
+        }
+        if updf is not None:
+            dnmsg.update(RX1DR=updf['DR'], RX1Freq=updf['Freq'], xtime=updf['upinfo']['xtime'], rctx=updf['upinfo']['rctx'])
+        job['freq'] = dnmsg.get('RX1Freq', self.rx2freq)   # first choice
+        await self.ws.send(json.dumps(dnmsg))
+
+    async def handle_updf(self, ws, msg):
+        job = self.jobs.get(msg['DevAddr'])
+        if job is not None and 'freq' not in job:
+            await self.send_job(msg['DevAddr'], job, msg)
+
+    async def handle_dntxed(self, ws, msg):
+        job = self.jobs.get(msg['diid'])
+        if job is not None:
+            job['dntxed'] = time.monotonic()
+
+
+class LbtSim(su.LgwSimServer):
+    def __init__(self) -> None:
+        super().__init__()
+        self.jobs = {}  # type: Dict[int,Dict[str,Any]]
+        self.scenario = None  # type: Optional[ccasim.CcaScenario]
+
+    async def on_tx(self, lgwsim, pkt):
+        job = self.jobs.get(sb.pdu_key(pkt['payload']))
+        if job is None:
+            return
+        now = lgwsim.xticks()
+        job['txfreq'] = pkt['freq_hz']
+        job['txxt'] = now + sb.xticks_diff(pkt['count_us'], now & sb.XTICKS_MASK)
+        job['violation'] = self.scenario is not None and self.scenario.busy(pkt['freq_hz'], job['txxt'])
+
+
+def outcome(job:Dict[str,Any]) -> str:
+    if 'txfreq' not in job:
+        return 'dropped'
+    if job['txfreq'] != job.get('freq'):
+        return 'rerouted'
+    return 'deferred' if job.get('busy') else 'clean'
+
+
+async def run_level(lgwsim:su.LgwSim, muxs:LbtMuxs, sim:LbtSim, name:str, freqs:List[float],
+                    occupancy:float, diid:int, rnd:random.Random, log:sb.LogTail, report:bu.BenchReport) -> int:
+    jobs = {}  # type: Dict[int,Dict[str,Any]]
+    muxs.jobs = sim.jobs = jobs
+    scn = sim.scenario = ccasim.CcaScenario(ccasim.interferers(freqs, occupancy, args.model, args.mean_busy, rnd.getrandbits(32)),
+                                            horizon=args.horizon)
+    chans = sb.upchannels(muxs.router_config)
+    n = int(args.rate*args.duration)
+    log.lines()
+    scn.start(lgwsim)
+    t0 = time.monotonic()
+    for i in range(n):
+        delay = t0 + i/args.rate - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        job = jobs[diid+i] = {}
+        if rnd.random() < args.classc:
+            await muxs.send_job(diid+i, job)
+        else:
+            await lgwsim.send_rx(rps=(7,125), freq=chans[i % len(chans)],
+                                 frame=sb.uplink_frame(diid+i, 20, fcnt=i))
+    await asyncio.sleep(2*RXDELAY + args.drain)
+    occ = scn.occupancy(lgwsim.xticks())
+    await scn.stop(lgwsim)
+
+    busy = Counter()  # type: Counter
+    for line in log.lines():
+        m = BUSY_RE.search(line)
+        if m:
+            busy[int(m.group(1))] += 1
+    for d,job in jobs.items():
+        job['busy'] = busy.get(d, 0)
+    frs = list(jobs.values())
+    outcomes = Counter(outcome(j) for j in frs)
+    vals = { 'occupancy': sum(occ.values())/len(occ) if occ else 0.0,
+             'sent': n,
+             'busy_retries': sum(busy.values()),
+             'lbt_violations': sum(1 for j in frs if j.get('violation')),
+             'cca_updates': scn.nupdates,
+             'cca_truncated': scn.truncated }
+    vals.update((k, outcomes[k]/max(n,1)) for k in OUTCOMES)
+    report.add('%s %s %s occ=%g' % (VARIANT, name, args.model, occupancy), **vals)
+    return diid + n
+
+
+async def run_config(name:str, rnd:random.Random, report:bu.BenchReport) -> None:
+    config, rx2freq = CONFIGS[name]
+    muxs = LbtMuxs(config, rx2freq)
+    sim = LbtSim()
+    freqs = sorted(set(sb.upchannels(config)) | { rx2freq })
+    log = sb.LogTail(STATION_LOG)
+    diid = 0x100
+    async with sb.station_setup(muxs, sim) as lgwsim:
+        for occupancy in [ float(x) for x in args.occupancy.split(',') ]:
+            diid = await run_level(lgwsim, muxs, sim, name, freqs, occupancy, diid, rnd, log, report)
+
+
+async def main() -> int:
+    report = bu.BenchReport('lbt')
+    rnd = random.Random(args.seed)
+    for name in args.configs:
+        await run_config(name, rnd, report)
+    report.done()
+    return 0
+
+fx.run(main, timeout=None)
@@ -0,0 +1,314 @@
+# --- Revised 3-Clause BSD License ---
+# Copyright Semtech Corporation 2022. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright notice,
+#       this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright notice,
+#       this list of conditions and the following disclaimer in the documentation
+#       and/or other materials provided with the distribution.
+#     * Neither the name of the Semtech corporation nor the names of its
+#       contributors may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SEMTECH CORPORATION. BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# asyncio vs uvloop for the station2pkfwd bridge and the pysys load
+# generators. Per loop kind a child process (running that loop itself)
+# starts the bridge with --loop <kind>, plays an LNS on the pkfwd UDP port
+# (PUSH_ACK/PULL_ACK, PULL_RESP for every --dn-every'th uplink) and drives
+# --routers simulated stations over MUXS with updf at the given aggregate
+# rates. Reported per loop and rate: uplink latency station->PUSH_DATA,
+# downlink latency PULL_RESP->dnmsg, bridge CPU per uplink and the loop lag
+# of the bridge (from its /metrics) and of the load generator.
+
+from typing import Any,Dict,List,Optional,Tuple
+import os
+import sys
+import time
+import json
+import base64
+import struct
+import shutil
+import resource
+import asyncio
+import argparse
+import subprocess
+import logging
+logger = logging.getLogger('bench-loops')
+
+import websockets
+import benchutils as bu
+import testutils as tstu
+import fixtures as fx
+import procprof
+import stationbench as sb
+import loops
+from id6 import Id6
+
+ap = argparse.ArgumentParser(description='Event loop benchmark for the station2pkfwd bridge and load generators.')
+ap.add_argument('--loops', default=','.join(loops.available()), help='Comma separated loop kinds to compare (default: all available).')
+ap.add_argument('--routers', type=int, default=20, help='Number of simulated stations.')
+ap.add_argument('--rates', default='100,500,2000', help='Comma separated aggregate uplink rates (updf/s).')
+ap.add_argument('--step', type=float, default=5.0, help='Seconds per rate step.')
+ap.add_argument('--drain', type=float, default=2.0, help='Seconds to wait for late frames after a step.')
+ap.add_argument('--dn-every', type=int, default=10, help='Answer every n-th uplink with a PULL_RESP (0: none).')
+ap.add_argument('--port', type=int, default=6140, help='Bridge INFOS port - MUXS +2, pkfwd UDP +4, metrics +5.')
+ap.add_argument('--child', default=None, help=argparse.SUPPRESS)
+args = ap.parse_args()
+
+tstu.setup_logging()
+logging.getLogger('websockets').setLevel(logging.WARNING)
+
+soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+if soft < hard:
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+BRIDGE_DIR = os.path.abspath('../../examples/station2pkfwd')
+CONF_DIR = os.path.abspath('conf')
+RESULT = 'RESULT '
+PKFWD_VER = 2
+PUSH_DATA, PUSH_ACK, PULL_DATA, PULL_RESP, PULL_ACK = 0, 1, 2, 3, 4
+LAG_METRIC = 'ts2pktfwd_loop_lag_seconds'
+
+
+def make_confdir(nrouters:int) -> List[str]:
+    """regions.yaml and router-::N.yaml (gateway_ID N) for the bridge - returns the router ids"""
+    shutil.rmtree(CONF_DIR, ignore_errors=True)
+    os.makedirs(CONF_DIR)
+    shutil.copy(os.path.join(BRIDGE_DIR, 'regions.yaml'), CONF_DIR)
+    with open(os.path.join(BRIDGE_DIR, 'router-1.yaml')) as f:
+        template = f.read()
+    rids = []
+    for i in range(1, nrouters+1):
+        rid = str(Id6(i, 'router'))
+        with open(os.path.join(CONF_DIR, rid + '.yaml'), 'w') as f:
+            f.write(template.replace('gateway_ID: "0000000000000001"', 'gateway_ID: "%016X"' % i))
+        rids.append(rid)
+    return rids
+
+
+class Lns(asyncio.DatagramProtocol):
+    """pkfwd server side: acks PUSH_DATA/PULL_DATA, records uplinks by DevAddr, sends PULL_RESPs."""
+
+    def __init__(self) -> None:
+        self.transport = None   # type: Optional[asyncio.DatagramTransport]
+        self.pull_addrs = {}    # type: Dict[int,Any]  gateway_ID -> addr
+        self.uptimes = {}       # type: Dict[int,float]  DevAddr -> PUSH_DATA arrival
+        self.dnsent = {}        # type: Dict[int,float]  key -> PULL_RESP sent
+
+    def connection_made(self, transport) -> None:
+        self.transport = transport
+
+    def datagram_received(self, data:bytes, addr) -> None:
+        now = time.monotonic()
+        _, token, t, gwid = struct.unpack_from('>BHBq', data, 0)
+        if t == PULL_DATA:
+            self.pull_addrs[gwid] = addr
+            self.transport.sendto(struct.pack('>BHB', PKFWD_VER, token, PULL_ACK), addr)
+            return
+        if t != PUSH_DATA:
+            return
+        self.transport.sendto(struct.pack('>BHB', PKFWD_VER, token, PUSH_ACK), addr)
+        for rxpk in json.loads(data[12:].decode()).get('rxpk', ()):
+            key = struct.unpack_from('<i', base64.b64decode(rxpk['data']), 1)[0]
+            self.uptimes[key] = now
+            if args.dn_every and key % args.dn_every == 0 and gwid in self.pull_addrs:
+                self.send_pull_resp(gwid, key, rxpk)
+
+    def send_pull_resp(self, gwid:int, key:int, rxpk:Dict[str,Any]) -> None:
+        txpk = {
+            'imme': False,
+            'tmst': (rxpk['tmst'] + 1000000) & 0xFFFFFFFF,
+            'freq': rxpk['freq'],
+            'rfch': 0,
+            'powe': 14,
+            'modu': 'LORA',
+            'datr': rxpk['datr'],
+            'codr': '4/5',
+            'ipol': True,
+            'size': 12,
+            'data': base64.b64encode(bytes.fromhex(sb.dnframe_pdu(key))).decode('ascii'),
+        }
+        self.dnsent[key] = time.monotonic()
+        self.transport.sendto(struct.pack('>BHB', PKFWD_VER, key & 0xFFFF, PULL_RESP) + json.dumps({ 'txpk': txpk }).encode(),
+                              self.pull_addrs[gwid])
+
+
+class StationClient:
+    """Simulated station on one MUXS connection - records dnmsg arrivals by pdu key."""
+
+    def __init__(self, rid:str, dntimes:Dict[int,float]) -> None:
+        self.rid = rid
+        self.dntimes = dntimes
+        self.ws = None          # type: Any
+        self.task = None        # type: Optional[asyncio.Future]
+
+    async def connect(self, uri:str) -> None:
+        self.ws = await websockets.connect(uri)
+        await self.ws.send(json.dumps({ 'msgtype': 'version', 'station': 'bench-loops', 'protocol': 2 }))
+        rconf = json.loads(await self.ws.recv())
+        assert rconf.get('msgtype') == 'router_config', rconf
+        self.task = asyncio.ensure_future(self.recv_loop())
+
+    async def recv_loop(self) -> None:
+        try:
+            async for m in self.ws:
+                msg = json.loads(m)
+                if msg.get('msgtype') == 'dnmsg':
+                    self.dntimes[sb.pdu_key(bytes.fromhex(msg['pdu']))] = time.monotonic()
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    async def send_updf(self, key:int, freq:int) -> None:
+        now = time.monotonic()
+        await self.ws.send(json.dumps({
+            'msgtype': 'updf', 'MHdr': 0x40, 'DevAddr': key, 'FCtrl': 0, 'FCnt': key & 0xFFFF, 'FOpts': '',
+            'FPort': 1, 'FRMPayload': '00'*8, 'MIC': key, 'DR': 5, 'Freq': freq,
+            'upinfo': { 'rctx': 0, 'xtime': (1<<48) | int(now*1e6), 'gpstime': 0, 'rxtime': time.time(), 'rssi': -60, 'snr': 9.0 },
+        }))
+
+    async def close(self) -> None:
+        await self.ws.close()
+        if self.task:
+            await self.task
+
+
+async def scrape_lag(port:int) -> Optional[Tuple[List[Tuple[float,int]],float,int]]:
+    """Cumulative buckets, sum and count of the bridge's loop lag histogram"""
+    try:
+        reader, writer = await asyncio.open_connection('localhost', port)
+        writer.write(b'GET /metrics HTTP/1.0\r\n\r\n')
+        body = (await reader.read()).decode()
+        writer.close()
+    except OSError:
+        return None
+    buckets, total, count = [], 0.0, 0
+    for line in body.splitlines():
+        if line.startswith(LAG_METRIC+'_bucket'):
+            le = line.split('le="')[1].split('"')[0]
+            buckets.append((float('inf') if le == '+Inf' else float(le), int(line.split()[-1])))
+        elif line.startswith(LAG_METRIC+'_sum'):
+            total = float(line.split()[-1])
+        elif line.startswith(LAG_METRIC+'_count'):
+            count = int(line.split()[-1])
+    return buckets, total, count
+
+
+def lag_delta(a, b) -> Dict[str,Any]:
+    """Mean and p99 bucket bound (ms) of the lag observed between scrapes a and b"""
+    if not a or not b or b[2] <= a[2]:
+        return { 'bridge_lag_ms_mean': None, 'bridge_lag_ms_p99': None }
+    n = b[2] - a[2]
+    p99 = next((le for (le, cb), (_, ca) in zip(b[0], a[0]) if cb - ca >= 0.99*n), float('inf'))
+    return { 'bridge_lag_ms_mean': (b[1]-a[1])/n*1e3, 'bridge_lag_ms_p99': p99*1e3 }
+
+
+async def run_step(lns:Lns, clients:List[StationClient], dntimes:Dict[int,float], bridge:fx.StationProcess,
+                   rate:float, key:int) -> Tuple[int,Dict[str,Any]]:
+    mon = loops.monitor()
+    mon.reset()
+    freqs = [ 868100000, 868300000, 868500000 ]
+    n = int(rate*args.step)
+    sent = {}  # type: Dict[int,float]
+    lag0 = await scrape_lag(args.port+5)
+    cpu0 = procprof.sample(bridge.proc.pid, 0.0)
+    t0 = time.monotonic()
+    for i in range(n):
+        k = key + i
+        sent[k] = time.monotonic()
+        await clients[i % len(clients)].send_updf(k, freqs[i % len(freqs)])
+        await asyncio.sleep(max(0.0, t0 + (i+1)/rate - time.monotonic()))
+    await asyncio.sleep(args.drain)
+    cpu1 = procprof.sample(bridge.proc.pid, 0.0)
+    lag1 = await scrape_lag(args.port+5)
+    up = [ (lns.uptimes[k] - t)*1e3 for k, t in sent.items() if k in lns.uptimes ]
+    dn = [ (dntimes[k] - lns.dnsent[k])*1e3 for k in sent if k in lns.dnsent and k in dntimes ]
+    ndn = sum(1 for k in sent if k in lns.dnsent)
+    uppct = bu.percentiles(up, (50,99))
+    dnpct = bu.percentiles(dn, (50,99))
+    gen = mon.summary((50,99))
+    return key + n, {
+        'uplinks': n,
+        'up_loss': 1 - len(up)/max(n,1),
+        'up_ms_p50': uppct['p50'],
+        'up_ms_p99': uppct['p99'],
+        'dn_loss': 1 - len(dn)/ndn if ndn else None,
+        'dn_ms_p50': dnpct['p50'],
+        'dn_ms_p99': dnpct['p99'],
+        'bridge_cpu_us_per_uplink': (cpu1[2] - cpu0[2])*1e6 / max(n,1) if cpu0 and cpu1 else None,
+        **lag_delta(lag0, lag1),
+        'gen_lag_ms_p50': gen['lag_ms_p50'],
+        'gen_lag_ms_p99': gen['lag_ms_p99'],
+    }
+
+
+async def child_main(kind:str) -> int:
+    rids = make_confdir(args.routers)
+    loop = asyncio.get_event_loop()
+    lns = Lns()
+    transport, _ = await loop.create_datagram_endpoint(lambda: lns, local_addr=('127.0.0.1', args.port+4))
+    bridge_args = [ 'main.py', '--infosuri', 'ws://localhost:%d' % args.port, '--pkfwduri', 'udp://localhost:%d' % (args.port+4),
+                    '--metricsuri', 'http://localhost:%d' % (args.port+5), '--confdir', CONF_DIR, '--loop', kind,
+                    '--loglevel', 'WARNING', '--logfile', os.path.abspath('bridge.log') ]
+    dntimes = {}  # type: Dict[int,float]
+    results = []
+    try:
+        async with fx.StationProcess(*bridge_args, binary=sys.executable, cwd=BRIDGE_DIR, profile=False) as bridge:
+            clients = [ StationClient(rid, dntimes) for rid in rids ]
+            for c in clients:
+                for _ in range(100):
+                    try:
+                        await c.connect('ws://localhost:%d/%s' % (args.port+2, c.rid))
+                        break
+                    except OSError:
+                        await asyncio.sleep(0.1)
+                else:
+                    raise AssertionError('Bridge MUXS not reachable')
+            # Wait for the PULL_DATA of every router - the downlink path
+            deadline = time.monotonic() + 10.0
+            while len(lns.pull_addrs) < len(rids) and time.monotonic() < deadline:
+                await asyncio.sleep(0.1)
+            key = 0x100
+            for rate in [ float(r) for r in args.rates.split(',') ]:
+                key, vals = await run_step(lns, clients, dntimes, bridge, rate, key)
+                results.append(('%s %g/s' % (kind, rate), vals))
+            for c in clients:
+                await c.close()
+    finally:
+        transport.close()
+    print(RESULT + json.dumps(results), flush=True)
+    return 0
+
+
+def main() -> int:
+    report = bu.BenchReport('loops')
+    for kind in args.loops.split(','):
+        if kind not in loops.available():
+            logger.warning('Loop %s not available - skipped', kind)
+            continue
+        cmd = [ sys.executable, sys.argv[0], '--child', kind ] + [ a for a in sys.argv[1:] ]
+        out = subprocess.run(cmd, stdout=subprocess.PIPE, check=True).stdout.decode()
+        line = next(l for l in out.splitlines() if l.startswith(RESULT))
+        for case, vals in json.loads(line[len(RESULT):]):
+            report.add(case, **vals)
+    report.done()
+    return 0
+
+
+if args.child:
+    loops.install(args.child)
+    fx.run(lambda: child_main(args.child), timeout=None)
+else:
+    sys.exit(main())
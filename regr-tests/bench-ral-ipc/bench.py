@@ -0,0 +1,192 @@
+# --- Revised 3-Clause BSD License ---
+# Copyright Semtech Corporation 2022. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright notice,
+#       this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright notice,
+#       this list of conditions and the following disclaimer in the documentation
+#       and/or other materials provided with the distribution.
+#     * Neither the name of the Semtech corporation nor the names of its
+#       contributors may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SEMTECH CORPORATION. BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+# Master/slave pipe IPC: the station master (testms* variants) runs N
+# Python radio slaves (slave.py, simutils.Slave) instead of ral_slave.c.
+# The slaves inject uplinks at an aggregate rate split evenly across them,
+# MUXS answers every --dn-every'th with a class A downlink and the slaves
+# echo each TX request they get. One station run per slave count and rate.
+# Reported: updf rate and loss, slave->MUXS uplink latency (pipe, master
+# and websocket), TX requests delivered and their lead ahead of the TX
+# time (TX_AIM_GAP less the master->slave delay).
+
+from typing import Any,Dict,List,Optional,Tuple
+import os
+import sys
+import glob
+import time
+import json
+import struct
+import asyncio
+import argparse
+import logging
+logger = logging.getLogger('bench-ral-ipc')
+
+import tcutils as tu
+import benchutils as bu
+import testutils as tstu
+import fixtures as fx
+import stationbench as sb
+from slave import UP_PORT, ECHO_PORT, ECHO, STAMP
+
+ap = argparse.ArgumentParser(description='Master/slave IPC benchmark.')
+ap.add_argument('--slaves', default='1,2,4', help='Comma separated slave counts - one station run each.')
+ap.add_argument('--rates', default='50,200,800', help='Comma separated aggregate uplink rates (frames/s).')
+ap.add_argument('--step', type=float, default=5.0, help='Seconds the slaves send per run.')
+ap.add_argument('--drain', type=float, default=3.0, help='Seconds to wait for late updfs and TX requests.')
+ap.add_argument('--dn-every', type=int, default=10, help='Answer every n-th uplink with a downlink (0: none).')
+ap.add_argument('--size', type=int, default=24, help='Uplink PHYPayload size (bytes, at least 21 for the send time).')
+args = ap.parse_args()
+
+tstu.setup_logging()
+logging.getLogger('_tcutils').setLevel(logging.INFO)
+
+VARIANT = os.environ.get('TEST_VARIANT', 'testsim')
+ROUTER_CONFIG = tu.router_config_EU863_6ch
+RXDELAY = 1
+
+
+class IpcMuxs(tu.Muxs):
+    def __init__(self) -> None:
+        super().__init__()
+        self.router_config = ROUTER_CONFIG
+        self.up_ms = []   # type: List[float]
+        self.dnsent = {}  # type: Dict[int,float]  pdu key -> mono
+        self.echos = {}   # type: Dict[int,Tuple[float,float]]  pdu key -> (dn delay ms, lead ms)
+        self.first = None # type: Optional[float]
+        self.last = None  # type: Optional[float]
+
+    def reset(self) -> None:
+        self.up_ms.clear()
+        self.dnsent.clear()
+        self.echos.clear()
+        self.first = self.last = None
+
+    async def handle_updf(self, ws, msg):
+        now = time.monotonic()
+        payload = bytes.fromhex(msg['FRMPayload'])
+        if msg['FPort'] == ECHO_PORT:
+            key, rxmono, lead = ECHO.unpack_from(payload, 0)
+            if key in self.dnsent:
+                self.echos[key] = (rxmono/1e3 - self.dnsent[key]*1e3, lead/1e3)
+            return
+        if msg['FPort'] != UP_PORT:
+            return
+        self.up_ms.append(now*1e3 - STAMP.unpack_from(payload, 0)[0]/1e3)
+        self.first = self.first or now
+        self.last = now
+        n = len(self.up_ms)
+        if args.dn_every and n % args.dn_every == 0:
+            await self.send_dnmsg(ws, msg, n)
+
+    async def send_dnmsg(self, ws, msg, key:int) -> None:
+        dnmsg = {
+            'msgtype' : 'dnmsg',
+            'dC'      : 0,
+            'priority': 0,
+            'RxDelay' : RXDELAY,
+            'RX1DR'   : msg['DR'],
+            'RX1Freq' : msg['Freq'],
+            'RX2DR'   : 0,
+            'RX2Freq' : 869525000,
+            'DevEui'  : '00-00-00-00-11-00-00-01',
+            'xtime'   : msg['upinfo']['xtime'],
+            'diid'    : key,
+            'MuxTime' : time.time(),
+            'rctx'    : msg['upinfo']['rctx'],
+            'pdu'     : sb.dnframe_pdu(key),
+        }
+        self.dnsent[key] = time.monotonic()
+        await ws.send(json.dumps(dnmsg))
+
+
+def make_slave_confs(n:int) -> None:
+    """slave-0.conf is checked in - the master runs one slave per slave-N.conf"""
+    for fn in glob.glob('slave-*.conf'):
+        idx = int(fn[6:-5])
+        if idx >= max(n, 1):
+            os.remove(fn)
+    for i in range(1, n):
+        with open('slave-%d.conf' % i, 'w') as f:
+            f.write('{}\n')
+
+
+async def run_case(muxs:IpcMuxs, nslaves:int, rate:float) -> Dict[str,Any]:
+    make_slave_confs(nslaves)
+    muxs.reset()
+    env = {
+        'RALBENCH_RATE' : str(rate/nslaves),
+        'RALBENCH_STEP' : str(args.step),
+        'RALBENCH_SIZE' : str(args.size),
+        'RALBENCH_FREQS': ','.join('%.3f' % f for f in sb.upchannels(ROUTER_CONFIG)),
+    }
+    exec_slave = '%s %s' % (sys.executable, os.path.abspath('slave.py'))
+    async with fx.StationProcess('-p', '--temp', '.', '-X', exec_slave, env=env):
+        deadline = time.monotonic() + 30.0
+        while muxs.first is None and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        if muxs.first is None:
+            raise AssertionError('No uplinks from %d slaves within 30s' % nslaves)
+        await asyncio.sleep(args.step + args.drain)
+    expected = nslaves * int(rate/nslaves*args.step)
+    nup = len(muxs.up_ms)
+    up = bu.percentiles(muxs.up_ms, (50,99))
+    leads = [ lead for _, lead in muxs.echos.values() ]
+    lead = bu.percentiles(leads, (1,50))
+    return {
+        'updf_rate': (nup-1)/(muxs.last-muxs.first) if nup > 1 and muxs.last > muxs.first else None,
+        'loss': 1 - nup/max(expected,1),
+        'up_ms_p50': up['p50'],
+        'up_ms_p99': up['p99'],
+        'dn': len(muxs.dnsent),
+        'tx_ratio': len(muxs.echos)/len(muxs.dnsent) if muxs.dnsent else None,
+        'lead_ms_p50': lead['p50'],
+        'lead_ms_p1': lead['p1'],
+        'late': sum(1 for x in leads if x < 0),
+    }
+
+
+async def main() -> int:
+    if not VARIANT.startswith('testms'):
+        logger.warning('Variant %s has no master/slave model - nothing to benchmark', VARIANT)
+        return 0
+    report = bu.BenchReport('ral-ipc')
+    muxs = IpcMuxs()
+    with open('tc.uri', 'w') as f:
+        f.write('ws://localhost:%d' % tu.INFOS_PORT)
+    try:
+        async with fx.serving(tu.Infos(), muxs):
+            for nslaves in [ int(s) for s in args.slaves.split(',') ]:
+                for rate in [ float(r) for r in args.rates.split(',') ]:
+                    vals = await run_case(muxs, nslaves, rate)
+                    report.add('%s %d slaves %g/s' % (VARIANT, nslaves, rate), **vals)
+    finally:
+        make_slave_confs(1)
+    report.done()
+    return 0
+
+fx.run(main, timeout=None)
@@ -0,0 +1,93 @@
+# --- Revised 3-Clause BSD License ---
+# Copyright Semtech Corporation 2022. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright notice,
+#       this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright notice,
+#       this list of conditions and the following disclaimer in the documentation
+#       and/or other materials provided with the distribution.
+#     * Neither the name of the Semtech corporation nor the names of its
+#       contributors may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SEMTECH CORPORATION. BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+# Radio slave of bench.py - exec'ed by the station master (-X). Sends
+# RALBENCH_RATE uplinks/s for RALBENCH_STEP secs once configured, each
+# carrying its send time (monotonic us) in FRMPayload. Every TX request is
+# echoed as an uplink on ECHO_PORT with the pdu key, the receive time and
+# the lead (us) of the request ahead of its TX time.
+
+import os
+import sys
+import time
+import struct
+import asyncio
+import logging
+
+import simutils as su
+import loops
+import stationbench as sb
+
+UP_PORT = 1
+ECHO_PORT = 2
+ECHO = struct.Struct('<Iqq')   # pdu key, receive mono us, lead us
+STAMP = struct.Struct('<q')    # send mono us
+
+
+class BenchSlave(su.Slave):
+    def __init__(self) -> None:
+        super().__init__()
+        self.rate = float(os.environ.get('RALBENCH_RATE', '10'))
+        self.step = float(os.environ.get('RALBENCH_STEP', '5'))
+        self.size = int(os.environ.get('RALBENCH_SIZE', '20'))
+        self.freqs = [ float(f) for f in os.environ.get('RALBENCH_FREQS', '868.1').split(',') ]
+        self.send_task = None  # type: asyncio.Future
+
+    async def ral_config(self, hwspec, config):
+        await super().ral_config(hwspec, config)
+        if self.send_task is None:
+            self.send_task = asyncio.ensure_future(self.send_uplinks())
+
+    async def ral_tx(self, rctx, txpow_eirp, rps, freq, txtime, txdata):
+        now = int(time.monotonic()*1e6)
+        key = sb.pdu_key(txdata)
+        echo = ECHO.pack(key, now, txtime - self.xtime())
+        self.send_rx(freq=self.freqs[0], rxdata=su.makeDF(devaddr=(self.slaveIdx<<24)|0x800000|(key & 0x7FFFFF),
+                                                          port=ECHO_PORT, payload=echo))
+        return None
+
+    async def send_uplinks(self) -> None:
+        n = int(self.rate*self.step)
+        base = self.slaveIdx << 24
+        t0 = time.monotonic()
+        for i in range(n):
+            stamp = STAMP.pack(int(time.monotonic()*1e6))
+            self.send_rx(freq=self.freqs[i % len(self.freqs)],
+                         rxdata=su.makeDF(devaddr=base|i, fcnt=i & 0xFFFF, port=UP_PORT,
+                                          payload=stamp + bytes(max(0, self.size - sb.UPFRAME_OVERHEAD - STAMP.size))))
+            await asyncio.sleep(max(0.0, t0 + (i+1)/self.rate - time.monotonic()))
+        logging.getLogger('slave').info('Slave (%d) sent %d uplinks in %.2fs', self.slaveIdx, n, time.monotonic()-t0)
+
+
+async def start() -> None:
+    await BenchSlave().start_slave()
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+    loops.install()
+    asyncio.ensure_future(start())
+    loops.get_event_loop().run_forever()
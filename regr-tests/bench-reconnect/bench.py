@@ -0,0 +1,307 @@
+# --- Revised 3-Clause BSD License ---
+# Copyright Semtech Corporation 2022. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright notice,
+#       this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright notice,
+#       this list of conditions and the following disclaimer in the documentation
+#       and/or other materials provided with the distribution.
+#     * Neither the name of the Semtech corporation nor the names of its
+#       contributors may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SEMTECH CORPORATION. BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Muxs outage / reconvergence: a population of real station processes and
+# simulated ws clients is connected to MUXS. MUXS is then killed and restarted
+# a number of times and the time until every router is connected again is
+# measured. The simulated clients follow the retry rules of src/tc.c
+# including the INFOS backoff hint. Each admission mode gets a fresh setup.
+
+from typing import Dict,List,Optional
+import os
+import re
+import sys
+import time
+import json
+import random
+import shutil
+import resource
+import asyncio
+from asyncio import subprocess
+import argparse
+import logging
+logger = logging.getLogger('bench-reconnect')
+
+import websockets
+import tcutils as tu
+import simutils as su
+import benchutils as bu
+import testutils as tstu
+import loops
+from id6 import Id6
+
+ap = argparse.ArgumentParser(description='MUXS outage reconvergence benchmark.')
+ap.add_argument('--stations', type=int, default=2, help='Number of real station processes.')
+ap.add_argument('--clients', type=int, default=1000, help='Number of simulated station clients.')
+ap.add_argument('--outages', type=int, default=3, help='Number of MUXS kill/restart cycles.')
+ap.add_argument('--downtime', type=float, default=5.0, help='Seconds MUXS stays down per outage.')
+ap.add_argument('--admission', nargs='*', default=['off', 'on'], choices=['off', 'on'], help='Admission modes to compare.')
+ap.add_argument('--infos-rate', type=float, default=200.0, help='INFOS admission rate (connects/s).')
+ap.add_argument('--muxs-rate', type=float, default=200.0, help='Rate of MUXS connects paced by INFOS backoff hints (connects/s).')
+ap.add_argument('--burst', type=float, default=50.0, help='Burst size of the admission buckets.')
+ap.add_argument('--converge-timeout', type=float, default=600.0, help='Give up waiting for reconvergence after this many seconds.')
+ap.add_argument('--seed', type=int, default=1)
+args = ap.parse_args()
+
+tstu.setup_logging()
+logging.getLogger('_tcutils').setLevel(logging.CRITICAL)  # MUXS kills produce close errors
+logging.getLogger('websockets').setLevel(logging.CRITICAL)
+
+soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+if soft < hard:
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+INFOS_URI = 'ws://localhost:6038'
+MUXS_URI  = 'ws://localhost:6039/router-%s'
+
+# Router ids - real stations first, simulated clients after
+STATION_BASE = 0x1
+CLIENT_BASE  = 0x10000
+
+
+class BenchMuxs(tu.Muxs):
+    """MUXS accepting /router-<id6> and tracking which routers are connected."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.connected = {}  # type: Dict[int,float]
+        self.expected = 0
+        self.converged = asyncio.Event()
+
+    async def handle_ws(self, ws):
+        m = re.match(r'^/router-(.+)$', tu.get_ws_path(ws))
+        if not m:
+            await ws.close(4000)
+            return
+        rid = Id6(m.group(1)).id
+        self.connected[rid] = time.monotonic()
+        if len(self.connected) >= self.expected:
+            self.converged.set()
+        try:
+            await ws.send(json.dumps(self.get_router_config()))
+            await self.handle_connection(ws)
+        finally:
+            self.connected.pop(rid, None)
+
+    async def kill(self) -> None:
+        self.server.close()
+        await self.server.wait_closed()
+        self.server = None
+        self.connected.clear()
+        self.converged.clear()
+
+
+class SimClient:
+    """Simulated station following the INFOS/MUXS retry rules of src/tc.c."""
+
+    REJECTED = 'rejected'
+    FAILED   = 'failed'
+    CLOSED   = 'closed'
+
+    def __init__(self, routerid:int) -> None:
+        self.routerid = routerid
+        self.retries = 0
+        self.muxsuri = None  # type: Optional[str]
+        self.hint = 0
+        self.ncups = 0
+        self.ninfos = 0
+        self.nmuxs = 0
+
+    async def infos_request(self) -> str:
+        self.ninfos += 1
+        self.hint = 0
+        try:
+            async with websockets.connect(INFOS_URI+'/router-info', open_timeout=60) as ws:
+                await ws.send(json.dumps({ 'router': self.routerid }))
+                resp = json.loads(await asyncio.wait_for(ws.recv(), 60))
+        except Exception:
+            return SimClient.FAILED
+        self.hint = resp.get('backoff', 0)
+        if 'error' in resp or not resp.get('uri'):
+            return SimClient.FAILED if self.hint else SimClient.REJECTED
+        self.muxsuri = resp['uri']
+        if self.hint:
+            await asyncio.sleep(self.hint)
+            self.hint = 0
+        return await self.muxs_session()
+
+    async def muxs_session(self) -> str:
+        self.nmuxs += 1
+        connected = False
+        try:
+            async with websockets.connect(self.muxsuri, open_timeout=60) as ws:
+                connected = True
+                await ws.send(json.dumps({ 'msgtype': 'version', 'station': 'bench', 'protocol': 2 }))
+                async for _ in ws:
+                    pass
+        except Exception:
+            pass
+        return SimClient.CLOSED if connected else SimClient.FAILED
+
+    async def run(self, delay:float) -> None:
+        await asyncio.sleep(delay)
+        tstate = await self.infos_request()
+        while True:
+            # Mirrors tc_continue
+            if tstate == SimClient.REJECTED or self.retries >= 10:
+                self.ncups += 1
+                self.retries = 0
+                self.muxsuri = None
+                await asyncio.sleep(1.0)
+                tstate = await self.infos_request()
+                continue
+            if self.muxsuri is not None:
+                if self.retries <= 4 and tstate == SimClient.CLOSED:
+                    await asyncio.sleep(1 << self.retries)
+                    self.retries += 1
+                    tstate = await self.muxs_session()
+                    continue
+                self.muxsuri = None
+                self.retries = 1
+            await asyncio.sleep(self.hint or min(self.retries, 6) * 10)
+            self.retries += 1
+            tstate = await self.infos_request()
+
+
+class Setup:
+    def __init__(self, admission:bool) -> None:
+        self.admission = admission
+        self.infos = tu.Infos()
+        self.infos.backlog = 4096
+        self.muxs = BenchMuxs()
+        self.muxs.backlog = 4096
+        if admission:
+            self.infos.admission = tu.TokenBucket(args.infos_rate, args.burst)
+            self.infos.muxs_admission = tu.TokenBucket(args.muxs_rate, args.burst)
+        self.sims = []      # type: List[su.LgwSimServer]
+        self.procs = []     # type: List[asyncio.subprocess.Process]
+        self.tasks = []     # type: List[asyncio.Task]
+        self.clients = []   # type: List[SimClient]
+
+    def routerids(self) -> List[int]:
+        return ([ STATION_BASE+i for i in range(args.stations) ] +
+                [ CLIENT_BASE+i for i in range(args.clients) ])
+
+    async def start_station(self, idx:int) -> None:
+        rid = Id6(STATION_BASE+idx)
+        home = 'st-%d' % idx
+        shutil.rmtree(home, ignore_errors=True)
+        os.makedirs(home)
+        with open('station.conf') as f:
+            conf = f.read().replace('"routerid": "::1"', '"routerid": "%s"' % rid)
+        with open(os.path.join(home, 'station.conf'), 'w') as f:
+            f.write(conf)
+        shutil.copy('slave-0.conf', home)
+        with open(os.path.join(home, 'tc.uri'), 'w') as f:
+            f.write(INFOS_URI)
+        sim = su.LgwSimServer(os.path.join(home, 'spidev'))
+        await sim.start_server()
+        self.sims.append(sim)
+        self.procs.append(await subprocess.create_subprocess_exec(
+            'station', '-p', '--home', home, '--temp', home))
+
+    async def start(self) -> None:
+        rids = self.routerids()
+        for rid in rids:
+            self.infos.add_route(rid, MUXS_URI % Id6(rid))
+        self.muxs.expected = len(rids)
+        await self.infos.start_server()
+        await self.muxs.start_server()
+        for i in range(args.stations):
+            await self.start_station(i)
+        rnd = random.Random(args.seed)
+        self.clients = [ SimClient(CLIENT_BASE+i) for i in range(args.clients) ]
+        self.tasks = [ asyncio.ensure_future(c.run(rnd.random())) for c in self.clients ]
+
+    async def stop(self) -> None:
+        for t in self.tasks:
+            t.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        for p in self.procs:
+            p.terminate()
+            await p.wait()
+        for sim in self.sims:
+            sim.close()
+        for srv in (self.muxs.server, self.infos.server):
+            if srv is not None:
+                srv.close()
+                await srv.wait_closed()
+
+    async def converge(self, t0:float) -> Optional[float]:
+        try:
+            await asyncio.wait_for(self.muxs.converged.wait(), args.converge_timeout)
+        except asyncio.TimeoutError:
+            logger.error('Not converged after %.0fs: %d/%d routers connected',
+                         args.converge_timeout, len(self.muxs.connected), self.muxs.expected)
+            return None
+        return time.monotonic() - t0
+
+    def counters(self) -> Dict[str,int]:
+        return {
+            'infos_rejected': self.infos.nrejected,
+            'infos_reqs'    : sum(c.ninfos for c in self.clients),
+            'muxs_conns'    : sum(c.nmuxs for c in self.clients),
+            'cups'          : sum(c.ncups for c in self.clients),
+        }
+
+
+async def run_mode(admission:bool, report:bu.BenchReport) -> None:
+    mode = 'admission' if admission else 'no-admission'
+    setup = Setup(admission)
+    t0 = time.monotonic()
+    await setup.start()
+    try:
+        secs = await setup.converge(t0)
+        report.add('%s-startup' % mode, routers=setup.muxs.expected, secs=secs, **setup.counters())
+        if secs is None:
+            return
+        lat = []  # type: List[float]
+        totals = []  # type: List[float]
+        for outage in range(args.outages):
+            await setup.muxs.kill()
+            await asyncio.sleep(args.downtime)
+            t0 = time.monotonic()
+            await setup.muxs.start_server()
+            secs = await setup.converge(t0)
+            lat.extend(t - t0 for t in setup.muxs.connected.values())
+            report.add('%s-outage%d' % (mode, outage), routers=setup.muxs.expected, secs=secs, **setup.counters())
+            if secs is None:
+                return
+            totals.append(secs)
+        report.add('%s-reconverge' % mode, routers=setup.muxs.expected, outages=args.outages,
+                   secs_max=max(totals), secs_mean=sum(totals)/len(totals),
+                   **{ 'router_%s' % k: v for k,v in bu.percentiles(lat).items() })
+    finally:
+        await setup.stop()
+
+
+async def main() -> None:
+    report = bu.BenchReport('reconnect')
+    for mode in args.admission:
+        await run_mode(mode == 'on', report)
+    report.done()
+
+loops.run(main())
@@ -0,0 +1,237 @@
+# --- Revised 3-Clause BSD License ---
+# Copyright Semtech Corporation 2022. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright notice,
+#       this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright notice,
+#       this list of conditions and the following disclaimer in the documentation
+#       and/or other materials provided with the distribution.
+#     * Neither the name of the Semtech corporation nor the names of its
+#       contributors may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SEMTECH CORPORATION. BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+# Gateway density over a shared RF medium: devices spread over a square area
+# send uplinks through rfmedium to 1..N real stations (gateways on a grid,
+# each with its own home st-N/ and lgwsim socket). MUXS plays the LNS: it
+# deduplicates the copies of each uplink within --dedup-window, answers a
+# share of them with a class A downlink through the gateway with the best
+# SNR and counts copies arriving after the window. Downlinks propagate back
+# through the medium to the devices. Reported per gateway count: unique
+# delivery ratio, copies per uplink (LNS dedup load), losses by cause and
+# downlinks received by devices.
+
+from typing import Any,Dict,List,Optional,Tuple
+import os
+import re
+import math
+import time
+import json
+import random
+import shutil
+import asyncio
+import argparse
+import contextlib
+import logging
+logger = logging.getLogger('bench-rf-medium')
+
+import tcutils as tu
+import simutils as su
+import benchutils as bu
+import testutils as tstu
+import fixtures as fx
+import stationbench as sb
+import rfmedium as rf
+from id6 import Id6
+
+ap = argparse.ArgumentParser(description='Gateway density benchmark over a shared RF medium.')
+ap.add_argument('--gateways', default='1,2,4', help='Comma separated gateway counts.')
+ap.add_argument('--devices', type=int, default=200, help='Number of devices.')
+ap.add_argument('--area', type=float, default=6000.0, help='Side of the square area (m).')
+ap.add_argument('--rate', type=float, default=10.0, help='Uplinks per second (all devices).')
+ap.add_argument('--duration', type=float, default=60.0, help='Seconds of uplinks per gateway count.')
+ap.add_argument('--shadowing', type=float, default=4.0, help='Log-normal shadowing sigma (dB).')
+ap.add_argument('--adr-margin', type=float, default=10.0, help='SNR margin (dB) for the device SF choice.')
+ap.add_argument('--dedup-window', type=float, default=0.2, help='LNS dedup window (s).')
+ap.add_argument('--dn-share', type=float, default=0.1, help='Share of uplinks answered with a downlink.')
+ap.add_argument('--seed', type=int, default=1)
+args = ap.parse_args()
+
+tstu.setup_logging()
+logging.getLogger('_tcutils').setLevel(logging.INFO)
+logging.getLogger('simutils').setLevel(logging.INFO)
+
+VARIANT = os.environ.get('TEST_VARIANT', 'testsim')
+ROUTER_CONFIG = tu.router_config_EU863_6ch
+MUXS_URI = 'ws://localhost:%d/router-%%s' % tu.MUXS_PORT
+RXDELAY = 1
+GW_BASE = 0x1
+
+
+class DedupMuxs(tu.Muxs):
+    """MUXS for several routers (/router-<id6>) deduplicating updfs by (DevAddr, FCnt)."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.router_config = ROUTER_CONFIG
+        self.uplinks = {}    # type: Dict[Tuple[int,int],Dict[str,Any]]
+        self.dnkeys = {}     # type: Dict[int,Tuple[int,int]]  downlink pdu key -> uplink
+        self.late = 0
+
+    async def handle_ws(self, ws):
+        m = re.match(r'^/router-(.+)$', tu.get_ws_path(ws))
+        if not m:
+            await ws.close(4000)
+            return
+        await ws.send(json.dumps(self.get_router_config()))
+        await self.handle_connection(ws)
+
+    async def handle_updf(self, ws, msg):
+        key = (msg['DevAddr'], msg['FCnt'])
+        up = self.uplinks.get(key)
+        if up is None:
+            up = self.uplinks[key] = self.expect(key)
+        elif up['closed']:
+            self.late += 1
+        up['copies'].append((ws, msg))
+
+    def expect(self, key:Tuple[int,int], dn:bool=False) -> Dict[str,Any]:
+        """Open the dedup window of an uplink - dn: answer it with a downlink"""
+        up = self.uplinks[key] = { 'copies': [], 'closed': False, 'dn': dn }
+        asyncio.ensure_future(self.dedup(key, up))
+        return up
+
+    async def dedup(self, key:Tuple[int,int], up:Dict[str,Any]) -> None:
+        await asyncio.sleep(args.dedup_window)
+        up['closed'] = True
+        if not up['dn'] or not up['copies']:
+            return
+        ws, msg = max(up['copies'], key=lambda c: c[1]['upinfo']['snr'])
+        dnkey = len(self.dnkeys) + 1
+        self.dnkeys[dnkey] = key
+        dnmsg = {
+            'msgtype' : 'dnmsg',
+            'dC'      : 0,
+            'priority': 0,
+            'RxDelay' : RXDELAY,
+            'RX1DR'   : msg['DR'],
+            'RX1Freq' : msg['Freq'],
+            'RX2DR'   : 0,
+            'RX2Freq' : 869525000,
+            'DevEui'  : '00-00-00-00-11-00-00-01',
+            'xtime'   : msg['upinfo']['xtime'],
+            'diid'    : dnkey,
+            'MuxTime' : time.time(),
+            'rctx'    : msg['upinfo']['rctx'],
+            'pdu'     : sb.dnframe_pdu(dnkey),
+        }
+        await ws.send(json.dumps(dnmsg))
+
+
+def grid(n:int, side:float) -> List[rf.Position]:
+    """n gateway positions on the cell centers of a square grid"""
+    k = math.ceil(math.sqrt(n))
+    cell = side / k
+    return [ ((i % k + 0.5)*cell, (i // k + 0.5)*cell) for i in range(n) ]
+
+
+def make_home(idx:int) -> str:
+    home = 'st-%d' % idx
+    shutil.rmtree(home, ignore_errors=True)
+    os.makedirs(home)
+    with open('station.conf') as f:
+        conf = f.read().replace('"routerid": "::1"', '"routerid": "%s"' % Id6(GW_BASE+idx))
+    with open(os.path.join(home, 'station.conf'), 'w') as f:
+        f.write(conf)
+    shutil.copy('slave-0.conf', home)
+    with open(os.path.join(home, 'tc.uri'), 'w') as f:
+        f.write('ws://localhost:%d' % tu.INFOS_PORT)
+    return home
+
+
+async def run_case(ngw:int, report:bu.BenchReport) -> None:
+    rnd = random.Random(args.seed)
+    infos = tu.Infos()
+    muxs = DedupMuxs()
+    medium = rf.Medium(rf.LogDistance(shadowing=args.shadowing, seed=args.seed))
+    homes = [ make_home(i) for i in range(ngw) ]
+    sims = [ su.LgwSimServer(os.path.join(home, 'spidev')) for home in homes ]
+    for i, (sim, pos) in enumerate(zip(sims, grid(ngw, args.area))):
+        infos.add_route(GW_BASE+i, MUXS_URI % Id6(GW_BASE+i))
+        medium.add_gateway(GW_BASE+i, sim, pos)
+    chans = sb.upchannels(ROUTER_CONFIG)
+    devs = []
+    for d in range(args.devices):
+        dev = medium.add_device(0x1000+d, (rnd.uniform(0, args.area), rnd.uniform(0, args.area)))
+        dev.sf = medium.best_sf(dev.pos, dev.txpow, args.adr_margin)
+        dev.fcnt = 0
+        devs.append(dev)
+
+    async with contextlib.AsyncExitStack() as stack:
+        await stack.enter_async_context(fx.serving(infos, muxs, *sims))
+        for home in homes:
+            await stack.enter_async_context(fx.StationProcess('-p', '--home', home, '--temp', home, profile=False))
+        for sim in sims:
+            await sim.expect_connected(0, within=30.0)
+        await asyncio.sleep(3.0)
+
+        sent = []  # type: List[Tuple[Tuple[int,int],Dict[Any,rf.Reception]]]
+        n = int(args.rate*args.duration)
+        t0 = time.monotonic()
+        for i in range(n):
+            delay = t0 + i/args.rate - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            dev = rnd.choice(devs)
+            dev.fcnt += 1
+            key = (dev.name, dev.fcnt & 0xFFFF)
+            if rnd.random() < args.dn_share:
+                muxs.expect(key, dn=True)
+            rxs = medium.transmit(dev, chans[i % len(chans)], (dev.sf,125),
+                                  sb.uplink_frame(dev.name, 20, fcnt=dev.fcnt))
+            sent.append((key, rxs))
+        await asyncio.sleep(2*RXDELAY + 2.0)
+        await medium.close()
+
+    # Uplinks picked for a downlink were registered before any copy arrived
+    ups = [ muxs.uplinks.get(key) for key,_ in sent ]
+    copies = [ len(up['copies']) if up else 0 for up in ups ]
+    heard = [ c for c in copies if c ]
+    ndn = len(muxs.dnkeys)
+    # Downlinks received by the device they were meant for
+    ndnrx = len(set(dnkey for dev in devs for _,rx in dev.received
+                    for dnkey in [sb.pdu_key(rx.frame)] if muxs.dnkeys.get(dnkey,(None,))[0] == dev.name))
+    vals = { 'uplinks': n,
+             'delivered': len(heard) / max(n,1),
+             'copies_mean': sum(heard) / max(len(heard),1),
+             'copies_max': max(heard) if heard else 0,
+             'updf_per_s': sum(copies) / args.duration,
+             'late_copies': muxs.late,
+             'dn_sent': ndn,
+             'dn_received': ndnrx / max(ndn,1) }
+    vals.update((k, v) for k,v in sorted(medium.stats.items()) if k.startswith(('up_', 'dn_')))
+    report.add('%s %d gw %d dev' % (VARIANT, ngw, args.devices), **vals)
+
+
+async def main() -> int:
+    report = bu.BenchReport('rf-medium')
+    for ngw in [ int(x) for x in args.gateways.split(',') ]:
+        await run_case(ngw, report)
+    report.done()
+    return 0
+
+fx.run(main, timeout=None)
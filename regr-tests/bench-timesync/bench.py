@@ -0,0 +1,165 @@
+# --- Revised 3-Clause BSD License ---
+# Copyright Semtech Corporation 2022. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright notice,
+#       this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright notice,
+#       this list of conditions and the following disclaimer in the documentation
+#       and/or other materials provided with the distribution.
+#     * Neither the name of the Semtech corporation nor the names of its
+#       contributors may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SEMTECH CORPORATION. BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+# Time sync faults: each scenario runs a station against timesim models for
+# SX130x clock drift, PPS jitter/outages, NMEA outages and asymmetric LNS
+# timesync delays. Probe uplinks compare the gpstime the station reports in
+# updf with the true GPS time of the frame. Reported per scenario: time to
+# the first synced uplink, share of synced uplinks and the error distribution
+# after --settle, and the station's time sync complaints from station.log.
+#
+# station.conf is written by bench.py - scenarios differ in the PPS mode
+# ("gps" or "fuzzy"). Slow processes are compressed by Scenario.speed, e.g.
+# temp-cycle plays one day of temperature drift per run.
+
+from typing import Any,Callable,Dict,List,Tuple
+import os
+import re
+import sys
+import json
+import asyncio
+import argparse
+import logging
+logger = logging.getLogger('bench-timesync')
+
+import tcutils as tu
+import simutils as su
+import benchutils as bu
+import testutils as tstu
+import fixtures as fx
+import stationbench as sb
+import timesim as ts
+
+ap = argparse.ArgumentParser(description='Time sync fault benchmark.')
+ap.add_argument('--scenarios', nargs='*', default=None, help='Scenarios to run (default: all).')
+ap.add_argument('--duration', type=float, default=300.0, help='Seconds per scenario.')
+ap.add_argument('--settle', type=float, default=60.0, help='Scenario seconds ignored for error statistics.')
+ap.add_argument('--probe', type=float, default=2.0, help='Seconds between probe uplinks.')
+ap.add_argument('--seed', type=int, default=1)
+args = ap.parse_args()
+
+tstu.setup_logging()
+logging.getLogger('_tcutils').setLevel(logging.INFO)
+logging.getLogger('simutils').setLevel(logging.INFO)
+
+VARIANT = os.environ.get('TEST_VARIANT', 'testsim')
+STATION_LOG = 'station.log'
+D = args.duration
+
+# name -> (PPS mode, scenario factory)
+SCENARIOS = {
+    'ideal':       ('gps',   lambda: ts.Scenario()),
+    'drift':       ('gps',   lambda: ts.Scenario(drift=ts.RandomWalkDrift(ppm=2.0, step=0.2, limit=20.0, seed=args.seed))),
+    'temp-cycle':  ('gps',   lambda: ts.Scenario(drift=ts.TemperatureDrift(ppm=1.0, amplitude=8.0), speed=86400/D)),
+    'pps-jitter':  ('gps',   lambda: ts.Scenario(pps=ts.PpsModel(jitter_us=100.0, seed=args.seed))),
+    'pps-outage':  ('gps',   lambda: ts.Scenario(pps=ts.PpsModel(outages=ts.Outages([(0.3*D, 0.2*D), (0.7*D, 20.0)])))),
+    'nmea-outage': ('gps',   lambda: ts.Scenario(nmea=ts.NmeaModel(outages=ts.Outages(rate=20.0, mean_len=20.0, seed=args.seed)))),
+    'asym-rtt':    ('fuzzy', lambda: ts.Scenario(rtt=ts.RttModel(up=0.02, down=0.2, jitter=0.05, seed=args.seed))),
+}
+
+EVENTS = [
+    ('no_pps',         r'No PPS pulse'),
+    ('sync_rejected',  r'Time sync rejected'),
+    ('excess_drift',   r'excessive clock drifts'),
+    ('lns_pps_drift',  r'Too much drift between last PPS'),
+    ('lns_syncs',      r'Timesync with LNS'),
+    ('gps_nofix',      r'GPS nofix|GGA sentence without a fix'),
+    ('conversion_err', r'Cannot convert|Failed to convert'),
+    ('forced_reset',   r'forcing reset'),
+]
+EVENTS_RE = [ (name, re.compile(rx)) for name,rx in EVENTS ]
+
+
+def write_station_conf(pps_mode:str) -> None:
+    conf = {
+        'SX1301_conf': {
+            'lorawan_public': True,
+            'clksrc': 1,
+            'device': 'spidev',
+            'pps': True,
+            'radio_0': { 'type': 'SX1257', 'rssi_offset': -166.0, 'tx_enable': True, 'antenna_gain': 0 },
+            'radio_1': { 'type': 'SX1257', 'rssi_offset': -166.0, 'tx_enable': False },
+        },
+        'station_conf': {
+            'routerid': '::1',
+            'gps': '~/gps.fifo',
+            'pps': pps_mode,
+            'log_file': STATION_LOG,
+            'log_level': 'VERBOSE',
+            'log_size': 100000000,
+            'log_rotate': 3,
+        },
+    }
+    with open('station.conf', 'w') as f:
+        json.dump(conf, f, indent=4)
+
+
+async def run_scenario(name:str, report:bu.BenchReport) -> None:
+    pps_mode, make = SCENARIOS[name]
+    write_station_conf(pps_mode)
+    timesim = ts.TimeSim(make())
+    probe = ts.TimeErrorProbe(timesim, interval=args.probe, freq=sb.upchannels(tu.router_config_EU863_6ch)[0])
+    muxs = ts.TimesyncMuxs(timesim, probe)
+    sim = su.LgwSimServer()
+    log = sb.LogTail(STATION_LOG)
+    log.lines()
+    async with sb.station_setup(muxs, sim, warmup=0.0):
+        timesim.start(sim, 'gps.fifo')
+        probe.start(sim)
+        await asyncio.sleep(args.duration)
+        await probe.stop()
+        await timesim.stop()
+
+    events = { k: 0 for k,_ in EVENTS }
+    for line in log.lines():
+        for k, rx in EVENTS_RE:
+            if rx.search(line):
+                events[k] += 1
+    settle = args.settle * timesim.scenario.speed
+    errs = [ abs(e) for e in probe.errors(settle) ]
+    first = next((t for t,e in probe.samples if e is not None), float('nan'))
+    vals = { 'probes': len(probe.samples),
+             'first_sync_s': first / timesim.scenario.speed,
+             'synced': probe.synced_ratio(settle),
+             'nmea': timesim.nmea_written }
+    vals.update(('err_us_'+p, v) for p,v in bu.percentiles(errs, (50,99)).items())
+    vals['err_us_max'] = max(errs) if errs else float('nan')
+    vals.update(events)
+    report.add('%s %s' % (VARIANT, name), **vals)
+
+
+async def main() -> int:
+    report = bu.BenchReport('timesync')
+    for name in args.scenarios or list(SCENARIOS):
+        if name not in SCENARIOS:
+            logger.error('Unknown scenario: %s (have: %s)', name, ' '.join(SCENARIOS))
+            return 2
+        await run_scenario(name, report)
+    report.done()
+    return 0
+
+fx.run(main, timeout=None)
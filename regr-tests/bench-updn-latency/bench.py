@@ -0,0 +1,194 @@
+# --- Revised 3-Clause BSD License ---
+# Copyright Semtech Corporation 2022. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright notice,
+#       this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright notice,
+#       this list of conditions and the following disclaimer in the documentation
+#       and/or other materials provided with the distribution.
+#     * Neither the name of the Semtech corporation nor the names of its
+#       contributors may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SEMTECH CORPORATION. BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+# Uplink to downlink latency of the station data path. Every uplink injected
+# with LgwSim.send_rx is answered by Muxs with a class A dnmsg as soon as its
+# updf arrives. Each hop is timestamped (monotonic, xticks at the radio):
+#
+#   rx      frame handed to the station by LgwSim.send_rx
+#   updf    updf arrived at Muxs - dnmsg sent right away
+#   tx      TX frame handed to LgwSim by the station (LgwSim.on_tx)
+#   dntxed  dntxed arrived at Muxs
+#
+# Reported hops are rx->updf, updf->dnmsg, dnmsg->tx (includes the station
+# holding the frame until shortly before RX1) and tx->dntxed (air time plus
+# the station's TX done report).
+# The RX1 margins are the slack left when the dnmsg was sent (RX1 air time
+# minus dnmsg send time) and how early the station handed the frame to the
+# radio (count_us minus xticks at on_tx). Cases sweep the uplink rate, SF mix
+# and payload size. bench.sh runs this once per build variant.
+
+from typing import Any,Dict,List
+import os
+import sys
+import time
+import json
+import asyncio
+import argparse
+import logging
+logger = logging.getLogger('bench-updn-latency')
+
+import tcutils as tu
+import simutils as su
+import benchutils as bu
+import testutils as tstu
+import fixtures as fx
+import stationbench as sb
+
+ap = argparse.ArgumentParser(description='Uplink to downlink latency benchmark.')
+ap.add_argument('--rates', default='2,10,20', help='Comma separated uplink rates (frames/s).')
+ap.add_argument('--sfs', nargs='*', default=['7', '7-9', '7-12'], help='SF mixes - single SF or range, used round robin.')
+ap.add_argument('--sizes', default='20,51', help='Comma separated uplink PHYPayload sizes (bytes).')
+ap.add_argument('--duration', type=float, default=10.0, help='Seconds of uplinks per case.')
+ap.add_argument('--drain', type=float, default=3.0, help='Seconds to wait for outstanding downlinks after a case.')
+args = ap.parse_args()
+
+tstu.setup_logging()
+logging.getLogger('_tcutils').setLevel(logging.INFO)
+logging.getLogger('simutils').setLevel(logging.INFO)
+
+VARIANT = os.environ.get('TEST_VARIANT', 'testsim')
+RX1DELAY = 1   # secs
+# Duty cycle would block most RX1 downlinks at higher rates
+ROUTER_CONFIG = { **tu.router_config_EU863_6ch, 'nodc': True }
+
+
+def parse_sfs(spec:str) -> List[int]:
+    lo, _, hi = spec.partition('-')
+    return list(range(int(lo), int(hi or lo)+1))
+
+
+class LatencyMuxs(tu.Muxs):
+    def __init__(self) -> None:
+        super().__init__()
+        self.router_config = ROUTER_CONFIG
+        self.frames = {}  # type: Dict[int,Dict[str,Any]]
+
+    async def handle_updf(self, ws, msg):
+        fr = self.frames.get(msg['DevAddr'])
+        if fr is None:
+            return
+        fr['updf'] = time.monotonic()
+        dnmsg = {
+            'msgtype' : 'dnmsg',
+            'dC'      : 0,
+            'dnmode'  : 'updn',
+            'priority': 0,
+            'RxDelay' : RX1DELAY,
+            'RX1DR'   : msg['DR'],
+            'RX1Freq' : msg['Freq'],
+            'RX2DR'   : 0,
+            'RX2Freq' : 869525000,
+            'DevEui'  : '00-00-00-00-11-00-00-01',
+            'xtime'   : msg['upinfo']['xtime'],
+            'seqno'   : msg['DevAddr'],
+            'MuxTime' : time.time(),
+            'rctx'    : msg['upinfo']['rctx'],
+            'pdu'     : sb.dnframe_pdu(msg['DevAddr']),
+        }
+        await ws.send(json.dumps(dnmsg))
+        fr['dnmsg'] = time.monotonic()
+
+    async def handle_dntxed(self, ws, msg):
+        fr = self.frames.get(msg['seqno'])
+        if fr is not None:
+            fr['dntxed'] = time.monotonic()
+
+
+class LatencySim(su.LgwSimServer):
+    def __init__(self) -> None:
+        super().__init__()
+        self.frames = {}  # type: Dict[int,Dict[str,Any]]
+
+    async def on_tx(self, lgwsim, pkt):
+        fr = self.frames.get(sb.pdu_key(pkt['payload']))
+        if fr is None:
+            return
+        fr['tx'] = time.monotonic()
+        fr['lead'] = sb.xticks_diff(pkt['count_us'], lgwsim.xticks())
+        fr['rxwin'] = sb.xticks_diff(pkt['count_us'], fr['rxxt']) / 1e6  # 1=RX1 2=RX2
+
+
+def hop_ms(frames, a:str, b:str) -> List[float]:
+    return [ (fr[b]-fr[a])*1e3 for fr in frames if a in fr and b in fr ]
+
+
+async def run_case(lgwsim:su.LgwSim, muxs:LatencyMuxs, sim:LatencySim, devaddr:int,
+                   rate:float, sfspec:str, size:int, report:bu.BenchReport) -> int:
+    frames = {}  # type: Dict[int,Dict[str,Any]]
+    muxs.frames = sim.frames = frames
+    sfs = parse_sfs(sfspec)
+    chans = sb.upchannels(ROUTER_CONFIG)
+    n = int(rate*args.duration)
+    t0 = time.monotonic()
+    for i in range(n):
+        delay = t0 + i/rate - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        xt = lgwsim.xticks()
+        frames[devaddr+i] = { 'rx': time.monotonic(), 'rxxt': xt & sb.XTICKS_MASK }
+        await lgwsim.send_rx(rps=(sfs[i % len(sfs)],125), freq=chans[i % len(chans)], rxtime=xt,
+                             frame=sb.uplink_frame(devaddr+i, size, fcnt=i))
+    await asyncio.sleep(RX1DELAY + args.drain)
+
+    frs = list(frames.values())
+    ntx = sum(1 for fr in frs if 'tx' in fr)
+    nrx1 = sum(1 for fr in frs if round(fr.get('rxwin', 0)) == RX1DELAY)
+    vals = { 'n': n,
+             'updf': sum(1 for fr in frs if 'updf' in fr) / max(n,1),
+             'tx': ntx / max(n,1),
+             'rx1': nrx1 / max(ntx,1) }
+    for name, samples in (('rx_updf_ms', hop_ms(frs, 'rx', 'updf')),
+                          ('updf_dnmsg_ms', hop_ms(frs, 'updf', 'dnmsg')),
+                          ('dnmsg_tx_ms', hop_ms(frs, 'dnmsg', 'tx')),
+                          ('tx_dntxed_ms', hop_ms(frs, 'tx', 'dntxed'))):
+        for p,v in bu.percentiles(samples, (50,99)).items():
+            vals['%s_%s' % (name,p)] = v
+    # Slack left for the station when the dnmsg went out - RX1 is due RX1DELAY after rx
+    slack = [ (fr['rx'] + RX1DELAY - fr['dnmsg'])*1e3 for fr in frs if 'dnmsg' in fr ]
+    lead = [ fr['lead']/1e3 for fr in frs if 'lead' in fr ]
+    for name, samples in (('dn_slack_ms', slack), ('tx_lead_ms', lead)):
+        for p,v in bu.percentiles(samples, (1,50)).items():
+            vals['%s_%s' % (name,p)] = v
+    report.add('%s sf%s %dB %g/s' % (VARIANT, sfspec, size, rate), **vals)
+    return devaddr + n
+
+
+async def main() -> int:
+    report = bu.BenchReport('updn-latency')
+    muxs = LatencyMuxs()
+    sim = LatencySim()
+    devaddr = 0x100
+    async with sb.station_setup(muxs, sim) as lgwsim:
+        for size in [ int(x) for x in args.sizes.split(',') ]:
+            for sfspec in args.sfs:
+                for rate in [ float(x) for x in args.rates.split(',') ]:
+                    devaddr = await run_case(lgwsim, muxs, sim, devaddr, rate, sfspec, size, report)
+    report.done()
+    return 0
+
+fx.run(main, timeout=None)
@@ -0,0 +1,107 @@
+# --- Revised 3-Clause BSD License ---
+# Copyright Semtech Corporation 2022. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright notice,
+#       this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright notice,
+#       this list of conditions and the following disclaimer in the documentation
+#       and/or other materials provided with the distribution.
+#     * Neither the name of the Semtech corporation nor the names of its
+#       contributors may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL SEMTECH CORPORATION. BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+# Uplink saturation: uplinks are injected into LgwSim at a rising rate until
+# the station drops frames or delays updf messages beyond a limit. Every
+# injected frame has a unique DevAddr, so each updf at Muxs is matched to its
+# frame - what is missing after a step is lost, the time from injection to
+# updf is the queueing delay. Station side drops ("out of space") are counted
+# from station.log. Saturation throughput is the highest received rate of a
+# step within the loss and delay limits.
+
+import os
+import re
+import sys
+import argparse
+import logging
+logger = logging.getLogger('bench-uplink-saturation')
+
+import tcutils as tu
+import simutils as su
+import benchutils as bu
+import testutils as tstu
+import fixtures as fx
+import stationbench as sb
+
+CONFIGS = {
+    'EU863_6ch': tu.router_config_EU863_6ch,
+    'US902_8ch': tu.router_config_US902_8ch,
+}
+
+ap = argparse.ArgumentParser(description='Uplink throughput saturation benchmark.')
+ap.add_argument('--configs', nargs='*', default=list(CONFIGS), choices=list(CONFIGS), help='Router configs to measure.')
+ap.add_argument('--start', type=float, default=20.0, help='Uplink rate of the first step (frames/s).')
+ap.add_argument('--factor', type=float, default=1.5, help='Rate increase per step.')
+ap.add_argument('--max-rate', type=float, default=5000.0, help='Stop after this rate.')
+ap.add_argument('--step', type=float, default=5.0, help='Seconds per rate step.')
+ap.add_argument('--drain', type=float, default=2.0, help='Seconds to wait for late updfs after a step.')
+ap.add_argument('--max-loss', type=float, default=0.01, help='Loss ratio above which the station is saturated.')
+ap.add_argument('--max-delay', type=float, default=0.5, help='p99 queueing delay (s) above which the station is saturated.')
+ap.add_argument('--sf', type=int, default=7, help='Uplink spreading factor.')
+ap.add_argument('--size', type=int, default=20, help='Uplink PHYPayload size (bytes).')
+args = ap.parse_args()
+
+tstu.setup_logging()
+logging.getLogger('_tcutils').setLevel(logging.INFO)
+logging.getLogger('simutils').setLevel(logging.INFO)
+
+VARIANT = os.environ.get('TEST_VARIANT', 'testsim')
+STATION_LOG = 'station.log'
+DROP_RE = re.compile(r'RX frame dropped|Dropped RX frame')
+
+
+async def run_config(name:str, report:bu.BenchReport) -> None:
+    config = CONFIGS[name]
+    muxs = sb.CountingMuxs(config)
+    sim = su.LgwSimServer()
+    chans = sb.upchannels(config)
+    drops = sb.LogTail(STATION_LOG, DROP_RE)
+    devaddr = 0x100
+    saturation = 0.0
+    async with sb.station_setup(muxs, sim) as lgwsim:
+        drops.count()
+        rate = args.start
+        while rate <= args.max_rate:
+            devaddr, vals = await sb.run_step(lgwsim, muxs, (args.sf,125), chans, devaddr, rate,
+                                              step=args.step, drain=args.drain, size=args.size)
+            vals['station_drops'] = drops.count()
+            report.add('%s %s %g/s' % (VARIANT, name, rate), **vals)
+            if vals['loss'] > args.max_loss or vals['delay_ms_p99'] > args.max_delay*1e3:
+                break
+            saturation = vals['received']
+            rate *= args.factor
+    report.add('%s %s saturation' % (VARIANT, name), uplinks_per_s=saturation, sf=args.sf, size=args.size)
+
+
+async def main() -> int:
+    report = bu.BenchReport('uplink-saturation')
+    for name in args.configs:
+        await run_config(name, report)
+    report.done()
+    return 0
+
+fx.run(main, timeout=None)
@@ -28,7 +28,6 @@ import os
 import sys
 import time
 import asyncio
-from asyncio import subprocess
 
 import logging
 logger = logging.getLogger('test2-gps')
@@ -36,12 +35,7 @@ logger = logging.getLogger('test2-gps')
 import tcutils as tu
 import simutils as su
 import testutils as tstu
-
-station = None
-infos = None
-muxs = None
-sim = None
-timeout = None
+import fixtures as fx
 
 def nmea_cksum(b:bytes) -> bytes:
     v = 0
@@ -56,14 +50,6 @@ class TestMuxs(tu.Muxs):
     gpsmove = 0
     gpsnofix = 0
 
-    async def testDone(self, status):
-        global station
-        if station:
-            station.terminate()
-            await station.wait()
-            station = None
-        os._exit(status)
-
     async def handle_event(self, ws, msg):
         logger.debug('EVENT: %r', msg)
 
@@ -82,24 +68,8 @@ class TestMuxs(tu.Muxs):
         logger.debug('ALARM(%d/%d): %s' % (self.gpscnt, self.cmdcnt, text))
 
 
-async def timeout():
-    await asyncio.sleep(30)
-    await muxs.testDone(2)
-
-
-async def test_start():
-    global station, infos, muxs, sim, timeout
-    infos = tu.Infos()
-    muxs = TestMuxs()
-    sim = su.LgwSimServer()
-    await infos.start_server()
-    await muxs.start_server()
-    await sim.start_server()
-
-    station_args = ['station','-p', '--temp', '.']
-    station = await subprocess.create_subprocess_exec(*station_args)
-
-    asyncio.ensure_future(timeout())
+async def feed_gps() -> None:
+    """GPGGA alternating between positions and fix/no fix plus a command once per second."""
     with open("./gps.fifo", "wb", 0) as f:
         with open("./cmd.fifo", "wb", 0) as c:
             await asyncio.sleep(1.0)
@@ -115,13 +85,19 @@ async def test_start():
                 f.write(sentence)
                 logger.debug('Writing cmd.fifo: %s' % (sentence[:-2].decode('ascii'),))
                 await asyncio.sleep(1)
-    notok = 1
+
+
+async def test_main() -> int:
+    muxs = TestMuxs()
+    async with fx.serving(tu.Infos(), muxs, su.LgwSimServer()):
+        async with fx.StationProcess('-p', '--temp', '.'):
+            await feed_gps()
     logger.debug('gpscnt=%d gpsmove=%d gpsnofix=%d cmdcnt=%d' % (muxs.gpscnt, muxs.gpsmove, muxs.gpsnofix, muxs.cmdcnt))
     if muxs.gpscnt >= 1 and muxs.gpsmove >= 1 and muxs.gpsnofix >= 1 and muxs.cmdcnt >= 15:
-        notok = 0
-    await muxs.testDone(notok)
+        return 0
+    return 1
+
 
 tstu.setup_logging()
 
-asyncio.ensure_future(test_start())
-asyncio.get_event_loop().run_forever()
+fx.run(test_main, timeout=30)
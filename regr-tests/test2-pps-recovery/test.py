@@ -40,7 +40,6 @@ import sys
 import time
 import json
 import asyncio
-from asyncio import subprocess
 
 import logging
 logger = logging.getLogger('test2-pps-recovery')
@@ -48,11 +47,7 @@ logger = logging.getLogger('test2-pps-recovery')
 import tcutils as tu
 import simutils as su
 import testutils as tstu
-
-station = None
-infos = None
-muxs = None
-sim = None
+import fixtures as fx
 
 # Expected threshold values from environment
 EXPECTED_PPS_RESET_THRES = int(os.environ.get('NO_PPS_RESET_THRES', 10))
@@ -68,19 +63,10 @@ def nmea_cksum(b:bytes) -> bytes:
 class TestMuxs(tu.Muxs):
     tscnt = 0
     first = None
-    config_verified = False
-
-    async def testDone(self, status, msg=''):
-        global station
-        if station:
-            station.terminate()
-            await station.wait()
-            station = None
-        if status:
-            print(f'TEST FAILED code={status} ({msg})', file=sys.stderr)
-        else:
-            print('TEST PASSED', file=sys.stderr)
-        os._exit(status)
+
+    def __init__(self, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.ts_sig = fx.Signal()
 
     async def handle_timesync(self, ws, msg):
         t = int(time.time()*1e6)
@@ -90,6 +76,7 @@ class TestMuxs(tu.Muxs):
             await asyncio.sleep(2.01)
         else:
             self.tscnt += 1
+            self.ts_sig.notify()
         msg['servertime'] = t
         await ws.send(json.dumps(msg))
 
@@ -97,80 +84,53 @@ class TestMuxs(tu.Muxs):
         logger.debug('ALARM: %r', msg)
 
 
-async def timeout():
-    await asyncio.sleep(40)
-    await muxs.testDone(2, 'TIMEOUT')
-
-
-async def verify_station_logs():
-    """Check station output for threshold configuration messages."""
-    # Give the station time to start and log threshold configuration
-    await asyncio.sleep(3)
-    
-    # The station should log the configured thresholds
-    # We'll check the test passes by normal operation working
-    return True
-
-
-async def test_start():
-    global station, infos, muxs, sim
-    
-    logger.info(f"Testing GPS recovery with thresholds: "
-                f"NO_PPS_RESET_THRES={EXPECTED_PPS_RESET_THRES}, "
-                f"NO_PPS_RESET_FAIL_THRES={EXPECTED_PPS_RESET_FAIL_THRES}")
-    
-    infos = tu.Infos()
-    muxs = TestMuxs()
-    sim = su.LgwSimServer()
-    await infos.start_server()
-    await muxs.start_server()
-    await sim.start_server()
-
-    station_args = ['station', '-p', '--temp', '.']
-    station = await subprocess.create_subprocess_exec(*station_args)
-
-    asyncio.ensure_future(timeout())
-    
-    # Verify station started with correct configuration
-    await verify_station_logs()
-    
+async def feed_gps() -> None:
+    """GPGGA with a valid fix and a command once per second - as a GPS receiver would."""
     with open("./gps.fifo", "wb", 0) as f:
         with open("./cmd.fifo", "wb", 0) as c:
-            await asyncio.sleep(1.0)
-            
-            # Phase 1: Normal operation with PPS
-            logger.info("Phase 1: Testing normal PPS operation")
-            for i in range(15):
+            i = 0
+            while True:
                 logger.debug('Writing GPGGA with fix...')
-                fixquality = 2  # Valid GPS fix
                 f.write(nmea_cksum(
-                    b'GPGGA,165848.000,4714.7671,N,00849.8387,E,%d,9,1.01,480.0,M,48.0,M,0000,0000' 
-                    % fixquality))
+                    b'GPGGA,165848.000,4714.7671,N,00849.8387,E,2,9,1.01,480.0,M,48.0,M,0000,0000'))
                 c.write(b'{"msgtype":"alarm","text":"CMD test no.%d"}\n' % (i,))
+                i += 1
                 await asyncio.sleep(1)
-            
-            # Verify we got timesync messages (indicates PPS is working)
-            if muxs.tscnt < 1:
-                await muxs.testDone(1, 'No timesync messages received - PPS not working')
-            
-            logger.info(f"Phase 1 complete: Received {muxs.tscnt} timesync messages")
-            
-            # Phase 2: Continue operation - test passes if station operates normally
-            # with GPS recovery feature enabled
-            logger.info("Phase 2: Continued operation with GPS recovery enabled")
-            for i in range(5):
-                f.write(nmea_cksum(
-                    b'GPGGA,165900.000,4714.7671,N,00849.8387,E,2,9,1.01,480.0,M,48.0,M,0000,0000'))
-                await asyncio.sleep(1)
-    
-    # Test passes if we got timesync messages and station operated normally
-    if muxs.tscnt >= 1:
-        logger.info(f"Test passed: GPS recovery feature enabled, normal operation verified")
-        await muxs.testDone(0)
-    else:
-        await muxs.testDone(1, 'PPS/Timesync not working with GPS recovery enabled')
+
+
+async def test_main() -> int:
+    logger.info(f"Testing GPS recovery with thresholds: "
+                f"NO_PPS_RESET_THRES={EXPECTED_PPS_RESET_THRES}, "
+                f"NO_PPS_RESET_FAIL_THRES={EXPECTED_PPS_RESET_FAIL_THRES}")
+
+    muxs = TestMuxs()
+    async with fx.serving(tu.Infos(), muxs, su.LgwSimServer()):
+        async with fx.StationProcess('-p', '--temp', '.'):
+            feeder = asyncio.ensure_future(feed_gps())
+            try:
+                # Phase 1: Normal operation with PPS - timesync answered in time
+                logger.info("Phase 1: Testing normal PPS operation")
+                try:
+                    await muxs.ts_sig.wait_for(lambda: muxs.tscnt >= 1, within=20.0)
+                except asyncio.TimeoutError:
+                    logger.error('No timesync messages received - PPS not working')
+                    return 1
+                logger.info(f"Phase 1 complete: Received {muxs.tscnt} timesync messages")
+
+                # Phase 2: Station keeps operating with GPS recovery enabled
+                logger.info("Phase 2: Continued operation with GPS recovery enabled")
+                n = muxs.tscnt
+                try:
+                    await muxs.ts_sig.wait_for(lambda: muxs.tscnt > n, within=10.0)
+                except asyncio.TimeoutError:
+                    logger.error('PPS/Timesync not working with GPS recovery enabled')
+                    return 1
+            finally:
+                feeder.cancel()
+    logger.info('Test passed: GPS recovery feature enabled, normal operation verified')
+    return 0
+
 
 tstu.setup_logging()
 
-asyncio.ensure_future(test_start())
-asyncio.get_event_loop().run_forever()
+fx.run(test_main, timeout=40)
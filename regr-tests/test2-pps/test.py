@@ -29,7 +29,6 @@ import sys
 import time
 import json
 import asyncio
-from asyncio import subprocess
 
 import logging
 logger = logging.getLogger('test2-pps')
@@ -37,12 +36,7 @@ logger = logging.getLogger('test2-pps')
 import tcutils as tu
 import simutils as su
 import testutils as tstu
-
-station = None
-infos = None
-muxs = None
-sim = None
-timeout = None
+import fixtures as fx
 
 def nmea_cksum(b:bytes) -> bytes:
     v = 0
@@ -55,15 +49,12 @@ class TestMuxs(tu.Muxs):
     tscnt = 0
     first = None
 
+    def __init__(self, outcome:fx.Outcome, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.outcome = outcome
+
     async def testDone(self, status, msg=''):
-        global station
-        if station:
-            station.terminate()
-            await station.wait()
-            station = None
-        if status:
-            print(f'TEST FAILED code={status} ({msg})', file=sys.stderr)
-        os._exit(status)
+        self.outcome.done(status, msg)
 
     async def handle_timesync(self, ws, msg):
         t = int(time.time()*1e6)
@@ -83,24 +74,7 @@ class TestMuxs(tu.Muxs):
         print('ALARM: %r' % (msg,))
 
 
-async def timeout():
-    await asyncio.sleep(50)
-    await muxs.testDone(2, 'TIMEOUT')
-
-
-async def test_start():
-    global station, infos, muxs, sim, timeout
-    infos = tu.Infos()
-    muxs = TestMuxs()
-    sim = su.LgwSimServer()
-    await infos.start_server()
-    await muxs.start_server()
-    await sim.start_server()
-
-    station_args = ['station','-p', '--temp', '.']
-    station = await subprocess.create_subprocess_exec(*station_args)
-
-    asyncio.ensure_future(timeout())
+async def feed_gps(muxs:TestMuxs) -> None:
     with open("./gps.fifo", "wb", 0) as f:
         # Send an NMEA sentence every 1sec
         # These are not used to sync time in any way - they are only indicative of
@@ -116,11 +90,22 @@ async def test_start():
                 await asyncio.sleep(1)
     if muxs.tscnt > 0:
         await muxs.testDone(0)
+        return
+    await muxs.testDone(1, 'No 2nd volley of timesync messages')
+
+
+async def test_main() -> int:
+    outcome = fx.Outcome()
+    muxs = TestMuxs(outcome)
+    async with fx.serving(tu.Infos(), muxs, su.LgwSimServer()):
+        async with fx.StationProcess('-p', '--temp', '.'):
+            feeder = asyncio.ensure_future(feed_gps(muxs))
+            try:
+                return await outcome.wait()
+            finally:
+                feeder.cancel()
 
-    print('No 2nd volley of timesync messages')
-    await muxs.testDone(1)
 
 tstu.setup_logging()
 
-asyncio.ensure_future(test_start())
-asyncio.get_event_loop().run_forever()
+fx.run(test_main, timeout=50)
@@ -29,7 +29,6 @@ import sys
 import time
 import json
 import asyncio
-from asyncio import subprocess
 
 import logging
 logger = logging.getLogger('test3-updn-tls')
@@ -37,12 +36,7 @@ logger = logging.getLogger('test3-updn-tls')
 import tcutils as tu
 import simutils as su
 import testutils as tstu
-
-
-station = None
-infos = None
-muxs = None
-sim = None
+import fixtures as fx
 
 
 class TestLgwSimServer(su.LgwSimServer):
@@ -92,21 +86,22 @@ class TestLgwSimServer(su.LgwSimServer):
 class TestMuxs(tu.Muxs):
     exp_seqno = []
 
+    def __init__(self, outcome:fx.Outcome, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.outcome = outcome
+
     async def testDone(self, status):
-        global station
-        if station:
-            station.terminate()
-            await station.wait()
-            station = None
-        os._exit(status)
+        self.outcome.done(status)
 
     async def handle_dntxed(self, ws, msg):
         seqno = msg['seqno']
         if seqno != msg['diid']:
             await self.testDone(3)
+            return
         if [seqno] != self.exp_seqno[0:1]:
             logger.error('DNTXED: %r but expected seqno=%r\n\t=>%r', seqno, self.exp_seqno, msg)
             await self.testDone(2)
+            return
         logger.debug('DNTXED: %r and expected seqno=%r', seqno, self.exp_seqno)
         del self.exp_seqno[0]
 
@@ -116,6 +111,7 @@ class TestMuxs(tu.Muxs):
         port = msg['FPort']
         if port >= 3:
             await self.testDone(0 if port == 3 else 1)
+            return
         dnframe = {
             'msgtype': 'dnframe',
             'DR'     : msg['DR'],
@@ -138,29 +134,25 @@ tls_no_ca = (sys.argv[2:3] == ['no_ca'])
 ws = 'wss' if tls_mode else 'ws'
 
 with open("tc.uri","w") as f:
-    f.write('%s://localhost:6038' % ws)
+    f.write('%s://localhost:%d' % (ws, tu.INFOS_PORT))
 
-async def test_start():
-    global station, infos, muxs, sim
-    infos = tu.Infos(muxsuri = ('%s://localhost:6039/router' % ws),
+async def test_main() -> int:
+    outcome = fx.Outcome()
+    infos = tu.Infos(muxsuri = ('%s://localhost:%d/router' % (ws, tu.MUXS_PORT)),
                      tlsidentity = ('infos-0' if tls_mode else None),
                      tls_no_ca = tls_no_ca)
-    muxs = TestMuxs(tlsidentity = ('muxs-0' if tls_mode else None),
+    muxs = TestMuxs(outcome,
+                    tlsidentity = ('muxs-0' if tls_mode else None),
                     tls_no_ca = tls_no_ca)
     sim = TestLgwSimServer()
-
-    await infos.start_server()
-    await muxs.start_server()
-    await sim.start_server()
-
     a = os.environ.get('STATION_ARGS','')
     args = [] if not a else a.split(' ')
     # 'valgrind', '--leak-check=full',
-    station_args = ['station','-p', '--temp', '.'] + args
-    station = await subprocess.create_subprocess_exec(*station_args)
+    async with fx.serving(infos, muxs, sim):
+        async with fx.StationProcess('-p', '--temp', '.', *args):
+            return await outcome.wait()
 
 
 tstu.setup_logging()
 
-asyncio.ensure_future(test_start())
-asyncio.get_event_loop().run_forever()
+fx.run(test_main, timeout=90)
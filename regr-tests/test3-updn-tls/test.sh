@@ -88,3 +88,9 @@ if [[ "$(cat radioinit.args)" != "$expect" ]]; then
     echo "             vs> $expect"
     exit 1
 fi
+
+# Optional TLS handshake rate benchmark - BENCH_TLS=<handshakes per case>
+if [[ -n "$BENCH_TLS" ]]; then
+    python -m tlsbench -n $BENCH_TLS --client ../pki-data/tc-router-1 --trust tc.trust
+    banner TLS handshake rate benchmark done
+fi
@@ -55,3 +55,9 @@ ln -s ../pki-data/tc-router-1.crt tc.crt
 python test.py tls
 banner TLS/wss with client auth done
 collect_gcda _tls_ca
+
+# Optional TLS handshake rate benchmark - BENCH_TLS=<handshakes per case>
+if [[ -n "$BENCH_TLS" ]]; then
+    python -m tlsbench -n $BENCH_TLS --client ../pki-data/tc-router-1 --trust tc.trust
+    banner TLS handshake rate benchmark done
+fi
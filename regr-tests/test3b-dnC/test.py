@@ -30,7 +30,6 @@ import time
 import json
 import random
 import asyncio
-from asyncio import subprocess
 
 import logging
 logger = logging.getLogger('test3b-dnC')
@@ -38,13 +37,9 @@ logger = logging.getLogger('test3b-dnC')
 import tcutils as tu
 import simutils as su
 import testutils as tstu
+import fixtures as fx
 
 
-station = None
-infos = None
-muxs = None
-sim = None
-
 
 class TestMuxs(tu.Muxs):
     exp_seqno = []
@@ -53,6 +48,10 @@ class TestMuxs(tu.Muxs):
     send_task = None
     ev = None
 
+    def __init__(self, outcome:fx.Outcome, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.outcome = outcome
+
     async def handle_connection(self, ws):
         self.ws = ws
         self.ev = asyncio.Event()
@@ -60,17 +59,13 @@ class TestMuxs(tu.Muxs):
         await super().handle_connection(ws)
 
     async def testDone(self, status):
-        global station
-        if station:
-            station.terminate()
-            await station.wait()
-            station = None
-        os._exit(status)
+        self.outcome.done(status)
 
     async def handle_dntxed(self, ws, msg):
         if [msg['seqno']] != self.exp_seqno[0:1]:
             logger.error('DNTXED: %r\nbut expected seqno=%r' % (msg, self.exp_seqno))
             await self.testDone(2)
+            return
         del self.exp_seqno[0]
         self.ev.set()
 
@@ -131,23 +126,20 @@ class TestMuxs(tu.Muxs):
 
 
 with open("tc.uri","w") as f:
-    f.write('ws://localhost:6038')
+    f.write('ws://localhost:%d' % tu.INFOS_PORT)
 
-async def test_start():
-    global station, infos, muxs, sim
+async def test_main() -> int:
     infos = tu.Infos()
-    muxs = TestMuxs()
+    outcome = fx.Outcome()
+    muxs = TestMuxs(outcome)
     sim = su.LgwSimServer()
 
-    await infos.start_server()
-    await muxs.start_server()
-    await sim.start_server()
-
     # 'valgrind', '--leak-check=full',
-    station_args = ['station','-p', '--temp', '.']
-    station = await subprocess.create_subprocess_exec(*station_args)
+    async with fx.serving(infos, muxs, sim):
+        async with fx.StationProcess('-p', '--temp', '.'):
+            return await outcome.wait()
+
 
 tstu.setup_logging()
 
-asyncio.ensure_future(test_start())
-asyncio.get_event_loop().run_forever()
+fx.run(test_main, timeout=60)
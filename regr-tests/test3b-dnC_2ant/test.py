@@ -29,7 +29,6 @@ import sys
 import time
 import json
 import asyncio
-from asyncio import subprocess
 
 import logging
 logger = logging.getLogger('test3b-dnC_2ant')
@@ -37,13 +36,9 @@ logger = logging.getLogger('test3b-dnC_2ant')
 import tcutils as tu
 import simutils as su
 import testutils as tstu
+import fixtures as fx
 
 
-station = None
-infos = None
-muxs = None
-sim = None
-
 n_ant = 1 if os.environ['TEST_VARIANT'].startswith('testsim') else 2
 omni = (os.environ['ANTENNA_TYPE'] == 'omni')
 
@@ -55,6 +50,10 @@ class TestMuxs(tu.Muxs):
     send_task = None
     ev = None
 
+    def __init__(self, outcome:fx.Outcome, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.outcome = outcome
+
     async def handle_connection(self, ws):
         self.ws = ws
         self.ev = asyncio.Event()
@@ -62,17 +61,13 @@ class TestMuxs(tu.Muxs):
         await super().handle_connection(ws)
 
     async def testDone(self, status):
-        global station
-        if station:
-            station.terminate()
-            await station.wait()
-            station = None
-        os._exit(status)
+        self.outcome.done(status)
 
     async def handle_dntxed(self, ws, msg):
         if (msg['seqno'], msg['rctx']) != (self.expected[0] if self.expected else None):
             logger.error('DNTXED: %r\nbut expected seqno=%r' % (msg, self.expected))
             await self.testDone(2)
+            return
         logger.debug('DNTXED %d ant#%d' % (msg['seqno'], msg['rctx']))
         del self.expected[0]
         self.ev.set()
@@ -132,6 +127,7 @@ class TestMuxs(tu.Muxs):
                 # OLD: 1 has shorter txtime, dntxed arrives before 0
                 # OLD: await self.send_classC_seq(dnmsgs, [(1,1),(0,0),(2,1)])
                 await self.testDone(0)
+                return
 
             if n_ant == 1 or not omni:
                 dnmsgs = [
@@ -140,6 +136,7 @@ class TestMuxs(tu.Muxs):
                     self.make_dnmsgC(rx2dr=0, plen=20, delayms=500) ]  # can be sent by push back
                 await self.send_classC_seq(dnmsgs, [(0,0),(2,0)])
                 await self.testDone(0)
+                return
 
             await self.testDone(1)
 
@@ -149,23 +146,20 @@ class TestMuxs(tu.Muxs):
 
 
 with open("tc.uri","w") as f:
-    f.write('ws://localhost:6038')
+    f.write('ws://localhost:%d' % tu.INFOS_PORT)
 
-async def test_start():
-    global station, infos, muxs, sim
+async def test_main() -> int:
     infos = tu.Infos()
-    muxs = TestMuxs()
+    outcome = fx.Outcome()
+    muxs = TestMuxs(outcome)
     sim = su.LgwSimServer()
 
-    await infos.start_server()
-    await muxs.start_server()
-    await sim.start_server()
-
     # 'valgrind', '--leak-check=full',
-    station_args = ['station','-p', '--temp', '.']
-    station = await subprocess.create_subprocess_exec(*station_args)
+    async with fx.serving(infos, muxs, sim):
+        async with fx.StationProcess('-p', '--temp', '.'):
+            return await outcome.wait()
+
 
 tstu.setup_logging()
 
-asyncio.ensure_future(test_start())
-asyncio.get_event_loop().run_forever()
+fx.run(test_main, timeout=60)
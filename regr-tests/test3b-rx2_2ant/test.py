@@ -29,7 +29,6 @@ import sys
 import time
 import json
 import asyncio
-from asyncio import subprocess
 
 import logging
 logger = logging.getLogger('test3b-rx2_2ant')
@@ -37,13 +36,9 @@ logger = logging.getLogger('test3b-rx2_2ant')
 import tcutils as tu
 import simutils as su
 import testutils as tstu
+import fixtures as fx
 
 
-station = None
-infos = None
-muxs = None
-sim = None
-
 n_ant = 1 if os.environ['TEST_VARIANT'].startswith('testsim') else 2
 omni = (os.environ['ANTENNA_TYPE'] == 'omni')
 
@@ -52,11 +47,12 @@ class TestLgwSimServer(su.LgwSimServer):
     fcnt = 0
     updf_task = None
     txcnt = 0
+    test_muxs = None
 
     async def on_connected(self, lgwsim:su.LgwSim) -> None:
         if lgwsim.unitIdx == 0:
             self.updf_task = asyncio.ensure_future(self.send_updf())
-            muxs.xticks = lgwsim.xticks
+            self.test_muxs.xticks = lgwsim.xticks
 
     async def on_close(self):
         if self.updf_task:
@@ -87,18 +83,17 @@ class TestMuxs(tu.Muxs):
     xtime_ext = 0
     xticks = None
 
+    def __init__(self, outcome:fx.Outcome, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.outcome = outcome
+
     async def handle_connection(self, ws):
         self.ws = ws
         self.ev = asyncio.Event()
         await super().handle_connection(ws)
 
     async def testDone(self, status):
-        global station
-        if station:
-            station.terminate()
-            await station.wait()
-            station = None
-        os._exit(status)
+        self.outcome.done(status)
 
     async def handle_updf(self, ws, msg):
         logger.debug('UPDF: rctx=%r Fcnt=%d Freq=%.3fMHz FPort=%d' % (msg['upinfo']['rctx'], msg['FCnt'], msg['Freq']/1e6, msg['FPort']))
@@ -111,6 +106,7 @@ class TestMuxs(tu.Muxs):
         if (msg['seqno'], msg['rctx']) != (self.expected[0] if self.expected else None):
             logger.debug('DNTXED: %r\nbut expected seqno=%r' % (msg, self.expected))
             await self.testDone(2)
+            return
         logger.debug('DNTXED %d ant#%d' % (msg['seqno'], msg['rctx']))
         del self.expected[0]
         self.ev.set()
@@ -176,6 +172,7 @@ class TestMuxs(tu.Muxs):
                 await self.send_classA_seq(dnmsgs, [(0,0),(1,1),(2,0),(3,1)])
                 # if dntxed sent at end of frame (old): await self.send_classA_seq(dnmsgs, [(1,1),(0,0),(3,1),(2,0)])
                 await self.testDone(0)
+                return
 
             if n_ant == 1 or not omni:
                 dnmsgs = [
@@ -184,6 +181,7 @@ class TestMuxs(tu.Muxs):
                     self.make_dnmsgA(dr=0, plen=20, delayms=0) ]    # cannot be sent by RX2
                 await self.send_classA_seq(dnmsgs, [(0,0),(1,0)])
                 await self.testDone(0)
+                return
 
             await self.testDone(1)
 
@@ -193,23 +191,21 @@ class TestMuxs(tu.Muxs):
 
 
 with open("tc.uri","w") as f:
-    f.write('ws://localhost:6038')
+    f.write('ws://localhost:%d' % tu.INFOS_PORT)
 
-async def test_start():
-    global station, infos, muxs, sim
+async def test_main() -> int:
     infos = tu.Infos()
-    muxs = TestMuxs()
+    outcome = fx.Outcome()
+    muxs = TestMuxs(outcome)
     sim = TestLgwSimServer()
-
-    await infos.start_server()
-    await muxs.start_server()
-    await sim.start_server()
+    sim.test_muxs = muxs
 
     # 'valgrind', '--leak-check=full',
-    station_args = ['station','-p', '--temp', '.']
-    station = await subprocess.create_subprocess_exec(*station_args)
+    async with fx.serving(infos, muxs, sim):
+        async with fx.StationProcess('-p', '--temp', '.'):
+            return await outcome.wait()
+
 
 tstu.setup_logging()
 
-asyncio.ensure_future(test_start())
-asyncio.get_event_loop().run_forever()
+fx.run(test_main, timeout=60)
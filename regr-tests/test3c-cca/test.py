@@ -29,7 +29,6 @@ import sys
 import time
 import json
 import asyncio
-from asyncio import subprocess
 
 import logging
 logger = logging.getLogger('test3c-cca')
@@ -37,81 +36,47 @@ logger = logging.getLogger('test3c-cca')
 import tcutils as tu
 import simutils as su
 import testutils as tstu
+import fixtures as fx
 
 
-station = None
-infos = None
-muxs = None
-sim = None
-
 FREQ1 = 922.1
 FREQ2 = 922.3
 FREQ3 = 922.5
 
 
 class TestLgwSimServer(su.LgwSimServer):
-    fcnt = 0
-    updf_task = None
-    txcnt = 0
-    exp_txfreq = []
 
     async def on_connected(self, lgwsim:su.LgwSim) -> None:
         now = lgwsim.xticks()
         await lgwsim.send_cca([(FREQ2, now, now+int(20e6))])
 
     async def on_close(self):
-        self.updf_task.cancel()
-        self.updf_task = None
         logger.debug('LGWSIM - close')
 
     async def on_tx(self, lgwsim, pkt):
         logger.debug('LGWSIM: TX %r' % (pkt,))
-        assert pkt['rf_power'] == 23
-        self.txcnt += 1
-        if [pkt['freq_hz']] != self.exp_txfreq[0:1]:
-            logger.debug('LGWSIM: freq=%.3fMHz but expected %.3fMHz' % (pkt['freq_hz']/1e6, self.exp_txfreq[0]/1e6))
-            await self.testDone(2)
-        del self.exp_txfreq[0]
 
 
 class TestMuxs(tu.Muxs):
-    exp_seqno = []
     seqno = 0
     ws = None
     send_task = None
-    ev = None
+
+    def __init__(self, outcome:fx.Outcome, sim:TestLgwSimServer, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.outcome = outcome
+        self.sim = sim
 
     def get_router_config(self):
         return tu.router_config_KR920
 
     async def handle_connection(self, ws):
         self.ws = ws
-        self.ev = asyncio.Event()
         self.send_task = asyncio.ensure_future(self.send_classC())
-        await super().handle_connection(ws)
-
-    async def testDone(self, status):
-        global station
-        if station:
-            try:
-                station.terminate()
-            except Exception as exc:
-                logger.error('Shutting down station: %s', exc, exc_info=True)
-            try:
-                await station.wait()
-                logger.error('Exit code station: %d', station.returncode)
-                station = None
-            except Exception as exc:
-                logger.error('Failed to get exit code of station: %s', exc, exc_info=True)
-            os._exit(status)
-
-    async def handle_dntxed(self, ws, msg):
-        if [msg['seqno']] != self.exp_seqno[0:1]:
-            logger.debug('DNTXED: %r\nbut expected seqno=%r' % (msg, self.exp_seqno))
-            await self.testDone(2)
-        del self.exp_seqno[0]
-        self.ev.set()
-
+        try:
+            await super().handle_connection(ws)
+        finally:
+            self.send_task.cancel()
 
     # airtime: dr=4 (SF8) plen=12  <83ms
     def make_dnmsgC(self, rx2dr=4, rx2freq=FREQ1, plen=12):
@@ -139,45 +104,46 @@ class TestMuxs(tu.Muxs):
         try:
             assert self.seqno & 1 == 0
 
+            expected = []
             for f in (FREQ1,FREQ2,FREQ3,FREQ2):
                 dnmsg = self.make_dnmsgC(rx2freq=f)
                 if f != FREQ2:
-                    self.exp_seqno.append(dnmsg['seqno'])
-                    sim.exp_txfreq.append(dnmsg['RX2Freq'])
+                    expected.append(dnmsg)
                 await self.ws.send(json.dumps(dnmsg))
 
-            while self.exp_seqno:
-                self.ev.clear()
-                await asyncio.wait_for(self.ev.wait(), 5.0)
-
-            await asyncio.sleep(2.0)
-            assert sim.exp_txfreq == []
-            await self.testDone(0)
+            # TX frames and dntxed must arrive in order - FREQ2 is blocked by CCA
+            for dnmsg in expected:
+                pkt = await self.sim.expect_tx(within=5.0)
+                if pkt['freq_hz'] != dnmsg['RX2Freq']:
+                    self.outcome.done(2, 'TX freq=%.3fMHz but expected %.3fMHz' % (pkt['freq_hz']/1e6, dnmsg['RX2Freq']/1e6))
+                    return
+                assert pkt['rf_power'] == 23
+                msg = await self.expect('dntxed', within=5.0)
+                if msg['seqno'] != dnmsg['seqno']:
+                    self.outcome.done(2, 'DNTXED: %r but expected seqno=%r' % (msg, dnmsg['seqno']))
+                    return
+            await self.sim.expect_no_tx(freq=FREQ2, within=2.0)
+            self.outcome.done(0)
         except asyncio.CancelledError:
             logger.debug('send_classC canceled.')
         except Exception as exc:
             logger.error('send_classC failed: %s', exc, exc_info=True)
-            await self.testDone(1)
+            self.outcome.fail(str(exc))
 
 
 with open("tc.uri","w") as f:
-    f.write('ws://localhost:6038')
+    f.write('ws://localhost:%d' % tu.INFOS_PORT)
 
-async def test_start():
-    global station, infos, muxs, sim
-    infos = tu.Infos()
-    muxs = TestMuxs()
+async def test_main() -> int:
+    outcome = fx.Outcome()
     sim = TestLgwSimServer()
-
-    await infos.start_server()
-    await muxs.start_server()
-    await sim.start_server()
-
+    muxs = TestMuxs(outcome, sim)
     # 'valgrind', '--leak-check=full',
-    station_args = ['station','-p', '--temp', '.']
-    station = await subprocess.create_subprocess_exec(*station_args)
+    async with fx.serving(tu.Infos(), muxs, sim):
+        async with fx.StationProcess('-p', '--temp', '.'):
+            return await outcome.wait()
+
 
 tstu.setup_logging()
 
-asyncio.ensure_future(test_start())
-asyncio.get_event_loop().run_forever()
+fx.run(test_main, timeout=60)
@@ -29,7 +29,6 @@ import sys
 import time
 import json
 import asyncio
-from asyncio import subprocess
 
 import logging
 logger = logging.getLogger('test3d-bcns')
@@ -37,13 +36,9 @@ logger = logging.getLogger('test3d-bcns')
 import tcutils as tu
 import simutils as su
 import testutils as tstu
+import fixtures as fx
 
 
-station = None
-infos = None
-muxs = None
-sim = None
-
 REGION = os.environ.get('REGION','KR920')
 PPM    = 1000000
 BINTV  = 2
@@ -63,8 +58,9 @@ class TestLgwSimServer(su.LgwSimServer):
         self.mono2utc = int((time.time() - time.monotonic()) * 1e6)
 
     async def on_close(self):
-        self.updf_task.cancel()
-        self.updf_task = None
+        if self.updf_task:
+            self.updf_task.cancel()
+            self.updf_task = None
         logger.debug('LGWSIM - close')
 
     async def on_tx(self, lgwsim, pkt):
@@ -109,6 +105,10 @@ class TestMuxs(tu.Muxs):
     send_task = None
     ev = None
 
+    def __init__(self, outcome:fx.Outcome, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.outcome = outcome
+
     def get_router_config(self):
         if REGION == 'US915':
             conf = tu.router_config_US902_8ch
@@ -133,24 +133,13 @@ class TestMuxs(tu.Muxs):
         await super().handle_connection(ws)
 
     async def testDone(self, status):
-        global station
-        if station:
-            try:
-                station.terminate()
-            except Exception as exc:
-                logger.error('Shutting down station: %s', exc, exc_info=True)
-            try:
-                await station.wait()
-                logger.error('Exit code station: %d', station.returncode)
-                station = None
-            except Exception as exc:
-                logger.error('Failed to get exit code of station: %s', exc, exc_info=True)
-            os._exit(status)
+        self.outcome.done(status)
 
     async def handle_dntxed(self, ws, msg):
         if [msg['seqno']] != self.exp_seqno[0:1]:
             logger.debug('DNTXED: %r\nbut expected seqno=%r' % (msg, self.exp_seqno))
             await self.testDone(2)
+            return
         del self.exp_seqno[0]
         self.ev.set()
 
@@ -203,24 +192,21 @@ if 'PPSTHRES' in os.environ:
     PPSTHRES = int(os.environ['PPSTHRES'])
 
 with open("tc.uri","w") as f:
-    f.write('ws://localhost:6038')
+    f.write('ws://localhost:%d' % tu.INFOS_PORT)
 
-async def test_start():
-    global station, infos, muxs, sim
+async def test_main() -> int:
     infos = tu.Infos()
-    muxs = TestMuxs()
+    outcome = fx.Outcome()
+    muxs = TestMuxs(outcome)
     sim = TestLgwSimServer()
     sim.test_muxs = muxs
 
-    await infos.start_server()
-    await muxs.start_server()
-    await sim.start_server()
-
     # 'valgrind', '--leak-check=full',
-    station_args = ['station','-p', '--temp', '.']
-    station = await subprocess.create_subprocess_exec(*station_args)
+    async with fx.serving(infos, muxs, sim):
+        async with fx.StationProcess('-p', '--temp', '.'):
+            return await outcome.wait()
+
 
 tstu.setup_logging()
 
-asyncio.ensure_future(test_start())
-asyncio.get_event_loop().run_forever()
+fx.run(test_main, timeout=60)
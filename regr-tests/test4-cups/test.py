@@ -30,7 +30,6 @@ import sys
 import time
 import json
 import asyncio
-from asyncio import subprocess
 
 import logging
 logger = logging.getLogger('test4-cups')
@@ -38,30 +37,25 @@ logger = logging.getLogger('test4-cups')
 import tcutils as tu
 import simutils as su
 import testutils as tstu
-
-
-restarts = 0
-station = None
-infos = None
-muxs = None
-cups = None
-sim = None
+import fixtures as fx
 
 
 class TestLgwSimServer(su.LgwSimServer):
     fcnt = 0
     updf_task = None
 
-    def __init__(self) -> None:
+    def __init__(self, cups:tu.Cups) -> None:
         super().__init__(path='_shome/spidev')
+        self.cups = cups
 
     async def on_connected(self, lgwsim:su.LgwSim) -> None:
         self.fcnt = 0
         self.updf_task = asyncio.ensure_future(self.send_updf())
 
     async def on_close(self):
-        self.updf_task.cancel()
-        self.updf_task = None
+        if self.updf_task:
+            self.updf_task.cancel()
+            self.updf_task = None
         logger.debug('LGWSIM - close')
 
     async def send_updf(self) -> None:
@@ -79,7 +73,7 @@ class TestLgwSimServer(su.LgwSimServer):
                     port = 2
                 else:
                     freq = 869.525
-                    port = 3 if cups.qcnt >= 2 else 4  # signal termination
+                    port = 3 if self.cups.qcnt >= 2 else 4  # signal termination
                 if 0 not in self.units:
                     return
                 lgwsim = self.units[0]
@@ -93,35 +87,13 @@ class TestLgwSimServer(su.LgwSimServer):
 
 class TestMuxs(tu.Muxs):
     exp_seqno = []
-    station_args = ['station','-p', '--temp', './_shome', '-h', './_shome']
-    #station_args = ['valgrind', '--leak-check=full', 'station','-p', '--temp', '.']
-    restart_station_handle = None
+
+    def __init__(self, outcome:fx.Outcome, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.outcome = outcome
 
     async def testDone(self, status):
-        if self.restart_station_handle:
-            self.restart_station_handle.cancel()
-            self.restart_station_handle = None
-        global station
-        if station:
-            station.terminate()
-            await station.wait()
-            station = None
-        sys.stdout.flush()
-        os._exit(status)
-
-    async def restart_station(self):
-        global station
-        while True:
-            if not station:
-                station = await subprocess.create_subprocess_exec(*self.station_args)
-            retcode = await station.wait()
-            logger.debug('STATION EXIT: code=%d' % (retcode,))
-            if not restarts:
-                sys.stdout.flush()
-                sys.exit(1 if restarts==0 else 0)
-            restarts -= 1
-            logger.debug('RESTARTING STATION...: code=%d' % (retcode,))
-            station = None
+        self.outcome.done(status)
 
     async def handle_connection(self, ws):
         self.exp_seqno = []
@@ -144,6 +116,7 @@ class TestMuxs(tu.Muxs):
         port = msg['FPort']
         if port >= 3:
             await self.testDone(0 if port == 3 else 1)
+            return
         dnframe = {
             'msgtype': 'dnframe',
             'DR'     : msg['DR'],
@@ -182,40 +155,47 @@ tls_no_ca = (sys.argv[2:3] == ['no_ca'])
 isTLS = 's' if tls_mode else ''
 
 with open("_shome/cups.uri","w") as f:
-    f.write('http://localhost:%d' % (6041 if isTLS else 6040,))
+    f.write('http://localhost:%d' % (tu.CUPS2_PORT if isTLS else tu.CUPS_PORT,))
 with open("_cups/cups-router-1.cfg","w") as f:
     f.write(
         ('{'
-        '"cupsUri": "http%s://localhost:6040",'
-        '"tcUri"  : "ws%s://localhost:6038",'
+        '"cupsUri": "http%s://localhost:%d",'
+        '"tcUri"  : "ws%s://localhost:%d",'
         '"version": "v1"'
-        '}') % (isTLS, isTLS))
+        '}') % (isTLS, tu.CUPS_PORT, isTLS, tu.INFOS_PORT))
+
+async def watch_station(station:fx.StationProcess, outcome:fx.Outcome) -> None:
+    # The station must keep running through the CUPS update
+    retcode = await station.wait()
+    outcome.fail('Station exited: code=%d' % (retcode,))
 
-async def test_start():
-    global station, infos, muxs, cups, sim
-    sim = TestLgwSimServer()
-    infos = tu.Infos(muxsuri = ('ws%s://localhost:6039/router' % isTLS),
+
+async def test_main() -> int:
+    outcome = fx.Outcome()
+    cups = TestCups(homedir = '_cups', tcdir = '_tc',
+                    tlsidentity = ('cups-0' if tls_mode else None),
+                    tls_no_ca = tls_no_ca)
+    cups2 = TestCups(homedir = '_cups', tcdir = '_tc', tlsidentity=None)
+    cups2.port = tu.CUPS2_PORT
+    sim = TestLgwSimServer(cups)
+    infos = tu.Infos(muxsuri = ('ws%s://localhost:%d/router' % (isTLS, tu.MUXS_PORT)),
                      homedir = '_tc',
                      tlsidentity = ('infos-0' if tls_mode else None),
                      tls_no_ca = tls_no_ca)
-    muxs = TestMuxs(homedir = '_tc',
+    muxs = TestMuxs(outcome,
+                    homedir = '_tc',
                     tlsidentity = ('muxs-0' if tls_mode else None),
                     tls_no_ca = tls_no_ca)
-    cups = TestCups(homedir = '_cups', tcdir = '_tc',
-                    tlsidentity = ('cups-0' if tls_mode else None),
-                    tls_no_ca = tls_no_ca)
-    cups2 = TestCups(homedir = '_cups', tcdir = '_tc', tlsidentity=None)
-    cups2.port = 6041
-    await sim.start_server()
-    await infos.start_server()
-    await muxs.start_server()
-    await cups.start_server()
-    await cups2.start_server()
-    await asyncio.sleep(0.3)    # give python some time to start up
-    muxs.restart_station_handle = asyncio.ensure_future(muxs.restart_station())
+    # 'valgrind', '--leak-check=full',
+    async with fx.serving(sim, infos, muxs, cups, cups2):
+        async with fx.StationProcess('-p', '--temp', './_shome', '-h', './_shome') as station:
+            watcher = asyncio.ensure_future(watch_station(station, outcome))
+            try:
+                return await outcome.wait()
+            finally:
+                watcher.cancel()
 
 
 tstu.setup_logging()
 
-asyncio.ensure_future(test_start())
-asyncio.get_event_loop().run_forever()
+fx.run(test_main, timeout=120)
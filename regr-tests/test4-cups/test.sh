@@ -51,7 +51,7 @@ function setup_A () {
     #    openssl ec -in sig-0.pub -inform PEM -outform DER -pubin | tail -c 64 > sig-0.key # Convert public key to compact binary format
     #    openssl dgst -sha512 -sign sig-0.pem v1.bin > v1.bin.sig-0               # Create signature
     rm -rf /tmp/update.bin* _shome _cups _tc
-    killall -q station || true
+    kill_stations
     mkdir -p _shome _cups _tc
     cp v1.bin* sig-0.key                   _cups/
     cp station.conf slave-0.conf sig-0.key _shome/
@@ -30,7 +30,6 @@ import time
 import json
 from pprint import pformat
 import asyncio
-from asyncio import subprocess
 
 import logging
 logger = logging.getLogger('test5-rmtsh')
@@ -38,146 +37,111 @@ logger = logging.getLogger('test5-rmtsh')
 import tcutils as tu
 import simutils as su
 import testutils as tstu
-
-
-station = None
-infos = None
-muxs = None
-sim = None
+import fixtures as fx
 
 
 class TestMuxs(tu.Muxs):
-    exp_seqno = []
-    seqno = 0
     ws = None
     send_task = None
-    ev = None
-    rmtsh_status = None
-    rmtsh_status_ev = asyncio.Event()
-    output = b''
+
+    def __init__(self, outcome:fx.Outcome, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.outcome = outcome
+        self.output = { 0: b'', 1: b'' }   # rmtsh session -> output received
+        self.output_sig = fx.Signal()
 
     async def handle_connection(self, ws):
         self.ws = ws
-        self.ev = asyncio.Event()
         self.send_task = asyncio.ensure_future(self.run_rmtsh())
-        await super().handle_connection(ws)
-
-    async def testDone(self, status):
-        global station
-        if station:
-            station.terminate()
-            await station.wait()
-            station = None
-        os._exit(status)
+        try:
+            await super().handle_connection(ws)
+        finally:
+            self.send_task.cancel()
 
     async def handle_binaryData(self, ws, data):
         if not data:
             return
         rmtsh_idx = data[0]
         logger.debug('RMTSH %d binary data:<<<%s>>>' % (rmtsh_idx, data[1:].decode('utf-8')))
-        self.output += data[1:]
-        #sys.stdout.write(data.decode('utf-8'))
-        #sys.stdout.flush()
+        self.output[rmtsh_idx] = self.output.get(rmtsh_idx, b'') + data[1:]
+        self.output_sig.notify()
 
-    async def handle_rmtsh(self, ws, msg):
-        logger.debug('RMTSH: %s' % (pformat(msg),))
-        self.rmtsh_status = msg['rmtsh']
-        self.rmtsh_status_ev.set()
+    async def expect_output(self, idx:int, text:bytes, within:float=5.0) -> None:
+        await self.output_sig.wait_for(lambda: text in self.output[idx], within)
 
-    async def waitForRmtshStatus(self):
-        self.rmtsh_status = None
-        self.rmtsh_status_ev.clear()
-        await asyncio.wait_for(self.rmtsh_status_ev.wait(), 3.0)
-        return self.rmtsh_status
+    async def rmtsh_status(self, dnmsg):
+        await self.ws.send(json.dumps(dnmsg))
+        msg = await self.expect('rmtsh', within=3.0)
+        logger.debug('RMTSH: %s' % (pformat(msg),))
+        return msg['rmtsh']
 
     async def run_rmtsh(self):
         try:
-            await asyncio.sleep(1.0)    # let station start up
-
-            dnmsg = {'msgtype':'rmtsh'}
-            await self.ws.send(json.dumps(dnmsg))
-            await self.waitForRmtshStatus()
-            assert (self.rmtsh_status[0]['started'] == False and
-                    self.rmtsh_status[1]['started'] == False)
-
-            dnmsg = b'\x00Some stuff'
-            await self.ws.send(dnmsg)
-            await asyncio.sleep(1.0)
-
-            dnmsg = {'msgtype':'rmtsh','start':0,'user':'Test session'}
-            await self.ws.send(json.dumps(dnmsg))
-            await self.waitForRmtshStatus()
-            assert (self.rmtsh_status[0]['started'] == True and
-                    self.rmtsh_status[1]['started'] == False)
-            assert  self.rmtsh_status[0]['user'] == 'Test session'
-
-            dnmsg = b'\x00ls\n'
-            await self.ws.send(dnmsg)
-            await asyncio.sleep(1.0)
-            assert b'spidev' in self.output
-            self.output = b''
+            await self.expect('version', within=5.0)
+
+            status = await self.rmtsh_status({'msgtype':'rmtsh'})
+            assert (status[0]['started'] == False and
+                    status[1]['started'] == False)
+
+            # Data for a session not started - ignored
+            await self.ws.send(b'\x00Some stuff')
+
+            status = await self.rmtsh_status({'msgtype':'rmtsh','start':0,'user':'Test session'})
+            assert (status[0]['started'] == True and
+                    status[1]['started'] == False)
+            assert  status[0]['user'] == 'Test session'
+
+            await self.ws.send(b'\x00ls\n')
+            await self.expect_output(0, b'spidev')
+            self.output[0] = b''
 
             txt = b'%f' % time.time()
-            dnmsg = b'\x00echo "%s" > test.txt; ls\n' % txt
-            await self.ws.send(dnmsg)
-            await asyncio.sleep(1.0)
-            assert b'test.txt' in self.output
-            self.output = b''
+            await self.ws.send(b'\x00echo "%s" > test.txt; ls\n' % txt)
+            await self.expect_output(0, b'test.txt')
+            self.output[0] = b''
             with open('test.txt','rb') as f:
                 assert f.read() == txt+b'\n'
 
-            dnmsg = {'msgtype':'rmtsh','stop':0}
-            await self.ws.send(json.dumps(dnmsg))
-            await self.waitForRmtshStatus()
-            assert (self.rmtsh_status[0]['started'] == False and
-                    self.rmtsh_status[1]['started'] == False)
-            assert  self.rmtsh_status[0]['user'] == 'Test session'
+            status = await self.rmtsh_status({'msgtype':'rmtsh','stop':0})
+            assert (status[0]['started'] == False and
+                    status[1]['started'] == False)
+            assert  status[0]['user'] == 'Test session'
 
-            await asyncio.sleep(1.0)
-
-            await self.ws.send(json.dumps({'msgtype':'rmtsh','start':1,'user':'Test2','term':'xterm','foo':2}))
-            await self.waitForRmtshStatus()
-            assert (self.rmtsh_status[0]['started'] == False and
-                    self.rmtsh_status[1]['started'] == True)
+            status = await self.rmtsh_status({'msgtype':'rmtsh','start':1,'user':'Test2','term':'xterm','foo':2})
+            assert (status[0]['started'] == False and
+                    status[1]['started'] == True)
 
             await self.ws.send(b'\x0Fls\n')
             await self.ws.send(b'\x01head -c 1024 /dev/urandom | hd\n')
-            await asyncio.sleep(1.0)
-
-            assert (self.rmtsh_status[0]['started'] == False and
-                    self.rmtsh_status[1]['started'] == True)
-
-            dnmsg = {'msgtype':'rmtsh','stop':1}
-            await self.ws.send(json.dumps(dnmsg))
-            await self.waitForRmtshStatus()
-            assert (self.rmtsh_status[0]['started'] == False and
-                    self.rmtsh_status[1]['started'] == False)
-            assert  self.rmtsh_status[0]['user'] == 'Test session'
+            await self.expect_output(1, b'00000400')   # hd prints the final offset last
+            assert self.output[0] == b''
 
-            await asyncio.sleep(1.0)
+            status = await self.rmtsh_status({'msgtype':'rmtsh','stop':1})
+            assert (status[0]['started'] == False and
+                    status[1]['started'] == False)
+            assert  status[0]['user'] == 'Test session'
 
-            await self.testDone(0)
+            self.outcome.done(0)
+        except asyncio.CancelledError:
+            logger.debug('run_rmtsh canceled.')
         except Exception as exc:
             logger.error('run_rmtsh failed: %s', exc, exc_info=True)
-            await self.testDone(1)
+            self.outcome.fail(str(exc))
 
 
-async def test_start():
-    global station, infos, muxs, sim
-    infos = tu.Infos()
-    muxs = TestMuxs()
-    sim = su.LgwSimServer()
+with open("tc.uri","w") as f:
+    f.write('ws://localhost:%d' % tu.INFOS_PORT)
 
-    await infos.start_server()
-    await muxs.start_server()
-    await sim.start_server()
 
+async def test_main() -> int:
+    outcome = fx.Outcome()
+    muxs = TestMuxs(outcome)
     # 'valgrind', '--leak-check=full',
-    station_args = ['station','-p', '--temp', '.']
-    station = await subprocess.create_subprocess_exec(*station_args)
+    async with fx.serving(tu.Infos(), muxs, su.LgwSimServer()):
+        async with fx.StationProcess('-p', '--temp', '.'):
+            return await outcome.wait()
 
 
 tstu.setup_logging()
 
-asyncio.ensure_future(test_start())
-asyncio.get_event_loop().run_forever()
+fx.run(test_main, timeout=30)
@@ -1,6 +1,7 @@
 
 import asyncio
-import slaveutils as su
+import simutils as su
+import loops
 
 slave = None
 
@@ -50,5 +51,6 @@ async def test_start():
     await slave.start_slave()
 
 
+loops.install()
 asyncio.ensure_future(test_start())
-asyncio.get_event_loop().run_forever()
+loops.get_event_loop().run_forever()
@@ -29,7 +29,6 @@ import sys
 import time
 import json
 import asyncio
-from asyncio import subprocess
 
 import logging
 logger = logging.getLogger('test5-runcmd')
@@ -37,25 +36,19 @@ logger = logging.getLogger('test5-runcmd')
 import tcutils as tu
 import simutils as su
 import testutils as tstu
-
-station = None
-infos = None
-muxs = None
-sim = None
+import fixtures as fx
 
 
 class TestMuxs(tu.Muxs):
     alarms = 0
 
+    def __init__(self, outcome:fx.Outcome, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.outcome = outcome
+
     async def testDone(self, status):
-        global station
-        if station:
-            station.terminate()
-            await station.wait()
-            logger.debug('Station exe code:%d' % (station.returncode,))
-            station = None
         logger.debug('Test Done: %d' % (status,))
-        os._exit(status)
+        self.outcome.done(status)
 
     def get_router_config(self):
         return {
@@ -121,7 +114,7 @@ class TestMuxs(tu.Muxs):
 
         except Exception as exc:
             logger.error('send_test_runcmd exception: %s', exc, exc_info=True)
-            raise
+            await self.testDone(1)
 
 
     async def handle_alarm(self, ws, msg):
@@ -130,29 +123,19 @@ class TestMuxs(tu.Muxs):
 
 
 with open("tc.uri","w") as f:
-    f.write('ws://localhost:6038')
-
-
-async def timeout():
-    await asyncio.sleep(20)
-    await muxs.testDone(2)
-
+    f.write('ws://localhost:%d' % tu.INFOS_PORT)
 
-async def test_start():
-    global station, infos, muxs
-    infos = tu.Infos()
-    muxs = TestMuxs()
-    sim = su.LgwSimServer()
-    await infos.start_server()
-    await muxs.start_server()
-    await sim.start_server()
 
-    station_args = ['station', '-p', '--temp', '.']
-    station = await subprocess.create_subprocess_exec(*station_args)
+async def test_main() -> int:
+    outcome = fx.Outcome()
+    muxs = TestMuxs(outcome)
+    async with fx.serving(tu.Infos(), muxs, su.LgwSimServer()):
+        async with fx.StationProcess('-p', '--temp', '.') as station:
+            status = await outcome.wait()
+    logger.debug('Station exe code:%d' % (station.returncode,))
+    return status
 
-    asyncio.ensure_future(timeout())
 
 tstu.setup_logging()
 
-asyncio.ensure_future(test_start())
-asyncio.get_event_loop().run_forever()
+fx.run(test_main, timeout=20)
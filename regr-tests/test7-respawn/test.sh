@@ -60,7 +60,7 @@ fi
 
 collect_gcda _notcuri
 
-echo "ws://localhost:6038" > tc.uri
+echo "ws://localhost:${INFOS_PORT:-6038}" > tc.uri
 
 # No other station running - start new daemon
 rm -f station.log
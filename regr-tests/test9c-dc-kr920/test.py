@@ -16,7 +16,6 @@ import sys
 import time
 import json
 import asyncio
-from asyncio import subprocess
 
 import logging
 logger = logging.getLogger('test9c-kr920')
@@ -25,14 +24,9 @@ sys.path.append('../../pysys')
 import tcutils as tu
 import simutils as su
 import testutils as tstu
+import fixtures as fx
 
 
-station = None
-infos = None
-muxs = None
-sim = None
-test_result = None
-
 # KR920 channels
 CH1 = 922100000
 CH2 = 922300000
@@ -120,20 +114,16 @@ class TestMuxs(tu.Muxs):
     max_tx = 99
     test_name = ''
 
+    def __init__(self, outcome:fx.Outcome, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.outcome = outcome
+
     def get_router_config(self):
         config = {**self.router_config, 'MuxTime': time.time()}
         if self.duty_cycle_enabled is not None:
             config['duty_cycle_enabled'] = self.duty_cycle_enabled
         return config
 
-    async def testDone(self, status):
-        global station, test_result
-        test_result = status
-        if station:
-            station.terminate()
-            await station.wait()
-            station = None
-
     async def handle_dntxed(self, ws, msg):
         self.tx_count += 1
         logger.info('DNTXED: seqno=%d tx_count=%d' % (msg['seqno'], self.tx_count))
@@ -147,11 +137,11 @@ class TestMuxs(tu.Muxs):
             if self.min_tx <= self.tx_count <= self.max_tx:
                 logger.info('SUCCESS [%s]: %d TX (expected %d-%d)' %
                            (self.test_name, self.tx_count, self.min_tx, self.max_tx))
-                await self.testDone(0)
+                self.outcome.done(0)
             else:
                 logger.error('FAILED [%s]: %d TX (expected %d-%d)' %
                             (self.test_name, self.tx_count, self.min_tx, self.max_tx))
-                await self.testDone(1)
+                self.outcome.done(1)
             return
         
         if fcnt < len(self.test_freqs):
@@ -173,8 +163,7 @@ class TestMuxs(tu.Muxs):
         await ws.send(json.dumps(dnframe))
 
 
-async def run_test(test_name):
-    global station, infos, muxs, sim, test_result
+async def test_main(test_name) -> int:
     
     if test_name not in TEST_CASES:
         logger.error('Unknown test: %s' % test_name)
@@ -186,13 +175,12 @@ async def run_test(test_name):
     logger.info('KR920 Test: %s' % tc['desc'])
     logger.info('='*60)
     
-    test_result = None
-    
     with open("tc.uri", "w") as f:
-        f.write('ws://localhost:6038')
+        f.write('ws://localhost:%d' % tu.INFOS_PORT)
     
-    infos = tu.Infos(muxsuri='ws://localhost:6039/router')
-    muxs = TestMuxs()
+    infos = tu.Infos(muxsuri='ws://localhost:%d/router' % tu.MUXS_PORT)
+    outcome = fx.Outcome()
+    muxs = TestMuxs(outcome)
     muxs.router_config = tu.router_config_KR920
     muxs.duty_cycle_enabled = tc['duty_cycle_enabled']
     muxs.test_freqs = tc['freqs']
@@ -207,36 +195,18 @@ async def run_test(test_name):
     sim.test_freqs = tc['freqs']
     sim.test_intervals = tc['intervals']
 
-    await infos.start_server()
-    await muxs.start_server()
-    await sim.start_server()
-
     variant = os.environ.get('TEST_VARIANT', 'testsim')
-    station_bin = '../../build-linux-%s/bin/station' % variant
-    station = await subprocess.create_subprocess_exec(station_bin, '-p', '--temp', '.')
-
-    try:
-        await asyncio.wait_for(station.wait(), timeout=25)
-    except asyncio.TimeoutError:
-        logger.error('TIMEOUT [%s]' % test_name)
-        if station:
-            station.terminate()
-            await station.wait()
-        if muxs.min_tx <= muxs.tx_count <= muxs.max_tx:
-            test_result = 0
-        else:
-            test_result = 1
-    
-    if sim: sim.close()
-    if infos and infos.server: infos.server.close()
-    if muxs and muxs.server: muxs.server.close()
-    await asyncio.sleep(0.3)
-    
-    return 0 if test_result == 0 else 1
+    station_bin = os.environ.get('BUILD_DIR', '../../build-linux-%s' % variant) + '/bin/station'
+    async with fx.serving(infos, muxs, sim):
+        async with fx.StationProcess('-p', '--temp', '.', binary=station_bin):
+            try:
+                return await outcome.wait(within=25)
+            except asyncio.TimeoutError:
+                logger.error('TIMEOUT [%s]' % test_name)
+                return 0 if muxs.min_tx <= muxs.tx_count <= muxs.max_tx else 1
 
 
 if __name__ == '__main__':
     tstu.setup_logging()
     test_name = os.environ.get('DC_TEST', 'DISABLED')
-    result = asyncio.get_event_loop().run_until_complete(run_test(test_name))
-    sys.exit(result)
+    fx.run(lambda: test_main(test_name), timeout=55)
@@ -43,15 +43,38 @@ export PYTHONPATH=${TD}/pysys:$PYTHONPATH
 TEST_NAME=$(basename $(dirname $(realpath $0)))
 
 # Cleanup any coverage file
+# With GCOV_PREFIX set (parallel runner) each test writes its own copy of the .gcda files
 GCDA_DIR=$BUILD_DIR/s2core
+if [[ -n "$GCOV_PREFIX" ]]; then
+    GCDA_DIR=$GCOV_PREFIX$(realpath -m $BUILD_DIR)/s2core
+fi
 rm -f $GCDA_DIR/*.gcda
 
 function collect_gcda () {
     echo "Collecting GCDA from $GCDA_DIR into $TEST_VARIANT$1.info"
+    if [[ -n "$GCOV_PREFIX" ]]; then
+        mkdir -p $GCDA_DIR
+        cp -f $BUILD_DIR/s2core/*.gcno $GCDA_DIR/ 2>/dev/null || true
+    fi
     lcov -c -d $GCDA_DIR -o $TEST_VARIANT$1.info
     rm -f $GCDA_DIR/*.gcda
 }
 
+function kill_stations () {
+    # Parallel runs (TEST_SANDBOX set) only kill stations started below this directory
+    local sig=${1:-TERM}
+    if [[ -z "$TEST_SANDBOX" ]]; then
+        killall -q -s $sig station || true
+        return
+    fi
+    local pid
+    for pid in $(pgrep -x station); do
+        if [[ "$(readlink /proc/$pid/cwd)" == "$PWD"* ]]; then
+            kill -s $sig $pid || true
+        fi
+    done
+}
+
 function disable_test () {
     # run-regression-tests will check ..N/A.. marker if we fail
     banner "--- Test N/A --- temporarily ${1:-disabled}"
@@ -67,9 +90,9 @@ function default_cleanup () {
     echo "Default cleanup..."
     exec 1>/dev/null 2>&1    # hide noisy output
     # Kill any station process
-    killall -q station || true
+    kill_stations
     sleep 1
-    killall -q -s9 station || true
+    kill_stations KILL
     # Kill any other processes related to test script
     pids="$timerpid $(jobs -p)"
     kill    $pids || true
@@ -11,6 +11,7 @@
 #define J_AS923JP              ((ujcrc_t)(0x6616F98E))
 #define J_asap                 ((ujcrc_t)(0x61D4E603))
 #define J_AU915                ((ujcrc_t)(0xD8599E68))
+#define J_backoff              ((ujcrc_t)(0xAE722035))
 #define J_bcning               ((ujcrc_t)(0x1EE5E245))
 #define J_beaconing            ((ujcrc_t)(0x58428CA7))
 #define J_cca                  ((ujcrc_t)(0x00636361))
@@ -164,6 +165,7 @@
 #define J_tx_enable            ((ujcrc_t)(0x631F9A2D))
 #define J_tx_gain_lut          ((ujcrc_t)(0x43B971DB))
 #define J_tx_notch_freq        ((ujcrc_t)(0xA8FCE052))
+#define J_ftime                ((ujcrc_t)(0x45B40915))
 #define J_pwr_idx              ((ujcrc_t)(0xDFD7588B))
 #define J_rssi_tcomp           ((ujcrc_t)(0x47CB0C8F))
 #define J_coeff_a              ((ujcrc_t)(0x87785402))
@@ -56,6 +56,8 @@
 
 #define MAX_CCA_INFOS   10
 #define MAGIC_CCA_FREQ  0xCCAFCCAF
+#define MAGIC_TIME_FREQ 0x71AE71AE
+#define TIME_FLAG_NOPPS 0x01
 
 #define RX_NPKTS 1000
 
@@ -70,6 +72,17 @@ struct cca_msg {
     struct cca_info infos[MAX_CCA_INFOS];
 };
 
+// Clock faults injected by the simulation (see pysys/timesim.py):
+// SX130x clock drift against the MCU and PPS offset/dropouts.
+struct time_msg {
+    u4_t magic;      // corresponds to freq_hz in struct lgw_pkt_rx_s
+    u4_t flags;
+    sL_t anchor;     // sys_time when drift_ppb took effect
+    sL_t drift_acc;  // drift accumulated up to anchor (us)
+    s4_t drift_ppb;
+    s4_t pps_offset; // PPS edge after the UTC second (us)
+};
+
 #if defined(CFG_lgw1)
 static struct lgw_pkt_tx_s tx_pkt;
 static struct lgw_pkt_rx_s rx_pkts[RX_NPKTS+1];
@@ -90,6 +103,8 @@ static aio_t*   aio;
 static tmr_t    conn_tmr;
 static struct sockaddr_un sockAddr;
 static struct cca_msg     cca_msg;
+static struct time_msg    time_msg;
+static sL_t               last_pps;
 
 uint8_t lgwx_device_mode = 0;
 uint8_t lgwx_beacon_len = 0;
@@ -115,9 +130,44 @@ static int cca (sL_t txtime, u4_t txfreq) {
 }
 
 
-static sL_t xticks () {
+// Apply a CCA/TIME frame at the head of the RX buffer.
+// Control frames queued behind RX frames are taken when the reader gets to them.
+static int take_ctl () {
+    if( rbused(rx_widx, rx_ridx, rxblen) < sizeof(rx_pkts[0]) )
+        return 0;
+    void* p = &rx_pkts[rx_ridx/sizeof(rx_pkts[0])];
+    switch( rx_pkts[rx_ridx/sizeof(rx_pkts[0])].freq_hz ) {
+    case MAGIC_CCA_FREQ:  cca_msg  = *(struct cca_msg*)p;  break;
+    case MAGIC_TIME_FREQ: time_msg = *(struct time_msg*)p; break;
+    default: return 0;
+    }
+    rx_ridx = (rx_ridx+sizeof(rx_pkts[0])) % rxblen;
+    return 1;
+}
+
+
+static sL_t xticks_at (sL_t t) {
     // Make it different from ustime_t to increase test coverage
-    return sys_time() - timeOffset;
+    sL_t x = t - timeOffset;
+    if( time_msg.drift_ppb )
+        x += time_msg.drift_acc + (t - time_msg.anchor) * time_msg.drift_ppb / 1000000000;
+    return x;
+}
+
+
+static sL_t xticks () {
+    return xticks_at(sys_time());
+}
+
+
+// xticks of the last PPS edge - stays put while PPS is out
+static sL_t pps_xticks () {
+    if( (time_msg.flags & TIME_FLAG_NOPPS) == 0 ) {
+        sL_t t = sys_time();
+        sL_t since = ((sys_utc() - time_msg.pps_offset) % 1000000 + 1000000) % 1000000;
+        last_pps = xticks_at(t - since);
+    }
+    return last_pps;
 }
 
 
@@ -231,10 +281,7 @@ static void read_socket (aio_t* aio) {
             rx_widx = (rx_widx+n) % rxblen;
         }
 
-        if( rbused(rx_widx, rx_ridx, rxblen) >= sizeof(rx_pkts[0]) && rx_pkts[rx_ridx/sizeof(rx_pkts[0])].freq_hz == MAGIC_CCA_FREQ ){
-            cca_msg = *(struct cca_msg*)&rx_pkts[rx_ridx/sizeof(rx_pkts[0])];
-            rx_ridx = (rx_ridx+sizeof(rx_pkts[0])) % rxblen;
-        }
+        take_ctl();
     }
 }
 
@@ -265,6 +312,8 @@ static void write_socket (aio_t* aio) {
 int lgw_receive (uint8_t max_pkt, struct lgw_pkt_rx_s *pkt_data) {
     int npkts = 0;
     while( npkts < max_pkt && rbused(rx_widx, rx_ridx, rxblen) >= sizeof(rx_pkts[0]) ){
+        if( take_ctl() )
+            continue;
         pkt_data[npkts] = rx_pkts[rx_ridx/sizeof(rx_pkts[0])];
         rx_ridx = (rx_ridx+sizeof(rx_pkts[0])) % rxblen;
         npkts += 1;
@@ -318,9 +367,7 @@ int lgw_stop (void) {
 
 
 int lgw_get_trigcnt(uint32_t* trig_cnt_us) {
-    sL_t t = xticks();
-    if( ppsLatched )
-        t -= sys_utc()%1000000;
+    sL_t t = ppsLatched ? pps_xticks() : xticks();
     trig_cnt_us[0] = t;
     return LGW_HAL_SUCCESS;
 }
@@ -331,6 +378,7 @@ int lgw_start () {
     if( aio )
         return LGW_HAL_ERROR;
     memset(&cca_msg, 0, sizeof(cca_msg));
+    memset(&time_msg, 0, sizeof(time_msg));
     memset(&sockAddr, 0, sizeof(sockAddr));
     // Make xticks different from ustime to cover more test ground.
     // xticks start at ~(1<<28) whenever a radio simulation starts.
@@ -1138,6 +1186,7 @@ int sx1301ar_start( uint8_t nb_brd ) {
     if( aio )
         return -1;
     memset(&cca_msg, 0, sizeof(cca_msg));
+    memset(&time_msg, 0, sizeof(time_msg));
     memset(&sockAddr, 0, sizeof(sockAddr));
     // Make xticks different from ustime to cover more test ground.
     // xticks start at ~(1<<28) whenever a radio simulation starts.
@@ -1159,6 +1208,8 @@ int sx1301ar_stop( uint8_t nb_brd ) {
 int sx1301ar_fetch( uint8_t brd, sx1301ar_rx_pkt_t * p, uint8_t max_nb, uint8_t * nb_pkt ) {
     int npkts = 0;
     while( npkts < max_nb && rbused(rx_widx, rx_ridx, rxblen) >= sizeof(rx_pkts[0]) ){
+        if( take_ctl() )
+            continue;
         p[npkts] = rx_pkts[rx_ridx/sizeof(rx_pkts[0])];
         rx_ridx = (rx_ridx+sizeof(rx_pkts[0])) % rxblen;
         npkts += 1;
@@ -1211,8 +1262,7 @@ int sx1301ar_get_instcnt( uint8_t brd, uint32_t * cnt_us ) {
 }
 
 int sx1301ar_get_trigcnt( uint8_t brd, uint32_t * cnt_us ) {
-    sL_t t = xticks();
-    t -= sys_utc()%1000000;
+    sL_t t = pps_xticks();
     cnt_us[0] = t  & 0xFFffFFff;
     return 0;
 }
@@ -1671,8 +1721,7 @@ int sx1301ar_get_trighs( uint8_t brd, uint32_t * cnt_hs)
     }
 
     /* Get high speed counter value at last PPS (HSPPS) */
-    sL_t t = xticks();
-    t -= sys_utc()%1000000;
+    sL_t t = pps_xticks();
     cnt_hs[0] = (t  & 0xFFffFFff)*256;
     return 0;
 }
@@ -142,6 +142,13 @@ static void tc_connect_muxs (tc_t* tc) {
 }
 
 
+static void tc_muxs_delayed (tmr_t* timeout) {
+    tc_t* tc = timeout2tc(timeout);
+    ws_free(&tc->ws);
+    tc_connect_muxs(tc);
+}
+
+
 static void tc_info_request (conn_t* _conn, int ev) {
     tc_t* tc = conn2tc(_conn);
     if( ev == WSEV_CONNECTED ) {
@@ -182,6 +189,7 @@ static void tc_info_request (conn_t* _conn, int ev) {
             case J_router: { router  = uj_str(&D); break; }
             case J_muxs  : { muxsid  = uj_str(&D); break; }
             case J_error : { error   = uj_str(&D); break; }
+            case J_backoff: { tc->backoff = min(uj_uint(&D), TC_MAX_BACKOFF); break; }
             case J_uri   : { muxsuri = uj_str(&D);
                 if( !uri_isScheme(muxsuri,"ws") && !uri_isScheme(muxsuri,"wss") ) {
                     LOG(MOD_TCE|ERROR, "Muxs URI must be ws://.. or wss://..: %s", muxsuri);
@@ -219,7 +227,8 @@ static void tc_info_request (conn_t* _conn, int ev) {
         uj_assertEOF(&D);
         if( error || muxsuri == NULL ) {
             LOG(MOD_TCE|ERROR, "Infos error: %s %s", router, error);
-            err = TC_ERR_REJECTED;
+            // An error with a backoff hint means INFOS is overloaded - retry later instead of asking CUPS
+            err = tc->backoff ? TC_ERR_FAILED : TC_ERR_REJECTED;
             goto failed;
         }
         LOG(MOD_TCE|INFO, "Infos: %s %s %s", router, muxsid, muxsuri);
@@ -237,6 +246,13 @@ static void tc_info_request (conn_t* _conn, int ev) {
             tc_done(tc, tstate);
             return;
         }
+        if( tc->backoff ) {
+            // Spread out MUXS connects as requested by INFOS
+            LOG(MOD_TCE|INFO, "MUXS connect delayed by INFOS backoff %ds", tc->backoff);
+            rt_setTimerCb(&tc->timeout, rt_seconds_ahead(tc->backoff), tc_muxs_delayed);
+            tc->backoff = 0;
+            return;
+        }
         ws_free(&tc->ws);
         tc_connect_muxs(tc);
         return;
@@ -379,10 +395,10 @@ void tc_continue (tc_t* tc) {
         tc->retries = 1;
     }
 
-    int backoff = min(tc->retries, 6);
+    int backoff = tc->backoff ? tc->backoff : min(tc->retries, 6) * 10;
     tc->tstate = TC_INFOS_BACKOFF;
-    rt_setTimerCb(&tc->timeout, rt_seconds_ahead(backoff * 10), tc->ondone);
-    LOG(MOD_TCE|INFO, "INFOS reconnect backoff %ds (retry %d)", backoff*10, tc->retries);
+    rt_setTimerCb(&tc->timeout, rt_seconds_ahead(backoff), tc->ondone);
+    LOG(MOD_TCE|INFO, "INFOS reconnect backoff %ds (retry %d)", backoff, tc->retries);
 }
 
 
@@ -50,12 +50,15 @@ enum {
     TC_ERR_DEAD          = -6,
 };
 
+enum { TC_MAX_BACKOFF = 3600 };  // upper bound for INFOS backoff hint (secs)
+
 typedef struct tc {
     ws_t     ws;          // WS connection state
     tmr_t    timeout;
     s1_t     tstate;      // state of TC engine
     u1_t     credset;     // connect via this credential set
     u1_t     retries;
+    u2_t     backoff;     // backoff hint from INFOS (secs) - 0=none
     char     muxsuri[MAX_URI_LEN+3];
     tmrcb_t  ondone;
     s2ctx_t  s2ctx;